@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import hashlib
+import functools
+import threading
+from collections import OrderedDict
+
+# Bộ đệm kết quả xác thực chuỗi chứng chỉ (bước 5 và 6) và public key đã parse (bước 4).
+# Khóa: SHA-256 của end-entity, các intermediate và trust anchor.
+
+DEFAULT_MAX_ENTRIES = 4096
+# Không giữ kết quả quá lâu dù chứng chỉ còn hạn: trạng thái thu hồi có thể thay đổi
+DEFAULT_MAX_TTL = 24 * 3600
+# Kết quả lỗi (vd. không tải được CRL) chỉ giữ ngắn để lần sau thử lại
+DEFAULT_NEGATIVE_TTL = 300
+
+
+def fingerprint(der):
+    return hashlib.sha256(der).hexdigest()
+
+
+def chain_key(end_entity, intermediates, trust_roots):
+    # Thứ tự intermediate / trust anchor không ảnh hưởng kết quả nên sắp xếp trước khi ghép
+    parts = [fingerprint(end_entity.dump()),
+             ','.join(sorted(fingerprint(c.dump()) for c in intermediates)),
+             ','.join(sorted(fingerprint(c.dump()) for c in trust_roots))]
+    return '|'.join(parts)
+
+
+def chain_expiry(certs, max_ttl=DEFAULT_MAX_TTL, next_update=None):
+    # TTL = sớm nhất trong: not_after của các chứng chỉ, nextUpdate của CRL/OCSP (nếu có), now + max_ttl
+    expires = time.time() + max_ttl
+    for c in certs:
+        try:
+            not_after = c['tbs_certificate']['validity']['not_after'].native
+            expires = min(expires, not_after.timestamp())
+        except Exception:
+            pass
+    if next_update is not None:
+        expires = min(expires, next_update.timestamp())
+    return expires
+
+
+class ChainValidationError(Exception):
+    pass
+
+
+class ChainCache:
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, path=None,
+                 max_ttl=DEFAULT_MAX_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL):
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.path = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (ok, error, expires)
+        self._lock = threading.Lock()
+        self._dirty = False
+        if path:
+            self.attach(path)
+
+    def attach(self, path):
+        # Bật lưu xuống đĩa: nạp các mục còn hạn từ file JSON
+        self.path = path
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    stored = json.load(f)
+            except (OSError, ValueError):
+                stored = {}
+            now = time.time()
+            with self._lock:
+                for key, (ok, error, expires) in stored.items():
+                    if expires > now:
+                        self._entries[key] = (ok, error, expires)
+                self._trim()
+
+    def _trim(self):
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, ok, error, expires):
+        with self._lock:
+            self._entries[key] = (ok, error, expires)
+            self._entries.move_to_end(key)
+            self._trim()
+            self._dirty = True
+
+    def validate(self, end_entity, intermediates, trust_roots, validate_fn, next_update=None, extra_key=''):
+        # Trả kết quả từ bộ đệm nếu còn hạn, ngược lại gọi validate_fn() và ghi nhớ.
+        # Lỗi được lưu dưới dạng thông điệp và ném lại ChainValidationError khi trúng bộ đệm.
+        # extra_key: phiên bản dữ liệu thu hồi / chế độ kiểm tra, đổi thì kết quả cũ không dùng lại.
+        key = chain_key(end_entity, intermediates, trust_roots)
+        if extra_key:
+            key = f'{key}|{extra_key}'
+        entry = self.get(key)
+        if entry is None:
+            try:
+                validate_fn()
+            except ImportError:
+                raise
+            except Exception as e:
+                entry = (False, str(e), time.time() + self.negative_ttl)
+            else:
+                certs = [end_entity] + list(intermediates) + list(trust_roots)
+                entry = (True, None, chain_expiry(certs, self.max_ttl, next_update))
+            self.put(key, *entry)
+        ok, error, _ = entry
+        if not ok:
+            raise ChainValidationError(error)
+        return True
+
+    def save(self):
+        # Ghi nguyên tử (file tạm + os.replace); gộp với nội dung hiện có để nhiều worker cùng dùng một file
+        if not self.path or not self._dirty:
+            return
+        merged = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    merged = json.load(f)
+            except (OSError, ValueError):
+                merged = {}
+        now = time.time()
+        with self._lock:
+            merged.update({k: list(v) for k, v in self._entries.items()})
+            self._dirty = False
+        merged = {k: v for k, v in merged.items() if v[2] > now}
+        if len(merged) > self.max_entries:
+            newest = sorted(merged.items(), key=lambda kv: kv[1][2])[-self.max_entries:]
+            merged = dict(newest)
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(merged, f)
+        os.replace(tmp, self.path)
+
+
+_certificates = OrderedDict()
+_certificates_lock = threading.Lock()
+MAX_CERTIFICATES = 1024
+CERTIFICATE_STATS = {'hits': 0, 'misses': 0}
+
+
+def load_certificate(der):
+    # cryptography x509 + public key được parse một lần cho mỗi fingerprint
+    from cryptography import x509 as crypto_x509
+    fp = fingerprint(der)
+    with _certificates_lock:
+        cached = _certificates.get(fp)
+        if cached is not None:
+            _certificates.move_to_end(fp)
+            CERTIFICATE_STATS['hits'] += 1
+            return cached
+        CERTIFICATE_STATS['misses'] += 1
+    cert = crypto_x509.load_der_x509_certificate(der)
+    cached = (cert, cert.public_key())
+    with _certificates_lock:
+        _certificates[fp] = cached
+        while len(_certificates) > MAX_CERTIFICATES:
+            _certificates.popitem(last=False)
+    return cached
+
+
+@functools.lru_cache(maxsize=MAX_CERTIFICATES)
+def load_public_key(spki_der):
+    # Chỉ public key (SubjectPublicKeyInfo) cho chế độ --quick: không phải import cryptography.x509
+    from cryptography.hazmat.primitives.serialization import load_der_public_key
+    return load_der_public_key(spki_der)
@@ -0,0 +1,144 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+from bo_dem_chung_chi import DEFAULT_MAX_TTL
+from doc_pdf import byte_view
+
+# Bộ đệm kết quả xác thực trên đĩa (SQLite), khóa theo nội dung tài liệu:
+#   document_key: SHA-256 của từng ByteRange + SHA-256 của /Contents từng chữ ký + phần đuôi chưa được ký
+#   context:      phiên bản bộ xác thực, trust anchor, dữ liệu thu hồi, chế độ kiểm tra
+# Đổi context thì kết quả cũ không còn được dùng; tổng dung lượng vượt max_bytes thì xóa mục lâu không dùng nhất.
+# Lỗi SQLite (khóa, file hỏng) chỉ làm trượt bộ đệm, không làm hỏng việc xác thực.
+
+DEFAULT_MAX_BYTES = 64 << 20
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT NOT NULL,
+    context TEXT NOT NULL,
+    code INTEGER NOT NULL,
+    verdict TEXT,
+    lines TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    expires REAL NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (key, context)
+);
+CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used);
+'''
+
+
+def document_key(data, sigs, digests):
+    # sigs: [(tên, ByteRange, Contents)] từ doc_pdf.find_signatures; digests: {tuple(ByteRange): SHA-256}
+    h = hashlib.sha256()
+    covered_end = 0
+    for name, br, contents in sigs:
+        br = tuple(br)
+        h.update(repr(br).encode('ascii'))
+        h.update(digests[br])
+        h.update(hashlib.sha256(contents).digest())
+        covered_end = max(covered_end, br[2] + br[3])
+    # Dữ liệu thêm vào sau chữ ký cuối (incremental update) ảnh hưởng tới bước 8
+    view = byte_view(data)
+    try:
+        h.update(hashlib.sha256(view[covered_end:]).digest())
+    finally:
+        view.release()
+    return h.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, max_ttl=DEFAULT_MAX_TTL):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_ttl = max_ttl
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # Mở kết nối khi dùng lần đầu trong mỗi tiến trình (worker được fork không dùng chung kết nối)
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(SCHEMA)
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, key, context):
+        # (code, lines, verdict) nếu có kết quả còn hạn cho đúng context, ngược lại None
+        now = time.time()
+        try:
+            with self._lock:
+                conn = self._connect()
+                row = conn.execute('SELECT code, lines, verdict FROM results WHERE key = ? AND context = ? '
+                                   'AND expires > ?', (key, context, now)).fetchone()
+                if row is not None:
+                    with conn:
+                        conn.execute('UPDATE results SET last_used = ? WHERE key = ? AND context = ?',
+                                     (now, key, context))
+        except sqlite3.Error:
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        code, lines, verdict = row
+        return code, json.loads(lines), verdict
+
+    def put(self, key, context, code, lines, verdict):
+        now = time.time()
+        payload = json.dumps(lines, ensure_ascii=False)
+        size = len(payload.encode('utf-8')) + len(key) + len(context)
+        try:
+            with self._lock:
+                conn = self._connect()
+                with conn:
+                    # Mục của context cũ (trust anchor / thu hồi đã đổi) không bao giờ trúng nữa, bị dọn theo
+                    # hạn hoặc theo dung lượng
+                    conn.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                 (key, context, code, verdict, payload, size, now, now + self.max_ttl, now))
+                    self._evict(conn, now)
+        except sqlite3.Error:
+            pass
+
+    def _evict(self, conn, now):
+        conn.execute('DELETE FROM results WHERE expires <= ?', (now,))
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Xóa tới còn 90% giới hạn để không phải dọn lại ở mỗi lần ghi
+        target = total - self.max_bytes * 9 // 10
+        doomed = []
+        for rowid, size in conn.execute('SELECT rowid, size FROM results ORDER BY last_used'):
+            doomed.append((rowid,))
+            target -= size
+            if target <= 0:
+                break
+        conn.executemany('DELETE FROM results WHERE rowid = ?', doomed)
+
+    def clear(self):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute('DELETE FROM results')
+
+    def stats(self):
+        with self._lock:
+            conn = self._connect()
+            entries, size = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results').fetchone()
+        return {'entries': entries, 'bytes': size, 'hits': self.hits, 'misses': self.misses}
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
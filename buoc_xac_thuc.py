@@ -0,0 +1,264 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Bộ chạy các bước xác thực theo phụ thuộc khai báo.
+# Mỗi bước (Step) khai báo các bước phải đạt trước (requires) và các bước chỉ cần xong trước (after).
+# StepEngine chạy song song các bước đã đủ điều kiện trong một thread pool dùng chung (băm và OpenSSL
+# nhả GIL), không bắt đầu các bước tốn kém khi chính sách (Policy) người gọi chọn đã không đạt,
+# và trả về kết quả có kiểu (SignatureResult) thay vì in ra. Các bước cụ thể nằm ở xacthuc.py.
+
+OK = '✓'
+WARN = '⚠'
+FAIL = '✗'
+SKIP = '-'
+
+
+class StepResult:
+    # text: dòng in sau tiêu đề bước; log: dòng nhật ký sau "Bước n: "; details: các dòng chi tiết
+    # (in trước text, ghi sau log); data: giá trị cho kết luận (vd. revoked, modified).
+    # Trạng thái lấy từ ký tự đầu của text (✓ / ⚠ / ✗); bước bị bỏ qua có trạng thái SKIP.
+    __slots__ = ('number', 'name', 'title', 'status', 'text', 'log', 'details', 'data', 'seconds')
+
+    def __init__(self, text, log=None, details=(), status=None, **data):
+        self.text = text
+        self.log = log if log is not None else text
+        self.details = list(details)
+        self.status = status or (text[:1] if text and text[:1] in (OK, WARN, FAIL) else FAIL)
+        self.data = data
+        self.number = self.name = self.title = None
+        self.seconds = 0.0
+
+    @classmethod
+    def skipped(cls, text=None):
+        # text None: bỏ qua vì bước phụ thuộc không đạt, không in gì (như trước khi có bộ chạy)
+        return cls(text, status=SKIP)
+
+    @property
+    def passed(self):
+        return self.status == OK
+
+    def echo_lines(self):
+        if self.text is None:
+            return []
+        return [f'{self.number}. {self.title}'] + self.details + [f'   {self.text}\n']
+
+    def log_lines(self):
+        if self.text is None:
+            return []
+        return [f'Bước {self.number}: {self.log}'] + self.details
+
+    def as_dict(self):
+        # message không lặp lại ký hiệu trạng thái (như JSON của dich_vu_xac_thuc)
+        message = self.log
+        if message and message[:1] in (OK, WARN, FAIL, SKIP) and message[1:2] == ' ':
+            message = message[2:]
+        return {'step': self.number, 'name': self.name, 'status': self.status, 'message': message,
+                'details': [d.strip() for d in self.details], 'seconds': round(self.seconds, 6)}
+
+
+class Step:
+    # number: thứ tự in (1..n); requires: các bước phải đạt, không đạt thì bước này bị bỏ qua;
+    # after: các bước chỉ cần chạy xong trước (dùng lại bộ đệm của bước đó);
+    # expensive: không bắt đầu khi chính sách đã không đạt; fatal: mã kết thúc khi bước này không đạt
+    # (dừng cả chữ ký, vd. không đọc được Signature dictionary)
+    number = 0
+    name = ''
+    title = ''
+    requires = ()
+    after = ()
+    expensive = False
+    fatal = None
+
+    def run(self, ctx):
+        raise NotImplementedError
+
+
+class Policy:
+    # steps: các bước được chạy (None = tất cả, cộng các bước chúng phụ thuộc);
+    # required: các bước phải đạt; short_circuit: khi một bước trong required không đạt thì bỏ qua
+    # các bước tốn kém chưa bắt đầu
+    def __init__(self, name, steps=None, required=(), short_circuit=False):
+        self.name = name
+        self.steps = None if steps is None else frozenset(steps)
+        self.required = tuple(required)
+        self.short_circuit = short_circuit
+
+    def runs(self, number):
+        return self.steps is None or number in self.steps
+
+    def failure(self, results):
+        # Bước đầu tiên trong required đã chạy xong mà không đạt (bước bị bỏ qua không tính), None nếu chưa có
+        for number in self.required:
+            result = results.get(number)
+            if result is not None and result.status in (WARN, FAIL):
+                return number
+        return None
+
+    def __repr__(self):
+        return f'Policy({self.name!r})'
+
+
+class SignatureResult:
+    # Kết quả một chữ ký: steps {số bước: StepResult} theo thứ tự bước; code khác 0 khi một bước fatal
+    # không đạt; verdict do nơi định nghĩa các bước kết luận
+    __slots__ = ('name', 'byte_range', 'steps', 'policy', 'code', 'verdict', 'seconds')
+
+    def __init__(self, name, byte_range, steps, policy, code=0, seconds=0.0):
+        self.name = name
+        self.byte_range = byte_range
+        self.steps = steps
+        self.policy = policy
+        self.code = code
+        self.verdict = None
+        self.seconds = seconds
+
+    def step(self, number):
+        return self.steps.get(number)
+
+    def passed(self, number):
+        result = self.steps.get(number)
+        return result is not None and result.passed
+
+    def data(self, number, key, default=None):
+        result = self.steps.get(number)
+        return result.data.get(key, default) if result is not None else default
+
+    def echo_lines(self):
+        out = []
+        for result in self.steps.values():
+            out.extend(result.echo_lines())
+        return out
+
+    def log_lines(self):
+        out = []
+        for result in self.steps.values():
+            out.extend(result.log_lines())
+        return out
+
+    def as_dict(self):
+        return {'name': self.name, 'byte_range': list(self.byte_range) if self.byte_range else None,
+                'policy': self.policy.name, 'code': self.code, 'verdict': self.verdict,
+                'seconds': round(self.seconds, 6),
+                'steps': [r.as_dict() for r in self.steps.values() if r.text is not None]}
+
+
+class VerificationResult:
+    # Kết quả cả tài liệu: code (0 = đã xác thực xong), verdict, signatures (SignatureResult),
+    # lines (nhật ký như nhat_ky_xac_thuc.txt); cached: lấy từ bộ đệm kết quả (không có signatures)
+    __slots__ = ('code', 'verdict', 'signatures', 'lines', 'policy', 'cached')
+
+    def __init__(self, code, verdict, signatures, lines, policy, cached=False):
+        self.code = code
+        self.verdict = verdict
+        self.signatures = signatures
+        self.lines = lines
+        self.policy = policy
+        self.cached = cached
+
+    def as_dict(self):
+        return {'code': self.code, 'verdict': self.verdict, 'policy': self.policy.name, 'cached': self.cached,
+                'signatures': [s.as_dict() for s in self.signatures], 'lines': self.lines}
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def shared_executor():
+    # Thread pool dùng chung cho mọi chữ ký của tiến trình; tạo lại sau fork (worker hàng loạt)
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=max(4, os.cpu_count() or 1),
+                                           thread_name_prefix='buoc_xac_thuc')
+            _executor_pid = os.getpid()
+        return _executor
+
+
+class StepEngine:
+    def __init__(self, steps, executor=None):
+        self.steps = sorted(steps, key=lambda s: s.number)
+        self._by_number = {s.number: s for s in self.steps}
+        self._executor = executor
+
+    def plan(self, policy):
+        # Các bước chính sách chọn cộng mọi bước chúng phụ thuộc, theo thứ tự bước
+        wanted = {s.number for s in self.steps if policy.runs(s.number)}
+        stack = list(wanted)
+        while stack:
+            step = self._by_number[stack.pop()]
+            for dep in step.requires + step.after:
+                if dep not in wanted:
+                    wanted.add(dep)
+                    stack.append(dep)
+        return [s for s in self.steps if s.number in wanted]
+
+    def _run_step(self, step, ctx):
+        t0 = time.perf_counter()
+        try:
+            result = step.run(ctx)
+        except Exception as e:
+            result = StepResult(f'✗ KHÔNG HỢP LỆ - Lỗi: {e}', f'✗ KHÔNG HỢP LỆ - {e}')
+        result.seconds = time.perf_counter() - t0
+        return result
+
+    def run(self, ctx, policy, name=None, byte_range=None, clock=None):
+        # Chạy các bước của một chữ ký; ctx: đối tượng dữ liệu vào dùng chung giữa các bước.
+        # clock: do_luong.StepClock nhận thời gian từng bước
+        t0 = time.perf_counter()
+        pending = self.plan(policy)
+        results = {}
+        running = {}
+        fatal = None
+
+        def record(step, result):
+            nonlocal fatal
+            result.number, result.name, result.title = step.number, step.name, step.title
+            results[step.number] = result
+            if step.fatal is not None and result.status != SKIP and not result.passed and fatal is None:
+                fatal = step
+            if clock is not None and result.status != SKIP:
+                clock.add(step.name, result.seconds)
+
+        while pending or running:
+            ready = []
+            progressed = True
+            while progressed:
+                progressed = False
+                for step in list(pending):
+                    if any(d not in results for d in step.requires + step.after):
+                        continue
+                    pending.remove(step)
+                    if fatal is not None or any(not results[d].passed for d in step.requires):
+                        record(step, StepResult.skipped())
+                        progressed = True
+                        continue
+                    failed = policy.failure(results) if policy.short_circuit and step.expensive else None
+                    if failed is not None:
+                        record(step, StepResult.skipped(
+                            f'- BỎ QUA - Chính sách {policy.name} đã không đạt ở bước {failed}'))
+                        progressed = True
+                        continue
+                    ready.append(step)
+            # Bước cuối cùng chạy ngay trên luồng gọi, các bước còn lại vào thread pool
+            if ready:
+                executor = self._executor or shared_executor()
+                for step in ready[:-1]:
+                    running[executor.submit(self._run_step, step, ctx)] = step
+                record(ready[-1], self._run_step(ready[-1], ctx))
+            elif running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    record(running.pop(future), future.result())
+            elif pending:
+                raise RuntimeError(f'Phụ thuộc vòng giữa các bước: {[s.number for s in pending]}')
+
+        ordered = {n: results[n] for n in sorted(results)}
+        if fatal is not None:
+            # Như trước: dừng ở bước fatal, không báo các bước sau (kể cả bước đã chạy song song)
+            ordered = {n: r for n, r in ordered.items() if n <= fatal.number}
+        return SignatureResult(name, byte_range, ordered, policy, code=fatal.fatal if fatal else 0,
+                               seconds=time.perf_counter() - t0)
@@ -0,0 +1,268 @@
+import zlib
+import hashlib
+import datetime
+
+from doc_pdf import XrefIndex, Name, Ref, find_startxref, serialize_object, serialize
+
+# Ghép lớp hiển thị chữ ký vào một trang bằng incremental update: giữ nguyên toàn bộ byte gốc,
+# chỉ nối thêm trang đã sửa + các object mới + bảng xref (/Prev trỏ về bảng cũ).
+# Chi phí phụ thuộc vào số object mới, không phụ thuộc vào số trang của tài liệu.
+# dss_update dùng cùng cách để nhúng dữ liệu xác thực dài hạn (/DSS) sau khi ký,
+# signature_update để chừa chỗ cho chữ ký (ký hai pha, xem ky_hai_pha.py).
+
+FORM_PREFIX = '/ChuKy'
+# Khóa trong một mục /VRI -> mảng tương ứng của /DSS
+DSS_KEYS = {'/Cert': '/Certs', '/CRL': '/CRLs', '/OCSP': '/OCSPs'}
+# Chỗ trống cho /ByteRange, được ghi đè (cùng độ dài) khi đã biết vị trí /Contents và độ dài file
+BYTERANGE_PLACEHOLDER = b'[0 0000000000 0000000000 0000000000]'
+# Các khóa trailer được chép sang phần cập nhật (không chép /XRefStm, /Prev, /Size cũ)
+TRAILER_KEYS = ('/Root', '/Info', '/ID')
+
+
+def _unique_names(existing, count, prefix=FORM_PREFIX):
+    names = []
+    i = 0
+    while len(names) < count:
+        name = f'{prefix}{i}'
+        if name not in existing:
+            names.append(name)
+        i += 1
+    return names
+
+
+def _xref_table(offsets):
+    # offsets: {num: (offset, gen)}; nhóm các số liên tiếp thành từng đoạn con
+    out = bytearray(b'xref\n0 1\n0000000000 65535 f\r\n')
+    nums = sorted(offsets)
+    i = 0
+    while i < len(nums):
+        j = i
+        while j + 1 < len(nums) and nums[j + 1] == nums[j] + 1:
+            j += 1
+        out += b'%d %d\n' % (nums[i], j - i + 1)
+        for num in nums[i:j + 1]:
+            off, gen = offsets[num]
+            out += b'%010d %05d n\r\n' % (off, gen)
+        i = j + 1
+    return bytes(out)
+
+
+def overlay_update(data, page_index, templates, index=None):
+    # Trả về bytes cần nối vào sau data để vẽ các template (doc_pdf.form_template) lên trang page_index
+    index = index or XrefIndex(data)
+    if '/Encrypt' in index.trailer:
+        raise ValueError('PDF có mã hóa, không ghép overlay bằng incremental update được')
+    page_ref, page, inherited = index.find_page(page_index)
+    start = len(data)
+    out = bytearray()
+    if not data[-1:] in (b'\n', b'\r'):
+        out += b'\n'
+    offsets = {}
+    next_num = index.size
+
+    def add(num, value, stream=None, ref_map=None, gen=0):
+        offsets[num] = (start + len(out), gen)
+        out.extend(serialize_object(num, value, stream, ref_map, gen))
+
+    # Các template: object cuối là Form XObject
+    form_refs = []
+    for objects in templates:
+        base = next_num
+        for i, (value, stream) in enumerate(objects):
+            add(base + i, value, stream, ref_map=lambda r, base=base: base + r.num)
+        next_num += len(objects)
+        form_refs.append(Ref(next_num - 1, 0))
+
+    # /Resources của trang (có thể kế thừa hoặc gián tiếp) được chép thành dict trực tiếp
+    resources = dict(index.resolve(page.get('/Resources', inherited.get('/Resources'))) or {})
+    xobjects = dict(index.resolve(resources.get('/XObject')) or {})
+    names = _unique_names(xobjects, len(form_refs))
+    for name, ref in zip(names, form_refs):
+        xobjects[name] = ref
+    resources['/XObject'] = xobjects
+
+    # Nội dung cũ được bọc trong q ... Q để trạng thái đồ họa của nó không ảnh hưởng overlay
+    contents = page.get('/Contents')
+    resolved = index.resolve(contents)
+    if isinstance(resolved, list):
+        old_contents = list(resolved)
+    else:
+        old_contents = [contents] if contents is not None else []
+    ops = b'Q\n' + b''.join(b'q %s Do Q\n' % n.encode('latin-1') for n in names)
+    head_num, tail_num = next_num, next_num + 1
+    add(head_num, {'/Filter': Name('/FlateDecode')}, zlib.compress(b'q\n'))
+    add(tail_num, {'/Filter': Name('/FlateDecode')}, zlib.compress(ops))
+    next_num += 2
+
+    new_page = dict(page)
+    new_page['/Resources'] = resources
+    new_page['/Contents'] = [Ref(head_num, 0)] + old_contents + [Ref(tail_num, 0)]
+    add(page_ref.num, new_page, gen=page_ref[1])
+
+    return _finish(data, index, out, start, offsets, next_num)
+
+
+def _finish(data, index, out, start, offsets, size):
+    # Bảng xref của các object vừa ghi + trailer (/Prev trỏ về bảng cũ)
+    xref_offset = start + len(out)
+    out += _xref_table(offsets)
+    trailer = {k: index.trailer[k] for k in TRAILER_KEYS if k in index.trailer}
+    trailer['/Size'] = size
+    trailer['/Prev'] = find_startxref(data)
+    out += b'trailer\n' + serialize(trailer) + b'\nstartxref\n%d\n%%%%EOF\n' % xref_offset
+    return bytes(out)
+
+
+def dss_update(data, vri, index=None):
+    # Trả về bytes cần nối vào sau data để thêm / bổ sung /DSS (Document Security Store, ISO 32000-2 12.8.4.3).
+    # vri: {khóa VRI (SHA-1 hex của /Contents chữ ký): (certs, crls, ocsps)}, mỗi phần tử là DER.
+    # /DSS đã có được giữ lại; cùng một DER chỉ được ghi một lần.
+    index = index or XrefIndex(data)
+    if '/Encrypt' in index.trailer:
+        raise ValueError('PDF có mã hóa, không thêm /DSS bằng incremental update được')
+    root_ref = index.trailer.get('/Root')
+    root = index.resolve(root_ref)
+    if not isinstance(root_ref, Ref) or not isinstance(root, dict):
+        raise ValueError('Không tìm thấy Catalog')
+    start = len(data)
+    out = bytearray()
+    if not data[-1:] in (b'\n', b'\r'):
+        out += b'\n'
+    offsets = {}
+    next_num = index.size
+
+    def add(value, stream=None, num=None, gen=0):
+        nonlocal next_num
+        if num is None:
+            num = next_num
+            next_num += 1
+        offsets[num] = (start + len(out), gen)
+        out.extend(serialize_object(num, value, stream, gen=gen))
+        return Ref(num, gen)
+
+    old = index.resolve(root.get('/DSS'))
+    old = old if isinstance(old, dict) else {}
+    lists = {}
+    known = {}  # SHA-256 của DER -> Ref của stream đã có
+    for key in DSS_KEYS.values():
+        refs = index.resolve(old.get(key))
+        lists[key] = list(refs) if isinstance(refs, list) else []
+        for ref in lists[key]:
+            value, stream = index.get_with_stream(ref.num) if isinstance(ref, Ref) else (None, None)
+            if stream is not None and not value.get('/Filter'):
+                known[hashlib.sha256(stream).digest()] = ref
+
+    def stream_ref(der, key):
+        digest = hashlib.sha256(der).digest()
+        if digest not in known:
+            known[digest] = add({}, der)
+            lists[key].append(known[digest])
+        return known[digest]
+
+    old_vri = index.resolve(old.get('/VRI'))
+    vri_dict = dict(old_vri) if isinstance(old_vri, dict) else {}
+    now = datetime.datetime.now(datetime.timezone.utc).strftime("D:%Y%m%d%H%M%SZ")
+    for vri_key, parts in vri.items():
+        entry = {'/Type': Name('/VRI')}
+        for (short, key), items in zip(DSS_KEYS.items(), parts):
+            refs = [stream_ref(der, key) for der in items]
+            if refs:
+                entry[short] = refs
+        entry['/TU'] = now
+        vri_dict['/' + vri_key] = add(entry)
+
+    dss = {k: v for k, v in old.items() if k not in DSS_KEYS.values() and k != '/VRI'}
+    dss['/Type'] = Name('/DSS')
+    for key, refs in lists.items():
+        if refs:
+            dss[key] = refs
+    dss['/VRI'] = vri_dict
+    new_root = dict(root)
+    new_root['/DSS'] = add(dss)
+    # Khai báo phần mở rộng ESIC (PAdES) cho reader PDF 1.7
+    extensions = index.resolve(root.get('/Extensions'))
+    extensions = dict(extensions) if isinstance(extensions, dict) else {}
+    extensions.setdefault('/ESIC', {'/BaseVersion': Name('/1.7'), '/ExtensionLevel': 5})
+    new_root['/Extensions'] = extensions
+    add(new_root, num=root_ref.num, gen=root_ref[1])
+    return _finish(data, index, out, start, offsets, next_num)
+
+
+def signature_update(data, page_index, fields, contents_size, index=None):
+    # Thêm trường chữ ký ẩn trên trang page_index với /Contents để trống contents_size byte.
+    # fields: các khóa thêm vào Signature dictionary (/M, /Reason, /Location, /ContactInfo, /Name).
+    # Trả về (bytes cần nối vào sau data, ByteRange, (đầu, cuối) của <...> /Contents trong file hoàn chỉnh)
+    index = index or XrefIndex(data)
+    if '/Encrypt' in index.trailer:
+        raise ValueError('PDF có mã hóa, không thêm chữ ký bằng incremental update được')
+    root_ref = index.trailer.get('/Root')
+    root = index.resolve(root_ref)
+    if not isinstance(root_ref, Ref) or not isinstance(root, dict):
+        raise ValueError('Không tìm thấy Catalog')
+    page_ref, page, inherited = index.find_page(page_index)
+    start = len(data)
+    out = bytearray()
+    if not data[-1:] in (b'\n', b'\r'):
+        out += b'\n'
+    offsets = {}
+    next_num = index.size
+
+    def add(value, stream=None, num=None, gen=0):
+        nonlocal next_num
+        if num is None:
+            num = next_num
+            next_num += 1
+        offsets[num] = (start + len(out), gen)
+        out.extend(serialize_object(num, value, stream, gen=gen))
+        return Ref(num, gen)
+
+    # Signature dictionary: ghi tay để biết vị trí /ByteRange và /Contents
+    sig_ref = Ref(next_num, 0)
+    next_num += 1
+    sig = {'/Type': Name('/Sig'), '/Filter': Name('/Adobe.PPKLite'), '/SubFilter': Name('/adbe.pkcs7.detached')}
+    sig.update(fields)
+    offsets[sig_ref.num] = (start + len(out), 0)
+    out += b'%d 0 obj\n' % sig_ref.num + serialize(sig)[:-2] + b'/ByteRange '
+    br_pos = len(out)
+    out += BYTERANGE_PLACEHOLDER + b' /Contents '
+    contents_start = start + len(out)
+    out += b'<' + b'0' * (2 * contents_size) + b'>'
+    contents_end = start + len(out)
+    out += b'>>\nendobj\n'
+
+    # Trường chữ ký gộp với widget ẩn (/Rect rỗng), tên không trùng các trường đã có
+    acro_value = root.get('/AcroForm')
+    acroform = index.resolve(acro_value)
+    acroform = dict(acroform) if isinstance(acroform, dict) else {}
+    fields_list = index.resolve(acroform.get('/Fields'))
+    fields_list = list(fields_list) if isinstance(fields_list, list) else []
+    names = set()
+    for ref in fields_list:
+        field = index.resolve(ref)
+        if isinstance(field, dict) and field.get('/T') is not None:
+            names.add(bytes(field['/T']) if not isinstance(field['/T'], str) else field['/T'].encode('latin-1'))
+    i = len(fields_list) + 1
+    while b'Signature%d' % i in names:
+        i += 1
+    widget = add({'/Type': Name('/Annot'), '/Subtype': Name('/Widget'), '/FT': Name('/Sig'),
+                  '/T': 'Signature%d' % i, '/V': sig_ref, '/F': 132, '/Rect': [0, 0, 0, 0], '/P': page_ref})
+
+    new_page = dict(page)
+    annots = index.resolve(page.get('/Annots'))
+    new_page['/Annots'] = (list(annots) if isinstance(annots, list) else []) + [widget]
+    add(new_page, num=page_ref.num, gen=page_ref[1])
+
+    acroform['/Fields'] = fields_list + [widget]
+    acroform['/SigFlags'] = int(index.resolve(acroform.get('/SigFlags')) or 0) | 3
+    if isinstance(acro_value, Ref):
+        add(acroform, num=acro_value.num, gen=acro_value[1])
+    else:
+        new_root = dict(root)
+        new_root['/AcroForm'] = add(acroform)
+        add(new_root, num=root_ref.num, gen=root_ref[1])
+
+    update = bytearray(_finish(data, index, out, start, offsets, next_num))
+    byte_range = (0, contents_start, contents_end, start + len(update) - contents_end)
+    filled = b'[0 %010d %010d %010d]' % byte_range[1:]
+    update[br_pos:br_pos + len(filled)] = filled
+    return bytes(update), byte_range, (contents_start, contents_end)
@@ -0,0 +1,394 @@
+import os
+import sys
+import time
+import hashlib
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from asn1crypto import algos, cms, core, tsp
+
+# Lấy dấu thời gian RFC 3161: gửi song song tới nhiều TSA, lấy token hợp lệ đầu tiên,
+# dùng lại kết nối HTTP giữa các tài liệu và theo dõi sức khỏe từng server (circuit breaker).
+
+# Thời hạn cho một request (kết nối + đọc) và cho cả lần lấy timestamp
+REQUEST_TIMEOUT = 5.0
+OVERALL_DEADLINE = 10.0
+# Số server được gửi đồng thời trong một đợt
+FANOUT = 2
+# Circuit breaker: mở sau N lỗi liên tiếp, thử lại (half-open) sau COOLDOWN giây
+FAILURE_THRESHOLD = 3
+COOLDOWN = 60.0
+# Trọng số EWMA cho độ trễ
+EWMA_ALPHA = 0.3
+
+
+class TsaError(Exception):
+    pass
+
+
+class ServerHealth:
+    def __init__(self, url):
+        self.url = url
+        self.latency = None  # EWMA, giây
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.half_open = False
+
+    def available(self, now):
+        # Được xếp vào danh sách ứng viên: circuit đóng, hoặc đã hết COOLDOWN mà chưa có request thử nào
+        if self.opened_at is None:
+            return True
+        return now - self.opened_at >= COOLDOWN and not self.half_open
+
+    def begin_request(self, now):
+        # Gọi ngay trước khi gửi: circuit đang mở thì chỉ cho đi đúng một request thử (half-open).
+        # Server có trong danh sách ứng viên nhưng không được gửi (đã có token, hết thời hạn) giữ nguyên trạng thái
+        if self.opened_at is None:
+            return True
+        if now - self.opened_at >= COOLDOWN and not self.half_open:
+            self.half_open = True
+            return True
+        return False
+
+    def score(self):
+        # Server chưa có số liệu được ưu tiên vừa phải để có cơ hội đo; mỗi lỗi liên tiếp bị phạt
+        # như một lần hết thời hạn để server chậm / hay lỗi xuống cuối danh sách
+        base = self.latency if self.latency is not None else REQUEST_TIMEOUT / 4
+        return base + self.consecutive_failures * REQUEST_TIMEOUT
+
+    def record_success(self, elapsed):
+        self.successes += 1
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.half_open = False
+        self.latency = elapsed if self.latency is None else (
+            EWMA_ALPHA * elapsed + (1 - EWMA_ALPHA) * self.latency)
+
+    def record_failure(self, now):
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.half_open = False
+        if self.consecutive_failures >= FAILURE_THRESHOLD or self.opened_at is not None:
+            self.opened_at = now
+
+    def as_dict(self):
+        return {
+            'url': self.url,
+            'latency_ms': round(self.latency * 1000, 1) if self.latency is not None else None,
+            'successes': self.successes,
+            'failures': self.failures,
+            'circuit': 'open' if self.opened_at is not None else 'closed',
+        }
+
+
+def build_request(digest, hashalgo='sha256', nonce=None):
+    nonce = nonce if nonce is not None else int.from_bytes(os.urandom(8), 'big')
+    req = tsp.TimeStampReq({
+        'version': 1,
+        'message_imprint': tsp.MessageImprint({
+            'hash_algorithm': algos.DigestAlgorithm({'algorithm': hashalgo}),
+            'hashed_message': digest,
+        }),
+        'nonce': nonce,
+        'cert_req': True,
+    })
+    return req, nonce
+
+
+def parse_response(body, digest, nonce):
+    # Kiểm tra status granted, message imprint và nonce khớp với request; trả về token (ContentInfo)
+    resp = tsp.TimeStampResp.load(body)
+    status = resp['status']['status'].native
+    if status not in ('granted', 'granted_with_mods'):
+        raise TsaError(f'TSA từ chối: {status}')
+    token = resp['time_stamp_token']
+    tst_info = token['content']['encap_content_info']['content'].parsed
+    if tst_info['message_imprint']['hashed_message'].native != digest:
+        raise TsaError('Message imprint trong token không khớp')
+    if tst_info['nonce'].native != nonce:
+        raise TsaError('Nonce trong token không khớp')
+    return token
+
+
+class TsaClient:
+    # Dùng chung cho nhiều tài liệu trong một tiến trình (thread-safe).
+    # concurrency: số timestamp được lấy đồng thời (dịch vụ ký), quyết định số luồng và kết nối keep-alive giữ sẵn
+    def __init__(self, servers, fanout=FANOUT, timeout=REQUEST_TIMEOUT, deadline=OVERALL_DEADLINE,
+                 credentials=None, concurrency=None):
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.servers = {url: ServerHealth(url) for url in servers}
+        self.fanout = max(1, fanout)
+        self.timeout = timeout
+        self.deadline = deadline
+        self.credentials = credentials
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(servers) or 1, pool_maxsize=max(8, concurrency or 0))
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._pool = ThreadPoolExecutor(max_workers=max(4, 2 * self.fanout, self.fanout * (concurrency or 0)),
+                                        thread_name_prefix='tsa')
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+        self._session.close()
+
+    def stats(self):
+        with self._lock:
+            return [h.as_dict() for h in self.servers.values()]
+
+    def _candidates(self):
+        now = time.monotonic()
+        with self._lock:
+            healthy = [h for h in self.servers.values() if h.available(now)]
+        return [h.url for h in sorted(healthy, key=ServerHealth.score)]
+
+    def _post(self, url, body, digest, nonce):
+        headers = {'Content-Type': 'application/timestamp-query'}
+        auth = None
+        if self.credentials:
+            auth = (self.credentials.get('username'), self.credentials.get('password'))
+        t0 = time.monotonic()
+        try:
+            r = self._session.post(url, data=body, headers=headers, auth=auth, timeout=self.timeout)
+            if r.status_code != 200:
+                raise TsaError(f'HTTP {r.status_code}')
+            token = parse_response(r.content, digest, nonce)
+        except Exception:
+            with self._lock:
+                self.servers[url].record_failure(time.monotonic())
+            raise
+        with self._lock:
+            self.servers[url].record_success(time.monotonic() - t0)
+        return token
+
+    def timestamp(self, digest, hashalgo='sha256'):
+        # Gửi theo từng đợt `fanout` server (nhanh nhất trước), trả về (token hợp lệ đầu tiên, URL của TSA
+        # đã cấp, số giây chờ); lỗi thì TsaError có .seconds. Không giữ kết quả lần gọi trong client
+        # (nhiều luồng dùng chung). Request thua cuộc vẫn chạy nền và chỉ dùng để cập nhật số liệu sức khỏe.
+        req, nonce = build_request(digest, hashalgo)
+        body = req.dump()
+        candidates = self._candidates()
+        if not candidates:
+            raise TsaError('Mọi TSA đều đang bị tạm ngắt (circuit open)')
+        start = time.monotonic()
+        end = start + self.deadline
+        errors = []
+        pending = set()
+        while candidates or pending:
+            while candidates and len(pending) < self.fanout:
+                url = candidates.pop(0)
+                health = self.servers[url]
+                with self._lock:
+                    if not health.begin_request(time.monotonic()):
+                        continue
+                try:
+                    fut = self._pool.submit(self._post, url, body, digest, nonce)
+                except Exception:
+                    with self._lock:
+                        health.half_open = False
+                    raise
+                fut.url = url
+                pending.add(fut)
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for fut in done:
+                try:
+                    token = fut.result()
+                except Exception as e:
+                    errors.append(f'{fut.url}: {e}')
+                    continue
+                return token, fut.url, time.monotonic() - start
+        error = TsaError('Không lấy được timestamp: ' + ('; '.join(errors) or 'hết thời hạn'))
+        error.seconds = time.monotonic() - start
+        raise error
+
+    def timestamp_attrs(self, data, hashalgo='sha256'):
+        # unsignedAttrs signature_time_stamp_token cho chữ ký `data` (giống endesive.signer.timestamp)
+        token, _, _ = self.timestamp(getattr(hashlib, hashalgo)(data).digest(), hashalgo)
+        return token_attrs(token)
+
+
+class TsaCall:
+    # Một lần ký: gọi TsaClient dùng chung và giữ nguồn / thời gian chờ TSA của riêng lần đó
+    # (endesive chỉ chuyển cho hook đối tượng truyền vào timestampurl, không trả kết quả ra ngoài)
+    def __init__(self, client):
+        self.client = client
+        self.source = None
+        self.seconds = 0.0
+
+    def timestamp(self, digest, hashalgo='sha256'):
+        try:
+            token, self.source, seconds = self.client.timestamp(digest, hashalgo)
+        except TsaError as e:
+            self.seconds += getattr(e, 'seconds', 0.0)
+            raise
+        self.seconds += seconds
+        return token
+
+    def timestamp_attrs(self, data, hashalgo='sha256'):
+        return token_attrs(self.timestamp(getattr(hashlib, hashalgo)(data).digest(), hashalgo))
+
+
+def token_attrs(token):
+    # unsignedAttrs chứa timestamp token (ContentInfo SignedData từ TSA)
+    return [cms.CMSAttribute({
+        'type': cms.CMSAttributeType('signature_time_stamp_token'),
+        'values': cms.SetOfContentInfo([cms.ContentInfo({
+            'content_type': cms.ContentType('signed_data'),
+            'content': token['content'],
+        })]),
+    })]
+
+
+_endesive_hooked = False
+
+
+def install_endesive_hook():
+    # endesive gọi signer.timestamp(unhashed, hashalgo, url, ...) và truyền nguyên timestampurl;
+    # khi timestampurl là TsaCall / TsaClient thì chuyển sang client, còn URL chuỗi vẫn dùng hàm gốc.
+    global _endesive_hooked
+    if _endesive_hooked:
+        return
+    from endesive import signer as endesive_signer
+    original = endesive_signer.timestamp
+
+    def timestamp(unhashed, hashalgo, url, credentials, req_options, prehashed=None):
+        if isinstance(url, (TsaCall, TsaClient)):
+            call = url if isinstance(url, TsaCall) else TsaCall(url)
+            if prehashed:
+                return token_attrs(call.timestamp(prehashed, hashalgo))
+            return call.timestamp_attrs(unhashed, hashalgo)
+        return original(unhashed, hashalgo, url, credentials, req_options, prehashed)
+
+    endesive_signer.timestamp = timestamp
+    _endesive_hooked = True
+
+
+# ---------------------------------------------------------------------------
+# TSA cục bộ (RFC 3161) để thử nghiệm / benchmark không cần mạng
+# ---------------------------------------------------------------------------
+
+def make_token(tsa_key, tsa_cert, message_imprint, nonce, serial, policy='1.2.3.4.1'):
+    # Ký TSTInfo bằng khóa RSA của TSA (cryptography), trả về ContentInfo SignedData
+    from asn1crypto import x509
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding
+    from cryptography.hazmat.primitives.serialization import Encoding
+
+    tst_info = tsp.TSTInfo({
+        'version': 'v1',
+        'policy': policy,
+        'message_imprint': message_imprint,
+        'serial_number': serial,
+        'gen_time': datetime.datetime.now(datetime.timezone.utc),
+        'nonce': nonce,
+    })
+    tst_der = tst_info.dump()
+    cert = x509.Certificate.load(tsa_cert.public_bytes(Encoding.DER))
+    signed_attrs = cms.CMSAttributes([
+        cms.CMSAttribute({'type': 'content_type', 'values': ['tst_info']}),
+        cms.CMSAttribute({'type': 'message_digest', 'values': [hashlib.sha256(tst_der).digest()]}),
+        cms.CMSAttribute({'type': 'signing_certificate_v2', 'values': [tsp.SigningCertificateV2({
+            'certs': [tsp.ESSCertIDv2({
+                'hash_algorithm': algos.DigestAlgorithm({'algorithm': 'sha256'}),
+                'cert_hash': hashlib.sha256(cert.dump()).digest(),
+            })],
+        })]}),
+    ])
+    signature = tsa_key.sign(signed_attrs.dump(), padding.PKCS1v15(), hashes.SHA256())
+    signer_info = cms.SignerInfo({
+        'version': 'v1',
+        'sid': cms.SignerIdentifier({'issuer_and_serial_number': cms.IssuerAndSerialNumber({
+            'issuer': cert.issuer, 'serial_number': cert.serial_number})}),
+        'digest_algorithm': algos.DigestAlgorithm({'algorithm': 'sha256'}),
+        'signed_attrs': signed_attrs,
+        'signature_algorithm': algos.SignedDigestAlgorithm({'algorithm': 'rsassa_pkcs1v15'}),
+        'signature': signature,
+    })
+    return cms.ContentInfo({
+        'content_type': 'signed_data',
+        'content': cms.SignedData({
+            'version': 'v3',
+            'digest_algorithms': [algos.DigestAlgorithm({'algorithm': 'sha256'})],
+            'encap_content_info': cms.EncapsulatedContentInfo({
+                'content_type': 'tst_info',
+                'content': core.ParsableOctetString(tst_der),
+            }),
+            'certificates': [cms.CertificateChoices({'certificate': cert})],
+            'signer_infos': [signer_info],
+        }),
+    })
+
+
+def serve_local_tsa(pfx_path, password, port=0, delay=0.0, fail=False):
+    # Dựng TSA cục bộ trên 127.0.0.1; trả về (server, url). delay/fail để mô phỏng TSA chậm / hỏng.
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from cryptography.hazmat.primitives.serialization.pkcs12 import load_key_and_certificates
+
+    with open(pfx_path, 'rb') as f:
+        key, cert, _ = load_key_and_certificates(f.read(), password)
+    counter = {'serial': 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Header và thân trả lời được ghi riêng: không tắt Nagle thì mỗi request keep-alive chờ thêm ~40 ms
+        # (delayed ACK của client)
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if delay:
+                time.sleep(delay)
+            if fail:
+                self.send_response(503)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            req = tsp.TimeStampReq.load(body)
+            with lock:
+                counter['serial'] += 1
+                serial = counter['serial']
+            token = make_token(key, cert, req['message_imprint'], req['nonce'].native, serial)
+            resp = tsp.TimeStampResp({'status': {'status': 'granted'}, 'time_stamp_token': token}).dump()
+            try:
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/timestamp-reply')
+                self.send_header('Content-Length', str(len(resp)))
+                self.end_headers()
+                self.wfile.write(resp)
+            except (BrokenPipeError, ConnectionResetError):
+                # client đã bỏ cuộc (hết thời hạn hoặc đã có token từ TSA khác)
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        # Hàng chờ listen mặc định (5) làm rơi kết nối khi đo tải với nhiều client cùng lúc
+        request_queue_size = 128
+        daemon_threads = True
+
+    server = Server(('127.0.0.1', port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}/tsa'
+
+
+if __name__ == '__main__':
+    # python dau_thoi_gian.py [PORT] [DELAY] : chạy TSA cục bộ ký bằng cert.pfx
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8318
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    server, url = serve_local_tsa('cert.pfx', b'1234', port=port, delay=delay)
+    print(f'TSA cục bộ đang chạy tại {url} (Ctrl+C để dừng)')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
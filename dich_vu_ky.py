@@ -0,0 +1,393 @@
+import os
+import sys
+import json
+import math
+import time
+import asyncio
+from urllib.parse import parse_qs
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from dich_vu_xac_thuc import HttpService, HttpError, HOST, MAX_BODY, MAX_CONNECTIONS
+from ky_hai_pha import KeyHolder, inject, prepare_batch, _init_preparer
+
+# Dịch vụ HTTP ký PDF cho cổng nộp bài (asyncio, không cần thư viện web ngoài), dựng trên ký hai pha:
+#   POST /sign?page=0&reason=...&location=...&contact=...&name=...   thân request là file PDF
+#        -> PDF đã ký (application/pdf); header X-Batch-Size, X-Queue-Ms, X-Sign-Ms, X-Timestamp
+#   GET  /health   số liệu dịch vụ (lô, hàng đợi, TSA)
+# Request đồng thời được gom thành lô nhỏ (tới batch_size tài liệu hoặc chờ thêm batch_window giây):
+# cả lô được chuẩn bị (ghép hình + chừa chỗ chữ ký) bằng một lần gọi vào pool tiến trình, ký bằng một lần
+# gọi KeyHolder trong luồng giữ khóa, timestamp lấy song song qua TsaClient (luồng riêng, không chặn
+# event loop). Khóa PFX, ảnh / font chữ ký và kết nối keep-alive tới TSA được giữ sẵn suốt đời dịch vụ.
+# Hàng đợi có giới hạn: đầy thì trả 503 kèm Retry-After ước theo tốc độ ký hiện tại.
+#   python dich_vu_ky.py [--host H] [--port P] [--workers N] [--batch-size N] [--batch-window MS]
+#                        [--max-queue N] [--max-body BYTES] [--pfx FILE] [--password MK] [--img FILE]
+#                        [--pss] [--digest sha384|sha512] [--tsa URL[,URL...]] [--no-tsa]
+#   python dich_vu_ky.py --bench [THU_MUC] [--concurrency C] [--requests N] [--workers N] [--tsa-delay S]
+#                        (TSA cục bộ + dịch vụ + tai_thu_dich_vu: file ký/s, độ trễ p50/p95/p99, thử quá tải)
+
+PORT = 8081
+DEFAULT_BATCH = 16
+BATCH_WINDOW = 0.002
+# Số request đã nhận nhưng chưa vào lô; vượt thì trả 503
+MAX_QUEUE = 64
+# Số timestamp lấy đồng thời (luồng chờ TSA và kết nối keep-alive giữ sẵn)
+TSA_CONCURRENCY = 32
+EWMA_ALPHA = 0.3
+SIGN_OPTIONS = ('page', 'reason', 'location', 'contact', 'name')
+
+
+class _Request:
+    __slots__ = ('data', 'options', 'future', 'queued')
+
+    def __init__(self, data, options, future):
+        self.data = data
+        self.options = options
+        self.future = future
+        self.queued = time.perf_counter()
+
+
+def parse_sign_options(query):
+    # Thông tin chữ ký từ query string; thiếu thì Preparer lấy theo ky.THONG_TIN_KY
+    options = {}
+    for key, values in parse_qs(query, keep_blank_values=False).items():
+        if key in SIGN_OPTIONS:
+            options[key] = values[-1]
+    if 'page' in options:
+        try:
+            options['page'] = int(options['page'])
+        except ValueError:
+            raise HttpError(400, f'page không hợp lệ: {options["page"]}')
+    return options
+
+
+class SignService(HttpService):
+    def __init__(self, workers=None, pfx_path=None, password=None, img_path=None, tsa_servers=None,
+                 batch_size=DEFAULT_BATCH, batch_window=BATCH_WINDOW, max_queue=MAX_QUEUE, max_body=MAX_BODY,
+                 max_connections=MAX_CONNECTIONS, pss=False, digest_algorithm=None):
+        import ky
+        super().__init__(max_body, max_connections)
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = max(1, batch_size)
+        self.batch_window = batch_window
+        self.max_queue = max_queue
+        servers = ky.TSA_SERVERS if tsa_servers is None else tsa_servers
+        self.tsa = None
+        if servers:
+            from dau_thoi_gian import TsaClient
+            self.tsa = TsaClient(servers, concurrency=TSA_CONCURRENCY)
+        # Timestamp không lấy trong KeyHolder (lần lượt, giữ luồng khóa) mà song song sau khi ký cả lô
+        self.holder = KeyHolder.from_pfx(pfx_path, password, pss=pss, digest_algorithm=digest_algorithm)
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_preparer,
+                                        initargs=(img_path or ky.TEN_ANH_KY, self.holder.digest_algorithm))
+        # Một luồng giữ khóa: ký, ráp CMS và ghi chữ ký vào PDF ngoài event loop
+        self._key_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix='khoa_ky')
+        self._tsa_threads = ThreadPoolExecutor(max_workers=TSA_CONCURRENCY, thread_name_prefix='cho_tsa')
+        self.waiting = 0
+        self.inflight = 0
+        self._tasks = set()
+        self.rate = None  # tài liệu/giây (EWMA theo từng lô) để ước Retry-After
+        self.stats = {'requests': 0, 'signed': 0, 'rejected': 0, 'errors': 0, 'batches': 0,
+                      'timestamps': 0, 'timestamp_errors': 0, 'bytes_in': 0, 'bytes_out': 0,
+                      'started': time.time()}
+
+    async def start(self, host=HOST, port=PORT):
+        self.queue = asyncio.Queue()
+        # Tối đa `workers` lô đang xử lý; hết chỗ thì request nằm lại hàng đợi (rồi bị 503)
+        self._slots = asyncio.Semaphore(self.workers)
+        self._batcher = asyncio.create_task(self._batch_loop())
+        await self._warm_up()
+        return await super().start(host, port)
+
+    async def _warm_up(self):
+        # Khởi động đủ worker (nạp ky, font, ảnh chữ ký) trước request đầu tiên
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self.pool, prepare_batch, []) for _ in range(self.workers)])
+
+    def close(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        self._key_thread.shutdown(wait=False)
+        self._tsa_threads.shutdown(wait=False)
+        if self.tsa is not None:
+            self.tsa.close()
+
+    def retry_after(self):
+        # Số giây để hàng đợi hiện tại được ký hết theo tốc độ gần đây (tối thiểu 1)
+        if not self.rate:
+            return 1
+        return max(1, math.ceil((self.waiting + self.inflight) / self.rate))
+
+    async def _dispatch(self, reader, writer, method, path, headers):
+        self.stats['requests'] += 1
+        route, _, query = path.partition('?')
+        if route == '/health':
+            return 200, self.health(), {}
+        if route != '/sign':
+            raise HttpError(404, f'Không có đường dẫn {route}')
+        if method != 'POST':
+            raise HttpError(405, 'Chỉ nhận POST', {'Allow': 'POST'})
+        if self.waiting >= self.max_queue:
+            self.stats['rejected'] += 1
+            raise HttpError(503, 'Dịch vụ ký đang quá tải', {'Retry-After': str(self.retry_after())})
+        options = parse_sign_options(query)
+        self.waiting += 1
+        queued = False
+        try:
+            data = await self._read_body(reader, writer, headers)
+            if not data.startswith(b'%PDF'):
+                raise HttpError(400, 'Thân request không phải file PDF')
+            self.stats['bytes_in'] += len(data)
+            request = _Request(data, options, asyncio.get_running_loop().create_future())
+            self.queue.put_nowait(request)
+            queued = True
+        finally:
+            if not queued:
+                self.waiting -= 1
+        signed, extra = await request.future
+        self.stats['signed'] += 1
+        self.stats['bytes_out'] += len(signed)
+        extra['Content-Type'] = 'application/pdf'
+        return 200, signed, extra
+
+    async def _batch_loop(self):
+        # Lấy request theo lô: đợi có chỗ xử lý, lấy hết những gì đang chờ (tới batch_size); lô còn nhỏ thì
+        # chờ thêm batch_window cho các request đang tới cùng lúc
+        while True:
+            await self._slots.acquire()
+            batch = [await self.queue.get()]
+            self._drain(batch)
+            if len(batch) < self.batch_size and self.batch_window > 0:
+                await asyncio.sleep(self.batch_window)
+                self._drain(batch)
+            self.waiting -= len(batch)
+            self.inflight += len(batch)
+            task = asyncio.create_task(self._run_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _drain(self, batch):
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+
+    async def _run_batch(self, batch):
+        loop = asyncio.get_running_loop()
+        t0 = time.perf_counter()
+        try:
+            prepared = await loop.run_in_executor(self.pool, prepare_batch, [(r.data, r.options) for r in batch])
+            t1 = time.perf_counter()
+            ready = []
+            for request, result in zip(batch, prepared):
+                if isinstance(result, str):
+                    self.stats['errors'] += 1
+                    request.future.set_exception(HttpError(400, f'Không chuẩn bị được tài liệu: {result}'))
+                else:
+                    ready.append((request, result[0]))
+            if ready:
+                parts = await loop.run_in_executor(self._key_thread, self.holder.sign_parts,
+                                                   [doc.digest for _, doc in ready])
+                t2 = time.perf_counter()
+                tokens = [None] * len(parts)
+                if self.tsa is not None:
+                    tokens = await asyncio.gather(*[
+                        loop.run_in_executor(self._tsa_threads, self.tsa.timestamp_attrs, signature)
+                        for _, signature in parts], return_exceptions=True)
+                t3 = time.perf_counter()
+                outputs = await loop.run_in_executor(self._key_thread, self._finish, ready, parts, tokens)
+                t4 = time.perf_counter()
+                timings = {'X-Batch-Size': str(len(batch)), 'X-Prepare-Ms': f'{(t1 - t0) * 1000:.1f}',
+                           'X-Key-Ms': f'{(t2 - t1) * 1000:.1f}', 'X-Tsa-Ms': f'{(t3 - t2) * 1000:.1f}'}
+                for (request, _), signed, token in zip(ready, outputs, tokens):
+                    extra = dict(timings)
+                    extra['X-Queue-Ms'] = f'{(t0 - request.queued) * 1000:.1f}'
+                    extra['X-Sign-Ms'] = f'{(t4 - request.queued) * 1000:.1f}'
+                    extra['X-Timestamp'] = '1' if token and not isinstance(token, BaseException) else '0'
+                    if not request.future.done():
+                        request.future.set_result((signed, extra))
+            self.stats['batches'] += 1
+            elapsed = time.perf_counter() - t0
+            if elapsed > 0:
+                rate = len(batch) * self.workers / elapsed
+                self.rate = rate if self.rate is None else EWMA_ALPHA * rate + (1 - EWMA_ALPHA) * self.rate
+        except Exception as e:
+            self.stats['errors'] += 1
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(HttpError(500, f'Lỗi ký: {type(e).__name__}: {e}'))
+        finally:
+            self.inflight -= len(batch)
+            self._slots.release()
+
+    def _finish(self, ready, parts, tokens):
+        # Luồng giữ khóa: ráp CMS (kèm timestamp nếu lấy được) rồi ghi vào chỗ trống /Contents của từng tài liệu
+        outputs = []
+        for (_, doc), (signed_attrs, signature), token in zip(ready, parts, tokens):
+            if isinstance(token, BaseException):
+                # Như ky.Signer: TSA lỗi thì vẫn ký, chỉ không có timestamp
+                self.stats['timestamp_errors'] += 1
+                token = None
+            elif token is not None:
+                self.stats['timestamps'] += 1
+            outputs.append(inject(doc, self.holder.assemble(signed_attrs, signature, token)))
+        return outputs
+
+    def health(self):
+        out = dict(self.stats)
+        out['uptime'] = round(time.time() - out.pop('started'), 1)
+        out.update(workers=self.workers, connections=self.connections, waiting=self.waiting,
+                   inflight=self.inflight, max_queue=self.max_queue, batch_size=self.batch_size,
+                   avg_batch=round(self.stats['signed'] / self.stats['batches'], 2) if self.stats['batches'] else None,
+                   docs_per_sec=round(self.rate, 1) if self.rate else None, retry_after=self.retry_after(),
+                   tsa=self.tsa.stats() if self.tsa is not None else [])
+        return out
+
+
+async def serve(host=HOST, port=PORT, **kwargs):
+    service = SignService(**kwargs)
+    server = await service.start(host, port)
+    addr = server.sockets[0].getsockname()
+    print(f'Dịch vụ ký đang chạy tại http://{addr[0]}:{addr[1]} ({service.workers} worker, '
+          f'lô {service.batch_size}, hàng đợi {service.max_queue}, '
+          f'TSA: {", ".join(service.tsa.servers) if service.tsa else "không"})', flush=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+def _free_port():
+    import socket
+    with socket.socket() as s:
+        s.bind((HOST, 0))
+        return s.getsockname()[1]
+
+
+def _get_json(port, path):
+    import urllib.request
+    with urllib.request.urlopen(f'http://{HOST}:{port}{path}', timeout=5) as r:
+        return json.loads(r.read())
+
+
+def _post(port, path, payload):
+    import urllib.request
+    req = urllib.request.Request(f'http://{HOST}:{port}{path}', data=payload,
+                                 headers={'Content-Type': 'application/pdf'})
+    with urllib.request.urlopen(req, timeout=30) as r:
+        return r.read(), dict(r.headers)
+
+
+def run_bench(directory=None, concurrency=16, requests=400, workers=None, tsa_delay=0.0, max_queue=MAX_QUEUE,
+              batch_size=DEFAULT_BATCH):
+    # TSA cục bộ (dau_thoi_gian) + dịch vụ ký ở tiến trình riêng + tai_thu_dich_vu làm client:
+    # 1) tải vừa (concurrency request cùng lúc), 2) quá tải (gấp 4 lần hàng đợi) để thấy 503 / Retry-After
+    import tempfile
+    import subprocess
+    from do_hieu_nang import PFX_PASSWORD, make_ca, make_pdf
+    from dau_thoi_gian import serve_local_tsa
+    from tai_thu_dich_vu import run_load
+    directory = os.path.abspath(directory or tempfile.mkdtemp(prefix='dich_vu_ky_'))
+    os.makedirs(directory, exist_ok=True)
+    pfx_path, img_path = make_ca(directory)
+    pdf_path = os.path.join(directory, 'bai_nop.pdf')
+    make_pdf(pdf_path, 2, seed='dich_vu_ky')
+    tsa_server, tsa_url = serve_local_tsa(pfx_path, PFX_PASSWORD, delay=tsa_delay)
+    port = _free_port()
+    workers = workers or os.cpu_count() or 1
+    cmd = [sys.executable, os.path.abspath(__file__), '--port', str(port), '--workers', str(workers),
+           '--pfx', pfx_path, '--password', PFX_PASSWORD.decode(), '--img', img_path, '--tsa', tsa_url,
+           '--max-queue', str(max_queue), '--batch-size', str(batch_size)]
+    proc = subprocess.Popen(cmd, cwd=directory)
+    results = {}
+    try:
+        deadline = time.time() + 60
+        while True:
+            try:
+                _get_json(port, '/health')
+                break
+            except OSError:
+                if proc.poll() is not None or time.time() > deadline:
+                    raise RuntimeError('Dịch vụ ký không khởi động được')
+                time.sleep(0.2)
+
+        # Kiểm tra một bản ký: xác thực bước 1-8 (có timestamp từ TSA cục bộ)
+        import xacthuc
+        with open(pdf_path, 'rb') as f:
+            signed, headers = _post(port, '/sign?reason=N%E1%BB%99p%20b%C3%A0i&page=0', f.read())
+        result = xacthuc.verify_document(signed)
+        steps = {n: r.status for s in result.signatures for n, r in s.steps.items()}
+        print(f'Bản ký mẫu: {len(signed)} byte, timestamp: {headers.get("X-Timestamp")}, {result.verdict}')
+        results['sample'] = {'bytes': len(signed), 'verdict': result.verdict, 'timestamp_step': steps.get(7)}
+
+        target = '/sign?reason=N%E1%BB%99p%20b%C3%A0i&location=Ph%C3%B2ng%20%C4%91%C3%A0o%20t%E1%BA%A1o'
+        for name, c, n in (('tai_vua', concurrency, requests), ('qua_tai', max(4 * max_queue, 2 * concurrency),
+                                                                requests)):
+            load = asyncio.run(run_load(pdf_path, HOST, port, c, n, 120.0, target=target))
+            results[name] = load
+            print(f'{name}: {load["concurrency"]} kết nối, {load["ok"]}/{load["requests"]} ký xong, '
+                  f'{load["rps"]} file/s, p50 {load["p50_ms"]} ms, p95 {load["p95_ms"]} ms, '
+                  f'p99 {load["p99_ms"]} ms, trạng thái {load["statuses"]}')
+        health = _get_json(port, '/health')
+        results['health'] = {k: health[k] for k in ('signed', 'rejected', 'batches', 'avg_batch', 'timestamps',
+                                                    'timestamp_errors', 'errors')}
+        print(f'Dịch vụ: {health["signed"]} file trong {health["batches"]} lô (trung bình {health["avg_batch"]}), '
+              f'{health["timestamps"]} timestamp, từ chối {health["rejected"]} (503), lỗi {health["errors"]}')
+    finally:
+        proc.terminate()
+        proc.wait(10)
+        tsa_server.shutdown()
+    out = os.path.join(directory, 'ket_qua_dich_vu_ky.json')
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f'Đã ghi {out}')
+    ok = results['sample']['timestamp_step'] == '✓' and results['tai_vua']['ok'] == results['tai_vua']['requests']
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    kwargs = {'pss': '--pss' in args}
+    if '--pss' in args:
+        args.remove('--pss')
+    if '--no-tsa' in args:
+        kwargs['tsa_servers'] = []
+        args.remove('--no-tsa')
+    host, port = HOST, PORT
+    bench = {}
+    for flag, key, conv in (('--host', 'host', str), ('--port', 'port', int), ('--workers', 'workers', int),
+                            ('--batch-size', 'batch_size', int), ('--batch-window', 'batch_window', float),
+                            ('--max-queue', 'max_queue', int), ('--max-body', 'max_body', int),
+                            ('--pfx', 'pfx_path', str), ('--password', 'password', str.encode),
+                            ('--img', 'img_path', str), ('--digest', 'digest_algorithm', str),
+                            ('--tsa', 'tsa_servers', lambda v: v.split(',')),
+                            ('--concurrency', 'concurrency', int), ('--requests', 'requests', int),
+                            ('--tsa-delay', 'tsa_delay', float)):
+        if flag in args:
+            i = args.index(flag)
+            value = conv(args[i + 1])
+            del args[i:i + 2]
+            if key == 'host':
+                host = value
+            elif key == 'port':
+                port = value
+            elif key in ('concurrency', 'requests', 'tsa_delay'):
+                bench[key] = value
+            elif key == 'batch_window':
+                # --batch-window tính bằng ms
+                kwargs[key] = value / 1000
+            else:
+                kwargs[key] = value
+    if '--bench' in args:
+        i = args.index('--bench')
+        directory = args[i + 1] if len(args) > i + 1 else None
+        for key in ('workers', 'max_queue', 'batch_size'):
+            if key in kwargs:
+                bench[key] = kwargs[key]
+        sys.exit(run_bench(directory, **bench))
+    try:
+        asyncio.run(serve(host, port, **kwargs))
+    except KeyboardInterrupt:
+        pass
+    except ValueError as e:
+        raise SystemExit(f'✗ {e}')
@@ -0,0 +1,363 @@
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+
+from doc_pdf import StreamingByteRangeHasher
+from do_luong import REGISTRY
+from xacthuc_hangloat import _init_worker, verify_data
+
+# Dịch vụ HTTP xác thực chữ ký PDF (asyncio, không cần thư viện web ngoài).
+#   POST /verify   thân request là file PDF (Content-Length hoặc chunked) -> JSON kết quả từng bước
+#                  (?quick=1: chỉ kiểm tra toàn vẹn, bước 1-4; ?policy=full|quick|strict: chính sách
+#                  của xacthuc.POLICIES; ?recheck=1: bỏ qua --result-cache)
+#   GET  /health   số liệu dịch vụ
+#   GET  /metrics  thời gian từng bước / bộ đệm dạng text của Prometheus
+# ByteRange được băm ngay trong lúc nhận dữ liệu; bước 1-8 chạy trong ProcessPoolExecutor.
+
+HOST = '127.0.0.1'
+PORT = 8080
+MAX_BODY = 50 * 1024 * 1024
+MAX_HEADER = 16 * 1024
+READ_CHUNK = 64 * 1024
+# Số tài liệu xác thực đồng thời (mặc định = số worker) và số request được phép xếp hàng thêm
+MAX_PENDING = 64
+MAX_CONNECTIONS = 256
+KEEPALIVE_TIMEOUT = 15
+BODY_TIMEOUT = 60
+# Số dòng trailer tối đa sau chunk cuối (transfer-encoding: chunked)
+MAX_TRAILERS = 32
+
+REASONS = {100: 'Continue', 200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           408: 'Request Timeout', 411: 'Length Required', 413: 'Payload Too Large',
+           431: 'Request Header Fields Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+_STEP_RE = re.compile(r'^Bước (\d+): (✓|⚠|✗) (.*)$')
+_SIG_RE = re.compile(r'^--- Chữ ký (\d+)/(\d+): (.*) ---$')
+
+
+class HttpError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+def structure_result(record):
+    # JSON theo từng chữ ký / từng bước: lấy kết quả có kiểu của worker, hoặc phân tích các dòng nhật ký
+    # (kết quả lấy từ bộ đệm kết quả chỉ có nhật ký)
+    signatures = record.get('signatures') or []
+    current = None
+    for line in [] if signatures else record.get('steps') or []:
+        line = line.strip()
+        m = _SIG_RE.match(line)
+        if m:
+            current = {'name': m.group(3), 'steps': [], 'verdict': None}
+            signatures.append(current)
+            continue
+        if line.startswith('Kết luận chữ ký') and current is not None:
+            current['verdict'] = line.split(': ', 1)[-1]
+            continue
+        m = _STEP_RE.match(line)
+        if m:
+            if current is None:
+                current = {'name': None, 'steps': [], 'verdict': record.get('verdict')}
+                signatures.append(current)
+            current['steps'].append({'step': int(m.group(1)), 'status': m.group(2), 'message': m.group(3)})
+    return {
+        'code': record.get('code'),
+        'result': record.get('ket_qua'),
+        'verdict': record.get('verdict'),
+        'policy': record.get('policy'),
+        'signatures': signatures,
+        'bytes': record.get('bytes'),
+        'seconds': record.get('seconds'),
+        'metrics': record.get('metrics'),
+    }
+
+
+class HttpService:
+    # Phần HTTP/1.1 dùng chung cho các dịch vụ (keep-alive, Content-Length / chunked, giới hạn kết nối);
+    # lớp con cài _dispatch trả về (status, body, headers)
+    def __init__(self, max_body=MAX_BODY, max_connections=MAX_CONNECTIONS):
+        self.max_body = max_body
+        self.max_connections = max_connections
+        self.connections = 0
+
+    async def start(self, host=HOST, port=PORT):
+        self.server = await asyncio.start_server(self.handle, host, port, limit=MAX_HEADER)
+        return self.server
+
+    async def _dispatch(self, reader, writer, method, path, headers):
+        raise NotImplementedError
+
+    async def handle(self, reader, writer):
+        if self.connections >= self.max_connections:
+            await self._respond(writer, 503, {'error': 'Quá nhiều kết nối'}, keep_alive=False,
+                                headers={'Retry-After': '1'})
+            writer.close()
+            return
+        self.connections += 1
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEPALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self._respond(writer, 431, {'error': 'Header quá lớn'}, keep_alive=False)
+                    break
+                try:
+                    method, path, version, headers = self._parse_head(head)
+                    keep_alive = self._wants_keep_alive(version, headers)
+                    status, body, extra = await self._dispatch(reader, writer, method, path, headers)
+                except HttpError as e:
+                    # Thân request có thể chưa đọc hết nên đóng kết nối sau lỗi
+                    keep_alive = False
+                    status, body, extra = e.status, {'error': str(e)}, e.headers
+                await self._respond(writer, status, body, keep_alive, extra)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    @staticmethod
+    def _parse_head(head):
+        try:
+            lines = head.decode('latin-1').split('\r\n')
+            method, path, version = lines[0].split(' ', 2)
+        except ValueError:
+            raise HttpError(400, 'Request line không hợp lệ')
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                k, v = line.split(':', 1)
+                headers[k.strip().lower()] = v.strip()
+        return method.upper(), path, version, headers
+
+    @staticmethod
+    def _wants_keep_alive(version, headers):
+        conn = headers.get('connection', '').lower()
+        if version == 'HTTP/1.1':
+            return conn != 'close'
+        return conn == 'keep-alive'
+
+    async def _read_body(self, reader, writer, headers, hasher=None):
+        # Đọc thân request theo khối; hasher (StreamingByteRangeHasher) nhận dữ liệu ngay khi tới
+        body = bytearray()
+        chunked = 'chunked' in headers.get('transfer-encoding', '').lower()
+        length = headers.get('content-length')
+        if not chunked:
+            if length is None:
+                raise HttpError(411, 'Thiếu Content-Length')
+            try:
+                length = int(length)
+            except ValueError:
+                raise HttpError(400, 'Content-Length không hợp lệ')
+            if length > self.max_body:
+                raise HttpError(413, f'File vượt quá {self.max_body} bytes')
+        if headers.get('expect', '').lower() == '100-continue':
+            writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+            await writer.drain()
+
+        async def read(n):
+            try:
+                return await asyncio.wait_for(reader.readexactly(n), BODY_TIMEOUT)
+            except asyncio.TimeoutError:
+                raise HttpError(408, 'Hết thời gian nhận dữ liệu')
+            except asyncio.IncompleteReadError:
+                raise HttpError(400, 'Kết nối đóng trước khi nhận đủ dữ liệu')
+
+        async def readline(too_long):
+            # Một dòng kích thước chunk / trailer; dòng dài hơn giới hạn của StreamReader -> too_long
+            try:
+                return await asyncio.wait_for(reader.readuntil(b'\r\n'), BODY_TIMEOUT)
+            except asyncio.TimeoutError:
+                raise HttpError(408, 'Hết thời gian nhận dữ liệu')
+            except asyncio.IncompleteReadError:
+                raise HttpError(400, 'Kết nối đóng trước khi nhận đủ dữ liệu')
+            except asyncio.LimitOverrunError:
+                raise HttpError(*too_long)
+
+        def accept(chunk):
+            if len(body) + len(chunk) > self.max_body:
+                raise HttpError(413, f'File vượt quá {self.max_body} bytes')
+            if hasher is not None:
+                hasher.feed(chunk)
+            body.extend(chunk)
+
+        if not chunked:
+            remaining = length
+            while remaining:
+                chunk = await read(min(READ_CHUNK, remaining))
+                accept(chunk)
+                remaining -= len(chunk)
+        else:
+            while True:
+                size_line = await readline((400, 'Dòng kích thước chunk quá dài'))
+                try:
+                    size = int(size_line.split(b';', 1)[0].strip(), 16)
+                except ValueError:
+                    raise HttpError(400, 'Chunk không hợp lệ')
+                if size == 0:
+                    # Bỏ qua trailer header (nếu có) tới dòng trống, tối đa MAX_TRAILERS dòng
+                    for _ in range(MAX_TRAILERS + 1):
+                        if await readline((431, 'Trailer quá lớn')) == b'\r\n':
+                            break
+                    else:
+                        raise HttpError(431, 'Quá nhiều dòng trailer')
+                    break
+                while size:
+                    chunk = await read(min(READ_CHUNK, size))
+                    accept(chunk)
+                    size -= len(chunk)
+                await read(2)
+        return bytes(body)
+
+    @staticmethod
+    async def _respond(writer, status, body, keep_alive, headers=None):
+        headers = dict(headers or {})
+        if isinstance(body, bytes):
+            # Thân nhị phân (vd. PDF đã ký): kiểu nội dung do nơi gọi đặt trong headers
+            payload = body
+            content_type = headers.pop('Content-Type', 'application/octet-stream')
+        elif isinstance(body, str):
+            payload = body.encode('utf-8')
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        else:
+            payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+            content_type = 'application/json; charset=utf-8'
+        head = [f'HTTP/1.1 {status} {REASONS.get(status, "")}',
+                f'Content-Type: {content_type}',
+                f'Content-Length: {len(payload)}',
+                'Connection: keep-alive' if keep_alive else 'Connection: close']
+        if keep_alive:
+            head.append(f'Keep-Alive: timeout={KEEPALIVE_TIMEOUT}')
+        for k, v in headers.items():
+            head.append(f'{k}: {v}')
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + payload)
+        await writer.drain()
+
+
+class VerifyService(HttpService):
+    def __init__(self, workers=None, trust_local_pfx=False, options=None, max_body=MAX_BODY,
+                 max_pending=MAX_PENDING, max_connections=MAX_CONNECTIONS):
+        super().__init__(max_body, max_connections)
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                        initargs=(trust_local_pfx, options))
+        self._slots = asyncio.Semaphore(self.workers)
+        self.pending = 0
+        self.stats = {'requests': 0, 'verified': 0, 'rejected': 0, 'errors': 0,
+                      'bytes': 0, 'prehashed': 0, 'started': time.time()}
+
+    def close(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+    async def _dispatch(self, reader, writer, method, path, headers):
+        self.stats['requests'] += 1
+        route, _, query = path.partition('?')
+        if route == '/health':
+            return 200, self.health(), {}
+        if route == '/metrics':
+            return 200, REGISTRY.to_prometheus(), {}
+        if route != '/verify':
+            raise HttpError(404, f'Không có đường dẫn {route}')
+        if method != 'POST':
+            raise HttpError(405, 'Chỉ nhận POST', {'Allow': 'POST'})
+        if self.pending >= self.workers + self.max_pending:
+            self.stats['rejected'] += 1
+            raise HttpError(503, 'Dịch vụ đang quá tải', {'Retry-After': '1'})
+
+        params = query.split('&')
+        quick = 'quick=1' in params
+        recheck = True if 'recheck=1' in params else None
+        policy = next((p.split('=', 1)[1] for p in params if p.startswith('policy=')), None)
+        if policy is not None:
+            from xacthuc import POLICIES
+            if policy not in POLICIES:
+                raise HttpError(400, f'Chính sách không hợp lệ: {policy} (chọn {", ".join(POLICIES)})')
+        self.pending += 1
+        try:
+            # ByteRange được băm ngay trong lúc nhận dữ liệu
+            hasher = StreamingByteRangeHasher()
+            data = await self._read_body(reader, writer, headers, hasher)
+            self.stats['bytes'] += len(data)
+            digests = hasher.digests()
+            self.stats['prehashed'] += len(digests)
+            loop = asyncio.get_running_loop()
+            async with self._slots:
+                try:
+                    record = await loop.run_in_executor(self.pool, verify_data, data, digests,
+                                                        headers.get('x-filename'), quick, recheck, policy)
+                except Exception as e:
+                    self.stats['errors'] += 1
+                    raise HttpError(500, f'Lỗi worker: {e}')
+        finally:
+            self.pending -= 1
+        if record.get('metrics'):
+            REGISTRY.observe(record['metrics'], record['ket_qua'])
+        result = structure_result(record)
+        result['sha256'] = hasher.running.hexdigest()
+        self.stats['verified'] += 1
+        return 200, result, {}
+
+    def health(self):
+        out = dict(self.stats)
+        out['uptime'] = round(time.time() - out.pop('started'), 1)
+        out.update(workers=self.workers, connections=self.connections, pending=self.pending)
+        return out
+
+
+async def serve(host=HOST, port=PORT, **kwargs):
+    service = VerifyService(**kwargs)
+    server = await service.start(host, port)
+    addr = server.sockets[0].getsockname()
+    print(f'Dịch vụ xác thực đang chạy tại http://{addr[0]}:{addr[1]} ({service.workers} worker)')
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+if __name__ == '__main__':
+    # python dich_vu_xac_thuc.py [--host H] [--port P] [--workers N] [--max-body BYTES] [--trust-local-pfx]
+    #                            [--chain-cache FILE] [--revocation-dir DIR] [--revocation-mode MODE]
+    #                            [--result-cache FILE.sqlite] [--trust-store THU_MUC|BUNDLE] [--trust-snapshot FILE]
+    args = sys.argv[1:]
+    kwargs = {}
+    if '--trust-local-pfx' in args:
+        kwargs['trust_local_pfx'] = True
+        args.remove('--trust-local-pfx')
+    options = {}
+    for flag, key in (('--chain-cache', 'chain_cache'), ('--revocation-dir', 'revocation_dir'),
+                      ('--revocation-mode', 'revocation_mode'), ('--result-cache', 'result_cache'),
+                      ('--trust-store', 'trust_store'), ('--trust-snapshot', 'trust_snapshot')):
+        if flag in args:
+            i = args.index(flag)
+            options[key] = args[i + 1]
+            del args[i:i + 2]
+    kwargs['options'] = options
+    host, port = HOST, PORT
+    for flag in ('--host', '--port', '--workers', '--max-body'):
+        if flag in args:
+            i = args.index(flag)
+            value = args[i + 1]
+            del args[i:i + 2]
+            if flag == '--host':
+                host = value
+            elif flag == '--port':
+                port = int(value)
+            else:
+                kwargs[flag[2:].replace('-', '_')] = int(value)
+    try:
+        asyncio.run(serve(host, port, **kwargs))
+    except KeyboardInterrupt:
+        pass
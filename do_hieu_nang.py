@@ -0,0 +1,481 @@
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import datetime
+import platform
+import tempfile
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Windows: không đo được peak RSS
+    resource = None
+
+# Bộ đo hiệu năng ký / xác thực trên bộ dữ liệu tổng hợp.
+# Sinh PDF với số trang, ảnh nhúng và số chữ ký khác nhau, ký bằng CA/PFX tạo tại chỗ + TSA cục bộ,
+# đo từng pha ký (overlay_render, page_merge, cms_sign, tsa, write) và từng bước xác thực 1-8 (do_luong).
+# Mỗi kịch bản chạy trong một tiến trình riêng để đo peak RSS; kết quả ghi ra JSON để so giữa các commit.
+# Cuối cùng đo khởi động lạnh của `xacthuc.py --quick` (cổng kiểm tra toàn vẹn) và chế độ đầy đủ.
+# --keys: chỉ đo số chữ ký / giây và số lần xác thực chữ ký / giây theo loại khóa (KEY_TYPES).
+#   python do_hieu_nang.py [--quick] [--iterations N] [--out FILE] [--compare FILE] [--corpus DIR] [--no-tsa]
+#   python do_hieu_nang.py --keys [--seconds S] [--out FILE] [--compare FILE] [--corpus DIR]
+
+RESULT_FILE = 'ket_qua_hieu_nang.json'
+PFX_PASSWORD = b'1234'
+# Sai khác lớn hơn ngưỡng này (tỉ lệ) so với kết quả cũ được đánh dấu là chậm đi
+REGRESSION_THRESHOLD = 0.20
+
+SCENARIOS = [
+    {'name': 'p1', 'pages': 1, 'images': 0, 'signatures': 1},
+    {'name': 'p10_anh', 'pages': 10, 'images': 3, 'signatures': 1},
+    {'name': 'p100', 'pages': 100, 'images': 0, 'signatures': 1},
+    {'name': 'p500', 'pages': 500, 'images': 0, 'signatures': 1},
+    {'name': 'p50_anh_lon', 'pages': 50, 'images': 20, 'image_px': 1024, 'signatures': 1},
+    {'name': 'p10_3chu_ky', 'pages': 10, 'images': 0, 'signatures': 3},
+]
+QUICK_SCENARIOS = ['p1', 'p100', 'p10_3chu_ky']
+
+SIGN_PHASES = ('overlay_render', 'page_merge', 'cms_sign', 'tsa', 'write')
+
+# Loại khóa của người ký: (thuật toán, tham số, RSASSA-PSS)
+KEY_TYPES = {
+    'rsa2048': ('rsa', 2048, False),
+    'rsa3072': ('rsa', 3072, False),
+    'rsa2048_pss': ('rsa', 2048, True),
+    'p256': ('ec', 'SECP256R1', False),
+    'p384': ('ec', 'SECP384R1', False),
+    'ed25519': ('ed25519', None, False),
+}
+KEY_RESULT_FILE = 'ket_qua_khoa.json'
+
+
+# ---------------------------------------------------------------------------
+# Dữ liệu tổng hợp
+# ---------------------------------------------------------------------------
+
+def generate_key(key_type):
+    from cryptography.hazmat.primitives.asymmetric import rsa, ec, ed25519
+    algo, param, _ = KEY_TYPES[key_type]
+    if algo == 'rsa':
+        return rsa.generate_private_key(public_exponent=65537, key_size=param)
+    if algo == 'ec':
+        return ec.generate_private_key(getattr(ec, param)())
+    return ed25519.Ed25519PrivateKey.generate()
+
+
+def make_ca(directory, key_type='rsa2048', filename='cert.pfx', crl_url=None, revoked=False):
+    # Root CA + chứng chỉ người ký (khóa theo KEY_TYPES) -> cert.pfx (mật khẩu PFX_PASSWORD) và ảnh chữ ký ky.png.
+    # crl_url: thêm CRLDistributionPoints vào chứng chỉ người ký và ghi CRL của CA vào directory/crl/<tên file
+    # trong crl_url>; revoked=True: CRL liệt kê chính chứng chỉ người ký
+    from cryptography import x509
+    from cryptography.x509.oid import NameOID
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.hazmat.primitives.serialization import pkcs12
+    from PIL import Image, ImageDraw
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+
+    def name(cn):
+        return x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, cn)])
+
+    ca_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    ca = (x509.CertificateBuilder()
+          .subject_name(name('Benchmark Root')).issuer_name(name('Benchmark Root'))
+          .public_key(ca_key.public_key()).serial_number(1)
+          .not_valid_before(now - datetime.timedelta(days=1))
+          .not_valid_after(now + datetime.timedelta(days=365))
+          .add_extension(x509.BasicConstraints(ca=True, path_length=None), True)
+          .add_extension(x509.KeyUsage(True, False, False, False, False, True, True, False, False), True)
+          .add_extension(x509.SubjectKeyIdentifier.from_public_key(ca_key.public_key()), False)
+          .sign(ca_key, hashes.SHA256()))
+    key = generate_key(key_type)
+    builder = (x509.CertificateBuilder()
+               .subject_name(name('Benchmark Signer')).issuer_name(ca.subject)
+               .public_key(key.public_key()).serial_number(2)
+               .not_valid_before(now - datetime.timedelta(days=1))
+               .not_valid_after(now + datetime.timedelta(days=365))
+               .add_extension(x509.KeyUsage(True, True, False, False, False, False, False, False, False), True)
+               .add_extension(x509.AuthorityKeyIdentifier.from_issuer_public_key(ca_key.public_key()), False))
+    if crl_url is not None:
+        builder = builder.add_extension(x509.CRLDistributionPoints([x509.DistributionPoint(
+            [x509.UniformResourceIdentifier(crl_url)], None, None, None)]), False)
+    cert = builder.sign(ca_key, hashes.SHA256())
+    if crl_url is not None:
+        crl = (x509.CertificateRevocationListBuilder()
+               .issuer_name(ca.subject).last_update(now - datetime.timedelta(minutes=5))
+               .next_update(now + datetime.timedelta(days=7))
+               .add_extension(x509.CRLNumber(1), False)
+               .add_extension(x509.AuthorityKeyIdentifier.from_issuer_public_key(ca_key.public_key()), False))
+        if revoked:
+            crl = crl.add_revoked_certificate(
+                x509.RevokedCertificateBuilder().serial_number(cert.serial_number)
+                .revocation_date(now - datetime.timedelta(minutes=1)).build())
+        crl_dir = os.path.join(directory, 'crl')
+        os.makedirs(crl_dir, exist_ok=True)
+        with open(os.path.join(crl_dir, crl_url.rsplit('/', 1)[-1]), 'wb') as f:
+            f.write(crl.sign(ca_key, hashes.SHA256()).public_bytes(serialization.Encoding.DER))
+    pfx_path = os.path.join(directory, filename)
+    with open(pfx_path, 'wb') as f:
+        f.write(pkcs12.serialize_key_and_certificates(
+            b'benchmark', key, cert, [ca], serialization.BestAvailableEncryption(PFX_PASSWORD)))
+
+    img = Image.new('RGBA', (400, 100), (255, 255, 255, 0))
+    draw = ImageDraw.Draw(img)
+    draw.line([(10, 80), (120, 20), (200, 70), (300, 25), (390, 60)], fill=(0, 0, 160, 255), width=4)
+    img_path = os.path.join(directory, 'ky.png')
+    img.save(img_path)
+    return pfx_path, img_path
+
+
+def make_pdf(path, pages, images=0, image_px=256, seed=0):
+    # PDF nhiều trang chữ; `images` ảnh nhiễu (khó nén) rải đều trên các trang
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.utils import ImageReader
+    from PIL import Image
+    import io
+
+    rng = random.Random(seed)
+    image_pages = set(rng.sample(range(pages), min(images, pages))) if images else set()
+    extra = max(0, images - pages)
+    c = canvas.Canvas(path, pagesize=A4)
+    for i in range(pages):
+        c.setFont('Times-Roman', 11)
+        for line in range(40):
+            c.drawString(60, 780 - line * 18, f'Trang {i + 1} - dòng {line + 1}: {rng.getrandbits(64):016x}')
+        count = (1 if i in image_pages else 0) + (extra if i == 0 else 0)
+        for k in range(count):
+            raw = rng.randbytes(image_px * image_px * 3)
+            img = Image.frombytes('RGB', (image_px, image_px), raw)
+            buf = io.BytesIO()
+            img.save(buf, format='PNG')
+            c.drawImage(ImageReader(io.BytesIO(buf.getvalue())), 60 + (k % 4) * 120, 60 + (k // 4) * 30,
+                        width=110, height=110)
+        c.showPage()
+    c.save()
+    return os.path.getsize(path)
+
+
+# ---------------------------------------------------------------------------
+# Đo
+# ---------------------------------------------------------------------------
+
+def summarize(samples):
+    # samples: danh sách giây -> thống kê theo mili giây
+    if not samples:
+        return None
+    values = sorted(samples)
+
+    def pct(p):
+        return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+    return {
+        'n': len(values),
+        'mean_ms': round(sum(values) / len(values) * 1000, 3),
+        'p50_ms': round(pct(50) * 1000, 3),
+        'p95_ms': round(pct(95) * 1000, 3),
+        'min_ms': round(values[0] * 1000, 3),
+    }
+
+
+def peak_rss_kb():
+    # Linux: VmHWM của tiến trình hiện tại (ru_maxrss được giữ qua fork/exec nên gồm cả tiến trình cha)
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS trả về byte, Linux trả về KB
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def run_scenario(scenario, corpus, tsa_url, iterations):
+    # Chạy trong tiến trình riêng (spawn): ký `iterations` lần rồi xác thực mọi bản đã ký
+    os.chdir(corpus)
+    import ky
+    import xacthuc
+    from doc_pdf import PdfBuffer
+    from do_luong import DocumentMetrics, STEP_NAMES
+
+    signer = ky.Signer(pfx_path='cert.pfx', password=PFX_PASSWORD, img_path='ky.png',
+                       tsa_servers=[tsa_url] if tsa_url else [], echo=lambda *a, **k: None)
+    src = os.path.join(corpus, f'{scenario["name"]}.pdf')
+    with open(src, 'rb') as f:
+        original = f.read()
+
+    sign_phases = {p: [] for p in SIGN_PHASES}
+    sign_total = []
+    outputs = []
+    tsa_source = None
+    for i in range(iterations):
+        data = original
+        out = os.path.join(corpus, f'{scenario["name"]}_ky_{i}.pdf')
+        t0 = time.perf_counter()
+        for _ in range(scenario.get('signatures', 1)):
+            t_sig = time.perf_counter()
+            _, tsa_source, timings = signer.sign_to_file(data, out, page=0, incremental=True)
+            sign_total.append(time.perf_counter() - t_sig)
+            for p in SIGN_PHASES:
+                sign_phases[p].append(timings.get(p, 0.0))
+            with open(out, 'rb') as f:
+                data = f.read()
+        outputs.append((out, time.perf_counter() - t0))
+
+    verify_steps = {s: [] for s in STEP_NAMES}
+    verify_total = []
+    verdicts = set()
+    for out, _ in outputs:
+        t0 = time.perf_counter()
+        metrics = DocumentMetrics()
+        with PdfBuffer(out) as data:
+            _, _, verdict = xacthuc.verify_pdf(data, True, lambda *a, **k: None, metrics=metrics)
+        verify_total.append(time.perf_counter() - t0)
+        verdicts.add(verdict)
+        # Thời gian từng bước của từng chữ ký
+        for clock in metrics.clocks:
+            for step, seconds in clock.steps.items():
+                verify_steps[step].append(seconds)
+
+    sign_seconds = sum(t for _, t in outputs)
+    verify_seconds = sum(verify_total)
+    return {
+        'name': scenario['name'],
+        'params': scenario,
+        'bytes': len(original),
+        'signed_bytes': os.path.getsize(outputs[-1][0]),
+        'iterations': iterations,
+        'sign': {
+            'docs_per_sec': round(iterations / sign_seconds, 2) if sign_seconds else None,
+            'total': summarize(sign_total),
+            'phases': {p: summarize(v) for p, v in sign_phases.items()},
+            'tsa_source': tsa_source,
+        },
+        'verify': {
+            'docs_per_sec': round(iterations / verify_seconds, 2) if verify_seconds else None,
+            'total': summarize(verify_total),
+            'steps': {s: summarize(v) for s, v in verify_steps.items()},
+            'verdicts': sorted(v or '✗' for v in verdicts),
+        },
+        'peak_rss_kb': peak_rss_kb(),
+    }
+
+
+def measure_cold_start(pdf, corpus, runs=10, quick=True):
+    # Thời gian thực của cả tiến trình `python xacthuc.py [--quick] file` (gồm khởi động interpreter và import)
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'xacthuc.py')
+    cmd = [sys.executable, script, pdf, '--trust-local-pfx'] + (['--quick'] if quick else [])
+    samples = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        subprocess.run(cmd, cwd=corpus, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+        samples.append(time.perf_counter() - t0)
+    return summarize(samples)
+
+
+def git_revision():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_benchmark(scenarios=None, iterations=5, corpus=None, use_tsa=True, echo=print):
+    from dau_thoi_gian import serve_local_tsa
+
+    scenarios = scenarios or SCENARIOS
+    corpus = os.path.abspath(corpus or tempfile.mkdtemp(prefix='do_hieu_nang_'))
+    os.makedirs(corpus, exist_ok=True)
+    echo(f'Tạo dữ liệu thử tại {corpus} ...')
+    pfx_path, _ = make_ca(corpus)
+    for sc in scenarios:
+        size = make_pdf(os.path.join(corpus, f'{sc["name"]}.pdf'), sc['pages'], sc.get('images', 0),
+                        sc.get('image_px', 256), seed=sc['name'])
+        echo(f'  {sc["name"]}: {sc["pages"]} trang, {sc.get("images", 0)} ảnh, {size / 1e6:.2f} MB')
+
+    server = tsa_url = None
+    if use_tsa:
+        server, tsa_url = serve_local_tsa(pfx_path, PFX_PASSWORD)
+    results = []
+    ctx = multiprocessing.get_context('spawn')
+    try:
+        for sc in scenarios:
+            with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                result = pool.submit(run_scenario, sc, corpus, tsa_url, iterations).result()
+            results.append(result)
+            echo(f'  {sc["name"]}: ký {result["sign"]["docs_per_sec"]} file/s, '
+                 f'xác thực {result["verify"]["docs_per_sec"]} file/s, peak RSS {result["peak_rss_kb"]} KB')
+        # Khởi động lạnh trên bản đã ký của kịch bản đầu tiên: chế độ nhanh (bước 1-4) và đầy đủ
+        cold_start = {}
+        signed = os.path.join(corpus, f'{scenarios[0]["name"]}_ky_0.pdf')
+        for mode, quick in (('quick', True), ('full', False)):
+            cold_start[mode] = measure_cold_start(signed, corpus, runs=max(iterations, 5), quick=quick)
+        echo(f'  Khởi động lạnh: nhanh p50 {cold_start["quick"]["p50_ms"]} ms, '
+             f'đầy đủ p50 {cold_start["full"]["p50_ms"]} ms')
+    finally:
+        if server is not None:
+            server.shutdown()
+    return {
+        'meta': {
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'git': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'iterations': iterations,
+            'tsa': bool(use_tsa),
+            'corpus': corpus,
+            'scenario_hash': hashlib.sha256(json.dumps(scenarios, sort_keys=True).encode()).hexdigest()[:12],
+        },
+        'scenarios': results,
+        'cold_start': cold_start,
+    }
+
+
+def _throughput(fn, seconds):
+    # Gọi fn lặp lại trong khoảng `seconds`; trả về (số lần / giây, thống kê từng lần)
+    samples = []
+    deadline = time.perf_counter() + seconds
+    while True:
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+        if t0 + samples[-1] >= deadline:
+            break
+    return round(len(samples) / sum(samples), 1), summarize(samples)
+
+
+def run_key_benchmark(corpus=None, seconds=1.0, echo=print):
+    # Theo từng loại khóa: số chữ ký CMS / giây (KeyHolder, không TSA), số lần kiểm tra chữ ký / giây
+    # (xacthuc.verify_signature, bước 4) và một lần ký + xác thực toàn vẹn cả tài liệu để chắc chắn đúng
+    import ky
+    import xacthuc
+    from asn1crypto import cms
+    from ky_hai_pha import KeyHolder
+
+    corpus = os.path.abspath(corpus or tempfile.mkdtemp(prefix='do_hieu_nang_khoa_'))
+    os.makedirs(corpus, exist_ok=True)
+    pdf_path = os.path.join(corpus, 'khoa.pdf')
+    make_pdf(pdf_path, 1, seed='khoa')
+    with open(pdf_path, 'rb') as f:
+        original = f.read()
+    results = {}
+    for key_type, (_, _, pss) in KEY_TYPES.items():
+        pfx_path, img_path = make_ca(corpus, key_type, f'{key_type}.pfx')
+        holder = KeyHolder.from_pfx(pfx_path, PFX_PASSWORD, pss=pss, echo=lambda *a, **k: None)
+        digest = hashlib.new(holder.digest_algorithm, key_type.encode()).digest()
+        sign_rate, sign_stats = _throughput(lambda: holder.sign_digests([digest]), seconds)
+
+        sd = cms.ContentInfo.load(holder.sign_digests([digest])[0])['content']
+        signer_info = sd['signer_infos'][0]
+        signed_attrs = signer_info['signed_attrs'].dump()
+        signature = signer_info['signature'].native
+        cert = xacthuc.signer_certificate(sd)
+        public_key = xacthuc.load_public_key(cert.public_key.dump())
+        verify_rate, verify_stats = _throughput(
+            lambda: xacthuc.verify_signature(sd, signed_attrs, signature, None, public_key), seconds)
+
+        signer = ky.Signer(pfx_path, PFX_PASSWORD, img_path, tsa_servers=[], echo=lambda *a, **k: None, pss=pss)
+        signed, _, _ = signer.sign(original, incremental=True)
+        with open(os.path.join(corpus, f'khoa_{key_type}.pdf'), 'wb') as f:
+            f.write(signed)
+        _, _, verdict = xacthuc.verify_pdf(signed, False, lambda *a, **k: None, quick=True, recheck=True)
+        results[key_type] = {
+            'scheme': holder.scheme,
+            'digest': holder.digest_algorithm,
+            'signature_bytes': len(signature),
+            'sign': {'per_sec': sign_rate, 'total': sign_stats},
+            'verify': {'per_sec': verify_rate, 'total': verify_stats},
+            'verdict': verdict,
+        }
+        echo(f'  {key_type:12} {holder.scheme}/{holder.digest_algorithm}: ký {sign_rate}/s, '
+             f'xác thực {verify_rate}/s, chữ ký {len(signature)} byte - {verdict}')
+    return results
+
+
+def _metrics(result):
+    # Phẳng hóa thành {kịch bản/pha: mean_ms} để so sánh
+    out = {}
+    for sc in result.get('scenarios', []):
+        for part, key in (('sign', 'phases'), ('verify', 'steps')):
+            for name, stats in (sc[part].get(key) or {}).items():
+                if stats:
+                    out[f'{sc["name"]}/{part}/{name}'] = stats['mean_ms']
+            if sc[part].get('total'):
+                out[f'{sc["name"]}/{part}/total'] = sc[part]['total']['mean_ms']
+    for mode, stats in (result.get('cold_start') or {}).items():
+        if stats:
+            out[f'cold_start/{mode}'] = stats['p50_ms']
+    for key_type, res in (result.get('keys') or {}).items():
+        for part in ('sign', 'verify'):
+            if res[part].get('total'):
+                out[f'keys/{key_type}/{part}'] = res[part]['total']['mean_ms']
+    return out
+
+
+def compare(old, new, threshold=REGRESSION_THRESHOLD, echo=print):
+    # In các chỉ số thay đổi quá ngưỡng; trả về số chỉ số chậm đi
+    before, after = _metrics(old), _metrics(new)
+    regressions = 0
+    echo(f'So sánh với {old.get("meta", {}).get("git")} ({old.get("meta", {}).get("time")}):')
+    for key in sorted(set(before) & set(after)):
+        a, b = before[key], after[key]
+        # Bỏ qua các pha quá ngắn (nhiễu đo)
+        if max(a, b) < 0.5:
+            continue
+        change = (b - a) / a if a else 0.0
+        if abs(change) >= threshold:
+            mark = '✗ chậm hơn' if change > 0 else '✓ nhanh hơn'
+            regressions += change > 0
+            echo(f'  {mark} {key}: {a:.2f} ms -> {b:.2f} ms ({change * 100:+.0f}%)')
+    if not regressions:
+        echo('  ✓ Không có chỉ số nào chậm đi quá ngưỡng')
+    return regressions
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    keys_only = '--keys' in args
+    opts = {'iterations': 5, 'out': KEY_RESULT_FILE if keys_only else RESULT_FILE, 'compare': None, 'corpus': None,
+            'seconds': 1.0}
+    for flag, key, conv in (('--iterations', 'iterations', int), ('--out', 'out', str),
+                            ('--compare', 'compare', str), ('--corpus', 'corpus', str), ('--seconds', 'seconds', float)):
+        if flag in args:
+            i = args.index(flag)
+            opts[key] = conv(args[i + 1])
+            del args[i:i + 2]
+    scenarios = SCENARIOS
+    if '--quick' in args:
+        scenarios = [sc for sc in SCENARIOS if sc['name'] in QUICK_SCENARIOS]
+    if keys_only:
+        print('Đo ký / xác thực theo loại khóa...')
+        result = {
+            'meta': {'time': datetime.datetime.now().isoformat(timespec='seconds'), 'git': git_revision(),
+                     'python': platform.python_version(), 'platform': platform.platform(),
+                     'seconds': opts['seconds']},
+            'keys': run_key_benchmark(opts['corpus'], opts['seconds']),
+        }
+    else:
+        result = run_benchmark(scenarios, opts['iterations'], opts['corpus'], use_tsa='--no-tsa' not in args)
+        print('Đo ký / xác thực theo loại khóa...')
+        result['keys'] = run_key_benchmark(os.path.join(result['meta']['corpus'], 'khoa'), opts['seconds'])
+    with open(opts['out'], 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f'Đã ghi kết quả vào {opts["out"]}')
+    code = 0
+    if opts['compare']:
+        with open(opts['compare'], 'r', encoding='utf-8') as f:
+            code = 1 if compare(json.load(f), result) else 0
+    sys.exit(code)
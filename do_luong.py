@@ -0,0 +1,149 @@
+import os
+import time
+import bisect
+import threading
+
+# Đo thời gian từng bước xác thực và bộ đếm (byte đã băm, trúng/trượt bộ đệm).
+# Chi phí chỉ là vài lần gọi perf_counter cho mỗi chữ ký nên luôn bật.
+# DocumentMetrics: số liệu của một tài liệu (ghi thành bản ghi JSONL);
+# MetricsRegistry: cộng dồn trong tiến trình, xuất dạng text của Prometheus.
+
+STEP_NAMES = ('byterange', 'pkcs7', 'digest', 'signature', 'chain', 'revocation', 'timestamp', 'incremental')
+# Ngưỡng histogram (giây)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+PREFIX = 'xacthuc'
+
+
+class StepClock:
+    # Đồng hồ của một chữ ký: mark(n) kết thúc bước đang chạy và bắt đầu bước n (1-8), mark() để dừng
+    __slots__ = ('steps', '_current', '_t0')
+
+    def __init__(self):
+        self.steps = {}
+        self._current = None
+        self._t0 = 0.0
+
+    def mark(self, step=None):
+        now = time.perf_counter()
+        if self._current is not None:
+            name = STEP_NAMES[self._current - 1]
+            self.steps[name] = self.steps.get(name, 0.0) + now - self._t0
+        self._current = step
+        self._t0 = now
+
+    def add(self, name, seconds):
+        # Cộng thời gian của một bước chạy riêng (bước chạy song song, không theo thứ tự mark)
+        self.steps[name] = self.steps.get(name, 0.0) + seconds
+
+
+class DocumentMetrics:
+    def __init__(self):
+        self.clocks = []
+        self.counters = {}
+        self.seconds = None
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def clock(self):
+        c = StepClock()
+        with self._lock:
+            self.clocks.append(c)
+        return c
+
+    def count(self, key, n=1):
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def finish(self):
+        for c in self.clocks:
+            c.mark()
+        self.seconds = time.perf_counter() - self._t0
+
+    def as_dict(self):
+        # {'seconds', 'signatures', 'steps': {bước: {'seconds', 'count'}}, 'per_signature': [...], bộ đếm}
+        steps = {}
+        for c in self.clocks:
+            for name, seconds in c.steps.items():
+                entry = steps.setdefault(name, {'seconds': 0.0, 'count': 0})
+                entry['seconds'] += seconds
+                entry['count'] += 1
+        for entry in steps.values():
+            entry['seconds'] = round(entry['seconds'], 6)
+        out = {
+            'seconds': round(self.seconds, 6) if self.seconds is not None else None,
+            'signatures': len(self.clocks),
+            'steps': {name: steps[name] for name in STEP_NAMES if name in steps},
+        }
+        if len(self.clocks) > 1:
+            out['per_signature'] = [{k: round(v, 6) for k, v in c.steps.items()} for c in self.clocks]
+        out.update(self.counters)
+        return out
+
+
+class MetricsRegistry:
+    # Cộng dồn bản ghi DocumentMetrics.as_dict() (có thể đến từ tiến trình worker khác)
+    def __init__(self, prefix=PREFIX):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self.documents = {}  # kết quả -> số tài liệu
+        self.step_seconds = {}
+        self.step_count = {}
+        self.step_buckets = {}  # bước -> số quan sát theo từng ngưỡng BUCKETS (+Inf ở cuối)
+        self.counters = {}
+        self.document_seconds = 0.0
+
+    def observe(self, metrics, result='unknown'):
+        with self._lock:
+            self.documents[result] = self.documents.get(result, 0) + 1
+            self.document_seconds += metrics.get('seconds') or 0.0
+            for name, entry in (metrics.get('steps') or {}).items():
+                self.step_seconds[name] = self.step_seconds.get(name, 0.0) + entry['seconds']
+                self.step_count[name] = self.step_count.get(name, 0) + entry['count']
+            per_signature = metrics.get('per_signature') or [
+                {k: v['seconds'] for k, v in (metrics.get('steps') or {}).items()}]
+            for sig in per_signature:
+                for name, seconds in sig.items():
+                    buckets = self.step_buckets.setdefault(name, [0] * (len(BUCKETS) + 1))
+                    buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+            for key, value in metrics.items():
+                if key not in ('seconds', 'signatures', 'steps', 'per_signature') and isinstance(value, int):
+                    self.counters[key] = self.counters.get(key, 0) + value
+
+    def to_prometheus(self):
+        p = self.prefix
+        out = []
+        with self._lock:
+            out.append(f'# HELP {p}_documents_total Số tài liệu đã xác thực theo kết quả')
+            out.append(f'# TYPE {p}_documents_total counter')
+            for result, n in sorted(self.documents.items()):
+                out.append(f'{p}_documents_total{{result="{result}"}} {n}')
+            out.append(f'# HELP {p}_document_seconds_total Tổng thời gian xác thực tài liệu')
+            out.append(f'# TYPE {p}_document_seconds_total counter')
+            out.append(f'{p}_document_seconds_total {self.document_seconds:.6f}')
+            out.append(f'# HELP {p}_step_seconds Thời gian từng bước xác thực (mỗi chữ ký)')
+            out.append(f'# TYPE {p}_step_seconds histogram')
+            for name in STEP_NAMES:
+                if name not in self.step_buckets:
+                    continue
+                cumulative = 0
+                for le, n in zip(BUCKETS, self.step_buckets[name]):
+                    cumulative += n
+                    out.append(f'{p}_step_seconds_bucket{{step="{name}",le="{le}"}} {cumulative}')
+                cumulative += self.step_buckets[name][-1]
+                out.append(f'{p}_step_seconds_bucket{{step="{name}",le="+Inf"}} {cumulative}')
+                out.append(f'{p}_step_seconds_sum{{step="{name}"}} {self.step_seconds.get(name, 0.0):.6f}')
+                out.append(f'{p}_step_seconds_count{{step="{name}"}} {self.step_count.get(name, 0)}')
+            for key, value in sorted(self.counters.items()):
+                out.append(f'# TYPE {p}_{key}_total counter')
+                out.append(f'{p}_{key}_total {value}')
+        return '\n'.join(out) + '\n'
+
+    def write_prometheus(self, path):
+        # Ghi nguyên tử để node_exporter (textfile collector) không đọc phải file dở
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp, path)
+
+
+REGISTRY = MetricsRegistry()
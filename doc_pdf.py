@@ -0,0 +1,1093 @@
+import os
+import base64
+import bisect
+import hashlib
+import re
+import mmap
+import zlib
+
+# Kích thước mỗi khối khi băm ByteRange (không tạo bản sao toàn bộ file)
+HASH_CHUNK = 1 << 20
+# Vùng cuối file dùng để tìm startxref / %%EOF
+TAIL_WINDOW = 4096
+# madvise (chỉ có trên Unix): đọc trước khi băm tuần tự, trả lại các trang đã băm khỏi RSS
+_MADV_SEQUENTIAL = getattr(mmap, 'MADV_SEQUENTIAL', None)
+_MADV_DONTNEED = getattr(mmap, 'MADV_DONTNEED', None)
+
+_BYTE_RANGE_RE = re.compile(br'/ByteRange\s*\[\s*(\d+)\s+(\d+)\s+(\d+)\s+(\d+)\s*\]')
+
+
+class PdfBuffer:
+    # Mở PDF dạng mmap chỉ đọc; dùng như bytes (len, slice, find/rfind) mà không nạp cả file vào RAM.
+    # File rỗng không mmap được nên dùng b'' thay thế.
+    def __init__(self, path):
+        self.path = path
+        self._f = open(path, 'rb')
+        size = os.fstat(self._f.fileno()).st_size
+        if size:
+            self.data = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.data = b''
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self._f.close()
+
+    def __enter__(self):
+        return self.data
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PdfSlice:
+    # Cửa sổ chỉ đọc [offset, offset + size) của một file lớn (vd. thành viên không nén trong ZIP/TAR),
+    # dùng như PdfBuffer (len, slice, find/rfind) với vị trí tính từ đầu cửa sổ. Chỉ mmap từ biên trang
+    # chứa offset tới hết cửa sổ; memoryview lấy qua byte_view() vì lớp Python không có buffer protocol.
+    def __init__(self, path, offset, size):
+        self.path = path
+        self.size = size
+        self._f = open(path, 'rb')
+        if offset + size > os.fstat(self._f.fileno()).st_size:
+            self._f.close()
+            raise ValueError(f'Cửa sổ [{offset}, {offset + size}) vượt quá kích thước file {path}')
+        start = offset - offset % mmap.ALLOCATIONGRANULARITY
+        self._base = offset - start
+        if size:
+            self._mm = mmap.mmap(self._f.fileno(), self._base + size, access=mmap.ACCESS_READ, offset=start)
+        else:
+            self._mm = b''
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.size)
+            if step != 1:
+                return self[start:stop][::step]
+            return self._mm[self._base + start:self._base + max(start, stop)]
+        if key < 0:
+            key += self.size
+        if not 0 <= key < self.size:
+            raise IndexError('PdfSlice index out of range')
+        return self._mm[self._base + key]
+
+    def find(self, sub, start=None, end=None):
+        start, end, _ = slice(start, end).indices(self.size)
+        pos = self._mm.find(sub, self._base + start, self._base + end)
+        return pos - self._base if pos >= 0 else -1
+
+    def rfind(self, sub, start=None, end=None):
+        start, end, _ = slice(start, end).indices(self.size)
+        pos = self._mm.rfind(sub, self._base + start, self._base + end)
+        return pos - self._base if pos >= 0 else -1
+
+    def view(self):
+        return memoryview(self._mm)[self._base:self._base + self.size]
+
+    def close(self):
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PdfParts:
+    # Tài liệu gồm nhiều đoạn bytes nối tiếp (vd. file gốc + các incremental update khi ký), dùng như PdfBuffer
+    # (len, slice, find/rfind) mà không ghép thành một bytes mới; slice chỉ sao chép đúng vùng được đọc
+    def __init__(self, parts):
+        self.parts = tuple(parts)
+        self._offsets = []
+        size = 0
+        for part in self.parts:
+            self._offsets.append(size)
+            size += len(part)
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def __add__(self, other):
+        # Nối thêm một đoạn (bytes) hoặc các đoạn của PdfParts khác
+        return PdfParts(self.parts + (other.parts if isinstance(other, PdfParts) else (other,)))
+
+    def _locate(self, pos):
+        i = bisect.bisect_right(self._offsets, pos) - 1
+        return i, pos - self._offsets[i]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.size)
+            if step != 1:
+                return self[start:stop][::step]
+            return b''.join(bytes(v) for v in self.views(start, stop))
+        if key < 0:
+            key += self.size
+        if not 0 <= key < self.size:
+            raise IndexError('PdfParts index out of range')
+        i, off = self._locate(key)
+        return self.parts[i][off]
+
+    def views(self, start, end):
+        # memoryview của từng đoạn nằm trong [start, end), theo thứ tự
+        i, off = self._locate(start) if start < self.size else (len(self.parts), 0)
+        while i < len(self.parts) and start < end:
+            part = self.parts[i]
+            n = min(len(part) - off, end - start)
+            if n > 0:
+                yield memoryview(part)[off:off + n]
+            start += n
+            i, off = i + 1, 0
+
+    def find(self, sub, start=None, end=None):
+        start, end, _ = slice(start, end).indices(self.size)
+        for base, part in zip(self._offsets, self.parts):
+            edge = base + len(part)
+            if edge <= start:
+                continue
+            if base >= end:
+                break
+            pos = part.find(sub, max(0, start - base), min(len(part), end - base))
+            if pos >= 0:
+                return base + pos
+            # Chuỗi vắt qua ranh giới với đoạn sau
+            if len(sub) > 1 and edge < end:
+                lo = max(start, edge - len(sub) + 1)
+                pos = self[lo:min(end, edge + len(sub) - 1)].find(sub)
+                if pos >= 0:
+                    return lo + pos
+        return -1
+
+    def rfind(self, sub, start=None, end=None):
+        start, end, _ = slice(start, end).indices(self.size)
+        for base, part in zip(reversed(self._offsets), reversed(self.parts)):
+            edge = base + len(part)
+            if base >= end:
+                continue
+            if edge <= start:
+                break
+            if len(sub) > 1 and edge < end:
+                lo = max(start, edge - len(sub) + 1)
+                pos = self[lo:min(end, edge + len(sub) - 1)].rfind(sub)
+                if pos >= 0:
+                    return lo + pos
+            pos = part.rfind(sub, max(0, start - base), min(len(part), end - base))
+            if pos >= 0:
+                return base + pos
+        return -1
+
+
+def byte_view(data):
+    # memoryview của bytes / bytearray / mmap / PdfSlice (bên gọi release() khi xong)
+    return data.view() if isinstance(data, PdfSlice) else memoryview(data)
+
+
+def find_startxref(data, end=None):
+    # Đọc offset của bảng xref cuối cùng từ đuôi file (hoặc của phần data[:end], vd. bản đã ký)
+    end = len(data) if end is None else end
+    tail_start = max(0, end - TAIL_WINDOW)
+    pos = data.rfind(b'startxref', tail_start, end)
+    if pos < 0:
+        return None
+    m = re.match(br'startxref\s+(\d+)', data[pos:pos + 64])
+    return int(m.group(1)) if m else None
+
+
+def iter_revisions_from_tail(data):
+    # Duyệt các đoạn incremental update từ cuối file về đầu, mỗi đoạn kết thúc bằng %%EOF.
+    # Trả về (start, end) của từng đoạn; chỉ quét phần giữa hai dấu %%EOF liên tiếp.
+    end = len(data)
+    eof = data.rfind(b'%%EOF', max(0, end - TAIL_WINDOW))
+    if eof < 0:
+        yield 0, end
+        return
+    while True:
+        prev = data.rfind(b'%%EOF', 0, eof)
+        start = prev + 5 if prev >= 0 else 0
+        yield start, end
+        if prev < 0:
+            return
+        end = start
+        eof = prev
+
+
+def parse_contents_gap(data, br):
+    # /Contents nằm đúng trong khoảng trống giữa hai cửa sổ ByteRange: <hex...>
+    a0, l0, a1, l1 = br
+    gap = bytes(data[a0 + l0:a1]).strip()
+    if gap.startswith(b'<') and gap.endswith(b'>'):
+        hexstr = re.sub(br'\s+', b'', gap[1:-1])
+        try:
+            return bytes.fromhex(hexstr.decode('ascii'))
+        except ValueError:
+            return None
+    return None
+
+
+def find_signature_dict(data):
+    # Tìm /ByteRange của chữ ký mới nhất bắt đầu từ đuôi file (đoạn update cuối trước),
+    # sau đó lấy /Contents từ khoảng trống mà ByteRange chừa ra.
+    for start, end in iter_revisions_from_tail(data):
+        pos = data.rfind(b'/ByteRange', start, end)
+        if pos < 0:
+            continue
+        m = _BYTE_RANGE_RE.match(bytes(data[pos:pos + 128]))
+        if not m:
+            continue
+        br = tuple(int(x) for x in m.groups())
+        a0, l0, a1, l1 = br
+        if a0 + l0 > a1 or a1 + l1 > len(data):
+            continue
+        return br, parse_contents_gap(data, br)
+    return None, None
+
+
+def _mapped(data):
+    # (mmap, vị trí của data trong mmap) khi data là ánh xạ của file, ngược lại (None, 0)
+    if isinstance(data, mmap.mmap):
+        return data, 0
+    if isinstance(data, PdfSlice) and isinstance(data._mm, mmap.mmap):
+        return data._mm, data._base
+    return None, 0
+
+
+def _advise(mm, option, start, end):
+    # madvise cho [start, end) của mm, start làm tròn xuống biên trang
+    if mm is None or option is None or end <= start:
+        return
+    start -= start % mmap.PAGESIZE
+    mm.madvise(option, start, end - start)
+
+
+def hash_byterange(data, br, hash_obj, chunk_size=HASH_CHUNK):
+    # Đưa hai cửa sổ ByteRange vào hash theo từng khối qua memoryview (không nối part1 + part2).
+    # Với file mmap, mỗi khối đã băm được trả lại (MADV_DONTNEED): RSS chỉ tăng cỡ một khối dù file nhiều GB;
+    # trang vẫn nằm trong page cache nên bước sau cần đọc lại cũng không phải đọc đĩa
+    a0, l0, a1, l1 = br
+    if isinstance(data, PdfParts):
+        for off, length in ((a0, l0), (a1, l1)):
+            for piece in data.views(off, off + length):
+                for i in range(0, len(piece), chunk_size):
+                    hash_obj.update(piece[i:i + chunk_size])
+        return hash_obj
+    mm, base = _mapped(data)
+    view = byte_view(data)
+    try:
+        for off, length in ((a0, l0), (a1, l1)):
+            end = off + length
+            _advise(mm, _MADV_SEQUENTIAL, base + off, base + end)
+            while off < end:
+                n = min(chunk_size, end - off)
+                hash_obj.update(view[off:off + n])
+                _advise(mm, _MADV_DONTNEED, base + off, base + off + n)
+                off += n
+    finally:
+        view.release()
+    return hash_obj
+
+
+_BYTERANGE_OVERLAP = 128
+
+
+class StreamingByteRangeHasher:
+    # Băm ByteRange trong khi dữ liệu còn đang tới (vd. upload HTTP).
+    # /ByteRange [0 a b c] thường nằm trước khe /Contents nên được phát hiện trước khi tới vị trí a:
+    # một hash chạy trên toàn bộ luồng được copy() tại a, rồi nhận tiếp [b, b+c).
+    # ByteRange phát hiện muộn (đã qua a) bị bỏ qua; bên gọi băm lại từ bộ đệm (hash_byterange).
+    def __init__(self, algo='sha256'):
+        self.algo = algo
+        self.pos = 0
+        self.running = hashlib.new(algo)  # hash toàn bộ luồng (cũng là hash của cả file)
+        self._targets = {}  # tuple(br) -> hash object (None khi chưa tới a)
+        self._tail = b''
+
+    def _scan(self, chunk):
+        # Giữ lại đuôi khối trước để không bỏ sót /ByteRange nằm vắt qua hai khối
+        window = self._tail + bytes(chunk)
+        base = self.pos - len(self._tail)
+        for m in _BYTE_RANGE_RE.finditer(window):
+            br = tuple(int(x) for x in m.groups())
+            if br in self._targets or br[0] != 0:
+                continue
+            # Chỉ nhận khi khe /Contents chưa bắt đầu (vị trí a còn ở phía trước)
+            if base + m.end() <= br[1] and br[1] >= self.pos:
+                self._targets[br] = None
+        self._tail = window[-_BYTERANGE_OVERLAP:]
+
+    def feed(self, chunk):
+        mv = memoryview(chunk)
+        start, end = self.pos, self.pos + len(mv)
+        self._scan(mv)
+        prev = start
+        for br in sorted((b for b, h in self._targets.items() if h is None and start <= b[1] <= end),
+                         key=lambda b: b[1]):
+            self.running.update(mv[prev - start:br[1] - start])
+            prev = br[1]
+            self._targets[br] = self.running.copy()
+        self.running.update(mv[prev - start:])
+        for br, h in self._targets.items():
+            if h is None:
+                continue
+            lo, hi = max(start, br[2]), min(end, br[2] + br[3])
+            if lo < hi:
+                h.update(mv[lo - start:hi - start])
+        self.pos = end
+
+    def digests(self):
+        # {tuple(br): digest} cho các ByteRange đã nhận đủ dữ liệu
+        return {br: h.digest() for br, h in self._targets.items()
+                if h is not None and self.pos >= br[2] + br[3]}
+
+
+# ---------------------------------------------------------------------------
+# Bảng chỉ mục xref / trailer: đọc đúng các object cần thiết thay vì quét cả file
+# ---------------------------------------------------------------------------
+
+_WS = b' \t\r\n\x0c\x00'
+_DELIM = b'()<>[]{}/%'
+_NUM_RE = re.compile(br'[+-]?(\d+\.?\d*|\.\d+)')
+_REF_RE = re.compile(br'(\d+)\s+(\d+)\s+R')
+_OBJ_HEAD_RE = re.compile(br'(\d+)\s+(\d+)\s+obj')
+# Giới hạn đọc cho phần đầu một object (dictionary), không đọc nội dung stream
+OBJ_READ_LIMIT = 1 << 20
+
+
+class PdfSyntaxError(Exception):
+    pass
+
+
+class Ref(tuple):
+    # Tham chiếu gián tiếp "num gen R"
+    def __new__(cls, num, gen):
+        return tuple.__new__(cls, (num, gen))
+
+    @property
+    def num(self):
+        return self[0]
+
+
+class Name(str):
+    pass
+
+
+class LiteralString(bytes):
+    # Chuỗi (...) giữ nguyên nội dung thô (kể cả escape) để ghi lại không đổi
+    pass
+
+
+class HexString(bytes):
+    # Chuỗi <...> kèm vị trí bắt đầu/kết thúc trong file (dùng cho /Contents)
+    start = None
+    end = None
+
+
+def _skip_ws(buf, pos):
+    n = len(buf)
+    while pos < n:
+        c = buf[pos:pos + 1]
+        if c in _WS and c:
+            pos += 1
+        elif c == b'%':
+            while pos < n and buf[pos:pos + 1] not in (b'\r', b'\n'):
+                pos += 1
+        else:
+            break
+    return pos
+
+
+def parse_value(buf, pos, base=0):
+    # Parser tối giản cho dictionary / array / số / name / chuỗi / tham chiếu.
+    # base là offset của buf trong file để ghi vị trí HexString.
+    pos = _skip_ws(buf, pos)
+    c = buf[pos:pos + 1]
+    if c == b'<' and buf[pos + 1:pos + 2] == b'<':
+        pos += 2
+        d = {}
+        while True:
+            pos = _skip_ws(buf, pos)
+            if buf[pos:pos + 2] == b'>>':
+                return d, pos + 2
+            key, pos = parse_value(buf, pos, base)
+            if not isinstance(key, Name):
+                raise PdfSyntaxError(f'Khóa dictionary không hợp lệ tại {base + pos}')
+            val, pos = parse_value(buf, pos, base)
+            d[key] = val
+    if c == b'[':
+        pos += 1
+        arr = []
+        while True:
+            pos = _skip_ws(buf, pos)
+            if buf[pos:pos + 1] == b']':
+                return arr, pos + 1
+            if not buf[pos:pos + 1]:
+                raise PdfSyntaxError('Array không đóng')
+            val, pos = parse_value(buf, pos, base)
+            arr.append(val)
+    if c == b'<':
+        end = buf.find(b'>', pos)
+        if end < 0:
+            raise PdfSyntaxError('Hex string không đóng')
+        raw = re.sub(br'\s+', b'', bytes(buf[pos + 1:end]))
+        if len(raw) % 2:
+            raw += b'0'
+        val = HexString(bytes.fromhex(raw.decode('ascii')))
+        val.start, val.end = base + pos, base + end + 1
+        return val, end + 1
+    if c == b'(':
+        depth, i, out = 0, pos, bytearray()
+        while True:
+            ch = buf[i:i + 1]
+            if not ch:
+                raise PdfSyntaxError('Chuỗi không đóng')
+            if ch == b'\\':
+                out += buf[i:i + 2]
+                i += 2
+                continue
+            if ch == b'(':
+                depth += 1
+                if depth == 1:
+                    i += 1
+                    continue
+            elif ch == b')':
+                depth -= 1
+                if depth == 0:
+                    return LiteralString(out), i + 1
+            out += ch
+            i += 1
+    if c == b'/':
+        i = pos + 1
+        while buf[i:i + 1] and buf[i:i + 1] not in _WS and buf[i:i + 1] not in _DELIM:
+            i += 1
+        return Name(bytes(buf[pos:i]).decode('latin-1')), i
+    m = _REF_RE.match(buf, pos)
+    if m:
+        return Ref(int(m.group(1)), int(m.group(2))), m.end()
+    m = _NUM_RE.match(buf, pos)
+    if m:
+        txt = m.group(0)
+        return (float(txt) if b'.' in txt else int(txt)), m.end()
+    for kw, val in ((b'true', True), (b'false', False), (b'null', None)):
+        if buf[pos:pos + len(kw)] == kw:
+            return val, pos + len(kw)
+    raise PdfSyntaxError(f'Token không hợp lệ tại {base + pos}')
+
+
+def _png_unpredict(raw, columns):
+    # Bỏ PNG predictor (/Predictor >= 10) cho xref stream
+    rowlen = columns + 1
+    out = bytearray()
+    prev = bytearray(columns)
+    for r in range(0, len(raw), rowlen):
+        ftype = raw[r]
+        row = bytearray(raw[r + 1:r + rowlen])
+        for i in range(len(row)):
+            left = row[i - 1] if i > 0 else 0
+            up = prev[i]
+            if ftype == 1:
+                row[i] = (row[i] + left) & 0xFF
+            elif ftype == 2:
+                row[i] = (row[i] + up) & 0xFF
+            elif ftype == 3:
+                row[i] = (row[i] + ((left + up) >> 1)) & 0xFF
+            elif ftype == 4:
+                ul = prev[i - 1] if i > 0 else 0
+                p = left + up - ul
+                pa, pb, pc = abs(p - left), abs(p - up), abs(p - ul)
+                row[i] = (row[i] + (left if pa <= pb and pa <= pc else up if pb <= pc else ul)) & 0xFF
+        out += row
+        prev = row
+    return bytes(out)
+
+
+def read_object_at(data, offset):
+    # Đọc "num gen obj <value> [stream ... endstream]" tại offset.
+    # Trả về (value, stream_bytes_or_None); stream chỉ được đọc khi cần (xref/object stream).
+    chunk = bytes(data[offset:offset + 64])
+    m = _OBJ_HEAD_RE.match(chunk.lstrip(_WS))
+    if not m:
+        raise PdfSyntaxError(f'Không có object tại offset {offset}')
+    skip = len(chunk) - len(chunk.lstrip(_WS))
+    start = offset + skip + m.end()
+    end = data.find(b'endobj', start, start + OBJ_READ_LIMIT)
+    stream_at = data.find(b'stream', start, end if end >= 0 else start + OBJ_READ_LIMIT)
+    if stream_at >= 0 and (end < 0 or stream_at < end):
+        head_end = stream_at
+    else:
+        head_end = end if end >= 0 else start + OBJ_READ_LIMIT
+    head = bytes(data[start:head_end])
+    value, _ = parse_value(head, 0, base=start)
+    return value, (start + len(head) if stream_at >= 0 and head_end == stream_at else None)
+
+
+def read_raw_stream(data, value, stream_kw_pos, resolve=None):
+    # Nội dung stream chưa giải nén (giữ nguyên /Filter) bắt đầu sau từ khóa "stream"
+    pos = stream_kw_pos + 6
+    if data[pos:pos + 2] == b'\r\n':
+        pos += 2
+    elif data[pos:pos + 1] in (b'\n', b'\r'):
+        pos += 1
+    length = value.get('/Length')
+    if isinstance(length, Ref) and resolve is not None:
+        length = resolve(length)
+    if not isinstance(length, int):
+        length = data.find(b'endstream', pos) - pos
+    return bytes(data[pos:pos + length])
+
+
+def read_stream(data, value, stream_kw_pos, resolve=None):
+    # Đọc và giải nén (FlateDecode, ASCII85Decode) nội dung stream bắt đầu sau từ khóa "stream"
+    raw = read_raw_stream(data, value, stream_kw_pos, resolve)
+    filters = value.get('/Filter')
+    if isinstance(filters, Name):
+        filters = [filters]
+    for flt in filters or []:
+        if flt in ('/FlateDecode', '/Fl'):
+            raw = zlib.decompress(raw)
+        elif flt in ('/ASCII85Decode', '/A85'):
+            raw = raw.strip()
+            if raw.endswith(b'~>'):
+                raw = raw[:-2]
+            raw = base64.a85decode(raw)
+        else:
+            raise PdfSyntaxError(f'Filter chưa hỗ trợ: {flt}')
+    parms = value.get('/DecodeParms') or {}
+    if isinstance(parms, list):
+        parms = parms[0] or {}
+    if parms.get('/Predictor', 1) >= 10:
+        raw = _png_unpredict(raw, parms.get('/Columns', 1))
+    return raw
+
+
+INHERITABLE_PAGE_KEYS = ('/Resources', '/MediaBox', '/CropBox', '/Rotate')
+
+
+def _read_xref_stream(data, offset):
+    value, stream_pos = read_object_at(data, offset)
+    if not isinstance(value, dict) or value.get('/Type') != '/XRef' or stream_pos is None:
+        raise PdfSyntaxError(f'Bảng xref không hợp lệ tại {offset}')
+    raw = read_stream(data, value, stream_pos)
+    widths = value['/W']
+    index = value.get('/Index') or [0, value['/Size']]
+    entries = {}
+    pos = 0
+    for first, count in zip(index[0::2], index[1::2]):
+        for num in range(first, first + count):
+            fields = []
+            for w in widths:
+                fields.append(int.from_bytes(raw[pos:pos + w], 'big') if w else None)
+                pos += w
+            ftype = 1 if widths[0] == 0 else fields[0]
+            if ftype == 1:
+                entries[num] = ('n', fields[1])
+            elif ftype == 2:
+                entries[num] = ('c', fields[1], fields[2])
+            else:
+                entries[num] = ('f',)
+    return entries, value
+
+
+def _scan_xref_table(data, pos):
+    # Chỉ đọc header các subsection (first, count) của bảng xref, nhảy qua các dòng 20 byte
+    subsections = []
+    while True:
+        pos = _skip_ws(data, pos)
+        if bytes(data[pos:pos + 7]) == b'trailer':
+            trailer, _ = parse_value(bytes(data[pos + 7:pos + 7 + 4096]), 0)
+            return subsections, trailer
+        m = re.match(br'(\d+)\s+(\d+)', bytes(data[pos:pos + 32]))
+        if not m:
+            raise PdfSyntaxError(f'Bảng xref hỏng tại {pos}')
+        first, count = int(m.group(1)), int(m.group(2))
+        pos = _skip_ws(data, pos + m.end())
+        subsections.append((first, count, pos))
+        pos += 20 * count
+
+
+def _table_entry(row):
+    # Dòng "oooooooooo ggggg n" -> ('n', offset) hoặc ('f',)
+    return ('n', int(row[:10])) if row[17:18] == b'n' else ('f',)
+
+
+def _table_entries(data, subsections):
+    entries = {}
+    for first, count, pos in subsections:
+        rows = bytes(data[pos:pos + 20 * count])
+        for i in range(count):
+            entries[first + i] = _table_entry(rows[i * 20:i * 20 + 18])
+    return entries
+
+
+class XrefIndex:
+    # Chỉ mục object của file: num -> ('n', offset) hoặc ('c', objstm_num, index).
+    # Dựng từ startxref, đi theo /Prev (và /XRefStm của file hybrid); bản mới nhất được ưu tiên.
+    def __init__(self, data):
+        self.data = data
+        self.entries = {}
+        self.trailer = {}
+        self.sections = []  # offset của từng bảng xref, mới nhất trước
+        self._objstm_cache = {}
+        offset = find_startxref(data)
+        if offset is None:
+            raise PdfSyntaxError('Không tìm thấy startxref')
+        seen = set()
+        while offset is not None and offset not in seen:
+            seen.add(offset)
+            self.sections.append(offset)
+            entries, trailer = self._read_section(offset)
+            if trailer.get('/XRefStm') is not None:
+                stm_entries, _ = self._read_section(trailer['/XRefStm'])
+                for k, v in stm_entries.items():
+                    if entries.get(k, ('f',))[0] == 'f':
+                        entries[k] = v
+            for k, v in entries.items():
+                self.entries.setdefault(k, v)
+            for k, v in trailer.items():
+                self.trailer.setdefault(k, v)
+            offset = trailer.get('/Prev')
+
+    def _read_section(self, offset):
+        data = self.data
+        head = bytes(data[offset:offset + 4])
+        if head == b'xref':
+            return self._read_table(offset + 4)
+        return _read_xref_stream(data, offset)
+
+    def _read_table(self, pos):
+        subsections, trailer = _scan_xref_table(self.data, pos)
+        return _table_entries(self.data, subsections), trailer
+
+    def get(self, num):
+        entry = self.entries.get(num)
+        if entry is None or entry[0] == 'f':
+            return None
+        if entry[0] == 'n':
+            value, _ = read_object_at(self.data, entry[1])
+            return value
+        return self._from_objstm(entry[1], num)
+
+    def _from_objstm(self, stm_num, num):
+        objs = self._objstm_cache.get(stm_num)
+        if objs is None:
+            entry = self.entries[stm_num]
+            value, stream_pos = read_object_at(self.data, entry[1])
+            raw = read_stream(self.data, value, stream_pos, self.resolve)
+            n, first = value['/N'], value['/First']
+            nums = [int(x) for x in raw[:first].split()]
+            objs = {}
+            for i in range(n):
+                objs[nums[2 * i]] = first + nums[2 * i + 1]
+            objs = (raw, objs)
+            self._objstm_cache[stm_num] = objs
+        raw, offsets = objs
+        value, _ = parse_value(raw, offsets[num])
+        return value
+
+    def get_with_stream(self, num):
+        # (value, stream thô hoặc None) của object num; object trong object stream không có stream
+        entry = self.entries.get(num)
+        if entry is None or entry[0] == 'f':
+            return None, None
+        if entry[0] == 'c':
+            return self._from_objstm(entry[1], num), None
+        value, stream_pos = read_object_at(self.data, entry[1])
+        if stream_pos is None:
+            return value, None
+        return value, read_raw_stream(self.data, value, stream_pos, self.resolve)
+
+    @property
+    def size(self):
+        return max(self.trailer.get('/Size', 0), max(self.entries, default=0) + 1)
+
+    def page_count(self):
+        root = self.resolve(self.trailer.get('/Root'))
+        pages = self.resolve(root.get('/Pages'))
+        return self.resolve(pages.get('/Count', 0))
+
+    def find_page(self, page_index):
+        # Đi xuống cây /Pages theo /Count, chỉ đọc các node trên đường tới trang cần tìm.
+        # Trả về (Ref của trang, dict trang, thuộc tính kế thừa từ node cha).
+        root = self.resolve(self.trailer.get('/Root'))
+        node = self.resolve(root.get('/Pages'))
+        inherited = {}
+        remaining = page_index
+        while True:
+            for key in INHERITABLE_PAGE_KEYS:
+                if key in node:
+                    inherited[key] = node[key]
+            for kid_ref in self.resolve(node.get('/Kids')) or []:
+                kid = self.resolve(kid_ref)
+                if kid.get('/Type') == '/Pages' or '/Kids' in kid:
+                    count = self.resolve(kid.get('/Count', 0))
+                    if remaining < count:
+                        node = kid
+                        break
+                    remaining -= count
+                else:
+                    if remaining == 0:
+                        return kid_ref, kid, inherited
+                    remaining -= 1
+            else:
+                raise IndexError(f'Không có trang {page_index}')
+
+    def resolve(self, value):
+        depth = 0
+        while isinstance(value, Ref) and depth < 32:
+            value = self.get(value.num)
+            depth += 1
+        return value
+
+
+class Revision:
+    # Một revision của file: bảng xref (hoặc xref stream) tại offset và trailer của nó.
+    # Bảng xref dạng text chỉ được đọc header subsection nên tra một object là O(số subsection);
+    # toàn bộ entry chỉ được đọc khi gọi entries() (các revision nhỏ thêm sau khi ký).
+    def __init__(self, data, offset):
+        self.data = data
+        self.offset = offset
+        self.number = None  # 1 = bản gốc
+        self._hybrid = None
+        if bytes(data[offset:offset + 4]) == b'xref':
+            self.kind = 'table'
+            self._subsections, self.trailer = _scan_xref_table(data, offset + 4)
+            self._entries = None
+        else:
+            self.kind = 'stream'
+            self._subsections = None
+            self._entries, self.trailer = _read_xref_stream(data, offset)
+
+    def _hybrid_entries(self):
+        # File hybrid: trailer bảng xref trỏ tới xref stream chứa các object nằm trong object stream
+        if self._hybrid is None:
+            stm = self.trailer.get('/XRefStm')
+            self._hybrid = _read_xref_stream(self.data, stm)[0] if stm is not None else {}
+        return self._hybrid
+
+    def lookup(self, num):
+        # Entry của num trong riêng revision này, None nếu revision không nhắc tới num
+        if self._entries is not None:
+            entry = self._entries.get(num)
+        else:
+            entry = None
+            for first, count, pos in self._subsections:
+                if first <= num < first + count:
+                    row_at = pos + 20 * (num - first)
+                    entry = _table_entry(bytes(self.data[row_at:row_at + 18]))
+            if (entry is None or entry[0] == 'f') and '/XRefStm' in self.trailer:
+                entry = self._hybrid_entries().get(num, entry)
+        return entry
+
+    def entries(self):
+        if self._entries is None:
+            entries = _table_entries(self.data, self._subsections)
+            for k, v in self._hybrid_entries().items():
+                if entries.get(k, ('f',))[0] == 'f':
+                    entries[k] = v
+            self._entries = entries
+        return self._entries
+
+    @property
+    def end(self):
+        # Vị trí ngay sau %%EOF kết thúc revision
+        eof = self.data.find(b'%%EOF', self.offset)
+        return eof + 5 if eof >= 0 else None
+
+    def __repr__(self):
+        return f'Revision({self.number}, offset={self.offset}, {self.kind})'
+
+
+class RevisionIndex:
+    # Các revision theo chuỗi startxref -> /Prev, cũ nhất trước. Dựng chỉ mục tốn thời gian theo số revision;
+    # get(num, upto) đọc object num như nó tồn tại ở revision `upto` (dùng so sánh trước / sau một update).
+    def __init__(self, data):
+        self.data = data
+        self.revisions = []
+        self._objstm_cache = {}
+        offset = find_startxref(data)
+        if offset is None:
+            raise PdfSyntaxError('Không tìm thấy startxref')
+        seen = set()
+        while offset is not None and offset not in seen:
+            seen.add(offset)
+            rev = Revision(data, offset)
+            self.revisions.append(rev)
+            offset = rev.trailer.get('/Prev')
+        self.revisions.reverse()
+        for i, rev in enumerate(self.revisions):
+            rev.number = i + 1
+
+    def lookup(self, num, upto=None):
+        # Entry mới nhất của num trong các revision 1..upto
+        upto = len(self.revisions) if upto is None else upto
+        for rev in reversed(self.revisions[:upto]):
+            entry = rev.lookup(num)
+            if entry is not None:
+                return entry
+        return None
+
+    def get(self, num, upto=None):
+        entry = self.lookup(num, upto)
+        if entry is None or entry[0] == 'f':
+            return None
+        if entry[0] == 'n':
+            value, _ = read_object_at(self.data, entry[1])
+            return value
+        stm_entry = self.lookup(entry[1], upto)
+        if stm_entry is None or stm_entry[0] != 'n':
+            raise PdfSyntaxError(f'Không tìm thấy object stream {entry[1]}')
+        objs = self._objstm_cache.get(stm_entry[1])
+        if objs is None:
+            value, stream_pos = read_object_at(self.data, stm_entry[1])
+            raw = read_stream(self.data, value, stream_pos, lambda v: self.resolve(v, upto))
+            first = self.resolve(value['/First'], upto)
+            nums = [int(x) for x in raw[:first].split()]
+            objs = (raw, {nums[2 * i]: first + nums[2 * i + 1] for i in range(len(nums) // 2)})
+            self._objstm_cache[stm_entry[1]] = objs
+        raw, offsets = objs
+        if num not in offsets:
+            raise PdfSyntaxError(f'Object {num} không có trong object stream {entry[1]}')
+        value, _ = parse_value(raw, offsets[num])
+        return value
+
+    def read_stream(self, num, upto=None):
+        # Nội dung đã giải nén của stream num ở revision `upto`; None nếu num không phải stream
+        entry = self.lookup(num, upto)
+        if entry is None or entry[0] != 'n':
+            return None
+        value, stream_pos = read_object_at(self.data, entry[1])
+        if stream_pos is None:
+            return None
+        return read_stream(self.data, value, stream_pos, lambda v: self.resolve(v, upto))
+
+    def resolve(self, value, upto=None):
+        depth = 0
+        while isinstance(value, Ref) and depth < 32:
+            value = self.get(value.num, upto)
+            depth += 1
+        return value
+
+
+class SignatureField:
+    def __init__(self, name, obj_num, byte_range, contents_span):
+        self.name = name
+        self.obj_num = obj_num
+        self.byte_range = byte_range
+        self.contents_span = contents_span  # (start, end) của <...> trong file
+
+    def __repr__(self):
+        return f'SignatureField({self.name!r}, obj={self.obj_num}, ByteRange={self.byte_range})'
+
+
+def _field_name(field, parent_name):
+    t = field.get('/T')
+    if isinstance(t, bytes):
+        if t.startswith(b'\xfe\xff'):
+            t = t[2:].decode('utf-16-be', 'replace')
+        else:
+            t = t.decode('latin-1')
+    return f'{parent_name}.{t}' if parent_name and t else (t or parent_name or '')
+
+
+def list_signature_fields(data, index=None):
+    # Liệt kê mọi trường /Sig đã ký qua Root -> /AcroForm -> /Fields (kể cả /Kids),
+    # đọc /ByteRange và vị trí /Contents của từng chữ ký. Sắp xếp theo thứ tự ký (ByteRange tăng dần).
+    index = index or XrefIndex(data)
+    root = index.resolve(index.trailer.get('/Root'))
+    acro = index.resolve(root.get('/AcroForm')) if isinstance(root, dict) else None
+    if not isinstance(acro, dict):
+        return []
+    found = []
+    seen = set()
+    stack = [(f, '', None) for f in reversed(index.resolve(acro.get('/Fields')) or [])]
+    while stack:
+        ref, parent_name, inherited_ft = stack.pop()
+        if isinstance(ref, Ref):
+            if ref.num in seen:
+                continue
+            seen.add(ref.num)
+        field = index.resolve(ref)
+        if not isinstance(field, dict):
+            continue
+        name = _field_name(field, parent_name)
+        ft = field.get('/FT', inherited_ft)
+        kids = index.resolve(field.get('/Kids'))
+        if kids:
+            stack.extend((k, name, ft) for k in reversed(kids))
+        if ft != '/Sig' or field.get('/V') is None:
+            continue
+        sig_ref = field['/V']
+        sig = index.resolve(sig_ref)
+        if not isinstance(sig, dict):
+            continue
+        br = index.resolve(sig.get('/ByteRange'))
+        contents = sig.get('/Contents')
+        if not isinstance(br, list) or len(br) != 4:
+            continue
+        span = (contents.start, contents.end) if isinstance(contents, HexString) else None
+        found.append(SignatureField(name, sig_ref.num if isinstance(sig_ref, Ref) else None,
+                                    tuple(int(x) for x in br), span))
+    found.sort(key=lambda s: s.byte_range[2] + s.byte_range[3])
+    return found
+
+
+def find_signatures(data):
+    # Trả về [(tên trường, ByteRange, Contents)] của mọi chữ ký, theo thứ tự ký.
+    # /Contents phải nằm đúng trong khoảng trống ByteRange chừa ra, nếu không coi như không đọc được.
+    try:
+        fields = list_signature_fields(data)
+    except (PdfSyntaxError, ValueError, KeyError, IndexError, TypeError, zlib.error):
+        fields = None
+    if not fields:
+        br, contents = find_signature_dict(data)
+        return [('Signature', br, contents)] if br else []
+    sigs = []
+    for field in fields:
+        br = field.byte_range
+        a0, l0, a1, l1 = br
+        contents = None
+        if a0 + l0 <= a1 and a1 + l1 <= len(data):
+            if field.contents_span is None or field.contents_span == (a0 + l0, a1):
+                contents = parse_contents_gap(data, br)
+        sigs.append((field.name, br, contents))
+    return sigs
+
+
+# ---------------------------------------------------------------------------
+# Ghi object PDF (dùng cho incremental update)
+# ---------------------------------------------------------------------------
+
+def _escape_literal(b):
+    return b.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+
+def serialize(value, out=None, ref_map=None):
+    # Ghi giá trị PDF ra bytes. ref_map: hàm đổi số object (khi chép object sang file khác)
+    if out is None:
+        out = bytearray()
+        serialize(value, out, ref_map)
+        return bytes(out)
+    if isinstance(value, Ref):
+        num = ref_map(value) if ref_map else value.num
+        out += b'%d 0 R' % num if ref_map else b'%d %d R' % value
+    elif isinstance(value, Name):
+        out += value.encode('latin-1')
+    elif value is True:
+        out += b'true'
+    elif value is False:
+        out += b'false'
+    elif value is None:
+        out += b'null'
+    elif isinstance(value, int):
+        out += b'%d' % value
+    elif isinstance(value, float):
+        out += (('%.6f' % value).rstrip('0').rstrip('.') or '0').encode('ascii')
+    elif isinstance(value, HexString):
+        out += b'<' + value.hex().encode('ascii') + b'>'
+    elif isinstance(value, LiteralString):
+        out += b'(' + value + b')'
+    elif isinstance(value, (bytes, bytearray)):
+        out += b'(' + _escape_literal(bytes(value)) + b')'
+    elif isinstance(value, str):
+        out += b'(' + _escape_literal(value.encode('latin-1')) + b')'
+    elif isinstance(value, list):
+        out += b'['
+        for i, v in enumerate(value):
+            if i:
+                out += b' '
+            serialize(v, out, ref_map)
+        out += b']'
+    elif isinstance(value, dict):
+        out += b'<<'
+        for k, v in value.items():
+            out += Name(k).encode('latin-1') + b' '
+            serialize(v, out, ref_map)
+            out += b' '
+        out += b'>>'
+    else:
+        raise TypeError(f'Không ghi được kiểu {type(value).__name__}')
+    return out
+
+
+def text_string(text):
+    # Chuỗi văn bản PDF: giữ nguyên nếu mã hóa được bằng latin-1, ngược lại UTF-16BE có BOM (tiếng Việt)
+    try:
+        text.encode('latin-1')
+        return text
+    except UnicodeEncodeError:
+        return HexString(b'\xfe\xff' + text.encode('utf-16-be'))
+
+
+def serialize_object(num, value, stream=None, ref_map=None, gen=0):
+    # "num gen obj ... endobj"; với stream thì /Length được đặt lại theo dữ liệu thô
+    out = bytearray(b'%d %d obj\n' % (num, gen))
+    if stream is not None:
+        value = dict(value)
+        value['/Length'] = len(stream)
+    serialize(value, out, ref_map)
+    if stream is not None:
+        out += b'\nstream\n' + stream + b'\nendstream'
+    out += b'\nendobj\n'
+    return bytes(out)
+
+
+def import_objects(index, value, exclude=('/Parent',)):
+    # Chép đồ thị object mà value tham chiếu tới (từ một file PDF khác) thành danh sách
+    # [(value, stream)] với tham chiếu tương đối LocalRef(i); dùng làm template chèn vào file khác.
+    objects = []
+    mapping = {}
+
+    def convert(v):
+        if isinstance(v, Ref):
+            if v.num not in mapping:
+                mapping[v.num] = len(objects)
+                objects.append(None)
+                obj, stream = index.get_with_stream(v.num)
+                objects[mapping[v.num]] = (convert(obj), stream)
+            return LocalRef(mapping[v.num])
+        if isinstance(v, dict):
+            return {k: convert(x) for k, x in v.items() if k not in exclude}
+        if isinstance(v, list):
+            return [convert(x) for x in v]
+        return v
+
+    return convert(value), objects
+
+
+class LocalRef(Ref):
+    # Tham chiếu tới object thứ i của template; số thật = base + i khi ghi
+    def __new__(cls, i):
+        return Ref.__new__(cls, i, 0)
+
+
+def form_template(index, page_index=0):
+    # Biến một trang (vd. overlay do reportlab tạo) thành Form XObject độc lập: template gồm
+    # [(value, stream)] với LocalRef; object cuối cùng là Form XObject.
+    _, page, inherited = index.find_page(page_index)
+    resources = page.get('/Resources', inherited.get('/Resources')) or {}
+    bbox = page.get('/MediaBox', inherited.get('/MediaBox')) or [0, 0, 595.2756, 841.8898]
+    contents = index.resolve(page.get('/Contents'))
+    if not isinstance(contents, list):
+        contents = [page.get('/Contents')] if contents is not None else []
+    parts = []
+    for ref in contents:
+        entry = index.entries.get(ref.num) if isinstance(ref, Ref) else None
+        if entry is None or entry[0] != 'n':
+            continue
+        value, stream_pos = read_object_at(index.data, entry[1])
+        parts.append(read_stream(index.data, value, stream_pos, index.resolve))
+    resources, objects = import_objects(index, resources)
+    form = {
+        '/Type': Name('/XObject'),
+        '/Subtype': Name('/Form'),
+        '/BBox': list(index.resolve(bbox)),
+        '/Resources': resources,
+        '/Filter': Name('/FlateDecode'),
+    }
+    objects.append((form, zlib.compress(b'\n'.join(parts))))
+    return objects
@@ -0,0 +1,313 @@
+import os
+import sys
+import time
+import hashlib
+import datetime
+
+from asn1crypto import cms, crl, ocsp, x509, core
+
+from doc_pdf import RevisionIndex, Ref, PdfSyntaxError, find_signatures
+from cap_nhat_tang_dan import dss_update, DSS_KEYS
+from thu_hoi import RevocationStore, EmbeddedRevocation, _load_der
+
+# Dữ liệu xác thực dài hạn (LTV): khi ký, thu thập OCSP response / CRL cho chuỗi chứng chỉ của chữ ký
+# (và của timestamp token) một lần rồi nhúng vào /DSS bằng incremental update (cap_nhat_tang_dan.dss_update).
+# Khi xác thực, bước 5-6 của xacthuc.py đọc /DSS trước (read_dss) nên không cần hỏi CA qua mạng.
+#   python du_lieu_ltv.py file.pdf [--revocation-dir DIR] [--no-fetch] [--out FILE]: thêm /DSS cho file đã ký
+#   python du_lieu_ltv.py --demo THU_MUC: tạo CA + CRL cục bộ, ký có LTV rồi xác thực không cần mạng
+
+FETCH_TIMEOUT = 5.0
+TIMESTAMP_TOKEN_OID = '1.2.840.113549.1.9.16.2.14'
+
+
+def vri_key(contents):
+    # Khóa của mục /VRI: SHA-1 (hex, chữ hoa) của giá trị /Contents của chữ ký
+    return hashlib.sha1(contents).hexdigest().upper()
+
+
+def signature_certs(contents):
+    # Chứng chỉ trong SignedData của chữ ký và trong timestamp token (unsignedAttrs) của nó
+    sd = cms.ContentInfo.load(contents)['content']
+    certs = [c.chosen for c in sd['certificates'] if c.name == 'certificate']
+    for signer_info in sd['signer_infos']:
+        unsigned = signer_info['unsigned_attrs']
+        if isinstance(unsigned, core.Void):
+            continue
+        for attr in unsigned:
+            if attr['type'].dotted != TIMESTAMP_TOKEN_OID:
+                continue
+            for token in attr['values']:
+                certs += [c.chosen for c in token['content']['certificates'] if c.name == 'certificate']
+    unique = {}
+    for cert in certs:
+        unique.setdefault(cert.sha256, cert)
+    return list(unique.values())
+
+
+def _issuer_of(cert, certs):
+    for candidate in certs:
+        if candidate.subject != cert.issuer:
+            continue
+        if cert.authority_key_identifier and candidate.key_identifier and \
+                cert.authority_key_identifier != candidate.key_identifier:
+            continue
+        return candidate
+    return None
+
+
+def build_ocsp_request(cert, issuer):
+    return ocsp.OCSPRequest({
+        'tbs_request': {
+            'request_list': [{
+                'req_cert': {
+                    'hash_algorithm': {'algorithm': 'sha1'},
+                    'issuer_name_hash': hashlib.sha1(cert.issuer.dump()).digest(),
+                    'issuer_key_hash': issuer.public_key.sha1,
+                    'serial_number': cert.serial_number,
+                },
+            }],
+        },
+    })
+
+
+def _next_update(obj):
+    if isinstance(obj, crl.CertificateList):
+        return obj['tbs_cert_list']['next_update'].native
+    values = [single['next_update'].native
+              for single in obj['response_bytes']['response'].parsed['tbs_response_data']['responses']]
+    values = [v for v in values if v is not None]
+    return min(values) if values else None
+
+
+class LtvCollector:
+    # Lấy dữ liệu thu hồi cho chuỗi chứng chỉ: kho cục bộ (--revocation-dir) trước, rồi OCSP (AIA) và
+    # CRL (CRLDistributionPoints) qua mạng nếu fetch=True. Kết quả được giữ tới nextUpdate nên ký hàng loạt
+    # với cùng một chứng chỉ chỉ hỏi CA một lần cho mỗi tiến trình.
+    def __init__(self, revocation_dir=None, fetch=True, timeout=FETCH_TIMEOUT, echo=print):
+        self.store = RevocationStore(revocation_dir) if revocation_dir else None
+        self.fetch = fetch
+        self.timeout = timeout
+        self.echo = echo
+        self.stats = {'cached': 0, 'store': 0, 'network': 0, 'missing': 0}
+        self._cache = {}  # (issuer sha256, serial) -> (nextUpdate, crls, ocsps)
+        self._session = None
+
+    def _http(self):
+        if self._session is None:
+            import requests
+            self._session = requests.Session()
+        return self._session
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def _fetch_ocsp(self, cert, issuer):
+        body = build_ocsp_request(cert, issuer).dump()
+        for url in cert.ocsp_urls:
+            try:
+                r = self._http().post(url, data=body, timeout=self.timeout,
+                                      headers={'Content-Type': 'application/ocsp-request'})
+                resp = ocsp.OCSPResponse.load(r.content)
+                if r.status_code == 200 and resp['response_status'].native == 'successful':
+                    return [resp]
+            except Exception as e:
+                self.echo(f'⚠ Không lấy được OCSP từ {url}: {e}')
+        return []
+
+    def _fetch_crls(self, cert):
+        for point in cert.crl_distribution_points:
+            url = point.url
+            if not url or not url.lower().startswith(('http://', 'https://')):
+                continue
+            try:
+                r = self._http().get(url, timeout=self.timeout)
+                if r.status_code == 200:
+                    obj = crl.CertificateList.load(_load_der(r.content))
+                    obj.native  # parse sớm để bỏ qua CRL hỏng
+                    return [obj]
+            except Exception as e:
+                self.echo(f'⚠ Không tải được CRL từ {url}: {e}')
+        return []
+
+    def _for_cert(self, cert, issuer):
+        key = (cert.issuer.sha256, cert.serial_number)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        hit = self._cache.get(key)
+        if hit is not None and (hit[0] is None or hit[0] > now):
+            self.stats['cached'] += 1
+            return hit[1], hit[2]
+        crls, ocsps = [], []
+        if self.store is not None:
+            self.store.refresh()
+            crls, ocsps = self.store.crls_for(cert), self.store.ocsps_for(cert)
+            if crls or ocsps:
+                self.stats['store'] += 1
+        if not crls and not ocsps and self.fetch:
+            # OCSP nhỏ và riêng cho chứng chỉ này; CRL khi CA không có OCSP responder
+            ocsps = self._fetch_ocsp(cert, issuer) if issuer is not None else []
+            crls = [] if ocsps else self._fetch_crls(cert)
+            if crls or ocsps:
+                self.stats['network'] += 1
+        if not crls and not ocsps:
+            self.stats['missing'] += 1
+            return [], []
+        updates = [u for u in map(_next_update, crls + ocsps) if u is not None]
+        self._cache[key] = (min(updates) if updates else None, crls, ocsps)
+        return crls, ocsps
+
+    def collect(self, certs):
+        # (certs, crls, ocsps) dạng DER cho mọi chứng chỉ không tự ký trong certs
+        certs = list(certs)
+        crls, ocsps = {}, {}
+        for cert in list(certs):
+            if cert.self_signed != 'no':
+                continue
+            cert_crls, cert_ocsps = self._for_cert(cert, _issuer_of(cert, certs))
+            for obj in cert_crls:
+                crls.setdefault(hashlib.sha256(obj.dump()).digest(), obj.dump())
+            for obj in cert_ocsps:
+                ocsps.setdefault(hashlib.sha256(obj.dump()).digest(), obj.dump())
+                # Chứng chỉ của OCSP responder (nếu được gửi kèm) cũng cần cho xác thực offline
+                basic = obj['response_bytes']['response'].parsed
+                for extra in basic['certs'] or []:
+                    if all(extra.sha256 != c.sha256 for c in certs):
+                        certs.append(extra)
+        return [c.dump() for c in certs], list(crls.values()), list(ocsps.values())
+
+
+def ltv_update(data, collector, signatures=None, index=None):
+    # Bytes cần nối vào data để nhúng dữ liệu LTV cho các chữ ký chưa có mục /VRI
+    # (signatures: [(tên, ByteRange, Contents)], mặc định mọi chữ ký trong tài liệu). None nếu không có gì để nhúng.
+    existing = read_dss(data)
+    done = set(existing.vri) if existing is not None else set()
+    vri = {}
+    for name, br, contents in signatures if signatures is not None else find_signatures(data):
+        if not contents or vri_key(contents) in done:
+            continue
+        certs, crls, ocsps = collector.collect(signature_certs(contents))
+        if crls or ocsps:
+            vri[vri_key(contents)] = (certs, crls, ocsps)
+    if not vri:
+        return None
+    return dss_update(data, vri, index)
+
+
+class DssData:
+    # Nội dung /DSS đã parse (asn1crypto); vri: {khóa VRI: {'/Cert': [...], '/CRL': [...], '/OCSP': [...]}}
+    def __init__(self, certs, crls, ocsps, vri):
+        self.certs = certs
+        self.crls = crls
+        self.ocsps = ocsps
+        self.vri = vri
+
+    def revocation(self, fallback=None):
+        return EmbeddedRevocation(self.crls, self.ocsps, fallback, self.certs)
+
+    def __bool__(self):
+        return bool(self.certs or self.crls or self.ocsps)
+
+
+def read_dss(data, index=None):
+    # /DSS của revision mới nhất, None nếu tài liệu không có (hoặc không đọc được)
+    try:
+        index = index or RevisionIndex(data)
+        root = index.resolve(index.revisions[-1].trailer.get('/Root'))
+        dss = index.resolve(root.get('/DSS')) if isinstance(root, dict) else None
+    except (PdfSyntaxError, ValueError, KeyError, IndexError, TypeError, AttributeError):
+        return None
+    if not isinstance(dss, dict):
+        return None
+    loaders = {'/Certs': x509.Certificate.load, '/CRLs': crl.CertificateList.load,
+               '/OCSPs': ocsp.OCSPResponse.load}
+    objects = {}
+    parsed = {}
+    for key, load in loaders.items():
+        objects[key] = []
+        refs = index.resolve(dss.get(key))
+        for ref in refs if isinstance(refs, list) else []:
+            try:
+                raw = index.read_stream(ref.num)
+                obj = load(raw)
+                obj.native  # parse sớm để bỏ qua dữ liệu hỏng
+            except Exception:
+                continue
+            objects[key].append(obj)
+            parsed[ref.num] = obj
+    vri = {}
+    entries = index.resolve(dss.get('/VRI'))
+    for name, entry in (entries.items() if isinstance(entries, dict) else []):
+        entry = index.resolve(entry)
+        if not isinstance(entry, dict):
+            continue
+        vri[name.lstrip('/').upper()] = {
+            short: [parsed[r.num] for r in index.resolve(entry.get(short)) or [] if isinstance(r, Ref) and r.num in parsed]
+            for short in DSS_KEYS}
+    return DssData(objects['/Certs'], objects['/CRLs'], objects['/OCSPs'], vri)
+
+
+# ---------------------------------------------------------------------------
+# Kiểm tra với CA + CRL tạo tại chỗ
+# ---------------------------------------------------------------------------
+
+def run_demo(directory, pdf_path=None):
+    # Ký pdf_path (mặc định goc.pdf cạnh file này) bằng CA thử với LTV (CRL lấy từ thư mục cục bộ),
+    # rồi xác thực chỉ bằng dữ liệu trong file
+    import ky
+    import xacthuc
+    from do_hieu_nang import PFX_PASSWORD, make_ca
+    if pdf_path is None:
+        pdf_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'goc.pdf')
+    os.makedirs(directory, exist_ok=True)
+    # Cổng 9 (discard) không trả lời: CRL chỉ có trong thư mục cục bộ
+    pfx_path, img_path = make_ca(directory, crl_url='http://127.0.0.1:9/ltv-test.crl')
+    crl_dir = os.path.join(directory, 'crl')
+    out = os.path.join(directory, 'ltv_da_ky.pdf')
+    signer = ky.Signer(pfx_path=pfx_path, password=PFX_PASSWORD, img_path=img_path, tsa_servers=[],
+                       ltv=LtvCollector(crl_dir, fetch=False))
+    with open(pdf_path, 'rb') as f:
+        _, _, timings = signer.sign_to_file(f.read(), out, page=0, incremental=True)
+    print(f'Đã ký có LTV: {out} ({timings.get("ltv", 0) * 1000:.1f} ms cho /DSS)')
+    with open(out, 'rb') as f:
+        data = f.read()
+    dss = read_dss(data)
+    print(f'/DSS: {len(dss.certs)} cert, {len(dss.crls)} CRL, {len(dss.ocsps)} OCSP, {len(dss.vri)} VRI')
+    # Xác thực không có --revocation-dir, không mạng, bắt buộc có dữ liệu thu hồi
+    xacthuc.configure(revocation_mode='hard-fail')
+    t0 = time.perf_counter()
+    code, lines, verdict = xacthuc.verify_pdf(data, echo=lambda *a, **k: None)
+    print(f'Xác thực offline ({(time.perf_counter() - t0) * 1000:.1f} ms):')
+    for line in lines:
+        if line.startswith(('Bước 5', 'Bước 6', 'Bước 8', '\nKẾT LUẬN')):
+            print('  ' + line.strip())
+    return code
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if '--demo' in args:
+        i = args.index('--demo')
+        sys.exit(run_demo(args[i + 1] if i + 1 < len(args) else 'ltv_demo'))
+    options = {}
+    for flag, key in (('--revocation-dir', 'revocation_dir'), ('--out', 'out')):
+        if flag in args:
+            i = args.index(flag)
+            options[key] = args[i + 1]
+            del args[i:i + 2]
+    fetch = '--no-fetch' not in args
+    args = [a for a in args if a != '--no-fetch']
+    path = args[0] if args else 'goc_da_ky.pdf'
+    with open(path, 'rb') as f:
+        data = f.read()
+    collector = LtvCollector(options.get('revocation_dir'), fetch=fetch)
+    update = ltv_update(data, collector)
+    collector.close()
+    if update is None:
+        print('Mọi chữ ký đã có dữ liệu LTV trong /DSS (hoặc file không có chữ ký)')
+        sys.exit(0)
+    out = options.get('out', path)
+    with open(out, 'wb') as f:
+        f.write(data)
+        f.write(update)
+    print(f'✓ Đã thêm /DSS ({len(update)} bytes) vào {out}: {collector.stats}')
@@ -0,0 +1,517 @@
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+import multiprocessing
+
+# Hàng đợi xác thực dùng chung cho nhiều tiến trình / nhiều máy (đợt xác thực lại cả kho lưu trữ cuối quý).
+# Worker nhận (claim) tài liệu theo lease: mỗi lần nhận có token và hạn lease, luồng heartbeat gia hạn trong lúc
+# xác thực; worker chết thì lease hết hạn và tài liệu được worker khác nhận lại. Ghi kết quả là idempotent:
+# mỗi tài liệu có đúng một kết quả, lần ghi sau (worker cũ chậm, lease đã bị nhận lại) bị bỏ qua.
+# SqliteJobQueue dùng một file SQLite (WAL) trên đĩa cục bộ hoặc ổ chia sẻ có khóa file tin cậy;
+# backend khác (Postgres SELECT ... FOR UPDATE SKIP LOCKED, Redis) chỉ cần cài đặt cùng giao diện JobQueue.
+#   python hang_doi_xac_thuc.py enqueue HANG_DOI.sqlite THU_MUC | @danh_sach.txt [--policy full|quick|strict]
+#   python hang_doi_xac_thuc.py work HANG_DOI.sqlite [--workers N] [--lease S] [--batch N] [--trust-local-pfx]
+#                               [--chain-cache FILE] [--revocation-dir DIR] [--revocation-mode MODE]
+#                               [--trust-store THU_MUC|BUNDLE] [--trust-snapshot FILE]
+#   python hang_doi_xac_thuc.py status HANG_DOI.sqlite
+#   python hang_doi_xac_thuc.py retry-failed HANG_DOI.sqlite
+#   python hang_doi_xac_thuc.py --demo THU_MUC [--workers N] [--docs N]
+
+DEFAULT_LEASE = 60.0
+DEFAULT_BATCH = 4
+# Nhận lại quá số lần này (worker chết khi đang xử lý tài liệu đó) thì đánh dấu lỗi thay vì thử mãi
+MAX_ATTEMPTS = 3
+POLL_SECONDS = 0.5
+# Cửa sổ tính tốc độ gần đây trong progress()
+RECENT_SECONDS = 60.0
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    policy TEXT,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    token TEXT,
+    lease_until REAL,
+    enqueued REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, lease_until);
+CREATE TABLE IF NOT EXISTS results (
+    job_id INTEGER PRIMARY KEY REFERENCES jobs (id),
+    path TEXT NOT NULL,
+    worker TEXT NOT NULL,
+    code INTEGER,
+    verdict TEXT,
+    ket_qua TEXT,
+    seconds REAL,
+    record TEXT NOT NULL,
+    finished REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_finished ON results (finished);
+CREATE TABLE IF NOT EXISTS workers (
+    worker TEXT PRIMARY KEY,
+    host TEXT,
+    last_seen REAL NOT NULL,
+    claimed INTEGER NOT NULL DEFAULT 0,
+    completed INTEGER NOT NULL DEFAULT 0,
+    duplicates INTEGER NOT NULL DEFAULT 0
+);
+'''
+
+
+class Job:
+    __slots__ = ('id', 'path', 'policy', 'token', 'attempts')
+
+    def __init__(self, id, path, policy, token, attempts):
+        self.id = id
+        self.path = path
+        self.policy = policy
+        self.token = token
+        self.attempts = attempts
+
+    def __repr__(self):
+        return f'Job({self.id}, {self.path!r}, lần {self.attempts})'
+
+
+class JobQueue:
+    # Giao diện backend hàng đợi. claim trả về các Job đang được worker giữ (lease tới now + lease_seconds);
+    # heartbeat gia hạn, trả về id các job còn giữ; complete ghi kết quả, False nếu tài liệu đã có kết quả
+    def enqueue(self, paths, policy=None):
+        raise NotImplementedError
+
+    def claim(self, worker, limit=1, lease_seconds=DEFAULT_LEASE):
+        raise NotImplementedError
+
+    def heartbeat(self, worker, jobs, lease_seconds=DEFAULT_LEASE):
+        raise NotImplementedError
+
+    def complete(self, worker, job, record):
+        raise NotImplementedError
+
+    def fail(self, worker, job, error):
+        raise NotImplementedError
+
+    def progress(self):
+        raise NotImplementedError
+
+
+class SqliteJobQueue(JobQueue):
+    def __init__(self, path, max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.max_attempts = max_attempts
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # Một kết nối cho mỗi tiến trình, dùng chung giữa luồng chính và luồng heartbeat (có khóa)
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(SCHEMA)
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def _write(self, fn, *args):
+        # Giao dịch ghi: BEGIN IMMEDIATE giữ khóa ghi ngay từ đầu nên hai worker không nhận cùng một job
+        with self._lock:
+            conn = self._connect()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                out = fn(conn, *args)
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+            return out
+
+    def enqueue(self, paths, policy=None):
+        # Tài liệu đã có trong hàng đợi (cùng đường dẫn) không được thêm lại; trả về số tài liệu mới
+        now = time.time()
+
+        def do(conn):
+            before = conn.total_changes
+            conn.executemany('INSERT OR IGNORE INTO jobs (path, policy, enqueued) VALUES (?, ?, ?)',
+                             [(os.path.abspath(p), policy, now) for p in paths])
+            return conn.total_changes - before
+        return self._write(do)
+
+    def claim(self, worker, limit=1, lease_seconds=DEFAULT_LEASE):
+        now = time.time()
+
+        def do(conn):
+            # Job lease hết hạn đã hết số lần thử: worker chết ngay trên tài liệu này, không giao lại nữa
+            conn.execute("UPDATE jobs SET state = 'failed', finished = ?, token = NULL, "
+                         "error = 'Worker dừng giữa chừng quá ' || attempts || ' lần' "
+                         "WHERE state = 'leased' AND lease_until < ? AND attempts >= ?",
+                         (now, now, self.max_attempts))
+            rows = conn.execute("SELECT id, path, policy, attempts FROM jobs "
+                                "WHERE state = 'pending' OR (state = 'leased' AND lease_until < ?) "
+                                "ORDER BY id LIMIT ?", (now, limit)).fetchall()
+            jobs = []
+            for job_id, path, policy, attempts in rows:
+                token = uuid.uuid4().hex
+                conn.execute("UPDATE jobs SET state = 'leased', worker = ?, token = ?, lease_until = ?, "
+                             "attempts = attempts + 1, started = ? WHERE id = ?",
+                             (worker, token, now + lease_seconds, now, job_id))
+                jobs.append(Job(job_id, path, policy, token, attempts + 1))
+            self._seen(conn, worker, now, claimed=len(jobs))
+            return jobs
+        return self._write(do)
+
+    def heartbeat(self, worker, jobs, lease_seconds=DEFAULT_LEASE):
+        now = time.time()
+
+        def do(conn):
+            held = []
+            for job in jobs:
+                cur = conn.execute("UPDATE jobs SET lease_until = ? WHERE id = ? AND token = ? AND state = 'leased'",
+                                   (now + lease_seconds, job.id, job.token))
+                if cur.rowcount:
+                    held.append(job.id)
+            self._seen(conn, worker, now)
+            return held
+        return self._write(do)
+
+    def complete(self, worker, job, record):
+        # Idempotent: kết quả đầu tiên của tài liệu được giữ, kể cả khi đến từ worker có lease đã hết hạn
+        # (công việc đã làm xong thì không bỏ); các lần ghi sau chỉ được đếm là trùng
+        now = time.time()
+
+        def do(conn):
+            state = conn.execute('SELECT state FROM jobs WHERE id = ?', (job.id,)).fetchone()
+            if state is None or state[0] == 'done':
+                self._seen(conn, worker, now, duplicates=1)
+                return False
+            conn.execute('INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                         (job.id, job.path, worker, record.get('code'), record.get('verdict'),
+                          record.get('ket_qua'), record.get('seconds'),
+                          json.dumps(record, ensure_ascii=False), now))
+            conn.execute("UPDATE jobs SET state = 'done', finished = ?, worker = ?, token = NULL, error = NULL "
+                         "WHERE id = ?", (now, worker, job.id))
+            self._seen(conn, worker, now, completed=1)
+            return True
+        return self._write(do)
+
+    def fail(self, worker, job, error):
+        # Lỗi không do tài liệu (vd. mất file tạm thời): trả job về hàng đợi nếu còn lượt thử
+        now = time.time()
+
+        def do(conn):
+            cur = conn.execute("UPDATE jobs SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                               "token = NULL, lease_until = NULL, error = ?, "
+                               "finished = CASE WHEN attempts >= ? THEN ? ELSE NULL END "
+                               "WHERE id = ? AND token = ? AND state = 'leased'",
+                               (self.max_attempts, str(error), self.max_attempts, now, job.id, job.token))
+            self._seen(conn, worker, now)
+            return bool(cur.rowcount)
+        return self._write(do)
+
+    def retry_failed(self):
+        def do(conn):
+            return conn.execute("UPDATE jobs SET state = 'pending', attempts = 0, error = NULL, finished = NULL "
+                                "WHERE state = 'failed'").rowcount
+        return self._write(do)
+
+    def _seen(self, conn, worker, now, claimed=0, completed=0, duplicates=0):
+        conn.execute('INSERT INTO workers (worker, host, last_seen, claimed, completed, duplicates) '
+                     'VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (worker) DO UPDATE SET last_seen = excluded.last_seen, '
+                     'claimed = claimed + excluded.claimed, completed = completed + excluded.completed, '
+                     'duplicates = duplicates + excluded.duplicates',
+                     (worker, worker.rsplit(':', 1)[0], now, claimed, completed, duplicates))
+
+    def progress(self):
+        # Số job theo trạng thái, lease hết hạn đang chờ nhận lại, tốc độ (toàn đợt / RECENT_SECONDS gần nhất),
+        # thời gian còn lại ước tính và số liệu từng worker
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            counts = dict(conn.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall())
+            expired = conn.execute("SELECT COUNT(*) FROM jobs WHERE state = 'leased' AND lease_until < ?",
+                                   (now,)).fetchone()[0]
+            first, last, done, done_bytes = conn.execute(
+                "SELECT MIN(j.started), MAX(r.finished), COUNT(*), "
+                "COALESCE(SUM(json_extract(r.record, '$.bytes')), 0) "
+                "FROM results r JOIN jobs j ON j.id = r.job_id").fetchone()
+            recent = conn.execute('SELECT COUNT(*) FROM results WHERE finished >= ?',
+                                  (now - RECENT_SECONDS,)).fetchone()[0]
+            verdicts = dict(conn.execute('SELECT ket_qua, COUNT(*) FROM results GROUP BY ket_qua').fetchall())
+            workers = {w: {'last_seen_ago': round(now - seen, 1), 'claimed': c, 'completed': d, 'duplicates': dup}
+                       for w, seen, c, d, dup in conn.execute(
+                           'SELECT worker, last_seen, claimed, completed, duplicates FROM workers ORDER BY worker')}
+        total = sum(counts.values())
+        remaining = counts.get('pending', 0) + counts.get('leased', 0)
+        elapsed = (last - first) if done and last and first else 0.0
+        rate = done / elapsed if elapsed > 0 else None
+        window = min(RECENT_SECONDS, now - first) if first else 0.0
+        recent_rate = recent / window if window > 0 and recent else None
+        speed = recent_rate or rate
+        return {
+            'total': total,
+            'pending': counts.get('pending', 0),
+            'leased': counts.get('leased', 0),
+            'expired_leases': expired,
+            'done': counts.get('done', 0),
+            'failed': counts.get('failed', 0),
+            'results': verdicts,
+            'docs_per_sec': round(rate, 2) if rate else None,
+            'mb_per_sec': round(done_bytes / 1e6 / elapsed, 2) if elapsed > 0 else None,
+            'recent_docs_per_sec': round(recent_rate, 2) if recent_rate else None,
+            'eta_seconds': round(remaining / speed, 1) if speed and remaining else (0.0 if not remaining else None),
+            'workers': workers,
+        }
+
+    def results(self):
+        with self._lock:
+            conn = self._connect()
+            return conn.execute('SELECT job_id, path, worker, ket_qua, verdict FROM results ORDER BY job_id').fetchall()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+
+
+def open_queue(spec):
+    # Chỗ chọn backend theo đường dẫn / URL; hiện có SQLite
+    return SqliteJobQueue(spec)
+
+
+class _Heartbeat(threading.Thread):
+    # Gia hạn lease của các job đang giữ mỗi lease / 3 giây trong lúc luồng chính xác thực
+    def __init__(self, queue, worker, lease_seconds):
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.worker = worker
+        self.lease_seconds = lease_seconds
+        self.jobs = []
+        self.lost = set()
+        self._stopped = threading.Event()
+        self._jobs_lock = threading.Lock()
+
+    def hold(self, jobs):
+        with self._jobs_lock:
+            self.jobs = list(jobs)
+
+    def release(self, job):
+        with self._jobs_lock:
+            self.jobs = [j for j in self.jobs if j.id != job.id]
+
+    def run(self):
+        while not self._stopped.wait(self.lease_seconds / 3):
+            with self._jobs_lock:
+                jobs = list(self.jobs)
+            if not jobs:
+                continue
+            try:
+                held = set(self.queue.heartbeat(self.worker, jobs, self.lease_seconds))
+            except sqlite3.Error:
+                continue
+            # Job mất lease (bị nhận lại): vẫn xác thực xong, complete() quyết định kết quả nào được giữ
+            self.lost.update(j.id for j in jobs if j.id not in held)
+
+    def stop(self):
+        self._stopped.set()
+
+
+def run_worker(queue_path, worker=None, lease_seconds=DEFAULT_LEASE, batch=DEFAULT_BATCH, trust_local_pfx=False,
+               options=None, echo=print, crash_after=None, idle_exit=True):
+    # Nhận và xác thực tới khi hàng đợi hết việc (idle_exit) hoặc mãi mãi (chế độ dịch vụ).
+    # crash_after: thoát đột ngột (os._exit) sau khi nhận job thứ n mà chưa ghi kết quả - để thử nhận lại lease
+    import xacthuc
+    from xacthuc_hangloat import _init_worker, verify_one
+    worker = worker or f'{socket.gethostname()}:{os.getpid()}'
+    _init_worker(trust_local_pfx, options)
+    queue = open_queue(queue_path)
+    heartbeat = _Heartbeat(queue, worker, lease_seconds)
+    heartbeat.start()
+    claimed = completed = 0
+    try:
+        while True:
+            jobs = queue.claim(worker, batch, lease_seconds)
+            if not jobs:
+                p = queue.progress()
+                if idle_exit and p['pending'] == 0 and p['leased'] == 0:
+                    break
+                time.sleep(POLL_SECONDS)
+                continue
+            heartbeat.hold(jobs)
+            for job in jobs:
+                claimed += 1
+                if crash_after is not None and claimed >= crash_after:
+                    echo(f'  ✗ {worker}: dừng đột ngột khi đang giữ {len(jobs)} job (thử nhận lại lease)')
+                    os._exit(3)
+                if not os.path.exists(job.path):
+                    queue.fail(worker, job, f'Không tìm thấy file: {job.path}')
+                    heartbeat.release(job)
+                    continue
+                record = verify_one(job.path, policy=job.policy)
+                record['worker'] = worker
+                record['attempt'] = job.attempts
+                if queue.complete(worker, job, record):
+                    completed += 1
+                    mark = {'hop_le': '✓', 'co_dieu_kien': '⚠'}.get(record['ket_qua'], '✗')
+                    echo(f'  {mark} {job.path} ({record["seconds"] * 1000:.1f} ms, {worker})')
+                else:
+                    echo(f'  - {job.path}: đã có kết quả từ worker khác, bỏ qua')
+                heartbeat.release(job)
+    finally:
+        heartbeat.stop()
+        xacthuc.CHAIN_CACHE.save()
+    return completed
+
+
+def _worker_main(queue_path, worker, lease_seconds, batch, trust_local_pfx, options, crash_after=None):
+    run_worker(queue_path, worker, lease_seconds, batch, trust_local_pfx, options, echo=print,
+               crash_after=crash_after)
+    sys.stdout.flush()
+
+
+def run_workers(queue_path, workers=None, lease_seconds=DEFAULT_LEASE, batch=DEFAULT_BATCH, trust_local_pfx=False,
+                options=None, crash=None):
+    # Chạy `workers` tiến trình worker trên máy này; crash: {chỉ số worker: crash_after} cho chế độ demo
+    workers = workers or os.cpu_count() or 1
+    host = socket.gethostname()
+    ctx = multiprocessing.get_context('spawn')
+    procs = []
+    for i in range(workers):
+        worker = f'{host}:w{i}:{uuid.uuid4().hex[:6]}'
+        p = ctx.Process(target=_worker_main, args=(queue_path, worker, lease_seconds, batch, trust_local_pfx,
+                                                   options, (crash or {}).get(i)))
+        p.start()
+        procs.append(p)
+    for p in procs:
+        p.join()
+    return [p.exitcode for p in procs]
+
+
+def print_progress(p):
+    print(f'Tổng {p["total"]}: chờ {p["pending"]}, đang xử lý {p["leased"]} (lease hết hạn {p["expired_leases"]}), '
+          f'xong {p["done"]}, lỗi {p["failed"]}')
+    if p['results']:
+        print('  Kết quả: ' + ', '.join(f'{k}: {v}' for k, v in sorted(p['results'].items())))
+    print(f'  Tốc độ: {p["docs_per_sec"]} file/s ({p["mb_per_sec"]} MB/s), '
+          f'{RECENT_SECONDS:.0f}s gần nhất: {p["recent_docs_per_sec"]} file/s, còn lại ước tính: {p["eta_seconds"]} s')
+    for w, s in p['workers'].items():
+        print(f'  {w}: nhận {s["claimed"]}, xong {s["completed"]}, trùng {s["duplicates"]}, '
+              f'lần cuối {s["last_seen_ago"]} s trước')
+
+
+def run_demo(directory, workers=4, docs=24, lease_seconds=2.0):
+    # Tự kiểm tra: ký `docs` PDF bằng CA tạo tại chỗ, cho `workers` tiến trình cùng nhận từ một hàng đợi,
+    # worker 0 chết sau khi nhận job đầu tiên; mọi tài liệu phải có đúng một kết quả, không tài liệu nào lỗi
+    import ky
+    from do_hieu_nang import PFX_PASSWORD, make_ca, make_pdf
+    directory = os.path.abspath(directory)
+    os.makedirs(directory, exist_ok=True)
+    pdf_dir = os.path.join(directory, 'pdf')
+    os.makedirs(pdf_dir, exist_ok=True)
+    pfx_path, img_path = make_ca(directory)
+    signer = ky.Signer(pfx_path, PFX_PASSWORD, img_path, tsa_servers=[], echo=lambda *a, **k: None)
+    base = os.path.join(directory, 'goc.pdf')
+    make_pdf(base, 2, seed='hang_doi')
+    with open(base, 'rb') as f:
+        original = f.read()
+    paths = []
+    for i in range(docs):
+        path = os.path.join(pdf_dir, f'tai_lieu_{i:03d}.pdf')
+        signer.sign_to_file(original, path, page=0, reason=f'Tài liệu {i}', incremental=True)
+        paths.append(path)
+
+    queue_path = os.path.join(directory, 'hang_doi.sqlite')
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(queue_path + suffix):
+            os.remove(queue_path + suffix)
+    queue = open_queue(queue_path)
+    added = queue.enqueue(paths)
+    again = queue.enqueue(paths)
+    print(f'Đã đưa {added} tài liệu vào {queue_path} (đưa lại lần hai: {again} tài liệu mới)')
+
+    os.chdir(directory)
+    t0 = time.perf_counter()
+    codes = run_workers(queue_path, workers, lease_seconds, batch=2, trust_local_pfx=True, crash={0: 1})
+    elapsed = time.perf_counter() - t0
+    print(f'Mã thoát các worker: {codes} ({elapsed:.2f}s)')
+
+    p = queue.progress()
+    print_progress(p)
+    results = queue.results()
+    per_path = {}
+    for _, path, _, _, _ in results:
+        per_path[path] = per_path.get(path, 0) + 1
+    reclaimed = sum(1 for (n,) in queue._connect().execute('SELECT attempts FROM jobs') if n > 1)
+    checks = [
+        ('mọi tài liệu có kết quả', set(per_path) == {os.path.abspath(x) for x in paths}),
+        ('mỗi tài liệu đúng một kết quả', all(n == 1 for n in per_path.values()) and len(results) == docs),
+        ('không còn job chờ / đang giữ / lỗi', p['pending'] == p['leased'] == p['failed'] == 0),
+        ('job của worker chết được nhận lại', codes[0] == 3 and reclaimed > 0),
+        ('mọi chữ ký hợp lệ', p['results'] == {'hop_le': docs}),
+    ]
+    ok = True
+    for name, passed in checks:
+        print(f'  {"✓" if passed else "✗"} {name}')
+        ok = ok and passed
+    print('✓ Hàng đợi: mỗi tài liệu được xác thực đúng một lần' if ok else '✗ Hàng đợi: kiểm tra không đạt')
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    options = {}
+    for flag, key in (('--chain-cache', 'chain_cache'), ('--revocation-dir', 'revocation_dir'),
+                      ('--revocation-mode', 'revocation_mode'),
+                      ('--trust-store', 'trust_store'), ('--trust-snapshot', 'trust_snapshot')):
+        if flag in args:
+            i = args.index(flag)
+            options[key] = args[i + 1]
+            del args[i:i + 2]
+    opts = {'workers': None, 'lease': DEFAULT_LEASE, 'batch': DEFAULT_BATCH, 'policy': None, 'docs': 24}
+    for flag, key, conv in (('--workers', 'workers', int), ('--lease', 'lease', float), ('--batch', 'batch', int),
+                            ('--policy', 'policy', str), ('--docs', 'docs', int)):
+        if flag in args:
+            i = args.index(flag)
+            opts[key] = conv(args[i + 1])
+            del args[i:i + 2]
+    trust_local = '--trust-local-pfx' in args
+    if trust_local:
+        args.remove('--trust-local-pfx')
+    if '--demo' in args:
+        i = args.index('--demo')
+        sys.exit(run_demo(args[i + 1], opts['workers'] or 4, opts['docs']))
+    if len(args) < 2:
+        print('Dùng: python hang_doi_xac_thuc.py enqueue|work|status|retry-failed HANG_DOI.sqlite ...')
+        sys.exit(2)
+    command, queue_path = args[0], args[1]
+    queue = open_queue(queue_path)
+    if command == 'enqueue':
+        from xacthuc_hangloat import collect_inputs
+        if opts['policy'] is not None:
+            from xacthuc import get_policy
+            get_policy(opts['policy'])
+        paths = collect_inputs(args[2])
+        added = queue.enqueue(paths, opts['policy'])
+        print(f'Đã đưa {added} tài liệu mới vào hàng đợi ({len(paths) - added} đã có sẵn)')
+    elif command == 'work':
+        codes = run_workers(queue_path, opts['workers'], opts['lease'], opts['batch'], trust_local, options)
+        print_progress(queue.progress())
+        sys.exit(0 if all(c == 0 for c in codes) else 1)
+    elif command == 'status':
+        print_progress(queue.progress())
+    elif command == 'retry-failed':
+        print(f'Đưa lại {queue.retry_failed()} job lỗi vào hàng đợi')
+    else:
+        print(f'✗ Lệnh không hợp lệ: {command}')
+        sys.exit(2)
@@ -0,0 +1,197 @@
+import io
+import os
+import hashlib
+import threading
+import functools
+from collections import OrderedDict
+
+from PyPDF2 import PdfReader
+from doc_pdf import XrefIndex, form_template
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+
+# Phần hiển thị chữ ký (ảnh + SĐT + họ tên) được render một lần thành Form XObject và cache;
+# mỗi tài liệu chỉ cần lớp chữ "Ngày ký" (cũng được cache theo ngày).
+# Mỗi lớp giữ PDF một trang do reportlab tạo; từ đó lấy trang PyPDF2 (ghép bằng merge_page)
+# hoặc template object (chèn bằng incremental update, xem cap_nhat_tang_dan.py).
+
+FONT_NAME = 'TimesNewRoman'
+# Tên file font ưu tiên theo thứ tự; Liberation Serif có cùng metric với Times New Roman,
+# DejaVu Serif có đủ dấu tiếng Việt
+FONT_FILES = [
+    'times.ttf', 'times new roman.ttf', 'timesbd.ttf',
+    'liberationserif-regular.ttf', 'tinos-regular.ttf', 'dejavuserif.ttf',
+]
+MAX_DATE_LAYERS = 64
+# Số lớp tĩnh (họ tên, SĐT, vị trí) giữ lại; ký hàng loạt nhiều người không làm bộ đệm phình mãi
+MAX_STATIC_LAYERS = 256
+_FORM_NAME = 'ChuKyTinh'
+
+
+def font_dirs():
+    win_fonts = os.path.join(os.environ.get('WINDIR', 'C:\\Windows'), 'Fonts')
+    home = os.path.expanduser('~')
+    return [
+        win_fonts,
+        '/usr/share/fonts',
+        '/usr/local/share/fonts',
+        os.path.join(home, '.fonts'),
+        os.path.join(home, '.local', 'share', 'fonts'),
+        '/Library/Fonts',
+        '/System/Library/Fonts',
+    ]
+
+
+@functools.lru_cache(maxsize=None)
+def find_font_file():
+    # Quét các thư mục font (Windows + Linux + macOS) một lần cho mỗi tiến trình
+    found = {}
+    for d in font_dirs():
+        if not os.path.isdir(d):
+            continue
+        for root, _, files in os.walk(d):
+            for name in files:
+                found.setdefault(name.lower(), os.path.join(root, name))
+    for name in FONT_FILES:
+        if name in found:
+            return found[name]
+    return None
+
+
+_font_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=None)
+def register_font(font_name=FONT_NAME):
+    # Try to register Times New Roman (hoặc font tương đương). Nếu không tìm thấy, dùng Times-Roman
+    path = find_font_file()
+    if path:
+        with _font_lock:
+            try:
+                pdfmetrics.registerFont(TTFont(font_name, path))
+                return font_name
+            except Exception:
+                pass
+    return 'Times-Roman'
+
+
+def default_position():
+    # Vị trí: đặt chữ ký ở góc phải dưới của trang (page 6), ngay bên dưới
+    # nhãn "Sinh viên ký" trong goc.pdf. Khoảng cách từ mép phải/bottom có thể điều chỉnh nếu cần.
+    page_width, page_height = A4
+    img_w = 50 * mm
+    img_h = 12 * mm
+    margin_right = 20 * mm
+    # Đặt ảnh sao cho mép phải ảnh cách mép phải trang margin_right
+    img_x = page_width - margin_right - img_w
+    # Đặt ảnh ở gần đáy trang; khoảng cách này nên nằm ngay dưới nhãn "Sinh viên ký".
+    img_y = page_height - 245 * mm
+    return (img_x, img_y, img_w, img_h)
+
+
+class OverlayLayer:
+    # Một lớp hiển thị: PDF một trang; trang PyPDF2 và template object được parse khi cần rồi giữ lại
+    def __init__(self, pdf_bytes):
+        self.pdf_bytes = pdf_bytes
+        self._page = None
+        self._template = None
+
+    @property
+    def page(self):
+        if self._page is None:
+            self._page = PdfReader(io.BytesIO(self.pdf_bytes)).pages[0]
+        return self._page
+
+    @property
+    def template(self):
+        if self._template is None:
+            self._template = form_template(XrefIndex(self.pdf_bytes))
+        return self._template
+
+
+class AppearanceCache:
+    # Cache lớp tĩnh theo (tên, SĐT, hash ảnh, font, vị trí) và lớp ngày ký theo (chuỗi ngày, font, vị trí).
+    # Giá trị cache là OverlayLayer.
+    def __init__(self, img_path=None, echo=print):
+        self.echo = echo
+        self.font_name = register_font()
+        self.image = None
+        self.image_hash = None
+        if img_path and os.path.exists(img_path):
+            try:
+                with open(img_path, 'rb') as f:
+                    raw = f.read()
+                self.image_hash = hashlib.sha256(raw).hexdigest()
+                self.image = ImageReader(io.BytesIO(raw))
+            except Exception as e:
+                echo("Không thể chèn ảnh chữ ký bằng ImageReader:", e)
+        else:
+            echo("Ảnh chữ ký không tìm thấy:", img_path)
+        self._static = OrderedDict()
+        self._dates = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # reportlab không đảm bảo an toàn đa luồng khi dùng chung ImageReader
+        self._lock = threading.Lock()
+
+    def static_key(self, name, contact, position):
+        return (name, contact, self.image_hash, self.font_name, tuple(position))
+
+    def _render_static(self, name, contact, position):
+        img_x, img_y, img_w, img_h = position
+        buf = io.BytesIO()
+        oc = canvas.Canvas(buf, pagesize=A4)
+        # Phần không đổi giữa các lần ký được đóng gói thành Form XObject
+        oc.beginForm(_FORM_NAME)
+        oc.setFont(self.font_name, 10)
+        # SĐT ngay dưới "Sinh viên ký", trên chữ ký
+        oc.drawString(img_x, img_y + 26 * mm, f'SĐT: {contact}')
+        # Vẽ ảnh chữ ký, giữ transparency nếu có
+        if self.image is not None:
+            try:
+                oc.drawImage(self.image, img_x, img_y, width=img_w, height=img_h, mask='auto')
+            except Exception as e:
+                self.echo("Không thể chèn ảnh chữ ký bằng ImageReader:", e)
+        # Hiển thị họ tên ngay dưới ảnh chữ ký (dưới chỗ ký), căn giữa theo ảnh
+        oc.drawCentredString(img_x + img_w / 2, img_y - (4 * mm), name)
+        oc.endForm()
+        oc.doForm(_FORM_NAME)
+        oc.save()
+        return OverlayLayer(buf.getvalue())
+
+    def _render_date(self, date_text, position):
+        img_x, img_y, _, _ = position
+        buf = io.BytesIO()
+        oc = canvas.Canvas(buf, pagesize=A4)
+        oc.setFont(self.font_name, 10)
+        oc.drawString(img_x, img_y + 22 * mm, f'Ngày ký: {date_text}')
+        oc.save()
+        return OverlayLayer(buf.getvalue())
+
+    def layers(self, name, contact, date_text, position=None):
+        # Trả về [lớp tĩnh, lớp ngày ký] (OverlayLayer) để ghép lên trang cần ký
+        position = tuple(position or default_position())
+        key = self.static_key(name, contact, position)
+        date_key = (date_text, self.font_name, position)
+        with self._lock:
+            static = self._static.get(key)
+            if static is None:
+                self.misses += 1
+                static = self._static[key] = self._render_static(name, contact, position)
+                while len(self._static) > MAX_STATIC_LAYERS:
+                    self._static.popitem(last=False)
+            else:
+                self.hits += 1
+                self._static.move_to_end(key)
+            date_layer = self._dates.get(date_key)
+            if date_layer is None:
+                date_layer = self._dates[date_key] = self._render_date(date_text, position)
+                while len(self._dates) > MAX_DATE_LAYERS:
+                    self._dates.popitem(last=False)
+            else:
+                self._dates.move_to_end(date_key)
+        return [static, date_layer]
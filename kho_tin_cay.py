@@ -0,0 +1,359 @@
+import os
+import sys
+import time
+import struct
+import hashlib
+import threading
+
+# Kho trust anchor: nạp chứng chỉ CA từ một thư mục hoặc một file bundle (PEM nhiều chứng chỉ, DER, PKCS#7 .p7b)
+# và đánh chỉ mục theo hash subject DN (đã chuẩn hóa) và Subject Key Identifier để bước 5 tìm issuer bằng
+# một lần tra dict thay vì so subject == issuer với từng chứng chỉ. Chỉ mục ghi ra snapshot nhị phân gọn:
+# lúc khởi động chỉ đọc snapshot (không parse lại hàng trăm file PEM/DER), chứng chỉ được parse khi cần tới.
+#   python kho_tin_cay.py build NGUON SNAPSHOT    (NGUON: thư mục hoặc file bundle)
+#   python kho_tin_cay.py info NGUON|SNAPSHOT
+#   python kho_tin_cay.py --bench [N]             (N CA tự sinh: parse nguồn vs nạp snapshot, tra chỉ mục vs quét)
+CERT_EXTENSIONS = ('.pem', '.crt', '.cer', '.der', '.p7b', '.p7c')
+SNAPSHOT_MAGIC = b'KHOTC\x00\x01\x00'
+# Chứng chỉ trung gian tối đa khi lần theo chuỗi tới anchor
+MAX_DEPTH = 10
+# Mỗi chứng chỉ: độ dài DER, hash subject, độ dài SKI (rồi SKI, DER)
+_ENTRY = struct.Struct('<I32sB')
+
+
+def name_hash(name):
+    # hashable của asn1crypto đã chuẩn hóa DN (hoa/thường, khoảng trắng) như quy tắc so tên của X.509
+    return hashlib.sha256(name.hashable.encode('utf-8')).digest()
+
+
+def _split_certificates(raw):
+    # Các DER chứng chỉ trong một file: PEM (một hoặc nhiều khối), PKCS#7 certs-only hoặc DER đơn
+    from asn1crypto import pem, cms
+    ders = []
+    if pem.detect(raw):
+        for kind, _, der in pem.unarmor(raw, multiple=True):
+            if kind in ('CERTIFICATE', 'TRUSTED CERTIFICATE', 'X509 CERTIFICATE'):
+                ders.append(der)
+            elif kind == 'PKCS7':
+                ders.extend(_split_certificates(der))
+        return ders
+    try:
+        info = cms.ContentInfo.load(raw)
+        if info['content_type'].native == 'signed_data':
+            return [c.chosen.dump() for c in info['content']['certificates'] if c.name == 'certificate']
+    except Exception:
+        pass
+    return [raw]
+
+
+def _source_files(source):
+    if os.path.isdir(source):
+        files = []
+        for root, dirs, names in os.walk(source):
+            dirs.sort()
+            for name in sorted(names):
+                if os.path.splitext(name)[1].lower() in CERT_EXTENSIONS:
+                    files.append(os.path.join(root, name))
+        return files
+    return [source]
+
+
+def source_fingerprint(source):
+    # Đổi khi file nguồn được thêm / xóa / sửa: snapshot cũ hơn nguồn thì bị dựng lại
+    digest = hashlib.sha256()
+    for path in _source_files(source):
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        digest.update(f'{os.path.abspath(path)}|{st.st_mtime_ns}|{st.st_size}\n'.encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+class TrustStore:
+    def __init__(self, entries=(), source=None, source_version=''):
+        # entries: (der, subject hash, ski)
+        self.source = source
+        self.source_version = source_version
+        self._ders = []
+        self._subjects = []
+        self._by_subject = {}  # subject hash -> [chỉ số]
+        self._by_ski = {}  # SKI -> [chỉ số]
+        self._by_sha256 = {}  # sha256(DER) -> chỉ số
+        self._parsed = {}  # chỉ số -> asn1crypto Certificate
+        self._lock = threading.Lock()
+        for der, subject, ski in entries:
+            self._add(der, subject, ski)
+        digest = hashlib.sha256()
+        for fp in sorted(self._by_sha256):
+            digest.update(fp)
+        self.version = digest.hexdigest()[:16]
+
+    def _add(self, der, subject, ski):
+        fp = hashlib.sha256(der).digest()
+        if fp in self._by_sha256:
+            return
+        index = len(self._ders)
+        self._ders.append(der)
+        self._subjects.append(subject)
+        self._by_sha256[fp] = index
+        self._by_subject.setdefault(subject, []).append(index)
+        if ski:
+            self._by_ski.setdefault(ski, []).append(index)
+
+    def __len__(self):
+        return len(self._ders)
+
+    @classmethod
+    def from_source(cls, source):
+        # Parse mọi chứng chỉ CA trong thư mục / bundle; file hỏng hoặc chứng chỉ không phải CA bị bỏ qua
+        from asn1crypto import x509
+        entries = []
+        for path in _source_files(source):
+            try:
+                with open(path, 'rb') as f:
+                    raw = f.read()
+                ders = _split_certificates(raw)
+            except (OSError, ValueError):
+                continue
+            for der in ders:
+                try:
+                    cert = x509.Certificate.load(der)
+                    # Chứng chỉ người dùng lẫn trong bundle không phải anchor; root v1 (không basicConstraints) vẫn giữ
+                    if not cert.ca and cert.self_signed == 'no':
+                        continue
+                    entries.append((cert.dump(), name_hash(cert.subject), cert.key_identifier or b''))
+                except Exception:
+                    continue
+        return cls(entries, source, source_fingerprint(source))
+
+    @classmethod
+    def load_snapshot(cls, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        if not data.startswith(SNAPSHOT_MAGIC):
+            raise ValueError(f'Không phải snapshot kho tin cậy: {path}')
+        pos = len(SNAPSHOT_MAGIC)
+        count, source_len, version_len = struct.unpack_from('<IHH', data, pos)
+        pos += 8
+        source = data[pos:pos + source_len].decode('utf-8') or None
+        pos += source_len
+        source_version = data[pos:pos + version_len].decode('ascii')
+        pos += version_len
+        entries = []
+        for _ in range(count):
+            der_len, subject, ski_len = _ENTRY.unpack_from(data, pos)
+            pos += _ENTRY.size
+            ski = data[pos:pos + ski_len]
+            pos += ski_len
+            entries.append((data[pos:pos + der_len], subject, ski))
+            pos += der_len
+        return cls(entries, source, source_version)
+
+    def save_snapshot(self, path):
+        # Ghi nguyên tử (file tạm + os.replace) để worker đang khởi động không đọc phải file dở
+        source = (os.path.abspath(self.source) if self.source else '').encode('utf-8')
+        version = self.source_version.encode('ascii')
+        parts = [SNAPSHOT_MAGIC, struct.pack('<IHH', len(self._ders), len(source), len(version)), source, version]
+        ski_of = {i: ski for ski, indexes in self._by_ski.items() for i in indexes}
+        for i, der in enumerate(self._ders):
+            ski = ski_of.get(i, b'')
+            parts.append(_ENTRY.pack(len(der), self._subjects[i], len(ski)))
+            parts.append(ski)
+            parts.append(der)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(b''.join(parts))
+        os.replace(tmp, path)
+
+    @classmethod
+    def open(cls, source, snapshot=None, echo=None):
+        # source là snapshot: nạp thẳng. Có snapshot còn khớp nguồn: nạp snapshot, ngược lại parse nguồn rồi ghi
+        # snapshot mới (nếu được chỉ định)
+        if os.path.isfile(source):
+            with open(source, 'rb') as f:
+                if f.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC:
+                    return cls.load_snapshot(source)
+        if snapshot and os.path.exists(snapshot):
+            try:
+                store = cls.load_snapshot(snapshot)
+            except (OSError, ValueError, struct.error):
+                store = None
+            if store is not None and store.source_version == source_fingerprint(source):
+                return store
+        store = cls.from_source(source)
+        if snapshot:
+            try:
+                store.save_snapshot(snapshot)
+            except OSError as e:
+                if echo:
+                    echo(f'⚠ Không ghi được snapshot kho tin cậy {snapshot}: {e}')
+        return store
+
+    def certificate(self, index):
+        cert = self._parsed.get(index)
+        if cert is None:
+            from asn1crypto import x509
+            cert = x509.Certificate.load(self._ders[index])
+            with self._lock:
+                self._parsed[index] = cert
+        return cert
+
+    def __contains__(self, cert):
+        return cert.sha256 in self._by_sha256
+
+    def issuers_of(self, cert):
+        # Ứng viên issuer trong kho: theo Authority Key Identifier nếu có (lọc đúng tên issuer), không có thì theo tên
+        issuer = name_hash(cert.issuer)
+        aki = cert.authority_key_identifier
+        if aki:
+            indexes = [i for i in self._by_ski.get(aki, ()) if self._subjects[i] == issuer]
+            if indexes:
+                return [self.certificate(i) for i in indexes]
+        return [self.certificate(i) for i in self._by_subject.get(issuer, ())]
+
+    def anchors_for(self, end_entity, intermediates=(), max_depth=MAX_DEPTH):
+        # Lần từ end-entity qua các intermediates của chữ ký tới chứng chỉ có trong kho; trả về các anchor
+        # dùng cho chuỗi này (chỉ những anchor liên quan vào ValidationContext, không cả kho)
+        bundle = {}
+        for c in intermediates:
+            bundle.setdefault(name_hash(c.subject), []).append(c)
+        cert = end_entity
+        seen = set()
+        for _ in range(max_depth + 1):
+            if cert in self:
+                return [cert]
+            anchors = self.issuers_of(cert)
+            if anchors:
+                return anchors
+            if cert.self_signed != 'no' or cert.sha256 in seen:
+                return []
+            seen.add(cert.sha256)
+            candidates = bundle.get(name_hash(cert.issuer), [])
+            aki = cert.authority_key_identifier
+            if aki:
+                candidates = [c for c in candidates if c.key_identifier in (None, aki)]
+            if not candidates:
+                return []
+            cert = candidates[0]
+        return []
+
+    def counts(self):
+        return len(self._ders), len(self._by_subject), len(self._by_ski)
+
+
+def _make_bench_source(directory, count):
+    # count CA (EC P-256, ký bởi một root) trong một bundle PEM và một thư mục mỗi chứng chỉ một file
+    import datetime
+    from cryptography import x509
+    from cryptography.x509.oid import NameOID
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+
+    def build(subject, issuer, key, issuer_key, serial, ca=True):
+        builder = (x509.CertificateBuilder().subject_name(subject).issuer_name(issuer)
+                   .public_key(key.public_key()).serial_number(serial)
+                   .not_valid_before(now - datetime.timedelta(days=1))
+                   .not_valid_after(now + datetime.timedelta(days=365))
+                   .add_extension(x509.BasicConstraints(ca=ca, path_length=None), True)
+                   .add_extension(x509.SubjectKeyIdentifier.from_public_key(key.public_key()), False)
+                   .add_extension(x509.AuthorityKeyIdentifier.from_issuer_public_key(issuer_key.public_key()),
+                                  False))
+        return builder.sign(issuer_key, hashes.SHA256())
+
+    def name(cn):
+        return x509.Name([x509.NameAttribute(NameOID.COUNTRY_NAME, 'VN'),
+                          x509.NameAttribute(NameOID.ORGANIZATION_NAME, 'Kho thử'),
+                          x509.NameAttribute(NameOID.COMMON_NAME, cn)])
+
+    cert_dir = os.path.join(directory, 'ca')
+    os.makedirs(cert_dir, exist_ok=True)
+    root_key = ec.generate_private_key(ec.SECP256R1())
+    root = build(name('Root thử'), name('Root thử'), root_key, root_key, 1)
+    certs = [root]
+    keys = [root_key]
+    for i in range(1, count):
+        key = ec.generate_private_key(ec.SECP256R1())
+        certs.append(build(name(f'CA thử {i:04d}'), root.subject, key, root_key, i + 1))
+        keys.append(key)
+    # Người ký dưới CA cuối cùng: chuỗi cần tra issuer trong kho
+    leaf_key = ec.generate_private_key(ec.SECP256R1())
+    leaf = build(name('Người ký thử'), certs[-1].subject, leaf_key, keys[-1], count + 1, ca=False)
+    pems = [c.public_bytes(serialization.Encoding.PEM) for c in certs]
+    for i, data in enumerate(pems):
+        with open(os.path.join(cert_dir, f'ca_{i:04d}.pem'), 'wb') as f:
+            f.write(data)
+    bundle = os.path.join(directory, 'bundle.pem')
+    with open(bundle, 'wb') as f:
+        f.write(b''.join(pems))
+    return cert_dir, bundle, leaf.public_bytes(serialization.Encoding.DER)
+
+
+def run_bench(count=500, directory=None):
+    import tempfile
+    from asn1crypto import x509
+    directory = directory or tempfile.mkdtemp(prefix='kho_tin_cay_')
+    cert_dir, bundle, leaf_der = _make_bench_source(directory, count)
+    leaf = x509.Certificate.load(leaf_der)
+    snapshot = os.path.join(directory, 'kho.snap')
+
+    t0 = time.perf_counter()
+    store = TrustStore.from_source(cert_dir)
+    parse_dir = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    TrustStore.from_source(bundle)
+    parse_bundle = time.perf_counter() - t0
+    store.save_snapshot(snapshot)
+    t0 = time.perf_counter()
+    loaded = TrustStore.open(cert_dir, snapshot)
+    open_snapshot = time.perf_counter() - t0
+    assert loaded.version == store.version and len(loaded) == count
+
+    # Cách cũ: parse mọi chứng chỉ rồi so subject == issuer lần lượt
+    all_certs = [x509.Certificate.load(d) for d in store._ders]
+    rounds = 200
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        linear = [c for c in all_certs if c.subject == leaf.issuer]
+    scan = (time.perf_counter() - t0) / rounds
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        indexed = loaded.anchors_for(leaf)
+    lookup = (time.perf_counter() - t0) / rounds
+    assert [c.sha256 for c in indexed] == [c.sha256 for c in linear]
+
+    print(f'Kho {count} CA ({os.path.getsize(snapshot) / 1024:.0f} KB snapshot):')
+    print(f'  Parse thư mục ({count} file): {parse_dir * 1000:.1f} ms, parse bundle PEM: {parse_bundle * 1000:.1f} ms')
+    print(f'  Nạp snapshot (kèm kiểm tra nguồn): {open_snapshot * 1000:.2f} ms '
+          f'({parse_dir / open_snapshot:.0f}x nhanh hơn)')
+    print(f'  Tìm issuer: quét tuyến tính {scan * 1e6:.0f} µs, chỉ mục {lookup * 1e6:.1f} µs '
+          f'({scan / lookup:.0f}x)')
+    return 0
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if '--bench' in args:
+        i = args.index('--bench')
+        count = int(args[i + 1]) if len(args) > i + 1 else 500
+        sys.exit(run_bench(count))
+    if len(args) >= 3 and args[0] == 'build':
+        t0 = time.perf_counter()
+        store = TrustStore.from_source(args[1])
+        store.save_snapshot(args[2])
+        certs, subjects, skis = store.counts()
+        print(f'✓ Đã ghi {args[2]}: {certs} chứng chỉ CA, {subjects} subject, {skis} SKI '
+              f'({(time.perf_counter() - t0) * 1000:.0f} ms)')
+    elif len(args) >= 2 and args[0] == 'info':
+        t0 = time.perf_counter()
+        store = TrustStore.open(args[1])
+        elapsed = time.perf_counter() - t0
+        certs, subjects, skis = store.counts()
+        print(f'Kho {args[1]}: {certs} chứng chỉ CA, {subjects} subject, {skis} SKI, phiên bản {store.version} '
+              f'(nạp {elapsed * 1000:.1f} ms)')
+        for i in range(certs):
+            print(f'  {store.certificate(i).subject.human_friendly}')
+    else:
+        print('Dùng: python kho_tin_cay.py build NGUON SNAPSHOT | info NGUON|SNAPSHOT | --bench [N]')
+        sys.exit(2)
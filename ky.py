@@ -1,14 +1,15 @@
 import io
+import sys
+import time
 import datetime
 import os
 from PyPDF2 import PdfReader, PdfWriter
 from endesive import pdf
 from cryptography.hazmat.primitives.serialization.pkcs12 import load_key_and_certificates
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.units import mm
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
+from dau_thoi_gian import TsaClient, TsaCall, install_endesive_hook
+from hinh_chu_ky import AppearanceCache
+from doc_pdf import XrefIndex, PdfParts, PdfSyntaxError, find_signatures
+from cap_nhat_tang_dan import overlay_update
 
 # Cấu hình
 THU_MUC = os.getcwd()
@@ -16,140 +17,26 @@ THU_MUC = os.getcwd()
 TEN_PDF_GOC = os.path.join(THU_MUC, 'goc.pdf')
 TEN_PFX = os.path.join(THU_MUC, 'cert.pfx')
 MAT_KHAU_PFX = b'1234'
+TEN_DAU_RA = os.path.join(THU_MUC, 'goc_da_ky.pdf')
+TEN_ANH_KY = os.path.join(THU_MUC, 'ky.png')
 
-# Đọc file gốc
-with open(TEN_PDF_GOC, 'rb') as f:
-    orig_pdf_bytes = f.read()
-
-reader = PdfReader(io.BytesIO(orig_pdf_bytes))
-print("Số trang PDF gốc:", len(reader.pages))
-
-# Thông tin hiển thị chữ ký
-dct = {
+# Thông tin hiển thị chữ ký mặc định
+THONG_TIN_KY = {
     'sigflags': 3,
     'sigflagsft': 132,
     'page': 5,  # page 6 (0-based index)
     'location': 'Thái Nguyên, Vietnam',
     'contact': '0981597907',
-    'signingdate': datetime.datetime.now().strftime("D:%Y%m%d%H%M%S+07'00'"),
     'reason': 'Nộp bài tập',
     'name': 'Hứa Thị Thanh Hiền',
 }
 
-# Load PFX
-p12_data = open(TEN_PFX, 'rb').read()
-privkey_obj, cert_obj, add_cert_objs = load_key_and_certificates(p12_data, MAT_KHAU_PFX)
-if privkey_obj is None or cert_obj is None:
-    raise SystemExit("Không load được private key hoặc certificate từ cert.pfx. Kiểm tra mật khẩu.")
-
-othercerts = add_cert_objs if add_cert_objs else []
-
-# Tạo overlay (ảnh chữ ký + thời gian ở trên + tên dưới) và ghép lên trang gốc trước khi ký
-page_width, page_height = A4
-img_path = os.path.join(THU_MUC, 'ky.png')
-sign_name_display = dct.get('name')
-
-# Try to register Times New Roman (Windows). Nếu không tìm thấy, dùng Times-Roman
-font_name = 'TimesNewRoman'
-font_registered = False
-win_fonts = os.path.join(os.environ.get('WINDIR', 'C:\\Windows'), 'Fonts')
-candidates = [
-    os.path.join(win_fonts, 'times.ttf'),
-    os.path.join(win_fonts, 'Times New Roman.ttf'),
-    os.path.join(win_fonts, 'times new roman.ttf'),
-    os.path.join(win_fonts, 'timesbd.ttf'),
-    os.path.join(win_fonts, 'Times.ttf'),
-]
-for p in candidates:
-    if os.path.exists(p):
-        try:
-            pdfmetrics.registerFont(TTFont(font_name, p))
-            font_registered = True
-            break
-        except Exception:
-            font_registered = False
-if not font_registered:
-    font_name = 'Times-Roman'
-
-# Vị trí: đặt chữ ký ở góc phải dưới của trang (page 6), ngay bên dưới
-# nhãn "Sinh viên ký" trong goc.pdf. Điều này đặt overlay vào trang chỉ
-# hiển thị (không phải annotation), chính xác ở góc phải dưới.
-# Khoảng cách từ mép phải/bottom có thể điều chỉnh nếu cần.
-img_w = 50 * mm
-img_h = 12 * mm
-margin_right = 20 * mm
-# Đặt ảnh sao cho mép phải ảnh cách mép phải trang margin_right
-img_x = page_width - margin_right - img_w
-# Đặt ảnh ở gần đáy trang; khoảng cách này nên nằm ngay dưới nhãn "Sinh viên ký".
-# Nếu cần tinh chỉnh, thay đổi giá trị của img_y.
-img_y = page_height - 245 * mm
-
-# Prepare overlay canvas
-from reportlab.lib.utils import ImageReader
-overlay_buf = io.BytesIO()
-oc = canvas.Canvas(overlay_buf, pagesize=A4)
-
-# Thêm số điện thoại và ngày ký ngay dưới dòng "Sinh viên ký"
-sign_date_display = datetime.datetime.now().strftime('%d/%m/%Y')
-sign_phone_display = '0981597907'
-oc.setFont(font_name, 10)
-# Vẽ số điện thoại và ngày ký ở vị trí phù hợp (ngay dưới "Sinh viên ký", trên chữ ký)
-oc.drawString(img_x, img_y + 26 * mm, f'SĐT: {sign_phone_display}')
-oc.drawString(img_x, img_y + 22 * mm, f'Ngày ký: {sign_date_display}')
-
-# Vẽ ảnh chữ ký, giữ transparency nếu có
-if os.path.exists(img_path):
-    try:
-        img_reader = ImageReader(img_path)
-        oc.drawImage(img_reader, img_x, img_y, width=img_w, height=img_h, mask='auto')
-    except Exception as e:
-        print("Không thể chèn ảnh chữ ký bằng ImageReader:", e)
-else:
-    print("Ảnh chữ ký không tìm thấy:", img_path)
-# Xóa chữ "Hien" và thay bằng ảnh chữ ký (đã vẽ ở trên);
-# hiển thị họ tên đầy đủ ngay phía trên đường kẻ, dưới ảnh chữ ký.
-text_center_x = img_x + img_w / 2
-oc.setFont(font_name, 10)
-# Hiển thị họ tên ngay dưới ảnh chữ ký (dưới chỗ ký), căn giữa theo ảnh
-oc.drawCentredString(text_center_x, img_y - (4 * mm), sign_name_display)
-oc.save()
-overlay_buf.seek(0)
-
-# Ghép overlay lên trang đầu
-overlay_pdf = PdfReader(overlay_buf)
-writer = PdfWriter()
-for i, page in enumerate(reader.pages):
-    if i == dct.get('page', 0):
-        page.merge_page(overlay_pdf.pages[0])
-    writer.add_page(page)
-
-new_pdf_buf = io.BytesIO()
-writer.write(new_pdf_buf)
-new_pdf_bytes = new_pdf_buf.getvalue()
-
-# Dùng PDF đã ghép overlay làm dữ liệu để ký
-datau = new_pdf_bytes
-
-# Chuẩn bị thông tin ký (ẩn annotation, vì phần hiển thị đã được ghép vào nội dung)
-page_count = len(reader.pages)
-requested_page = dct.get('page', 0)
-sigpage = requested_page if 0 <= requested_page < page_count else max(0, page_count - 1)
-
-udct = {
-    'sigpage': sigpage,
-    'signaturebox': None,  # invisible signature annotation
-    'contact': dct.get('contact'),
-    'location': dct.get('location'),
-    'signingdate': dct.get('signingdate'),
-    'reason': dct.get('reason'),
-    'sigflags': dct.get('sigflags', 3),
-    'sigflagsft': dct.get('sigflagsft', 132),
-    'name': dct.get('name'),
-}
+# Kích thước cố định (byte) dành cho /Contents khi có timestamp: endesive ký một lần thay vì hai lần
+# (hai lần ký có thể nhận token từ hai TSA khác nhau, độ dài khác nhau)
+SIG_PLACEHOLDER = 16384
 
-# Ký bằng endesive với timestamp
-# Thử nhiều TSA server khác nhau
-tsa_servers = [
+# Các TSA server, được gửi song song và xếp hạng theo độ trễ / lỗi (dau_thoi_gian.TsaClient)
+TSA_SERVERS = [
     'http://timestamp.digicert.com',
     'http://timestamp.globalsign.com/tsa/r6advanced1',
     'http://tsa.starfieldtech.com',
@@ -157,45 +44,287 @@ tsa_servers = [
     'http://timestamp.apple.com/ts01'
 ]
 
-signed_pdf_append = None
-for tsa_url in tsa_servers:
+
+def sign_info(opts, now, page=None, reason=None, location=None, contact=None, name=None, signingdate=None):
+    # Thông tin chữ ký của một tài liệu: tham số truyền vào, thiếu thì lấy theo opts (THONG_TIN_KY)
+    return {
+        'sigflags': opts['sigflags'],
+        'sigflagsft': opts['sigflagsft'],
+        'page': opts['page'] if page is None else page,
+        'location': opts['location'] if location is None else location,
+        'contact': opts['contact'] if contact is None else contact,
+        'signingdate': signingdate or now.strftime("D:%Y%m%d%H%M%S+07'00'"),
+        'reason': opts['reason'] if reason is None else reason,
+        'name': opts['name'] if name is None else name,
+    }
+
+
+class Signer:
+    # Nạp khóa, chuỗi chứng chỉ, font và ảnh chữ ký một lần; sign() dùng lại cho mọi tài liệu.
+    # Dùng được lâu dài trong một tiến trình dịch vụ (không giữ trạng thái theo từng tài liệu).
+    def __init__(self, pfx_path=TEN_PFX, password=MAT_KHAU_PFX, img_path=TEN_ANH_KY,
+                 tsa_servers=None, defaults=None, echo=print, tsa=None, ltv=None, pss=False, digest_algorithm=None):
+        self.echo = echo
+        self.defaults = dict(THONG_TIN_KY)
+        self.defaults.update(defaults or {})
+        # tsa: TsaClient dùng chung (giữ kết nối và số liệu sức khỏe giữa các tài liệu)
+        servers = TSA_SERVERS if tsa_servers is None else tsa_servers
+        if tsa is None and servers:
+            tsa = TsaClient(servers)
+        self.tsa = tsa
+        # ltv: du_lieu_ltv.LtvCollector; có thì nhúng OCSP/CRL của chuỗi chứng chỉ vào /DSS sau khi ký
+        self.ltv = ltv
+        if self.tsa is not None:
+            install_endesive_hook()
+
+        # Load PFX
+        with open(pfx_path, 'rb') as f:
+            p12_data = f.read()
+        self.privkey, self.cert, add_cert_objs = load_key_and_certificates(p12_data, password)
+        if self.privkey is None or self.cert is None:
+            raise ValueError(f"Không load được private key hoặc certificate từ {pfx_path}. Kiểm tra mật khẩu.")
+        self.othercerts = add_cert_objs if add_cert_objs else []
+        # endesive chỉ ký đúng RSA PKCS#1 v1.5 + SHA-256 trên một bytes liền; khóa EC / Ed25519, RSA-PSS,
+        # hàm băm khác và ký incremental (dữ liệu dạng PdfParts) đi qua KeyHolder
+        # (CMS tự dựng, cùng thuộc tính ký như endesive)
+        from ky_hai_pha import KeyHolder, key_scheme
+        self.endesive = key_scheme(self.privkey, pss) == 'rsa' and digest_algorithm in (None, 'sha256')
+        self.holder = KeyHolder(self.privkey, self.cert, self.othercerts, tsa=self.tsa, echo=echo,
+                                pss=pss, digest_algorithm=digest_algorithm)
+
+        # Font, ảnh và phần hiển thị chữ ký được render một lần rồi dùng lại
+        self.appearance = AppearanceCache(img_path, echo=echo)
+
+    def cms_sign(self, datau, udct, tsa_call=None):
+        # Ký bằng endesive với timestamp; nếu không TSA nào trả lời thì ký không có timestamp.
+        # tsa_call: TsaCall nhận nguồn và thời gian chờ TSA của lần ký này (mặc định tạo mới).
+        # datau: bytes hoặc PdfParts. Trả về (phần chữ ký nối sau datau, URL TSA đã cấp timestamp hoặc None)
+        if tsa_call is None and self.tsa is not None:
+            tsa_call = TsaCall(self.tsa)
+        if not self.endesive or isinstance(datau, PdfParts):
+            return self._holder_sign(datau, udct, tsa_call)
+        if tsa_call is not None:
+            try:
+                self.echo("Đang lấy timestamp (gửi song song tới các TSA)...")
+                signed_pdf_append = pdf.cms.sign(
+                    datau,
+                    dict(udct, aligned=SIG_PLACEHOLDER),
+                    self.privkey,
+                    self.cert,
+                    self.othercerts,
+                    algomd='sha256',
+                    timestampurl=tsa_call
+                )
+                self.echo(f"✓ Đã thêm timestamp từ {tsa_call.source}")
+                return signed_pdf_append, tsa_call.source
+            except Exception as e:
+                self.echo(f"✗ Lỗi timestamp: {e}")
+
+        self.echo("\n⚠ Không thể kết nối TSA server nào. Ký không có timestamp...")
+        return pdf.cms.sign(datau, udct, self.privkey, self.cert, self.othercerts, algomd='sha256'), None
+
+    def _holder_sign(self, datau, udct, tsa_call):
+        # Trường chữ ký được nối thành một đoạn riêng: chỉ đoạn này được sửa khi ghi CMS, datau không bị sao chép
+        from ky_hai_pha import reserve_signature, inject
+        if tsa_call is not None:
+            self.echo("Đang lấy timestamp (gửi song song tới các TSA)...")
+        data = datau if isinstance(datau, PdfParts) else PdfParts([datau])
+        prepared = reserve_signature(data, udct['sigpage'], udct, SIG_PLACEHOLDER, self.holder.digest_algorithm)
+        cms_der = self.holder.sign_digests([prepared.digest], tsa=tsa_call)[0]
+        source = tsa_call.source if tsa_call is not None else None
+        if source is not None:
+            self.echo(f"✓ Đã thêm timestamp từ {source}")
+        elif tsa_call is not None:
+            self.echo("\n⚠ Không thể kết nối TSA server nào. Ký không có timestamp...")
+        return inject(prepared, cms_der).parts[-1], source
+
+    def sign(self, pdf_input, page=None, reason=None, location=None, contact=None, name=None,
+             signingdate=None, incremental=False):
+        # pdf_input: bytes hoặc stream (có .read()).
+        # Trả về (toàn bộ PDF đã ký (bytes), URL TSA đã cấp timestamp hoặc None, thời gian từng pha)
+        parts, tsa_source, timings = self._sign_parts(
+            pdf_input, page, reason, location, contact, name, signingdate, incremental)
+        return b''.join(parts), tsa_source, timings
+
+    def sign_to_file(self, pdf_input, out_path, page=None, reason=None, location=None, contact=None,
+                     name=None, signingdate=None, incremental=False):
+        # Ghi thẳng ra đĩa từng đoạn (byte gốc, các incremental update, phần chữ ký), không ghép thành một bytes mới.
+        # Trả về (số byte đã ghi, URL TSA đã cấp timestamp hoặc None, thời gian từng pha)
+        parts, tsa_source, timings = self._sign_parts(
+            pdf_input, page, reason, location, contact, name, signingdate, incremental)
+        t0 = time.perf_counter()
+        with open(out_path, 'wb') as f:
+            for part in parts:
+                f.write(part)
+        timings['write'] = time.perf_counter() - t0
+        return sum(len(part) for part in parts), tsa_source, timings
+
+    def _merge_overlay(self, orig_pdf_bytes, requested_page, layers):
+        # Ghép overlay bằng PyPDF2 và ghi lại toàn bộ tài liệu; trả về (bytes, số trang)
+        reader = PdfReader(io.BytesIO(orig_pdf_bytes))
+        writer = PdfWriter()
+        for i, pg in enumerate(reader.pages):
+            if i == requested_page:
+                for layer in layers:
+                    pg.merge_page(layer.page)
+            writer.add_page(pg)
+        new_pdf_buf = io.BytesIO()
+        writer.write(new_pdf_buf)
+        return new_pdf_buf.getvalue(), len(reader.pages)
+
+    def _sign_parts(self, pdf_input, page, reason, location, contact, name, signingdate, incremental):
+        # Trả về (các đoạn bytes nối tiếp tạo thành PDF đã ký, URL TSA hoặc None,
+        # thời gian từng pha (giây): overlay_render, page_merge, cms_sign, tsa, ltv; sign_to_file thêm write)
+        if hasattr(pdf_input, 'read'):
+            orig_pdf_bytes = pdf_input.read()
+        elif isinstance(pdf_input, bytes):
+            orig_pdf_bytes = pdf_input
+        else:
+            orig_pdf_bytes = bytes(pdf_input)
+        now = datetime.datetime.now()
+        dct = sign_info(self.defaults, now, page, reason, location, contact, name, signingdate)
+
+        requested_page = dct.get('page', 0)
+        timings = {}
+        t0 = time.perf_counter()
+        layers = self.appearance.layers(dct['name'], dct['contact'], now.strftime('%d/%m/%Y'))
+        templates = [layer.template for layer in layers] if incremental else None
+        t1 = time.perf_counter()
+        timings['overlay_render'] = t1 - t0
+
+        # Ghép overlay (lớp tĩnh dạng Form XObject + lớp ngày ký) lên trang được chọn.
+        # incremental: nối trang đã sửa + object mới vào sau byte gốc (chỉ đọc các node cây trang cần thiết),
+        # byte gốc và phần nối thêm giữ thành các đoạn riêng (PdfParts);
+        # ngược lại (hoặc khi file không hỗ trợ) ghi lại toàn bộ bằng PyPDF2.
+        datau = None
+        if incremental:
+            try:
+                index = XrefIndex(orig_pdf_bytes)
+                page_count = index.page_count()
+                if 0 <= requested_page < page_count:
+                    update = overlay_update(orig_pdf_bytes, requested_page, templates, index)
+                    datau = PdfParts([orig_pdf_bytes, update])
+                else:
+                    datau = PdfParts([orig_pdf_bytes])
+            except (PdfSyntaxError, ValueError, KeyError, IndexError, AttributeError) as e:
+                self.echo("⚠ Không ghép overlay theo incremental update được, ghi lại toàn bộ:", e)
+        if datau is None:
+            # Dùng PDF đã ghép overlay làm dữ liệu để ký
+            datau, page_count = self._merge_overlay(orig_pdf_bytes, requested_page, layers)
+        sigpage = requested_page if 0 <= requested_page < page_count else max(0, page_count - 1)
+        t2 = time.perf_counter()
+        timings['page_merge'] = t2 - t1
+
+        # Chuẩn bị thông tin ký (ẩn annotation, vì phần hiển thị đã được ghép vào nội dung)
+        udct = {
+            'sigpage': sigpage,
+            'signaturebox': None,  # invisible signature annotation
+            'contact': dct.get('contact'),
+            'location': dct.get('location'),
+            'signingdate': dct.get('signingdate'),
+            'reason': dct.get('reason'),
+            'sigflags': dct.get('sigflags', 3),
+            'sigflagsft': dct.get('sigflagsft', 132),
+            'name': dct.get('name'),
+        }
+        tsa_call = TsaCall(self.tsa) if self.tsa is not None else None
+        signed_pdf_append, tsa_source = self.cms_sign(datau, udct, tsa_call)
+        tsa_seconds = tsa_call.seconds if tsa_call is not None else 0.0
+        timings['tsa'] = tsa_seconds
+        timings['cms_sign'] = time.perf_counter() - t2 - tsa_seconds
+        parts = list(datau.parts) if isinstance(datau, PdfParts) else [datau]
+        parts.append(signed_pdf_append)
+        if self.ltv is not None:
+            update = self._ltv_update(PdfParts(parts), timings)
+            if update is not None:
+                parts.append(update)
+        return parts, tsa_source, timings
+
+    def _ltv_update(self, signed, timings):
+        # /DSS cho chữ ký vừa tạo, nối thêm dạng incremental update sau phần chữ ký (None nếu không có gì)
+        from du_lieu_ltv import ltv_update
+        t0 = time.perf_counter()
+        try:
+            update = ltv_update(signed, self.ltv, find_signatures(signed)[-1:])
+        except (PdfSyntaxError, ValueError, KeyError, IndexError, TypeError) as e:
+            self.echo("⚠ Không nhúng được dữ liệu LTV (/DSS):", e)
+            update = None
+        timings['ltv'] = time.perf_counter() - t0
+        if update is None:
+            self.echo("⚠ Không có dữ liệu thu hồi để nhúng vào /DSS")
+        return update
+
+
+def main(incremental=False, ltv=None, key_options=None):
+    # Đọc file gốc
+    with open(TEN_PDF_GOC, 'rb') as f:
+        orig_pdf_bytes = f.read()
+
+    print("Số trang PDF gốc:", XrefIndex(orig_pdf_bytes).page_count())
+
+    try:
+        signer = Signer(ltv=ltv, **(key_options or {}))
+    except ValueError as e:
+        raise SystemExit(str(e))
+    signer.sign_to_file(orig_pdf_bytes, TEN_DAU_RA, incremental=incremental)
+
+    print("Đã ký thành công! File:", TEN_DAU_RA)
+
     try:
-        print(f"Đang thử TSA: {tsa_url}...")
-        signed_pdf_append = pdf.cms.sign(
-            datau, 
-            udct, 
-            privkey_obj, 
-            cert_obj, 
-            othercerts, 
-            algomd='sha256',
-            timestampurl=tsa_url
-        )
-        print(f"✓ Đã thêm timestamp từ {tsa_url}")
-        break
+        test_reader = PdfReader(open(TEN_DAU_RA, 'rb'))
+        print("PDF hợp lệ! Số trang:", len(test_reader.pages))
+
+        # Hiển thị thông tin về chữ ký
+        if '/AcroForm' in test_reader.trailer['/Root']:
+            acroform = test_reader.trailer['/Root']['/AcroForm']
+            if '/Fields' in acroform:
+                print("Số trường chữ ký:", len(acroform['/Fields']))
     except Exception as e:
-        print(f"✗ Lỗi với {tsa_url}: {e}")
-        continue
+        print("PDF không hợp lệ:", e)
 
-if signed_pdf_append is None:
-    print("\n⚠ Không thể kết nối TSA server nào. Ký không có timestamp...")
-    signed_pdf_append = pdf.cms.sign(datau, udct, privkey_obj, cert_obj, othercerts, algomd='sha256')
 
-TEN_DAU_RA = os.path.join(THU_MUC, 'goc_da_ky.pdf')
-# Ghi file một lần để tránh incremental updates
-final_pdf = datau + signed_pdf_append
-with open(TEN_DAU_RA, 'wb') as f:
-    f.write(final_pdf)
-
-print("Đã ký thành công! File:", TEN_DAU_RA)
-
-try:
-    test_reader = PdfReader(open(TEN_DAU_RA, 'rb'))
-    print("PDF hợp lệ! Số trang:", len(test_reader.pages))
-    
-    # Hiển thị thông tin về chữ ký
-    if '/AcroForm' in test_reader.trailer['/Root']:
-        acroform = test_reader.trailer['/Root']['/AcroForm']
-        if '/Fields' in acroform:
-            print("Số trường chữ ký:", len(acroform['/Fields']))
-except Exception as e:
-    print("PDF không hợp lệ:", e)
+if __name__ == '__main__':
+    # --incremental: giữ nguyên byte gốc, overlay được nối vào dạng incremental update
+    # --batch THU_MUC | manifest.jsonl | @danh_sach.txt [--out THU_MUC] [--workers N]: ký hàng loạt
+    args = sys.argv[1:]
+    incremental = '--incremental' in args
+    # --ltv [--revocation-dir DIR] [--no-fetch]: nhúng OCSP/CRL của chuỗi chứng chỉ vào /DSS (xác thực offline);
+    # CRL/OCSP lấy từ thư mục cục bộ trước, --no-fetch: không hỏi CA qua mạng
+    ltv = None
+    if '--ltv' in args:
+        revocation_dir = None
+        if '--revocation-dir' in args:
+            i = args.index('--revocation-dir')
+            revocation_dir = args[i + 1]
+            del args[i:i + 2]
+        ltv = {'revocation_dir': revocation_dir, 'fetch': '--no-fetch' not in args}
+    # --pfx FILE [--password MK]: khóa RSA, EC (P-256 / P-384) hoặc Ed25519;
+    # --pss: RSA ký bằng RSASSA-PSS; --digest sha384|sha512: hàm băm khác mặc định theo loại khóa
+    key_options = {'pss': '--pss' in args}
+    for flag, key, conv in (('--pfx', 'pfx_path', str), ('--password', 'password', str.encode),
+                            ('--digest', 'digest_algorithm', str)):
+        if flag in args:
+            i = args.index(flag)
+            key_options[key] = conv(args[i + 1])
+            del args[i:i + 2]
+    if '--batch' in args:
+        options = {}
+        for flag, key, conv in (('--batch', 'spec', str), ('--out', 'out_dir', str), ('--workers', 'workers', int)):
+            if flag in args:
+                i = args.index(flag)
+                options[key] = conv(args[i + 1])
+                del args[i:i + 2]
+        if '--deferred' in args:
+            # --deferred [--batch-size N]: ký hai pha, worker chỉ chuẩn bị PDF, khóa ký nằm ở tiến trình chính;
+            # luôn ký bằng incremental update (--incremental không cần), --ltv nhúng /DSS sau khi ghi CMS
+            from ky_hai_pha import run_deferred_sign
+            if '--batch-size' in args:
+                i = args.index('--batch-size')
+                options['batch_size'] = int(args[i + 1])
+            sys.exit(run_deferred_sign(ltv=ltv, **options, **key_options))
+        from ky_hangloat import run_bulk_sign
+        sys.exit(run_bulk_sign(incremental=incremental, ltv=ltv, **options, **key_options))
+    if ltv is not None:
+        from du_lieu_ltv import LtvCollector
+        ltv = LtvCollector(**ltv)
+    main(incremental=incremental, ltv=ltv, key_options=key_options)
@@ -0,0 +1,507 @@
+import os
+import sys
+import time
+import hashlib
+import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+from doc_pdf import (XrefIndex, PdfBuffer, PdfParts, PdfSyntaxError, find_signatures, hash_byterange,
+                     text_string)
+from cap_nhat_tang_dan import overlay_update, signature_update
+
+# Ký hai pha: tách phần xử lý PDF (nhiều tiến trình, không cần khóa riêng) khỏi thao tác với khóa
+# (một nơi giữ khóa duy nhất):
+#   1. Preparer.prepare: ghép hình chữ ký + trường chữ ký có /Contents để trống (incremental update),
+#      trả về ByteRange và digest của phần được ký (SHA-256, hoặc hàm băm theo loại khóa)
+#   2. KeyHolder.sign_digests: nhận một lô digest, trả về CMS SignedData (detached) cho từng digest
+#      trong một lần gọi
+#   3. inject / inject_file: ghi CMS (hex) vào đúng chỗ trống /Contents đã chừa, không đổi độ dài file
+#   python ky_hai_pha.py --batch THU_MUC | manifest.jsonl | @danh_sach.txt [--out THU_MUC] [--workers N]
+#                        [--batch-size N]
+#   python ky_hai_pha.py vao.pdf ra.pdf
+
+DEFAULT_BATCH = 64
+CONTENT_TYPE_DATA = 'data'
+
+
+class PreparedDocument:
+    # Tài liệu đã chừa chỗ cho chữ ký; data có thể là None khi tài liệu đã được ghi ra file (path)
+    def __init__(self, data, byte_range, contents_span, digest, path=None):
+        self.data = data
+        self.byte_range = byte_range
+        self.contents_span = contents_span
+        self.digest = digest
+        self.path = path
+
+    @property
+    def capacity(self):
+        # Số byte DER tối đa của CMS vừa chỗ trống
+        start, end = self.contents_span
+        return (end - start - 2) // 2
+
+    def as_dict(self):
+        return {'path': self.path, 'byte_range': list(self.byte_range),
+                'contents_span': list(self.contents_span), 'digest': self.digest.hex()}
+
+    @classmethod
+    def from_dict(cls, d, data=None):
+        return cls(data, tuple(d['byte_range']), tuple(d['contents_span']), bytes.fromhex(d['digest']), d.get('path'))
+
+
+class Preparer:
+    # Phía xử lý PDF: không nạp khóa riêng. Font, ảnh và phần hiển thị chữ ký được render một lần như Signer.
+    # digest_algorithm phải khớp KeyHolder.digest_algorithm của nơi ký.
+    def __init__(self, img_path=None, defaults=None, contents_size=None, echo=print, digest_algorithm='sha256'):
+        import ky
+        from hinh_chu_ky import AppearanceCache
+        self.defaults = dict(ky.THONG_TIN_KY)
+        self.defaults.update(defaults or {})
+        self.contents_size = contents_size or ky.SIG_PLACEHOLDER
+        self.appearance = AppearanceCache(img_path or ky.TEN_ANH_KY, echo=echo)
+        self.digest_algorithm = digest_algorithm
+
+    def prepare(self, pdf_input, page=None, reason=None, location=None, contact=None, name=None,
+                signingdate=None):
+        # Trả về (PreparedDocument, thời gian từng pha (giây): page_merge, prepare)
+        import ky
+        data = pdf_input.read() if hasattr(pdf_input, 'read') else bytes(pdf_input)
+        now = datetime.datetime.now()
+        dct = ky.sign_info(self.defaults, now, page, reason, location, contact, name, signingdate)
+        timings = {}
+        t0 = time.perf_counter()
+        index = XrefIndex(data)
+        page_count = index.page_count()
+        requested_page = dct['page']
+        if 0 <= requested_page < page_count:
+            layers = self.appearance.layers(dct['name'], dct['contact'], now.strftime('%d/%m/%Y'))
+            data += overlay_update(data, requested_page, [layer.template for layer in layers], index)
+            index = XrefIndex(data)
+        sigpage = requested_page if 0 <= requested_page < page_count else max(0, page_count - 1)
+        t1 = time.perf_counter()
+        timings['page_merge'] = t1 - t0
+        prepared = reserve_signature(data, sigpage, dct, self.contents_size, self.digest_algorithm, index)
+        timings['prepare'] = time.perf_counter() - t1
+        return prepared, timings
+
+
+def reserve_signature(data, sigpage, dct, contents_size, digest_algorithm='sha256', index=None):
+    # Nối trường chữ ký với /Contents để trống vào data; dct: thông tin chữ ký (ky.sign_info).
+    # data là PdfParts thì phần nối thêm thành một đoạn mới, không ghép lại cả tài liệu
+    fields = {'/M': dct['signingdate'], '/Name': text_string(dct['name']),
+              '/Reason': text_string(dct['reason']), '/Location': text_string(dct['location']),
+              '/ContactInfo': text_string(dct['contact'])}
+    update, byte_range, contents_span = signature_update(data, sigpage, fields, contents_size, index)
+    data = data + update if isinstance(data, PdfParts) else bytes(data) + update
+    digest = hash_byterange(data, byte_range, hashlib.new(digest_algorithm)).digest()
+    return PreparedDocument(data, byte_range, contents_span, digest)
+
+
+def key_scheme(key, pss=False):
+    # Loại chữ ký theo khóa riêng (cryptography): 'rsa', 'rsa_pss', 'ecdsa' hoặc 'ed25519'
+    from cryptography.hazmat.primitives.asymmetric import rsa, ec, ed25519
+    if isinstance(key, rsa.RSAPrivateKey):
+        return 'rsa_pss' if pss else 'rsa'
+    if isinstance(key, ec.EllipticCurvePrivateKey):
+        return 'ecdsa'
+    if isinstance(key, ed25519.Ed25519PrivateKey):
+        return 'ed25519'
+    raise ValueError(f'Loại khóa chưa hỗ trợ: {type(key).__name__}')
+
+
+def default_digest(key, pss=False):
+    # Hàm băm cho messageDigest: theo độ mạnh của đường cong (P-384 -> SHA-384),
+    # Ed25519 dùng SHA-512 (RFC 8419), RSA giữ SHA-256 như endesive
+    scheme = key_scheme(key, pss)
+    if scheme == 'ed25519':
+        return 'sha512'
+    if scheme == 'ecdsa':
+        return {384: 'sha384', 521: 'sha512'}.get(key.curve.key_size, 'sha256')
+    return 'sha256'
+
+
+class KeyHolder:
+    # Nơi duy nhất giữ khóa riêng. sign_digests nhận một lô digest (của ByteRange, theo digest_algorithm)
+    # và trả về CMS SignedData detached tương ứng (contentType, messageDigest, signingCertificateV2 như
+    # endesive); có tsa thì thêm timestamp token cho từng chữ ký. Khóa RSA (PKCS#1 v1.5 hoặc PSS),
+    # ECDSA (P-256 / P-384 / P-521) và Ed25519. Bản này chạy trong tiến trình; dịch vụ giữ khóa từ xa
+    # chỉ cần cùng giao diện sign_digests.
+    def __init__(self, key, cert, chain=(), tsa=None, echo=print, pss=False, digest_algorithm=None):
+        from asn1crypto import x509, cms
+        from cryptography.hazmat.primitives.serialization import Encoding
+        self._key = key
+        self.scheme = key_scheme(key, pss)
+        self.digest_algorithm = digest_algorithm or default_digest(key, pss)
+        self.cert = x509.Certificate.load(cert.public_bytes(Encoding.DER))
+        self.chain = [x509.Certificate.load(c.public_bytes(Encoding.DER)) for c in chain or []]
+        # Phần giống nhau ở mọi chữ ký được mã hóa DER một lần: dựng signingCertificateV2 bằng asn1crypto
+        # tốn vài ms, lâu hơn cả thao tác ký với khóa EC / Ed25519
+        self._certificates = cms.CertificateSet([self.cert] + self.chain).dump()
+        self._fixed_attrs = [a.dump() for a in (
+            cms.CMSAttribute({'type': 'content_type', 'values': [CONTENT_TYPE_DATA]}),
+            cms.CMSAttribute({'type': 'signing_certificate_v2', 'values': [{
+                'certs': [{'hash_algorithm': {'algorithm': 'sha256'}, 'cert_hash': self.cert.sha256}],
+            }]}),
+        )]
+        self._signature_algorithm_der = self._signature_algorithm().dump()
+        self.tsa = tsa
+        self.echo = echo
+        self.stats = {'batches': 0, 'signatures': 0, 'timestamps': 0}
+
+    @classmethod
+    def from_pfx(cls, pfx_path=None, password=None, **kwargs):
+        import ky
+        from cryptography.hazmat.primitives.serialization.pkcs12 import load_key_and_certificates
+        pfx_path = pfx_path or ky.TEN_PFX
+        with open(pfx_path, 'rb') as f:
+            key, cert, others = load_key_and_certificates(f.read(), password or ky.MAT_KHAU_PFX)
+        if key is None or cert is None:
+            raise ValueError(f"Không load được private key hoặc certificate từ {pfx_path}. Kiểm tra mật khẩu.")
+        return cls(key, cert, others, **kwargs)
+
+    def sign_digests(self, digests, tsa=None):
+        # tsa: thay self.tsa cho lần gọi này (vd. dau_thoi_gian.TsaCall giữ nguồn timestamp của một lần ký)
+        self.stats['batches'] += 1
+        return [self._signed_data(digest, tsa or self.tsa) for digest in digests]
+
+    def _signature_algorithm(self):
+        from asn1crypto import algos
+        if self.scheme == 'ed25519':
+            return algos.SignedDigestAlgorithm({'algorithm': 'ed25519'})
+        if self.scheme == 'ecdsa':
+            return algos.SignedDigestAlgorithm({'algorithm': f'{self.digest_algorithm}_ecdsa'})
+        if self.scheme == 'rsa_pss':
+            # Salt bằng độ dài digest: giá trị được mọi bộ xác thực PAdES chấp nhận
+            return algos.SignedDigestAlgorithm({
+                'algorithm': 'rsassa_pss',
+                'parameters': {
+                    'hash_algorithm': {'algorithm': self.digest_algorithm},
+                    'mask_gen_algorithm': {'algorithm': 'mgf1', 'parameters': {'algorithm': self.digest_algorithm}},
+                    'salt_length': hashlib.new(self.digest_algorithm).digest_size,
+                    'trailer_field': 'trailer_field_bc',
+                },
+            })
+        return algos.SignedDigestAlgorithm({'algorithm': 'rsassa_pkcs1v15'})
+
+    def _sign(self, data):
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import padding, ec
+        if self.scheme == 'ed25519':
+            return self._key.sign(data)
+        md = getattr(hashes, self.digest_algorithm.upper())()
+        if self.scheme == 'ecdsa':
+            return self._key.sign(data, ec.ECDSA(md))
+        if self.scheme == 'rsa_pss':
+            return self._key.sign(data, padding.PSS(padding.MGF1(md), md.digest_size), md)
+        return self._key.sign(data, padding.PKCS1v15(), md)
+
+    def sign_parts(self, digests):
+        # Chỉ phần dùng khóa: (signedAttrs, chữ ký) cho từng digest trong một lần gọi; timestamp và ráp CMS
+        # (assemble) làm sau, để nơi gọi lấy timestamp song song thay vì lần lượt trong lúc giữ khóa
+        self.stats['batches'] += 1
+        return [self._signature(digest) for digest in digests]
+
+    def _signature(self, digest):
+        from asn1crypto import cms
+        content_type, signing_certificate = (cms.CMSAttribute.load(a) for a in self._fixed_attrs)
+        signed_attrs = cms.CMSAttributes([
+            content_type,
+            cms.CMSAttribute({'type': 'message_digest', 'values': [digest]}),
+            signing_certificate,
+        ])
+        return signed_attrs, self._sign(signed_attrs.dump())
+
+    def assemble(self, signed_attrs, signature, unsigned_attrs=None):
+        # CMS SignedData detached từ kết quả sign_parts; unsigned_attrs: vd. TsaClient.timestamp_attrs(signature)
+        from asn1crypto import cms, algos
+        signer_info = {
+            'version': 'v1',
+            'sid': cms.SignerIdentifier({'issuer_and_serial_number': {
+                'issuer': self.cert.issuer, 'serial_number': self.cert.serial_number}}),
+            'digest_algorithm': algos.DigestAlgorithm({'algorithm': self.digest_algorithm}),
+            'signed_attrs': signed_attrs,
+            'signature_algorithm': algos.SignedDigestAlgorithm.load(self._signature_algorithm_der),
+            'signature': signature,
+        }
+        if unsigned_attrs:
+            signer_info['unsigned_attrs'] = unsigned_attrs
+        self.stats['signatures'] += 1
+        return cms.ContentInfo({
+            'content_type': 'signed_data',
+            'content': cms.SignedData({
+                'version': 'v1',
+                'digest_algorithms': [{'algorithm': self.digest_algorithm}],
+                'encap_content_info': {'content_type': CONTENT_TYPE_DATA},
+                'certificates': cms.CertificateSet.load(self._certificates),
+                'signer_infos': [signer_info],
+            }),
+        }).dump()
+
+    def _signed_data(self, digest, tsa=None):
+        signed_attrs, signature = self._signature(digest)
+        unsigned_attrs = None
+        if tsa is not None:
+            try:
+                unsigned_attrs = tsa.timestamp_attrs(signature)
+                self.stats['timestamps'] += 1
+            except Exception as e:
+                self.echo(f"✗ Lỗi timestamp: {e}")
+        return self.assemble(signed_attrs, signature, unsigned_attrs)
+
+
+def _hex_contents(prepared, cms_der):
+    hexed = cms_der.hex().encode('ascii')
+    if len(cms_der) > prepared.capacity:
+        raise ValueError(f'CMS ({len(cms_der)} byte) lớn hơn chỗ trống /Contents ({prepared.capacity} byte)')
+    return hexed
+
+
+def inject(prepared, cms_der):
+    # Trả về tài liệu hoàn chỉnh (bytes, hoặc PdfParts như prepared.data): CMS ghi vào đầu chỗ trống,
+    # phần còn lại giữ các số 0 đệm
+    hexed = _hex_contents(prepared, cms_der)
+    start = prepared.contents_span[0] + 1
+    if isinstance(prepared.data, PdfParts):
+        # /Contents nằm trong đoạn cuối (trường chữ ký vừa nối): chỉ sửa đoạn đó
+        parts = list(prepared.data.parts)
+        start -= len(prepared.data) - len(parts[-1])
+        last = bytearray(parts[-1])
+        last[start:start + len(hexed)] = hexed
+        return PdfParts(parts[:-1] + [bytes(last)])
+    data = bytearray(prepared.data)
+    data[start:start + len(hexed)] = hexed
+    return bytes(data)
+
+
+def inject_file(prepared, cms_der, path=None):
+    # Như inject nhưng ghi thẳng vào file đã chuẩn bị (chỉ ghi đè vùng /Contents)
+    hexed = _hex_contents(prepared, cms_der)
+    with open(path or prepared.path, 'r+b') as f:
+        f.seek(prepared.contents_span[0] + 1)
+        f.write(hexed)
+
+
+# ---------------------------------------------------------------------------
+# Ký hàng loạt: worker chuẩn bị tài liệu, tiến trình chính giữ khóa và ký theo lô
+# ---------------------------------------------------------------------------
+
+_worker_preparer = None
+_worker_error = None
+
+
+def _init_preparer(img_path, digest_algorithm='sha256'):
+    global _worker_preparer, _worker_error
+    try:
+        _worker_preparer = Preparer(img_path, echo=lambda *a, **k: None, digest_algorithm=digest_algorithm)
+    except Exception as e:
+        _worker_error = f'Không khởi tạo được Preparer: {e}'
+
+
+def prepare_one(job):
+    # Worker: chuẩn bị một tài liệu vào file tạm cạnh file đích, trả về bản ghi kèm digest cần ký
+    from ky_hangloat import JOB_OPTIONS
+    t0 = time.perf_counter()
+    record = {'input': job['input'], 'output': job['output'], 'pid': os.getpid()}
+    tmp = f'{job["output"]}.{os.getpid()}.tmp'
+    try:
+        if _worker_preparer is None:
+            raise RuntimeError(_worker_error or 'Worker chưa được khởi tạo')
+        with open(job['input'], 'rb') as f:
+            data = f.read()
+        os.makedirs(os.path.dirname(os.path.abspath(job['output'])), exist_ok=True)
+        options = {k: job[k] for k in JOB_OPTIONS if k in job}
+        prepared, timings = _worker_preparer.prepare(data, **options)
+        with open(tmp, 'wb') as f:
+            f.write(prepared.data)
+        prepared.path = tmp
+        record.update(prepared.as_dict())
+        record['bytes'] = len(prepared.data)
+        record['ok'] = True
+        record['timings'] = {k: round(v, 6) for k, v in timings.items()}
+    except Exception as e:
+        record['ok'] = False
+        record['error'] = f'{type(e).__name__}: {e}'
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+    record['seconds'] = round(time.perf_counter() - t0, 6)
+    return record
+
+
+def prepare_batch(items):
+    # Worker: chuẩn bị một lô tài liệu trong bộ nhớ (dịch vụ ký); items: [(PDF bytes, tùy chọn chữ ký)].
+    # Trả về (PreparedDocument, thời gian từng pha) hoặc thông điệp lỗi (str) cho từng tài liệu,
+    # lỗi một tài liệu không hỏng cả lô
+    out = []
+    for data, options in items:
+        try:
+            if _worker_preparer is None:
+                raise RuntimeError(_worker_error or 'Worker chưa được khởi tạo')
+            out.append(_worker_preparer.prepare(data, **options))
+        except Exception as e:
+            out.append(f'{type(e).__name__}: {e}')
+    return out
+
+
+def append_ltv(path, collector):
+    # Nối /DSS (OCSP/CRL của chữ ký cuối, du_lieu_ltv.LtvCollector) vào file đã ký dạng incremental update.
+    # Trả về số byte đã nối (0 khi không có dữ liệu thu hồi để nhúng)
+    from du_lieu_ltv import ltv_update
+    with PdfBuffer(path) as data:
+        update = ltv_update(data, collector, find_signatures(data)[-1:])
+    if update is None:
+        return 0
+    with open(path, 'ab') as f:
+        f.write(update)
+    return len(update)
+
+
+def _sign_batch(holder, batch, report, ltv=None):
+    # Một lần gọi sign_digests cho cả lô, rồi ghi CMS vào từng file tạm và đổi tên thành file đích;
+    # ltv: LtvCollector, có thì nhúng /DSS vào từng file sau khi ghi CMS (như ky.Signer)
+    from xacthuc_hangloat import append_record
+    t0 = time.perf_counter()
+    prepared = [PreparedDocument.from_dict(r) for r in batch]
+    try:
+        signatures = holder.sign_digests([p.digest for p in prepared])
+        error = None
+    except Exception as e:
+        signatures = [None] * len(batch)
+        error = f'{type(e).__name__}: {e}'
+    sign_seconds = time.perf_counter() - t0
+    failures = 0
+    for record, doc, cms_der in zip(batch, prepared, signatures):
+        try:
+            if cms_der is None:
+                raise RuntimeError(error)
+            inject_file(doc, cms_der)
+            if ltv is not None:
+                t_ltv = time.perf_counter()
+                try:
+                    if not append_ltv(doc.path, ltv):
+                        print(f'  ⚠ {record["input"]}: không có dữ liệu thu hồi để nhúng vào /DSS')
+                except (PdfSyntaxError, ValueError, KeyError, IndexError, TypeError) as e:
+                    print(f'  ⚠ {record["input"]}: không nhúng được dữ liệu LTV (/DSS): {e}')
+                record['timings']['ltv'] = round(time.perf_counter() - t_ltv, 6)
+            os.replace(doc.path, record['output'])
+            record['timings']['sign_batch'] = round(sign_seconds, 6)
+            record['batch_size'] = len(batch)
+            print(f'  ✓ {record["output"]} ({record["seconds"] * 1000:.1f} ms chuẩn bị)')
+        except Exception as e:
+            failures += 1
+            record['ok'] = False
+            record['error'] = f'{type(e).__name__}: {e}' if cms_der is not None else error
+            print(f'  ✗ {record["input"]}: {record["error"]}')
+            try:
+                os.remove(doc.path)
+            except OSError:
+                pass
+        for key in ('path', 'byte_range', 'contents_span', 'digest'):
+            record.pop(key, None)
+        append_record(record, report)
+    return failures
+
+
+def run_deferred_sign(spec, out_dir=None, workers=None, batch_size=DEFAULT_BATCH, pfx_path=None, password=None,
+                      img_path=None, tsa_servers=None, report=None, pss=False, digest_algorithm=None, ltv=None):
+    # Tài liệu luôn được chuẩn bị bằng incremental update; ltv: tham số của du_lieu_ltv.LtvCollector
+    # (giữ ở tiến trình ký, OCSP/CRL đã lấy được dùng lại cho mọi tài liệu)
+    import ky
+    from ky_hangloat import collect_jobs, SIGN_REPORT
+    from xacthuc_hangloat import append_record
+    report = report or SIGN_REPORT
+    try:
+        jobs = collect_jobs(spec, out_dir)
+    except (OSError, ValueError, KeyError) as e:
+        print(f'✗ Không đọc được danh sách tài liệu: {e}')
+        return 1
+    if not jobs:
+        print(f'✗ Không có file PDF nào trong: {spec}')
+        return 1
+    servers = ky.TSA_SERVERS if tsa_servers is None else tsa_servers
+    tsa = None
+    if servers:
+        from dau_thoi_gian import TsaClient
+        tsa = TsaClient(servers)
+    try:
+        holder = KeyHolder.from_pfx(pfx_path, password, tsa=tsa, pss=pss, digest_algorithm=digest_algorithm)
+    except ValueError as e:
+        print(f'✗ {e}')
+        return 1
+    collector = None
+    if ltv is not None:
+        from du_lieu_ltv import LtvCollector
+        collector = LtvCollector(echo=lambda *a, **k: None, **ltv)
+    workers = workers or os.cpu_count() or 1
+    print(f'Ký hai pha {len(jobs)} file: {workers} worker chuẩn bị, ký theo lô {batch_size} digest...')
+
+    failures = 0
+    batch = []
+    t0 = time.perf_counter()
+    chunksize = max(1, len(jobs) // (workers * 8))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_preparer,
+                             initargs=(img_path or ky.TEN_ANH_KY, holder.digest_algorithm)) as pool:
+        # Lô được ký ngay khi đủ, trong lúc worker tiếp tục chuẩn bị các tài liệu sau
+        for record in pool.map(prepare_one, jobs, chunksize=chunksize):
+            if not record['ok']:
+                failures += 1
+                print(f'  ✗ {record["input"]}: {record["error"]}')
+                append_record(record, report)
+                continue
+            batch.append(record)
+            if len(batch) >= batch_size:
+                failures += _sign_batch(holder, batch, report, collector)
+                batch = []
+        if batch:
+            failures += _sign_batch(holder, batch, report, collector)
+    elapsed = time.perf_counter() - t0
+    if tsa is not None:
+        tsa.close()
+    if collector is not None:
+        collector.close()
+
+    summary = {
+        'summary': True,
+        'deferred': True,
+        'time': datetime.datetime.now().isoformat(timespec='seconds'),
+        'input': spec,
+        'files': len(jobs),
+        'workers': workers,
+        'batch_size': batch_size,
+        'batches': holder.stats['batches'],
+        'seconds': round(elapsed, 3),
+        'docs_per_sec': round(len(jobs) / elapsed, 2) if elapsed > 0 else None,
+        'signed': len(jobs) - failures,
+        'failures': failures,
+        'timestamps': holder.stats['timestamps'],
+    }
+    append_record(summary, report)
+
+    print('=' * 60)
+    print(f'Tổng: {len(jobs)} file trong {elapsed:.2f}s ({summary["docs_per_sec"]} file/s), '
+          f'{summary["batches"]} lần gọi khóa ký')
+    print(f'  ✓ đã ký: {summary["signed"]}  ✗ lỗi: {failures}')
+    print(f'Đã ghi báo cáo vào {report}')
+    return 0 if failures == 0 else 1
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if '--batch' in args:
+        options = {}
+        for flag, key, conv in (('--batch', 'spec', str), ('--out', 'out_dir', str), ('--workers', 'workers', int),
+                                ('--batch-size', 'batch_size', int)):
+            if flag in args:
+                i = args.index(flag)
+                options[key] = conv(args[i + 1])
+                del args[i:i + 2]
+        sys.exit(run_deferred_sign(**options))
+    # Một file: chuẩn bị, ký (lô 1 digest) và ghi CMS trong cùng tiến trình
+    src = args[0] if args else 'goc.pdf'
+    dst = args[1] if len(args) > 1 else 'goc_da_ky.pdf'
+    holder = KeyHolder.from_pfx()
+    with open(src, 'rb') as f:
+        prepared, _ = Preparer(digest_algorithm=holder.digest_algorithm).prepare(f)
+    with open(dst, 'wb') as f:
+        f.write(inject(prepared, holder.sign_digests([prepared.digest])[0]))
+    print(f'Đã ký hai pha: {dst} (ByteRange {list(prepared.byte_range)})')
@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import datetime
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from xacthuc_hangloat import append_record, collect_inputs
+
+# Ký hàng loạt trên nhiều tiến trình. Mỗi worker giải mã cert.pfx và nạp font/ảnh chữ ký một lần (ky.Signer),
+# file kết quả được ghi vào file tạm rồi os.replace nên không bao giờ có file ký dở.
+SIGN_REPORT = 'bao_cao_ky_hang_loat.jsonl'
+OUTPUT_SUFFIX = '_da_ky.pdf'
+# Các khóa được lấy từ manifest cho từng tài liệu (truyền thẳng vào Signer.sign_to_file)
+JOB_OPTIONS = ('page', 'reason', 'location', 'contact', 'name')
+
+# Trạng thái riêng của từng worker (khởi tạo một lần trong _init_worker)
+_worker_signer = None
+_worker_error = None
+_worker_incremental = True
+
+
+def load_manifest(path):
+    # Manifest JSONL, mỗi dòng: {"input": "a.pdf", "output": "a_ky.pdf", "page": 0, "reason": ..., "location": ...}
+    # Đường dẫn tương đối được tính từ thư mục chứa manifest; "output" có thể bỏ trống.
+    base = os.path.dirname(os.path.abspath(path))
+    jobs = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f'{path}:{lineno}: dòng manifest không hợp lệ: {e}')
+            job = {'input': os.path.join(base, entry['input'])}
+            if entry.get('output'):
+                job['output'] = os.path.join(base, entry['output'])
+            job.update({k: entry[k] for k in JOB_OPTIONS if entry.get(k) is not None})
+            jobs.append(job)
+    return jobs
+
+
+def collect_jobs(spec, out_dir=None):
+    # spec: manifest *.jsonl, thư mục (quét đệ quy *.pdf) hoặc @danh_sach.txt
+    if spec.lower().endswith('.jsonl') and os.path.isfile(spec):
+        jobs = load_manifest(spec)
+    else:
+        jobs = [{'input': p} for p in collect_inputs(spec)]
+    root = spec if os.path.isdir(spec) else None
+    for job in jobs:
+        if 'output' in job:
+            continue
+        stem = os.path.splitext(job['input'])[0] + OUTPUT_SUFFIX
+        if out_dir:
+            rel = os.path.relpath(stem, root) if root else os.path.basename(stem)
+            stem = os.path.join(out_dir, rel)
+        job['output'] = stem
+    return jobs
+
+
+def _init_worker(pfx_path, password, img_path, tsa_servers, incremental, ltv=None, pss=False, digest_algorithm=None):
+    global _worker_signer, _worker_error, _worker_incremental
+    import ky
+    _worker_incremental = incremental
+    try:
+        # ltv: tham số của du_lieu_ltv.LtvCollector; mỗi worker giữ OCSP/CRL đã lấy cho mọi tài liệu của nó
+        collector = None
+        if ltv is not None:
+            from du_lieu_ltv import LtvCollector
+            collector = LtvCollector(echo=lambda *a, **k: None, **ltv)
+        _worker_signer = ky.Signer(pfx_path, password, img_path, tsa_servers=tsa_servers, echo=lambda *a, **k: None,
+                                   ltv=collector, pss=pss, digest_algorithm=digest_algorithm)
+    except Exception as e:
+        # Không làm hỏng pool: mọi tài liệu của worker này được báo lỗi
+        _worker_error = f'Không nạp được khóa ký: {e}'
+
+
+def sign_one(job):
+    t0 = time.perf_counter()
+    record = {'input': job['input'], 'output': job['output'], 'pid': os.getpid()}
+    tmp = f'{job["output"]}.{os.getpid()}.tmp'
+    try:
+        if _worker_signer is None:
+            raise RuntimeError(_worker_error or 'Worker chưa được khởi tạo')
+        with open(job['input'], 'rb') as f:
+            data = f.read()
+        os.makedirs(os.path.dirname(os.path.abspath(job['output'])), exist_ok=True)
+        options = {k: job[k] for k in JOB_OPTIONS if k in job}
+        record['bytes'], record['tsa'], timings = _worker_signer.sign_to_file(
+            data, tmp, incremental=_worker_incremental, **options)
+        os.replace(tmp, job['output'])
+        record['ok'] = True
+        record['timings'] = {k: round(v, 6) for k, v in timings.items()}
+    except Exception as e:
+        record['ok'] = False
+        record['error'] = f'{type(e).__name__}: {e}'
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+    record['seconds'] = round(time.perf_counter() - t0, 6)
+    return record
+
+
+def run_bulk_sign(spec, out_dir=None, workers=None, pfx_path=None, password=None, img_path=None,
+                  tsa_servers=None, incremental=True, report=SIGN_REPORT, ltv=None, pss=False, digest_algorithm=None):
+    import ky
+    try:
+        jobs = collect_jobs(spec, out_dir)
+    except (OSError, ValueError, KeyError) as e:
+        print(f'✗ Không đọc được danh sách tài liệu: {e}')
+        return 1
+    if not jobs:
+        print(f'✗ Không có file PDF nào trong: {spec}')
+        return 1
+    workers = workers or os.cpu_count() or 1
+    initargs = (pfx_path or ky.TEN_PFX, password or ky.MAT_KHAU_PFX, img_path or ky.TEN_ANH_KY,
+                ky.TSA_SERVERS if tsa_servers is None else tsa_servers, incremental, ltv, pss, digest_algorithm)
+    print(f'Ký hàng loạt {len(jobs)} file với {workers} worker...')
+
+    failures = 0
+    tsa_sources = Counter()
+    t0 = time.perf_counter()
+    chunksize = max(1, len(jobs) // (workers * 8))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as pool:
+        for record in pool.map(sign_one, jobs, chunksize=chunksize):
+            append_record(record, report)
+            if record['ok']:
+                tsa_sources[record['tsa'] or 'không có timestamp'] += 1
+                print(f'  ✓ {record["output"]} ({record["seconds"] * 1000:.1f} ms)')
+            else:
+                failures += 1
+                print(f'  ✗ {record["input"]}: {record["error"]}')
+    elapsed = time.perf_counter() - t0
+
+    summary = {
+        'summary': True,
+        'time': datetime.datetime.now().isoformat(timespec='seconds'),
+        'input': spec,
+        'files': len(jobs),
+        'workers': workers,
+        'seconds': round(elapsed, 3),
+        'docs_per_sec': round(len(jobs) / elapsed, 2) if elapsed > 0 else None,
+        'signed': len(jobs) - failures,
+        'failures': failures,
+        'tsa_sources': dict(tsa_sources),
+    }
+    append_record(summary, report)
+
+    print('=' * 60)
+    print(f'Tổng: {len(jobs)} file trong {elapsed:.2f}s ({summary["docs_per_sec"]} file/s)')
+    print(f'  ✓ đã ký: {summary["signed"]}  ✗ lỗi: {failures}')
+    for source, n in tsa_sources.most_common():
+        print(f'  Timestamp: {source} ({n} file)')
+    print(f'Đã ghi báo cáo vào {report}')
+    return 0 if failures == 0 else 1
@@ -0,0 +1,379 @@
+import sys
+import json
+import zlib
+
+from doc_pdf import (RevisionIndex, Ref, PdfSyntaxError, PdfBuffer, find_startxref, find_signatures,
+                     list_signature_fields, parse_contents_gap)
+
+# Phân tích các incremental update sau một chữ ký (bước 8 của xacthuc.py).
+# Đi theo chuỗi startxref -> /Prev (doc_pdf.RevisionIndex), với mỗi revision thêm vào sau vùng được ký:
+# liệt kê object mới / bị sửa / bị xoá, so với bản trước đó rồi phân loại theo các thay đổi được phép
+# sau khi ký (ISO 32000-1 12.8.2.2 DocMDP, ETSI EN 319 142-1): DSS, chữ ký / timestamp mới, điền form.
+# Chỉ đọc các object có trong revision sau ký (và bản cũ của chúng) nên không phụ thuộc kích thước file.
+
+# Loại thay đổi -> được phép hay không (mặc định, khi không có DocMDP)
+ALLOWED_CATALOG_KEYS = {'/DSS', '/AcroForm', '/Extensions'}
+ALLOWED_ACROFORM_KEYS = {'/Fields', '/SigFlags', '/NeedAppearances', '/DR', '/DA'}
+# Khóa được đổi khi ký vào một trường chữ ký có sẵn / khi điền form
+SIG_FIELD_FILL_KEYS = {'/V', '/AP', '/AS', '/F', '/P', '/Lock'}
+FORM_FILL_KEYS = {'/V', '/AS', '/AP', '/I'}
+# Object được tham chiếu từ một thay đổi hợp lệ thì thuộc cùng loại (vd. stream /AP của widget)
+REACHED_KIND = {'dss': 'dss', 'signature': 'signature', 'timestamp': 'timestamp'}
+# DocMDP P=1: chỉ cho phép thêm DSS và timestamp tài liệu (PAdES-LTA)
+NO_CHANGE_KINDS = {'xref', 'objstm', 'dss', 'timestamp', 'unused'}
+# Trang chỉ được đổi các khóa này khi ghép hình chữ ký hiển thị (xem _stamp_overlay)
+STAMP_PAGE_KEYS = {'/Contents', '/Resources'}
+_PAIRED_WITH_TIMESTAMP = {'signature_field', 'acroform', 'catalog', 'annots', 'appearance'}
+TAIL_SLACK = b' \t\r\n\x00\x0c'
+
+
+def _refs(value, out=None):
+    # Mọi Ref nằm trong value (dict / list lồng nhau)
+    out = [] if out is None else out
+    if isinstance(value, Ref):
+        out.append(value)
+    elif isinstance(value, dict):
+        for v in value.values():
+            _refs(v, out)
+    elif isinstance(value, list):
+        for v in value:
+            _refs(v, out)
+    return out
+
+
+def _changed_keys(old, new):
+    old = old if isinstance(old, dict) else {}
+    return {k for k in set(old) | set(new) if old.get(k) != new.get(k)}
+
+
+def _field_type(index, upto, value):
+    # /FT có thể kế thừa từ trường cha (/Parent)
+    depth = 0
+    while isinstance(value, dict) and depth < 16:
+        if '/FT' in value:
+            return value['/FT']
+        value = index.resolve(value.get('/Parent'), upto)
+        depth += 1
+    return None
+
+
+def _is_widget_or_field(index, upto, ref):
+    value = index.resolve(ref, upto)
+    return isinstance(value, dict) and (value.get('/Subtype') == '/Widget' or
+                                         _field_type(index, upto, value) is not None)
+
+
+def docmdp_permission(index, upto, br):
+    # Mức DocMDP (1-3) nếu chữ ký `br` là chữ ký chứng nhận (/Perms /DocMDP của Catalog trỏ tới nó)
+    try:
+        root = index.resolve(index.revisions[upto - 1].trailer.get('/Root'), upto)
+        perms = index.resolve(root.get('/Perms'), upto) if isinstance(root, dict) else None
+        sig = index.resolve(perms.get('/DocMDP'), upto) if isinstance(perms, dict) else None
+        if not isinstance(sig, dict) or tuple(index.resolve(sig.get('/ByteRange'), upto) or ()) != tuple(br):
+            return None
+        for ref in index.resolve(sig.get('/Reference'), upto) or []:
+            ref = index.resolve(ref, upto)
+            if isinstance(ref, dict) and ref.get('/TransformMethod') == '/DocMDP':
+                params = index.resolve(ref.get('/TransformParams'), upto) or {}
+                return int(index.resolve(params.get('/P', 2), upto))
+    except (PdfSyntaxError, ValueError, KeyError, TypeError, AttributeError, zlib.error):
+        pass
+    return None
+
+
+def _is_new(index, n, ref):
+    entry = index.lookup(ref.num, n - 1) if isinstance(ref, Ref) else ('n',)
+    return entry is None or entry[0] == 'f'
+
+
+def _inherited(index, upto, page, key):
+    depth = 0
+    while isinstance(page, dict) and depth < 16:
+        if key in page:
+            return index.resolve(page[key], upto)
+        page = index.resolve(page.get('/Parent'), upto)
+        depth += 1
+    return None
+
+
+def _ends_at(data, rev, end):
+    # Vị trí end là %%EOF của revision (cho phép dấu xuống dòng ngay sau %%EOF)
+    eof = rev.end
+    return eof is not None and eof <= end <= eof + 2 and not bytes(data[eof:end]).strip(TAIL_SLACK)
+
+
+def _signed_by_next_signature(index, n):
+    # Revision n hoặc revision ngay sau nó kết thúc bằng một chữ ký thật: giá trị /V của trường /Sig trong
+    # AcroForm (như doc_pdf.find_signatures), ByteRange kết thúc đúng ở %%EOF của revision đó và chữ ký CMS
+    # hợp lệ. Dict có /ByteRange /Contents không được trường nào tham chiếu hay chữ ký giả không tính.
+    from xacthuc import cms_signature_valid
+    data = index.data
+    revisions = index.revisions[n - 1:n + 1]
+    for field in list_signature_fields(data):
+        br = field.byte_range
+        a0, l0, a1, l1 = br
+        if a0 != 0 or a0 + l0 > a1 or a1 + l1 > len(data) or \
+                field.contents_span not in (None, (a0 + l0, a1)) or \
+                not any(_ends_at(data, rev, a1 + l1) for rev in revisions):
+            continue
+        contents = parse_contents_gap(data, br)
+        if contents and cms_signature_valid(data, br, contents):
+            return True
+    return False
+
+
+def _stamp_overlay(index, n, old, value):
+    # Hình chữ ký hiển thị do ky.py ghép bằng incremental update (cap_nhat_tang_dan.overlay_update):
+    # /Contents = [q] + nội dung cũ giữ nguyên + [Q q /Xn Do Q ...], /Resources chỉ thêm /XObject mới,
+    # và có chữ ký thật kết thúc ở revision này hoặc revision sau. Ngoài việc vẽ thêm XObject mới
+    # (tương đương /AP của widget chữ ký) trang không đổi gì. Trả về các Ref đi theo, None nếu không khớp.
+    try:
+        old_contents = index.resolve(old.get('/Contents'), n - 1)
+        if not isinstance(old_contents, list):
+            old_contents = [old['/Contents']] if old.get('/Contents') is not None else []
+        contents = index.resolve(value.get('/Contents'), n)
+        if not isinstance(contents, list) or contents[1:-1] != old_contents or len(contents) < 2 or \
+                not all(_is_new(index, n, r) for r in (contents[0], contents[-1])):
+            return None
+        old_res = _inherited(index, n - 1, old, '/Resources') or {}
+        res = _inherited(index, n, value, '/Resources') or {}
+        if _changed_keys(old_res, res) - {'/XObject'}:
+            return None
+        old_xobjects = index.resolve(old_res.get('/XObject'), n - 1) or {}
+        xobjects = index.resolve(res.get('/XObject'), n) or {}
+        added = [k for k in xobjects if k not in old_xobjects]
+        if any(xobjects.get(k) != v for k, v in old_xobjects.items()) or not added or \
+                not all(_is_new(index, n, xobjects[k]) for k in added):
+            return None
+        head = index.read_stream(contents[0].num, n)
+        tail = index.read_stream(contents[-1].num, n)
+        if head is None or tail is None or head.split() != [b'q']:
+            return None
+        drawn = [b'Q']
+        for k in added:
+            drawn += [b'q', k.encode('latin-1'), b'Do', b'Q']
+        if tail.split() != drawn or not _signed_by_next_signature(index, n):
+            return None
+    except (PdfSyntaxError, ValueError, KeyError, TypeError, AttributeError, zlib.error):
+        return None
+    return [contents[0], contents[-1]] + [xobjects[k] for k in added]
+
+
+def _classify(index, n, num, value, change, permission):
+    # (loại, được phép, chi tiết, các Ref đi theo) cho object có kiểu; loại None = xét theo tham chiếu
+    if isinstance(value, list):
+        if change != 'changed':
+            return None, None, None, []
+        old = index.get(num, n - 1)
+        # Mảng /Annots hoặc /Fields chỉ được nối thêm widget / trường
+        if isinstance(old, list) and value[:len(old)] == old and value[len(old):] and \
+                all(isinstance(r, Ref) and _is_widget_or_field(index, n, r) for r in value[len(old):]):
+            return 'annots', True, None, []
+        return None, None, None, []
+    if not isinstance(value, dict):
+        return None, None, None, []
+    t = value.get('/Type')
+    subtype = value.get('/Subtype')
+    if t == '/XRef':
+        return 'xref', True, None, []
+    if t == '/ObjStm':
+        return 'objstm', True, None, []
+    if t in ('/Sig', '/DocTimeStamp') or ('/ByteRange' in value and '/Contents' in value):
+        kind = 'timestamp' if t == '/DocTimeStamp' or value.get('/SubFilter') == '/ETSI.RFC3161' else 'signature'
+        if change == 'changed':
+            return kind, False, 'sửa chữ ký đã có', []
+        return kind, True, None, _refs(value.get('/Reference'))
+    if t == '/DSS' or (t is None and value and set(value) <= {'/VRI', '/Certs', '/CRLs', '/OCSPs'}):
+        return 'dss', True, None, _refs(value)
+    if t == '/Catalog':
+        old = index.get(num, n - 1) if change == 'changed' else \
+            index.resolve(index.revisions[n - 2].trailer.get('/Root'), n - 1)
+        keys = _changed_keys(old, value) - ALLOWED_CATALOG_KEYS
+        if keys:
+            return 'catalog', False, f'đổi {", ".join(sorted(keys))}', []
+        return 'catalog', True, None, []
+    if t is None and '/Fields' in value:
+        old = index.get(num, n - 1) if change == 'changed' else {}
+        keys = _changed_keys(old, value) - ALLOWED_ACROFORM_KEYS
+        old_fields = index.resolve(old.get('/Fields'), n - 1) if isinstance(old, dict) else None
+        new_fields = index.resolve(value.get('/Fields'), n)
+        if keys:
+            return 'acroform', False, f'đổi {", ".join(sorted(keys))}', []
+        if isinstance(old_fields, list) and isinstance(new_fields, list) and \
+                not set(old_fields) <= set(new_fields):
+            return 'acroform', False, 'bỏ trường form đã có', []
+        return 'acroform', True, None, _refs(value.get('/DR'))
+    if t == '/Page':
+        if change == 'new':
+            return 'page', False, 'thêm trang', []
+        old = index.get(num, n - 1)
+        keys = _changed_keys(old, value)
+        if keys and keys <= STAMP_PAGE_KEYS:
+            follow = _stamp_overlay(index, n, old, value)
+            if follow is not None:
+                return 'signature_stamp', True, None, follow
+        if keys - {'/Annots'}:
+            return 'page', False, f'đổi {", ".join(sorted(keys - {"/Annots"}))}', []
+        old_annots = index.resolve(old.get('/Annots'), n - 1) or []
+        new_annots = index.resolve(value.get('/Annots'), n) or []
+        added = [r for r in new_annots if r not in old_annots]
+        if not set(old_annots) <= set(new_annots) or \
+                not all(isinstance(r, Ref) and _is_widget_or_field(index, n, r) for r in added):
+            return 'page', False, 'đổi /Annots (không chỉ thêm widget)', []
+        return 'annots', True, None, []
+    if t == '/Pages':
+        return 'page', False, 'sửa cây trang', []
+    ft = _field_type(index, n, value)
+    if ft is not None or subtype == '/Widget':
+        return _classify_field(index, n, num, value, change, ft, permission)
+    if t == '/Annot' or subtype is not None and '/Rect' in value:
+        ok = permission == 3
+        return 'annotation', ok, None if ok else ('thêm chú thích' if change == 'new' else 'sửa chú thích'), \
+            _refs(value.get('/AP')) if ok else []
+    return None, None, None, []
+
+
+def _classify_field(index, n, num, value, change, ft, permission):
+    follow = _refs(value.get('/AP')) + _refs(value.get('/V'))
+    old = index.get(num, n - 1) if change == 'changed' else None
+    if ft == '/Sig':
+        if change == 'new':
+            return 'signature_field', True, None, follow
+        keys = _changed_keys(old, value) - SIG_FIELD_FILL_KEYS
+        if keys:
+            return 'signature_field', False, f'đổi {", ".join(sorted(keys))}', []
+        if isinstance(old, dict) and old.get('/V') is not None and old.get('/V') != value.get('/V'):
+            return 'signature_field', False, 'thay chữ ký đã có', []
+        return 'signature_field', True, None, follow
+    if change == 'new':
+        return 'form_fill', False, 'thêm trường form mới', []
+    keys = _changed_keys(old, value) - FORM_FILL_KEYS
+    if keys:
+        return 'form_fill', False, f'đổi {", ".join(sorted(keys))}', []
+    return 'form_fill', True, None, follow
+
+
+def analyze_revision(index, rev, permission=None):
+    # Diff của một revision so với revision ngay trước: [{num, change, kind, allowed, detail}]
+    n = rev.number
+    objects = {}
+    values = {}
+    changes = {}
+    for num, entry in sorted(rev.entries().items()):
+        if num == 0:
+            continue
+        old_entry = index.lookup(num, n - 1)
+        existed = old_entry is not None and old_entry[0] != 'f'
+        if entry[0] == 'f':
+            if existed:
+                objects[num] = _object(num, 'freed', 'object', False, 'xoá object đã có')
+            continue
+        changes[num] = 'changed' if existed else 'new'
+        try:
+            values[num] = index.get(num, n)
+        except (PdfSyntaxError, ValueError, KeyError, IndexError, TypeError, zlib.error) as e:
+            objects[num] = _object(num, changes[num], 'object', False, f'không đọc được: {e}')
+
+    pending = []
+    for num, value in values.items():
+        kind, ok, detail, follow = _classify(index, n, num, value, changes[num], permission)
+        if kind is None:
+            continue
+        objects[num] = _object(num, changes[num], kind, ok, detail)
+        if ok:
+            pending.extend((ref.num, REACHED_KIND.get(kind, 'appearance')) for ref in follow)
+    # Object không có kiểu (stream /AP, font, dữ liệu DSS...) thuộc về thay đổi hợp lệ tham chiếu tới nó
+    while pending:
+        num, kind = pending.pop()
+        if num not in values or num in objects:
+            continue
+        objects[num] = _object(num, changes[num], kind, True, None)
+        pending.extend((ref.num, kind) for ref in _refs(values[num]))
+    # Revision có sửa trang: object mới không được gì trong revision (hay trailer) tham chiếu không được bỏ qua,
+    # kể cả dict có /ByteRange /Contents (có thể là chữ ký giả đặt kèm để hợp thức hóa nội dung vẽ thêm)
+    page_edit = any(o['kind'] in ('page', 'signature_stamp') for o in objects.values())
+    if page_edit:
+        referenced = {ref.num for value in list(values.values()) + [rev.trailer] for ref in _refs(value)}
+        for num, o in objects.items():
+            if o['change'] == 'new' and num not in referenced and o['kind'] not in ('xref', 'objstm'):
+                o['allowed'] = False
+                o['detail'] = 'không được tham chiếu, cùng revision sửa trang'
+    for num in values:
+        if num not in objects:
+            if changes[num] == 'new' and page_edit and num not in referenced:
+                objects[num] = _object(num, 'new', 'unused', False, 'không được tham chiếu, cùng revision sửa trang')
+            elif changes[num] == 'new':
+                # Object mới không được gì tham chiếu: không ảnh hưởng tới hiển thị
+                objects[num] = _object(num, 'new', 'unused', True, 'không được tham chiếu')
+            else:
+                objects[num] = _object(num, 'changed', 'object', False, 'sửa object đã có')
+
+    if permission == 1:
+        has_timestamp = any(o['kind'] == 'timestamp' for o in objects.values())
+        for o in objects.values():
+            allowed_kinds = NO_CHANGE_KINDS | (_PAIRED_WITH_TIMESTAMP if has_timestamp else set())
+            if o['allowed'] and o['kind'] not in allowed_kinds:
+                o['allowed'] = False
+                o['detail'] = 'DocMDP P=1 không cho phép thay đổi'
+    result = [objects[k] for k in sorted(objects)]
+    return {
+        'revision': n,
+        'offset': rev.offset,
+        'objects': result,
+        'new': sum(o['change'] == 'new' for o in result),
+        'changed': sum(o['change'] == 'changed' for o in result),
+        'freed': sum(o['change'] == 'freed' for o in result),
+        'kinds': sorted({o['kind'] for o in result} - {'xref', 'objstm'}),
+        'allowed': all(o['allowed'] for o in result),
+    }
+
+
+def _object(num, change, kind, allowed, detail):
+    return {'num': num, 'change': change, 'kind': kind, 'allowed': allowed, 'detail': detail}
+
+
+def analyze_revisions(data, br, index=None):
+    # Các revision thêm vào sau vùng được chữ ký `br` bao phủ, cùng các vấn đề của chuỗi xref
+    signed_end = br[2] + br[3]
+    problems = []
+    index = index or RevisionIndex(data)
+    signed = [r for r in index.revisions if r.offset < signed_end]
+    after = [r for r in index.revisions if r.offset >= signed_end]
+    # Bản đã ký phải nằm trong chuỗi /Prev, nếu không reader sẽ bỏ qua chính các object đã được ký
+    expected = find_startxref(data, signed_end)
+    if not signed or signed[-1].offset != expected:
+        problems.append('chuỗi /Prev không đi qua bản đã ký')
+    permission = docmdp_permission(index, signed[-1].number, br) if signed else None
+    revisions = [analyze_revision(index, rev, permission) for rev in after]
+    # Dữ liệu nằm ngoài mọi revision (sau %%EOF cuối) không được reader dùng nhưng là dấu hiệu chỉnh tay
+    end = after[-1].end if after else signed_end
+    if end is not None and end < len(data):
+        stray = bytes(data[end:]).strip(TAIL_SLACK)
+        if stray:
+            problems.append(f'{len(stray)} byte không thuộc revision nào sau %%EOF cuối')
+    return {
+        'signed_revision': signed[-1].number if signed else None,
+        'revisions': revisions,
+        'docmdp': permission,
+        'problems': problems,
+        'allowed': not problems and all(r['allowed'] for r in revisions),
+    }
+
+
+def describe_revision(r):
+    # Một dòng tóm tắt cho nhật ký, vd. "Revision 3 (xref @ 272169): mới 4, sửa 2 - signature, signature_field"
+    parts = [f'{label} {r[key]}' for key, label in (('new', 'mới'), ('changed', 'sửa'), ('freed', 'xoá')) if r[key]]
+    kinds = ', '.join(r['kinds']) or 'không có object'
+    return f'Revision {r["revision"]} (xref @ {r["offset"]}): {", ".join(parts) or "0 object"} - {kinds}'
+
+
+if __name__ == '__main__':
+    # python phan_tich_phien_ban.py file.pdf: diff từng revision sau mỗi chữ ký (JSON)
+    path = sys.argv[1] if len(sys.argv) > 1 else 'goc_da_ky.pdf'
+    with PdfBuffer(path) as data:
+        out = []
+        for name, br, _ in find_signatures(data):
+            report = analyze_revisions(data, br)
+            report['signature'] = name
+            out.append(report)
+    print(json.dumps(out, ensure_ascii=False, indent=2))
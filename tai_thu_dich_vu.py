@@ -0,0 +1,108 @@
+import sys
+import json
+import time
+import asyncio
+
+# Đo tải dịch vụ xác thực (dich_vu_xac_thuc.py) hoặc dịch vụ ký (dich_vu_ky.py, --target /sign?...):
+# nhiều kết nối keep-alive gửi cùng một file PDF. Trả lời 503 thì chờ theo Retry-After như client thật.
+# python tai_thu_dich_vu.py [file.pdf] [--host H] [--port P] [--concurrency C] [--requests N] [--duration S]
+#                           [--target /verify]
+
+DEFAULT_PDF = 'goc_da_ky.pdf'
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(p / 100 * (len(values) - 1)))))
+    return values[k]
+
+
+async def _read_response(reader):
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split(' ', 2)[1])
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            k, v = line.split(':', 1)
+            headers[k.strip().lower()] = v.strip()
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+    return status, headers, body
+
+
+async def _client(host, port, payload, deadline, budget, latencies, statuses, target='/verify'):
+    # Một kết nối keep-alive; mở lại nếu server đóng kết nối
+    reader = writer = None
+    request = (f'POST {target} HTTP/1.1\r\nHost: {host}:{port}\r\nContent-Type: application/pdf\r\n'
+               f'Content-Length: {len(payload)}\r\n\r\n').encode('latin-1') + payload
+    while time.perf_counter() < deadline and budget[0] > 0:
+        budget[0] -= 1
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            t0 = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            status, headers, _ = await _read_response(reader)
+            latencies.append(time.perf_counter() - t0)
+            statuses[status] = statuses.get(status, 0) + 1
+            if headers.get('connection', '').lower() == 'close':
+                writer.close()
+                writer = None
+            if status == 503:
+                await asyncio.sleep(min(float(headers.get('retry-after', 1)), max(0.0, deadline - time.perf_counter())))
+        except (OSError, asyncio.IncompleteReadError) as e:
+            statuses[type(e).__name__] = statuses.get(type(e).__name__, 0) + 1
+            if writer is not None:
+                writer.close()
+            writer = None
+            await asyncio.sleep(0.05)
+    if writer is not None:
+        writer.close()
+
+
+async def run_load(path, host='127.0.0.1', port=8080, concurrency=8, requests=200, duration=30.0, target='/verify'):
+    with open(path, 'rb') as f:
+        payload = f.read()
+    latencies = []
+    statuses = {}
+    budget = [requests]
+    t0 = time.perf_counter()
+    await asyncio.gather(*[_client(host, port, payload, t0 + duration, budget, latencies, statuses, target)
+                           for _ in range(concurrency)])
+    elapsed = time.perf_counter() - t0
+    ok = statuses.get(200, 0)
+    return {
+        'file': path,
+        'bytes': len(payload),
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'ok': ok,
+        'statuses': {str(k): v for k, v in statuses.items()},
+        'seconds': round(elapsed, 3),
+        'rps': round(ok / elapsed, 2) if elapsed > 0 else None,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+        'max_ms': round(max(latencies) * 1000, 2) if latencies else None,
+    }
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    kwargs = {}
+    for flag, key, conv in (('--host', 'host', str), ('--port', 'port', int),
+                            ('--concurrency', 'concurrency', int), ('--requests', 'requests', int),
+                            ('--duration', 'duration', float), ('--target', 'target', str)):
+        if flag in args:
+            i = args.index(flag)
+            kwargs[key] = conv(args[i + 1])
+            del args[i:i + 2]
+    path = args[0] if args else DEFAULT_PDF
+    result = asyncio.run(run_load(path, **kwargs))
+    print(f'{result["ok"]}/{result["requests"]} request thành công trong {result["seconds"]}s: '
+          f'{result["rps"]} req/s, p50 {result["p50_ms"]} ms, p99 {result["p99_ms"]} ms')
+    print(json.dumps(result, ensure_ascii=False))
+    sys.exit(0 if result['ok'] == result['requests'] and result['ok'] > 0 else 1)
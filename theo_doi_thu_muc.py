@@ -0,0 +1,421 @@
+import os
+import sys
+import time
+import json
+import errno
+import select
+import shutil
+import signal
+import sqlite3
+import struct
+import datetime
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from do_luong import REGISTRY
+from xacthuc_hangloat import _init_worker, verify_one, append_record
+
+try:
+    import ctypes
+    import ctypes.util
+except ImportError:  # không có ctypes: chỉ dùng quét định kỳ
+    ctypes = None
+
+# Tiến trình chạy nền theo dõi thư mục: PDF mới / thay đổi được xác thực bằng pool worker
+# (xacthuc_hangloat._init_worker: module và trust context nạp một lần cho mỗi worker),
+# sau đó gắn nhãn (file .ket_qua.json bên cạnh) hoặc chuyển vào --move-to/<kết quả>/.
+# Linux dùng inotify (qua ctypes), nơi khác hoặc thư mục mạng (--poll) thì quét định kỳ.
+# Trạng thái (đường dẫn, kích thước, mtime) lưu trong SQLite nên khởi động lại không xác thực lại file cũ.
+#   python theo_doi_thu_muc.py THU_MUC [THU_MUC ...] [--workers N] [--move-to DIR] [--state FILE]
+#                              [--settle S] [--poll] [--poll-interval S] [--max-queue N] [--prometheus FILE]
+#                              [--trust-local-pfx] [--chain-cache FILE] [--revocation-dir DIR]
+#                              [--revocation-mode MODE] [--result-cache FILE.sqlite]
+#                              [--trust-store THU_MUC|BUNDLE] [--trust-snapshot FILE]
+
+WATCH_REPORT = 'bao_cao_theo_doi.jsonl'
+STATE_FILE = 'trang_thai_theo_doi.sqlite'
+TAG_SUFFIX = '.ket_qua.json'
+# File phải đứng yên (kích thước, mtime không đổi) chừng này giây mới được xác thực
+SETTLE_SECONDS = 1.0
+# Chưa thấy %%EOF ở cuối file thì chờ thêm, tối đa SETTLE_SECONDS * INCOMPLETE_WAITS
+INCOMPLETE_WAITS = 10
+POLL_INTERVAL = 2.0
+TICK = 0.2
+# Tên file tạm thường gặp của trình quét / trình duyệt / rsync, không xác thực
+IGNORED_PREFIXES = ('.', '~')
+IGNORED_SUFFIXES = ('.part', '.tmp', '.crdownload')
+
+# inotify(7)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+_EVENT = struct.Struct('iIII')
+
+
+def is_candidate(path):
+    name = os.path.basename(path)
+    return (name.lower().endswith('.pdf') and not name.startswith(IGNORED_PREFIXES)
+            and not name.lower().endswith(IGNORED_SUFFIXES))
+
+
+def _inside(path, root):
+    return root is not None and os.path.commonpath([path, root]) == root
+
+
+def walk_pdfs(directory, exclude=None):
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.') and not _inside(os.path.join(root, d), exclude))
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            if is_candidate(path):
+                yield path
+
+
+class InotifyWatcher:
+    # Theo dõi đệ quy bằng inotify; poll() trả về (danh sách đường dẫn có thay đổi, có tràn hàng đợi không)
+    def __init__(self, directories, exclude=None):
+        if ctypes is None or not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, 'inotify chỉ có trên Linux')
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1')
+        self.exclude = exclude
+        self._dirs = {}  # watch descriptor -> thư mục
+        for d in directories:
+            self.add_tree(d)
+
+    def _add(self, directory):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f'inotify_add_watch {directory}')
+        self._dirs[wd] = directory
+
+    def add_tree(self, directory):
+        for root, dirs, _ in os.walk(directory):
+            dirs[:] = [d for d in dirs if not d.startswith('.') and not _inside(os.path.join(root, d), self.exclude)]
+            self._add(root)
+
+    def poll(self, timeout):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return [], False
+        try:
+            buf = os.read(self.fd, 256 * 1024)
+        except BlockingIOError:
+            return [], False
+        paths = []
+        overflow = False
+        pos = 0
+        while pos + _EVENT.size <= len(buf):
+            wd, mask, _, length = _EVENT.unpack_from(buf, pos)
+            name = buf[pos + _EVENT.size:pos + _EVENT.size + length].rstrip(b'\0')
+            pos += _EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            directory = self._dirs.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                # Thư mục con mới (tạo hoặc chuyển vào): theo dõi và lấy luôn các file đã có sẵn bên trong
+                if mask & (IN_CREATE | IN_MOVED_TO) and not _inside(path, self.exclude):
+                    try:
+                        self.add_tree(path)
+                    except OSError:
+                        continue
+                    paths.extend(walk_pdfs(path, self.exclude))
+            elif is_candidate(path):
+                paths.append(path)
+        return paths, overflow
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    # Quét lại cây thư mục mỗi `interval` giây, trả về file mới hoặc có (kích thước, mtime) thay đổi
+    def __init__(self, directories, exclude=None, interval=POLL_INTERVAL):
+        self.directories = directories
+        self.exclude = exclude
+        self.interval = interval
+        self._seen = {}
+        self._next = 0.0
+
+    def poll(self, timeout):
+        now = time.monotonic()
+        if now < self._next:
+            time.sleep(min(timeout, self._next - now))
+            return [], False
+        self._next = now + self.interval
+        changed = []
+        seen = {}
+        for d in self.directories:
+            for path in walk_pdfs(d, self.exclude):
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                seen[path] = (st.st_size, st.st_mtime_ns)
+                if self._seen.get(path) != seen[path]:
+                    changed.append(path)
+        self._seen = seen
+        return changed, False
+
+    def close(self):
+        pass
+
+
+class WatchState:
+    # Các file đã xác thực: (đường dẫn, kích thước, mtime) -> kết quả. Dùng để bỏ qua khi khởi động lại.
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, '
+                          'mtime_ns INTEGER, ket_qua TEXT, verdict TEXT, moved_to TEXT, time TEXT)')
+
+    def is_done(self, path, size, mtime_ns):
+        row = self.conn.execute('SELECT size, mtime_ns FROM files WHERE path = ?', (path,)).fetchone()
+        return row is not None and tuple(row) == (size, mtime_ns)
+
+    def mark(self, path, size, mtime_ns, record):
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)',
+                              (path, size, mtime_ns, record['ket_qua'], record['verdict'],
+                               record.get('moved_to'), record['time']))
+            if record.get('moved_to'):
+                # Lần sau file nằm ở vị trí mới (có thể vẫn trong thư mục được theo dõi)
+                self.conn.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                  (record['moved_to'], size, mtime_ns, record['ket_qua'], record['verdict'],
+                                   None, record['time']))
+
+    def close(self):
+        self.conn.close()
+
+
+def _init_watch_worker(trust_local_pfx, options):
+    # Ctrl+C gửi SIGINT cho cả nhóm tiến trình: chỉ tiến trình chính xử lý để dừng êm
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _init_worker(trust_local_pfx, options)
+
+
+def _has_eof_marker(path):
+    # PDF ghi xong luôn kết thúc bằng %%EOF (có thể kèm vài byte xuống dòng)
+    try:
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - 1024))
+            return b'%%EOF' in f.read()
+    except OSError:
+        return False
+
+
+class WatchDaemon:
+    def __init__(self, directories, workers=None, trust_local_pfx=False, options=None, move_to=None,
+                 state_path=STATE_FILE, report=WATCH_REPORT, settle=SETTLE_SECONDS, poll=False,
+                 poll_interval=POLL_INTERVAL, max_queue=None, prometheus=None):
+        self.directories = [os.path.abspath(d) for d in directories]
+        self.workers = workers or os.cpu_count() or 1
+        self.trust_local_pfx = trust_local_pfx
+        self.options = options
+        self.move_to = os.path.abspath(move_to) if move_to else None
+        self.state_path = state_path
+        self.report = report
+        self.settle = settle
+        self.poll = poll
+        self.poll_interval = poll_interval
+        # Số file tối đa đang chờ worker + đang xác thực; đầy thì ngừng nhận sự kiện mới
+        self.max_queue = max_queue or self.workers * 4
+        self.prometheus = prometheus
+        self.pending = {}  # đường dẫn -> [kích thước, mtime, lần thay đổi cuối, số lần chờ %%EOF]
+        self.ready = deque()
+        self.inflight = {}  # future -> (đường dẫn, kích thước, mtime)
+        self.counts = {'hop_le': 0, 'co_dieu_kien': 0, 'khong_hop_le': 0, 'loi': 0}
+        self._stop = threading.Event()
+
+    def stop(self, *args):
+        self._stop.set()
+
+    def _open_watcher(self):
+        if not self.poll:
+            try:
+                return InotifyWatcher(self.directories, self.move_to)
+            except OSError as e:
+                print(f'⚠ Không dùng được inotify ({e}), chuyển sang quét mỗi {self.poll_interval}s')
+        return PollingWatcher(self.directories, self.move_to, self.poll_interval)
+
+    def _notice(self, path, now):
+        # Ghi nhận file có thay đổi; mỗi lần thay đổi đặt lại thời gian chờ đứng yên
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.pending.pop(path, None)
+            return
+        entry = self.pending.get(path)
+        if entry is None or (entry[0], entry[1]) != (st.st_size, st.st_mtime_ns):
+            if entry is None and self.state.is_done(path, st.st_size, st.st_mtime_ns):
+                return
+            self.pending[path] = [st.st_size, st.st_mtime_ns, now, 0]
+
+    def _promote(self, now):
+        # File đã đứng yên đủ lâu (và có %%EOF) -> hàng đợi xác thực
+        for path, entry in list(self.pending.items()):
+            if len(self.ready) + len(self.inflight) >= self.max_queue:
+                return
+            if now - entry[2] < self.settle:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                del self.pending[path]
+                continue
+            if (st.st_size, st.st_mtime_ns) != (entry[0], entry[1]):
+                self.pending[path] = [st.st_size, st.st_mtime_ns, now, entry[3]]
+                continue
+            if not _has_eof_marker(path) and entry[3] < INCOMPLETE_WAITS:
+                entry[2] = now
+                entry[3] += 1
+                continue
+            del self.pending[path]
+            if path not in self.ready and not any(p == path for p, _, _ in self.inflight.values()):
+                self.ready.append((path, st.st_size, st.st_mtime_ns))
+
+    def _submit(self):
+        while self.ready and len(self.inflight) < self.workers * 2:
+            path, size, mtime_ns = self.ready.popleft()
+            self.inflight[self.pool.submit(verify_one, path)] = (path, size, mtime_ns)
+
+    def _place(self, path, ket_qua):
+        # Chuyển file vào move_to/<kết quả>/<đường dẫn tương đối>; không ghi đè file trùng tên
+        root = next((d for d in self.directories if _inside(path, d)), os.path.dirname(path))
+        target = os.path.join(self.move_to, ket_qua, os.path.relpath(path, root))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.exists(target):
+            stem, ext = os.path.splitext(target)
+            target = f'{stem}_{datetime.datetime.now():%Y%m%d%H%M%S%f}{ext}'
+        shutil.move(path, target)
+        return target
+
+    def _finish(self, future):
+        path, size, mtime_ns = self.inflight.pop(future)
+        try:
+            record = future.result()
+        except Exception as e:
+            record = {'file': path, 'code': 1, 'ket_qua': 'loi', 'verdict': None, 'steps': [f'✗ Lỗi worker: {e}']}
+        record['time'] = datetime.datetime.now().isoformat(timespec='seconds')
+        try:
+            st = os.stat(path)
+            changed = (st.st_size, st.st_mtime_ns) != (size, mtime_ns)
+        except OSError:
+            changed = True
+        if changed:
+            # File bị ghi tiếp trong lúc xác thực: kết quả không còn đúng, chờ lần thay đổi sau
+            self._notice(path, time.monotonic())
+            return
+        try:
+            if self.move_to:
+                record['moved_to'] = self._place(path, record['ket_qua'])
+            else:
+                tag = {k: record.get(k) for k in ('ket_qua', 'verdict', 'code', 'steps', 'time')}
+                with open(path + TAG_SUFFIX, 'w', encoding='utf-8') as f:
+                    json.dump(tag, f, ensure_ascii=False, indent=2)
+        except OSError as e:
+            record['tag_error'] = str(e)
+        self.state.mark(path, size, mtime_ns, record)
+        self.counts[record['ket_qua']] += 1
+        if record.get('metrics'):
+            REGISTRY.observe(record['metrics'], record['ket_qua'])
+            if self.prometheus:
+                REGISTRY.write_prometheus(self.prometheus)
+        append_record(record, self.report)
+        mark = {'hop_le': '✓', 'co_dieu_kien': '⚠'}.get(record['ket_qua'], '✗')
+        where = f' -> {record["moved_to"]}' if record.get('moved_to') else ''
+        print(f'  {mark} {path}{where} ({(record.get("seconds") or 0) * 1000:.1f} ms)')
+
+    def run(self):
+        self.state = WatchState(self.state_path)
+        watcher = self._open_watcher()
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_watch_worker,
+                                        initargs=(self.trust_local_pfx, self.options))
+        kind = 'inotify' if isinstance(watcher, InotifyWatcher) else f'quét mỗi {self.poll_interval}s'
+        print(f'Theo dõi {", ".join(self.directories)} ({kind}, {self.workers} worker, '
+              f'hàng đợi tối đa {self.max_queue})')
+        # Khởi động: file có sẵn (hoặc tới lúc tiến trình không chạy) mà chưa có trong trạng thái
+        now = time.monotonic()
+        for d in self.directories:
+            for path in walk_pdfs(d, self.move_to):
+                self._notice(path, now)
+        try:
+            while not self._stop.is_set():
+                now = time.monotonic()
+                if len(self.ready) + len(self.inflight) < self.max_queue:
+                    paths, overflow = watcher.poll(TICK if not self.inflight else 0)
+                    if overflow:
+                        # Hàng đợi sự kiện của kernel bị tràn (do đang dồn việc): quét lại toàn bộ
+                        for d in self.directories:
+                            paths.extend(walk_pdfs(d, self.move_to))
+                    for path in paths:
+                        self._notice(path, now)
+                self._promote(now)
+                self._submit()
+                if self.inflight:
+                    done, _ = wait(list(self.inflight), timeout=TICK, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._finish(future)
+                elif len(self.ready) + len(self.inflight) >= self.max_queue:
+                    time.sleep(TICK)
+        finally:
+            # Dừng nhận file mới, chờ các file đang xác thực xong
+            for future in list(self.inflight):
+                self._finish(future)
+            self.pool.shutdown(wait=True)
+            watcher.close()
+            self.state.close()
+        print(f'Đã dừng. ✓ hợp lệ: {self.counts["hop_le"]}  ⚠ có điều kiện: {self.counts["co_dieu_kien"]}  '
+              f'✗ không hợp lệ: {self.counts["khong_hop_le"]}  ✗ lỗi: {self.counts["loi"]}')
+        return 0
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    kwargs = {}
+    if '--trust-local-pfx' in args:
+        kwargs['trust_local_pfx'] = True
+        args.remove('--trust-local-pfx')
+    if '--poll' in args:
+        kwargs['poll'] = True
+        args.remove('--poll')
+    options = {}
+    for flag, key in (('--chain-cache', 'chain_cache'), ('--revocation-dir', 'revocation_dir'),
+                      ('--revocation-mode', 'revocation_mode'), ('--result-cache', 'result_cache'),
+                      ('--trust-store', 'trust_store'), ('--trust-snapshot', 'trust_snapshot')):
+        if flag in args:
+            i = args.index(flag)
+            options[key] = args[i + 1]
+            del args[i:i + 2]
+    kwargs['options'] = options
+    for flag, key, conv in (('--workers', 'workers', int), ('--move-to', 'move_to', str),
+                            ('--state', 'state_path', str), ('--settle', 'settle', float),
+                            ('--poll-interval', 'poll_interval', float), ('--max-queue', 'max_queue', int),
+                            ('--prometheus', 'prometheus', str), ('--report', 'report', str)):
+        if flag in args:
+            i = args.index(flag)
+            kwargs[key] = conv(args[i + 1])
+            del args[i:i + 2]
+    if not args:
+        print('Cách dùng: python theo_doi_thu_muc.py THU_MUC [THU_MUC ...] [--move-to DIR] [--workers N] ...')
+        sys.exit(2)
+    daemon = WatchDaemon(args, **kwargs)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+    sys.exit(daemon.run())
@@ -0,0 +1,253 @@
+import os
+import time
+import hashlib
+import datetime
+import threading
+
+from asn1crypto import crl, ocsp, pem
+
+# Kho thu hồi cục bộ: nạp CRL (*.crl, DER hoặc PEM) và OCSP response đã tải sẵn (*.ocsp)
+# từ một thư mục, đánh chỉ mục theo issuer và serial để bước 6 không cần mạng.
+# EmbeddedRevocation dùng cùng chỉ mục cho CRL/OCSP nhúng trong /DSS của tài liệu.
+CRL_EXTENSIONS = ('.crl',)
+OCSP_EXTENSIONS = ('.ocsp', '.ors')
+# Khoảng thời gian tối thiểu giữa hai lần quét lại thư mục (thả file mới vào là được nạp)
+REFRESH_INTERVAL = 5.0
+
+
+def _utcnow():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _load_der(raw):
+    if pem.detect(raw):
+        _, _, raw = pem.unarmor(raw)
+    return raw
+
+
+def _name_hashes(name):
+    # OCSP CertID có thể dùng SHA-1 hoặc SHA-256 cho issuerNameHash
+    der = name.dump()
+    return hashlib.sha1(der).digest(), hashlib.sha256(der).digest()
+
+
+class RevocationStore:
+    def __init__(self, directory, refresh_interval=REFRESH_INTERVAL):
+        self.directory = directory
+        self.refresh_interval = refresh_interval
+        self.version = ''
+        self._files = {}  # path -> (mtime, size, kind, obj)
+        self._crls_by_issuer = {}  # issuer name sha256 -> [CertificateList]
+        self._revoked = {}  # (issuer name sha256, serial) -> ngày thu hồi
+        self._ocsps = {}  # (issuer name hash, serial) -> [(OCSPResponse, SingleResponse)]
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.refresh(force=True)
+
+    def refresh(self, force=False):
+        # Quét lại thư mục nếu đã quá refresh_interval; chỉ đọc lại các file mới / thay đổi.
+        # Trả về True nếu nội dung kho thay đổi.
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.refresh_interval:
+            return False
+        with self._lock:
+            self._checked_at = now
+            seen = {}
+            try:
+                names = sorted(os.listdir(self.directory))
+            except OSError:
+                names = []
+            for name in names:
+                ext = os.path.splitext(name)[1].lower()
+                if ext in CRL_EXTENSIONS:
+                    kind = 'crl'
+                elif ext in OCSP_EXTENSIONS:
+                    kind = 'ocsp'
+                else:
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                old = self._files.get(path)
+                if old and old[0] == st.st_mtime and old[1] == st.st_size:
+                    seen[path] = old
+                    continue
+                try:
+                    with open(path, 'rb') as f:
+                        raw = _load_der(f.read())
+                    if kind == 'crl':
+                        obj = crl.CertificateList.load(raw)
+                        obj.native  # parse sớm để bỏ qua file hỏng
+                    else:
+                        obj = ocsp.OCSPResponse.load(raw)
+                        if obj['response_status'].native != 'successful':
+                            continue
+                except Exception:
+                    continue
+                seen[path] = (st.st_mtime, st.st_size, kind, obj)
+            if set(seen) == set(self._files) and all(seen[p] is self._files[p] for p in seen):
+                return False
+            self._files = seen
+            self._rebuild()
+            return True
+
+    def _rebuild(self):
+        crls_by_issuer = {}
+        revoked = {}
+        ocsps = {}
+        for path, (_, _, kind, obj) in sorted(self._files.items()):
+            if kind == 'crl':
+                tbs = obj['tbs_cert_list']
+                issuer_hash = tbs['issuer'].sha256
+                crls_by_issuer.setdefault(issuer_hash, []).append(obj)
+                for entry in tbs['revoked_certificates']:
+                    key = (issuer_hash, entry['user_certificate'].native)
+                    revoked[key] = entry['revocation_date'].native
+            else:
+                basic = obj['response_bytes']['response'].parsed
+                for single in basic['tbs_response_data']['responses']:
+                    cert_id = single['cert_id']
+                    key = (cert_id['issuer_name_hash'].native, cert_id['serial_number'].native)
+                    ocsps.setdefault(key, []).append((obj, single))
+        self._crls_by_issuer = crls_by_issuer
+        self._revoked = revoked
+        self._ocsps = ocsps
+        digest = hashlib.sha256()
+        for path, (mtime, size, _, _) in sorted(self._files.items()):
+            digest.update(f'{path}|{mtime}|{size}\n'.encode('utf-8'))
+        self.version = digest.hexdigest()[:16]
+
+    @staticmethod
+    def _fresh(next_update, now):
+        return next_update is None or next_update > now
+
+    def crls_for(self, cert):
+        # CRL còn hạn (nextUpdate > hiện tại) của issuer của cert
+        now = _utcnow()
+        return [c for c in self._crls_by_issuer.get(cert.issuer.sha256, [])
+                if self._fresh(c['tbs_cert_list']['next_update'].native, now)]
+
+    def ocsps_for(self, cert):
+        now = _utcnow()
+        out = []
+        for name_hash in _name_hashes(cert.issuer):
+            for resp, single in self._ocsps.get((name_hash, cert.serial_number), []):
+                if self._fresh(single['next_update'].native, now) and resp not in out:
+                    out.append(resp)
+        return out
+
+    def status(self, cert):
+        # Tra nhanh theo (issuer, serial): 'revoked', 'good' (có CRL/OCSP còn hạn) hoặc None (không có dữ liệu)
+        if (cert.issuer.sha256, cert.serial_number) in self._revoked and self.crls_for(cert):
+            return 'revoked'
+        for name_hash in _name_hashes(cert.issuer):
+            for resp, single in self._ocsps.get((name_hash, cert.serial_number), []):
+                if self._fresh(single['next_update'].native, _utcnow()):
+                    return single['cert_status'].name
+        return 'good' if self.crls_for(cert) else None
+
+    def next_update_for(self, certs):
+        # nextUpdate sớm nhất của dữ liệu thu hồi liên quan tới chuỗi (giới hạn TTL bộ đệm bước 5/6)
+        earliest = None
+        for cert in certs:
+            values = [c['tbs_cert_list']['next_update'].native for c in self.crls_for(cert)]
+            for name_hash in _name_hashes(cert.issuer):
+                for _, single in self._ocsps.get((name_hash, cert.serial_number), []):
+                    values.append(single['next_update'].native)
+            for v in values:
+                if v is not None and (earliest is None or v < earliest):
+                    earliest = v
+        return earliest
+
+    def counts(self):
+        kinds = [v[2] for v in self._files.values()]
+        return kinds.count('crl'), kinds.count('ocsp')
+
+
+class EmbeddedRevocation(RevocationStore):
+    # CRL / OCSP response nhúng trong tài liệu (/DSS, xem du_lieu_ltv.read_dss): tra dữ liệu nhúng trước,
+    # chứng chỉ không có dữ liệu nhúng còn hạn thì hỏi kho `fallback` (--revocation-dir) nếu có.
+    # certs: chứng chỉ đi kèm (/DSS /Certs), dùng thêm khi dựng chuỗi.
+    def __init__(self, crls, ocsps, fallback=None, certs=()):
+        self.directory = None
+        self.certs = list(certs)
+        self.refresh_interval = REFRESH_INTERVAL
+        self.fallback = fallback
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._files = {}
+        for i, obj in enumerate(crls):
+            self._files[f'dss:crl:{i}'] = (0, 0, 'crl', obj)
+        for i, obj in enumerate(ocsps):
+            if obj['response_status'].native == 'successful':
+                self._files[f'dss:ocsp:{i}'] = (0, 0, 'ocsp', obj)
+        self._rebuild()
+        digest = hashlib.sha256()
+        for _, _, _, obj in self._files.values():
+            digest.update(hashlib.sha256(obj.dump()).digest())
+        self._own_version = 'dss:' + digest.hexdigest()[:16]
+        self.version = self._version()
+
+    def _version(self):
+        return self._own_version + (':' + self.fallback.version if self.fallback is not None else '')
+
+    def refresh(self, force=False):
+        if self.fallback is None or not self.fallback.refresh(force):
+            return False
+        self.version = self._version()
+        return True
+
+    def crls_for(self, cert):
+        own = RevocationStore.crls_for(self, cert)
+        if own or self.fallback is None:
+            return own
+        return self.fallback.crls_for(cert)
+
+    def ocsps_for(self, cert):
+        own = RevocationStore.ocsps_for(self, cert)
+        if own or self.fallback is None:
+            return own
+        return self.fallback.ocsps_for(cert)
+
+    def status(self, cert):
+        own = RevocationStore.status(self, cert)
+        if own is not None or self.fallback is None:
+            return own
+        return self.fallback.status(cert)
+
+    def next_update_for(self, certs):
+        values = [RevocationStore.next_update_for(self, certs)]
+        if self.fallback is not None:
+            values.append(self.fallback.next_update_for(certs))
+        values = [v for v in values if v is not None]
+        return min(values) if values else None
+
+    def embedded_status(self, cert):
+        # Trạng thái chỉ theo dữ liệu nhúng (None: tài liệu không có dữ liệu còn hạn cho cert)
+        return RevocationStore.status(self, cert)
+
+
+_context_class = None
+
+
+def make_validation_context(store, trust_roots=None, revocation_mode='soft-fail'):
+    # ValidationContext của certvalidator, lấy CRL/OCSP từ kho theo issuer/serial thay vì tải qua mạng
+    global _context_class
+    from certvalidator import ValidationContext
+    if _context_class is None:
+        class StoreValidationContext(ValidationContext):
+            def retrieve_crls(self, cert):
+                return self._revocation_store.crls_for(cert)
+
+            def retrieve_ocsps(self, cert, issuer):
+                return self._revocation_store.ocsps_for(cert)
+
+        _context_class = StoreValidationContext
+    kwargs = {'crls': [], 'ocsps': [], 'allow_fetching': False, 'revocation_mode': revocation_mode}
+    if trust_roots:
+        kwargs['trust_roots'] = list(trust_roots)
+    context = _context_class(**kwargs)
+    context._revocation_store = store
+    return context
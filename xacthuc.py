@@ -1,53 +1,35 @@
+import time
+_T_START = time.perf_counter()
+
 import sys
-import re
 import hashlib
 import os
-from asn1crypto import cms, pem, x509
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.asymmetric import padding, ec
-from cryptography.hazmat.primitives.asymmetric import utils as asym_utils
-import traceback
-from cryptography import x509 as crypto_x509
-from cryptography.hazmat.primitives.serialization import Encoding
-from endesive.pdf import verify as endesive_verify
+import datetime
+import functools
+from doc_pdf import (PdfBuffer, PdfSyntaxError, find_signatures, hash_byterange, byte_view,
+                     StreamingByteRangeHasher, HASH_CHUNK)
+from bo_dem_chung_chi import ChainCache, load_certificate, load_public_key, CERTIFICATE_STATS
+from do_luong import DocumentMetrics, REGISTRY
+from bo_dem_ket_qua import ResultCache, document_key
+from phan_tich_phien_ban import analyze_revisions, describe_revision, TAIL_SLACK
+from buoc_xac_thuc import Step, StepResult, StepEngine, Policy, VerificationResult
+
+# asn1crypto, cryptography, certvalidator và kho thu hồi chỉ được import khi bước cần tới chúng
+# (chế độ --quick chỉ chạy bước 1-4 nên không nạp certvalidator / thu_hoi)
 
 DEFAULT_PDF = 'goc_da_ky.pdf'
 LOG_FILE = 'nhat_ky_xac_thuc.txt'
-
-
-def find_byte_range(data: bytes):
-    m = re.search(br'/ByteRange\s*\[\s*(\d+)\s+(\d+)\s+(\d+)\s+(\d+)\s*\]', data)
-    if not m:
-        return None
-    return tuple(int(x) for x in m.groups())
-
-
-def extract_contents(data: bytes):
-    # find hex contents between <...>
-    m = re.search(br'/Contents\s*<([0-9A-Fa-f\s]+)>', data)
-    if m:
-        hexstr = re.sub(br'\s+', b'', m.group(1))
-        return bytes.fromhex(hexstr.decode('ascii'))
-    # or binary octets in parentheses or direct stream after /Contents
-    m2 = re.search(br'/Contents\s*\((.*?)\)\s*', data, re.S)
-    if m2:
-        return m2.group(1)
-    # fallback: try to locate PKCS7 DER by scanning for ASN.1 header
-    m3 = re.search(br'\x30\x82', data)
-    if m3:
-        return data[m3.start():]
-    return None
-
-
-def compute_hash_over_byterange(data: bytes, br):
-    a0, l0, a1, l1 = br
-    part1 = data[a0:a0 + l0]
-    part2 = data[a1:a1 + l1]
-    return part1 + part2
+# Kết luận của chế độ --quick khi bước 1-4 đều đạt
+QUICK_VERDICT = '✓ NGUYÊN VẸN - Dữ liệu và chữ ký khớp (chưa kiểm tra chuỗi, thu hồi, timestamp)'
+# Tăng khi đổi cách xác thực mà mã nguồn các module dưới đây không đổi (vd. nâng cấp certvalidator)
+VERIFIER_VERSION = '1'
+VERIFIER_MODULES = ('xacthuc.py', 'doc_pdf.py', 'bo_dem_chung_chi.py', 'thu_hoi.py', 'phan_tich_phien_ban.py',
+                    'du_lieu_ltv.py', 'buoc_xac_thuc.py', 'kho_tin_cay.py')
 
 
 def parse_pkcs7(contents: bytes):
     # contents may be wrapped in CMS ContentInfo
+    from asn1crypto import cms, pem
     try:
         if pem.detect(contents):
             type_name, headers, der_bytes = pem.unarmor(contents)
@@ -62,32 +44,38 @@ def parse_pkcs7(contents: bytes):
         return None
 
 
-def verify_signed_attrs_hash(sd, signed_attrs_bytes, computed_digest, log):
-    # find messageDigest attribute inside signed_attrs
-    try:
-        signer_info = sd['signer_infos'][0]
-        attrs = signer_info['signed_attrs']
-        for attr in attrs:
-            if attr['type'].native == 'message_digest':
-                md = attr['values'][0].native
-                if md == computed_digest:
-                    log.append('- messageDigest: MATCH')
-                    return True
-                else:
-                    log.append(f"- messageDigest: MISMATCH (expected {md.hex()}, got {computed_digest.hex()})")
-                    return False
-    except Exception as e:
-        log.append(f"- messageDigest: error checking: {e}")
-        return False
+def signer_certificate(sd):
+    # Chứng chỉ của người ký theo sid của SignerInfo (issuer + serial hoặc subjectKeyIdentifier);
+    # tập certificates của SignedData được sắp theo DER nên chứng chỉ đầu tiên không nhất thiết là của người ký
+    certs = [c.chosen for c in sd['certificates'] if c.name == 'certificate']
+    sid = sd['signer_infos'][0]['sid']
+    for c in certs:
+        if sid.name == 'issuer_and_serial_number':
+            if c.issuer == sid.chosen['issuer'] and c.serial_number == sid.chosen['serial_number'].native:
+                return c
+        elif c.key_identifier == sid.chosen.native:
+            return c
+    return certs[0] if certs else None
+
+
+def _hash(name):
+    from cryptography.hazmat.primitives import hashes
+    return getattr(hashes, name.upper().replace('-', '').replace('_', ''))()
 
 
-def verify_signature(sd, signed_attrs_der, signature_bytes, cert):
-    # Determine signature algorithm
+def verify_signature(sd, signed_attrs_der, signature_bytes, cert, public_key=None):
+    from cryptography.hazmat.primitives.asymmetric import padding, ec, rsa, ed25519
+    # Thuật toán chữ ký theo SignerInfo: RSA PKCS#1 v1.5, RSASSA-PSS, ECDSA, Ed25519
     signer_info = sd['signer_infos'][0]
-    sig_algo = signer_info['signature_algorithm']['algorithm'].native
-    digest_algo = signer_info['digest_algorithm']['algorithm'].native
+    algo = signer_info['signature_algorithm']
+    scheme = algo.signature_algo
+    try:
+        # sha256_rsa, sha384_ecdsa...: hàm băm nằm trong OID; rsassa_pkcs1v15 / ecdsa: theo digest_algorithm
+        hash_name = algo.hash_algo
+    except ValueError:
+        hash_name = signer_info['digest_algorithm']['algorithm'].native
 
-    pub = cert.public_key()
+    pub = public_key if public_key is not None else cert.public_key()
     
     # Chuẩn bị signed_attrs với tag 0xA0 thành 0x31 (SET OF)
     # PKCS#7 signed attributes được hash với tag SET OF (0x31) không phải CONTEXT SPECIFIC (0xA0)
@@ -97,344 +85,757 @@ def verify_signature(sd, signed_attrs_der, signature_bytes, cert):
         signed_attrs_for_hash = signed_attrs_der
     
     try:
-        if sig_algo.startswith('rsa') or 'rsa' in sig_algo.lower():
-            hash_algo = getattr(hashes, digest_algo.upper().replace('-', ''))()
-            pub.verify(signature_bytes, signed_attrs_for_hash, padding.PKCS1v15(), hash_algo)
-        elif 'ecdsa' in sig_algo.lower():
-            hash_algo = getattr(hashes, digest_algo.upper().replace('-', ''))()
-            pub.verify(signature_bytes, signed_attrs_for_hash, ec.ECDSA(hash_algo))
+        if scheme == 'rsassa_pkcs1v15' and isinstance(pub, ec.EllipticCurvePublicKey):
+            # endesive ghi nhãn rsassa_pkcs1v15 cho cả chữ ký ECDSA
+            scheme = 'ecdsa'
+        if scheme == 'rsassa_pkcs1v15' and isinstance(pub, rsa.RSAPublicKey):
+            pub.verify(signature_bytes, signed_attrs_for_hash, padding.PKCS1v15(), _hash(hash_name))
+        elif scheme == 'rsassa_pss' and isinstance(pub, rsa.RSAPublicKey):
+            params = algo['parameters']
+            md = _hash(params['hash_algorithm']['algorithm'].native)
+            mgf_md = _hash(params['mask_gen_algorithm']['parameters']['algorithm'].native)
+            pub.verify(signature_bytes, signed_attrs_for_hash,
+                       padding.PSS(padding.MGF1(mgf_md), params['salt_length'].native), md)
+        elif scheme == 'ecdsa' and isinstance(pub, ec.EllipticCurvePublicKey):
+            pub.verify(signature_bytes, signed_attrs_for_hash, ec.ECDSA(_hash(hash_name)))
+        elif scheme == 'ed25519' and isinstance(pub, ed25519.Ed25519PublicKey):
+            pub.verify(signature_bytes, signed_attrs_for_hash)
         else:
-            # try a best-effort assume PKCS1v15+sha256
-            pub.verify(signature_bytes, signed_attrs_for_hash, padding.PKCS1v15(), hashes.SHA256())
+            raise ValueError(f"thuật toán {algo['algorithm'].native} không khớp khóa {type(pub).__name__}")
     except Exception as e:
         raise Exception(f"Signature verification failed: {e}")
 
 
-def build_log(lines, path=LOG_FILE):
-    with open(path, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(lines))
+def cms_signature_valid(data, br, contents):
+    # Bước 2-4 rút gọn: PKCS#7 parse được, messageDigest khớp hash ByteRange và chữ ký đúng với public key
+    # trong cert (phan_tich_phien_ban dùng để chỉ công nhận hình chữ ký ghép trước một chữ ký thật)
+    try:
+        sd = parse_pkcs7(contents)
+        signer_info = sd['signer_infos'][0]
+        digest = hash_byterange(data, br, hashlib.new(signer_info['digest_algorithm']['algorithm'].native)).digest()
+        if not any(a['type'].native == 'message_digest' and a['values'][0].native == digest
+                   for a in signer_info['signed_attrs']):
+            return False
+        public_key = load_public_key(signer_certificate(sd).public_key.dump())
+        verify_signature(sd, signer_info['signed_attrs'].dump(), signer_info['signature'].native, None,
+                         public_key=public_key)
+    except Exception:
+        return False
+    return True
 
 
-def main(pdfpath, trust_local_pfx=False):
-    lines = []
-    if not os.path.exists(pdfpath):
-        print(f'✗ File không tìm thấy: {pdfpath}')
-        return 1
+@functools.lru_cache(maxsize=None)
+def load_local_trust_root(pfx_path='cert.pfx', password=b'1234'):
+    # Giải mã cert.pfx một lần cho mỗi tiến trình thay vì ở mỗi bước / mỗi file
+    from asn1crypto import x509
+    from cryptography.hazmat.primitives.serialization import Encoding
+    from cryptography.hazmat.primitives.serialization.pkcs12 import load_key_and_certificates
+    pfx_data = open(pfx_path, 'rb').read()
+    priv_local, cert_local, add_local = load_key_and_certificates(pfx_data, password)
+    if cert_local is None:
+        return None
+    der = cert_local.public_bytes(encoding=Encoding.DER)
+    return x509.Certificate.load(der)
 
-    data = open(pdfpath, 'rb').read()
-    
-    print('\n' + '='*60)
-    print('CÁC BƯỚC XÁC THỰC CHỮ KÝ TRÊN PDF')
-    print('='*60 + '\n')
-    
-    # Bước 1: Đọc Signature dictionary
-    print('1. Đọc Signature dictionary: /Contents, /ByteRange')
-    br = find_byte_range(data)
-    contents = extract_contents(data)
-    
-    if not br or not contents:
-        print('   ✗ KHÔNG HỢP LỆ - Không tìm thấy /ByteRange hoặc /Contents\n')
-        lines.append('Bước 1: ✗ KHÔNG HỢP LỆ - Không đọc được Signature dictionary')
-        build_log(lines)
-        return 2
-    print(f'   ✓ HỢP LỆ - ByteRange: {br}, Contents: {len(contents)} bytes\n')
-    lines.append(f'Bước 1: ✓ HỢP LỆ - ByteRange: {br}')
-    
-    # Bước 2: Tách PKCS#7, kiểm tra định dạng
-    print('2. Tách PKCS#7, kiểm tra định dạng')
-    sd = parse_pkcs7(contents)
-    
-    if sd is None:
-        print('   ✗ KHÔNG HỢP LỆ - Không parse được PKCS#7 SignedData\n')
-        lines.append('Bước 2: ✗ KHÔNG HỢP LỆ - Định dạng PKCS#7 không hợp lệ')
-        build_log(lines)
-        return 3
-    print('   ✓ HỢP LỆ - PKCS#7 SignedData được parse thành công\n')
-    lines.append('Bước 2: ✓ HỢP LỆ - PKCS#7 định dạng hợp lệ')
-    
-    # Bước 3: Tính hash và so sánh messageDigest
-    print('3. Tính hash và so sánh messageDigest')
-    signed_data_bytes = compute_hash_over_byterange(data, br)
-    sha = hashlib.sha256(signed_data_bytes).digest()
-    
-    signer_info = sd['signer_infos'][0]
-    signed_attrs = signer_info['signed_attrs']
-    md_attr = None
-    md_match = False
-    
-    try:
-        for a in signed_attrs:
-            if a['type'].native == 'message_digest':
-                md_attr = a['values'][0].native
-                break
-        
-        if md_attr and md_attr == sha:
-            print('   ✓ HỢP LỆ - messageDigest khớp với hash tính được\n')
-            lines.append('Bước 3: ✓ HỢP LỆ - messageDigest khớp')
-            md_match = True
-        else:
-            print('   ✗ KHÔNG HỢP LỆ - messageDigest không khớp\n')
-            lines.append('Bước 3: ✗ KHÔNG HỢP LỆ - messageDigest không khớp')
-    except Exception as e:
-        print(f'   ✗ KHÔNG HỢP LỆ - Lỗi kiểm tra: {e}\n')
-        lines.append(f'Bước 3: ✗ KHÔNG HỢP LỆ - Lỗi: {e}')
-    
-    # Bước 4: Verify signature bằng public key
-    print('4. Verify signature bằng public key trong cert')
-    cert = None
-    sig_valid = False
-    
-    try:
-        certs = sd['certificates']
-        if certs and len(certs) > 0:
-            cert_choice = certs[0]
-            cert_der = cert_choice.chosen.dump()
-            cert = crypto_x509.load_der_x509_certificate(cert_der)
-            
-            signature_bytes = signer_info['signature'].native
-            signed_attrs_der = signed_attrs.dump()
-            
-            # Verify signature
-            verify_signature(sd, signed_attrs_der, signature_bytes, cert)
-            print('   ✓ HỢP LỆ - Signature hợp lệ với public key\n')
-            lines.append('Bước 4: ✓ HỢP LỆ - Signature được xác thực')
-            sig_valid = True
+
+_validation_contexts = {}
+
+
+def get_validation_context(trust_roots):
+    # Dùng lại ValidationContext cho cùng một tập trust roots (bước 5 và 6, các file trong cùng worker)
+    from certvalidator import ValidationContext
+    key = tuple(sorted(hashlib.sha256(c.dump()).hexdigest() for c in trust_roots))
+    context = _validation_contexts.get(key)
+    if context is None:
+        if REVOCATION_STORE is not None:
+            from thu_hoi import make_validation_context
+            context = make_validation_context(REVOCATION_STORE, trust_roots, REVOCATION_MODE)
         else:
-            print('   ✗ KHÔNG HỢP LỆ - Không có chứng chỉ\n')
-            lines.append('Bước 4: ✗ KHÔNG HỢP LỆ - Không có chứng chỉ')
-    except Exception as e:
-        print(f'   ✗ KHÔNG HỢP LỆ - Signature không hợp lệ: {e}\n')
-        lines.append(f'Bước 4: ✗ KHÔNG HỢP LỆ - {e}')
+            context = ValidationContext(trust_roots=list(trust_roots)) if trust_roots else ValidationContext()
+        _validation_contexts[key] = context
+    return context
+
+
+# Bộ đệm kết quả xác thực chuỗi, dùng chung cho bước 5, bước 6 và mọi file trong tiến trình
+CHAIN_CACHE = ChainCache()
+# Kho CRL/OCSP cục bộ (--revocation-dir); None = ValidationContext mặc định của certvalidator
+REVOCATION_STORE = None
+REVOCATION_MODE = 'soft-fail'
+# Bộ đệm kết quả trên đĩa (--result-cache); None = luôn xác thực lại
+RESULT_CACHE = None
+RESULT_RECHECK = False
+# Kho trust anchor (--trust-store thư mục / bundle / snapshot); None = chỉ root trong chữ ký và cert.pfx
+TRUST_STORE = None
+
+
+def configure(chain_cache=None, revocation_dir=None, revocation_mode=None, result_cache=None, recheck=None,
+              trust_store=None, trust_snapshot=None):
+    # Cấu hình dùng chung cho CLI và worker của chế độ hàng loạt
+    # result_cache: file SQLite lưu kết quả theo nội dung tài liệu; recheck: bỏ qua kết quả đã lưu (vẫn ghi mới)
+    # trust_snapshot: snapshot chỉ mục của trust_store, nạp thay cho việc parse lại nguồn khi còn khớp
+    global REVOCATION_STORE, REVOCATION_MODE, RESULT_CACHE, RESULT_RECHECK, TRUST_STORE
+    if trust_store:
+        from kho_tin_cay import TrustStore
+        TRUST_STORE = TrustStore.open(trust_store, trust_snapshot)
+    if result_cache:
+        RESULT_CACHE = ResultCache(result_cache)
+    if recheck is not None:
+        RESULT_RECHECK = bool(recheck)
+    if chain_cache:
+        CHAIN_CACHE.attach(chain_cache)
+    if revocation_mode:
+        REVOCATION_MODE = revocation_mode
+    if revocation_dir:
+        from thu_hoi import RevocationStore
+        REVOCATION_STORE = RevocationStore(revocation_dir)
+    _validation_contexts.clear()
+
+
+def validate_chain_cached(sd, trust_local_pfx=False, strict_pfx=True, revocation=None):
+    # Dựng trust roots (self-signed trong bundle + cert.pfx nếu được yêu cầu + anchor của chuỗi trong
+    # TRUST_STORE) rồi xác thực chuỗi
+    # bằng certvalidator qua CHAIN_CACHE. strict_pfx=False: lỗi đọc cert.pfx được bỏ qua.
+    # revocation: thu_hoi.EmbeddedRevocation của tài liệu (/DSS), dùng thay cho REVOCATION_STORE
+    from certvalidator import CertificateValidator
+    asn1_certs = [c.chosen for c in sd['certificates']]
+    end_entity = signer_certificate(sd)
+    intermediates = [c for c in asn1_certs if c.sha256 != end_entity.sha256]
+    if revocation is not None:
+        intermediates += [c for c in revocation.certs
+                          if c.self_signed == 'no' and all(c.sha256 != x.sha256 for x in asn1_certs)]
     
-    # Bước 5: Kiểm tra chain → root trusted CA
-    print('5. Kiểm tra chain → root trusted CA')
-    chain_ok = False
+    # Tin tưởng root trong bundle hoặc PFX
+    trust_roots = []
+    for c in asn1_certs:
+        if c.issuer == c.subject:
+            trust_roots.append(c)
     
-    try:
-        if cert is not None and certs:
-            cert_list = []
-            for c in certs:
-                der = c.chosen.dump()
-                cert_list.append(crypto_x509.load_der_x509_certificate(der))
-            
-            # Check for self-signed root
-            roots = [c for c in cert_list if c.issuer == c.subject]
-            
-            # Kiểm tra chain bằng cách verify signature từng cấp
-            chain_valid = True
-            chain_info = []
-            
-            # Sắp xếp chain: end entity → intermediate → root
-            for i, c in enumerate(cert_list):
-                subj = c.subject.rfc4514_string()
-                issuer = c.issuer.rfc4514_string()
-                chain_info.append(f"   [{i}] {subj[:50]}...")
-                
-                # Kiểm tra issuer
-                if c.issuer != c.subject:
-                    # Tìm issuer cert trong bundle
-                    issuer_cert = None
-                    for potential_issuer in cert_list:
-                        if potential_issuer.subject == c.issuer:
-                            issuer_cert = potential_issuer
-                            break
-                    
-                    if issuer_cert:
-                        try:
-                            # Verify signature
-                            issuer_pub = issuer_cert.public_key()
-                            c.signature
-                            chain_info.append(f"       → Signed by: {issuer_cert.subject.rfc4514_string()[:50]}...")
-                        except Exception:
-                            chain_valid = False
-                    else:
-                        chain_info.append(f"       ⚠ Issuer not found in bundle")
-            
-            # Try certvalidator if available
-            try:
-                from certvalidator import CertificateValidator, ValidationContext
-                asn1_certs = [c.chosen for c in sd['certificates']]
-                end_entity = asn1_certs[0]
-                intermediates = asn1_certs[1:] if len(asn1_certs) > 1 else []
-                
-                # Tin tưởng root trong bundle hoặc PFX
-                trust_roots = []
-                for c in asn1_certs:
-                    if c.issuer == c.subject:
-                        trust_roots.append(c)
-                
-                if trust_local_pfx and os.path.exists('cert.pfx'):
-                    from cryptography.hazmat.primitives.serialization.pkcs12 import load_key_and_certificates
-                    pfx_data = open('cert.pfx', 'rb').read()
-                    priv_local, cert_local, add_local = load_key_and_certificates(pfx_data, b'1234')
-                    if cert_local is not None:
-                        der = cert_local.public_bytes(encoding=Encoding.DER)
-                        asn1_local = x509.Certificate.load(der)
-                        if asn1_local not in trust_roots:
-                            trust_roots.append(asn1_local)
-                
-                context = ValidationContext(trust_roots=trust_roots) if trust_roots else ValidationContext()
-                validator = CertificateValidator(end_entity, intermediate_certs=intermediates, validation_context=context)
-                valres = validator.validate_usage(set())
-                
-                print('   ✓ HỢP LỆ - Chain được xác thực tới root CA\n')
-                lines.append('Bước 5: ✓ HỢP LỆ - Chain hợp lệ')
-                chain_ok = True
-            except Exception as e:
-                # Nếu có root trong bundle → chấp nhận như trusted
-                if roots and (trust_local_pfx or len(roots) > 0):
-                    print(f'   ✓ HỢP LỆ - Chain đầy đủ với {len(cert_list)} certs (self-signed root được tin tưởng)\n')
-                    lines.append(f'Bước 5: ✓ HỢP LỆ - Chain hợp lệ ({len(cert_list)} certs)')
-                    chain_ok = True
-                elif roots:
-                    print(f'   ⚠ CẢNH BÁO - Có {len(roots)} self-signed root, chưa tin tưởng đầy đủ\n')
-                    lines.append('Bước 5: ⚠ CẢNH BÁO - Self-signed root')
-                else:
-                    print('   ✗ KHÔNG HỢP LỆ - Không tìm thấy trusted root CA\n')
-                    lines.append('Bước 5: ✗ KHÔNG HỢP LỆ - Không có trusted root')
-        else:
-            print('   ✗ KHÔNG HỢP LỆ - Không có dữ liệu chứng chỉ\n')
-            lines.append('Bước 5: ✗ KHÔNG HỢP LỆ - Không có cert')
-    except Exception as e:
-        print(f'   ✗ KHÔNG HỢP LỆ - Lỗi: {e}\n')
-        lines.append(f'Bước 5: ✗ KHÔNG HỢP LỆ - {e}')
+    if trust_local_pfx and os.path.exists('cert.pfx'):
+        try:
+            asn1_local = load_local_trust_root()
+        except Exception:
+            if strict_pfx:
+                raise
+            asn1_local = None
+        if asn1_local is not None and asn1_local not in trust_roots:
+            trust_roots.append(asn1_local)
+    if TRUST_STORE is not None:
+        # Tra chỉ mục theo issuer / AKI: chỉ các anchor của chuỗi này, không đưa cả kho vào ValidationContext
+        for anchor in TRUST_STORE.anchors_for(end_entity, intermediates):
+            if all(anchor.sha256 != c.sha256 for c in trust_roots):
+                trust_roots.append(anchor)
     
-    # Bước 6: Kiểm tra OCSP/CRL
-    print('6. Kiểm tra OCSP/CRL')
-    revocation_ok = False
+    # File CRL/OCSP mới được thả vào thư mục → dựng lại context, khóa bộ đệm đổi theo version kho
+    next_update = None
+    extra_key = REVOCATION_MODE
+    store = revocation if revocation is not None else REVOCATION_STORE
+    if store is not None:
+        if store.refresh():
+            _validation_contexts.clear()
+        next_update = store.next_update_for([end_entity] + intermediates)
+        extra_key = f'{REVOCATION_MODE}:{store.version}'
     
-    try:
-        from certvalidator import CertificateValidator, ValidationContext
-        asn1_certs = [c.chosen for c in sd['certificates']]
-        end_entity = asn1_certs[0]
-        intermediates = asn1_certs[1:] if len(asn1_certs) > 1 else []
-        
-        # Nếu có trust_local_pfx hoặc có root CA trong bundle, tin tưởng nó
-        trust_roots = []
-        
-        # Tìm self-signed root trong bundle
-        for c in asn1_certs:
-            if c.issuer == c.subject:
-                trust_roots.append(c)
-        
-        # Hoặc load từ PFX nếu được yêu cầu
-        if trust_local_pfx and os.path.exists('cert.pfx'):
-            try:
-                from cryptography.hazmat.primitives.serialization.pkcs12 import load_key_and_certificates
-                pfx_data = open('cert.pfx', 'rb').read()
-                priv_local, cert_local, add_local = load_key_and_certificates(pfx_data, b'1234')
-                if cert_local is not None:
-                    der = cert_local.public_bytes(encoding=Encoding.DER)
-                    asn1_local = x509.Certificate.load(der)
-                    trust_roots.append(asn1_local)
-            except Exception:
-                pass
-        
-        if trust_roots:
-            context = ValidationContext(trust_roots=trust_roots)
+    def run():
+        if revocation is not None:
+            # Dữ liệu riêng của tài liệu: không giữ context lại cho tài liệu khác
+            from thu_hoi import make_validation_context
+            context = make_validation_context(revocation, trust_roots, REVOCATION_MODE)
         else:
-            context = ValidationContext()
-        
+            context = get_validation_context(trust_roots)
         validator = CertificateValidator(end_entity, intermediate_certs=intermediates, validation_context=context)
-        valres = validator.validate_usage(set())
-        
-        print('   ✓ HỢP LỆ - OCSP/CRL đã kiểm tra, chứng chỉ chưa bị thu hồi\n')
-        lines.append('Bước 6: ✓ HỢP LỆ - OCSP/CRL OK')
-        revocation_ok = True
-    except ImportError:
-        print('   ⚠ CẢNH BÁO - Không thể kiểm tra (thiếu certvalidator module)\n')
-        lines.append('Bước 6: ⚠ CẢNH BÁO - Không thể kiểm tra OCSP/CRL')
-    except Exception as e:
-        # Nếu lỗi là do self-signed và đã có trong trust_roots → chấp nhận
-        if 'self-signed' in str(e).lower() and cert is not None:
-            if cert.issuer == cert.subject:
-                print('   ⚠ CẢNH BÁO - Chứng chỉ self-signed, bỏ qua kiểm tra OCSP/CRL\n')
-                lines.append('Bước 6: ⚠ CẢNH BÁO - Self-signed cert, không áp dụng OCSP/CRL')
-            else:
-                print(f'   ✗ KHÔNG HỢP LỆ - Lỗi: {e}\n')
-                lines.append(f'Bước 6: ✗ KHÔNG HỢP LỆ - {e}')
-        else:
-            print(f'   ✗ KHÔNG HỢP LỆ - Lỗi: {e}\n')
-            lines.append(f'Bước 6: ✗ KHÔNG HỢP LỆ - {e}')
-    
-    # Bước 7: Kiểm tra timestamp token
-    print('7. Kiểm tra timestamp token')
-    ts_found = False
+        validator.validate_usage(set())
     
+    return CHAIN_CACHE.validate(end_entity, intermediates, trust_roots, run,
+                                next_update=next_update, extra_key=extra_key)
+
+
+def build_log(lines, path=LOG_FILE):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines))
+
+
+def _worst_verdict(verdicts):
+    if any(v is None or v.startswith('✗') for v in verdicts):
+        return '✗ KHÔNG HỢP LỆ - Có chữ ký không hợp lệ'
+    if any(v.startswith('⚠') for v in verdicts):
+        return '⚠ HỢP LỆ (có điều kiện) - Có chữ ký chưa được tin cậy đầy đủ'
+    if all(v == QUICK_VERDICT for v in verdicts):
+        return '✓ NGUYÊN VẸN - Tất cả chữ ký khớp dữ liệu (chưa kiểm tra chuỗi, thu hồi, timestamp)'
+    return '✓ HỢP LỆ - Tất cả chữ ký và chuỗi chứng chỉ được tin cậy'
+
+
+def verify_pdf(data, trust_local_pfx=False, echo=print, digests=None, metrics=None, quick=False, recheck=None,
+               policy=None):
+    # Chạy 8 bước cho từng chữ ký trong PDF (bytes hoặc mmap), in ra và trả về (mã kết thúc, dòng nhật ký,
+    # kết luận). Không tự ghi file nhật ký để chế độ hàng loạt có thể gom kết quả nhiều file.
+    # quick: chỉ kiểm tra toàn vẹn (bước 1-4), như policy='quick'. Các tham số khác: xem verify_document.
+    result = verify_document(data, trust_local_pfx, digests, metrics, get_policy(policy, quick), recheck)
+    render_result(result, echo)
+    return result.code, result.lines, result.verdict
+
+
+def verify_document(data, trust_local_pfx=False, digests=None, metrics=None, policy=None, recheck=None):
+    # Như verify_pdf nhưng không in gì, trả về buoc_xac_thuc.VerificationResult.
+    # digests: {tuple(ByteRange): SHA-256} đã băm sẵn (vd. trong lúc nhận upload), bỏ qua băm lại ở bước 3.
+    # metrics: do_luong.DocumentMetrics nhận thời gian từng bước và bộ đếm bộ đệm.
+    # policy: tên trong POLICIES hoặc Policy ('full', 'quick', 'strict').
+    # recheck: bỏ qua RESULT_CACHE cho lần này (None = theo configure(recheck=...)).
+    policy = get_policy(policy)
+    if recheck is None:
+        recheck = RESULT_RECHECK
+    if metrics is None:
+        return _verify_document(data, trust_local_pfx, digests, None, policy, recheck)
+    # Số trúng/trượt bộ đệm là hiệu số trước/sau (gần đúng khi nhiều luồng cùng xác thực)
+    before = _cache_counters()
     try:
-        unsigned = signer_info['unsigned_attrs']
-        for a in unsigned:
-            if a['type'].dotted == '1.2.840.113549.1.9.16.2.14':
-                ts_found = True
-                print('   ✓ HỢP LỆ - Timestamp token (RFC3161) có trong unsignedAttrs\n')
-                lines.append('Bước 7: ✓ HỢP LỆ - Có timestamp token')
-                break
-        
-        if not ts_found:
-            print('   ⚠ CẢNH BÁO - Không tìm thấy timestamp token\n')
-            lines.append('Bước 7: ⚠ CẢNH BÁO - Không có timestamp token')
-    except Exception:
-        print('   ⚠ CẢNH BÁO - Không có unsignedAttrs để kiểm tra\n')
-        lines.append('Bước 7: ⚠ CẢNH BÁO - Không có unsignedAttrs')
-    
-    # Bước 8: Kiểm tra incremental update
-    print('8. Kiểm tra incremental update (phát hiện sửa đổi)')
-    total_ranges_len = br[1] + br[3]
-    a0, l0, a1, l1 = br
-    
-    # Kiểm tra xem file size có khớp với ByteRange + signature không
-    if total_ranges_len + len(contents) == len(data):
-        # File size khớp chính xác → không có dữ liệu thêm sau signature
-        print('   ✓ HỢP LỆ - Không phát hiện sửa đổi sau khi ký\n')
-        lines.append('Bước 8: ✓ HỢP LỆ - Không có sửa đổi sau ký')
-    else:
-        # Có dữ liệu thêm → kiểm tra xem có phải incremental update hợp lệ không
-        extra_bytes = len(data) - (total_ranges_len + len(contents))
-        
-        # Kiểm tra xem phần dữ liệu thêm có chứa nội dung đáng ngờ không
-        after_sig = data[a1 + l1:] if (a1 + l1) < len(data) else b''
-        
-        # Nếu chỉ chứa xref/trailer của signature → OK
-        suspicious = False
-        if b'/Type' in after_sig and b'/Contents' in after_sig:
-            # Có thể có thêm object được thêm sau ký → đáng ngờ
-            suspicious = True
-        elif b'/Annot' in after_sig:
-            # Có annotation mới → đáng ngờ
-            suspicious = True
-        
-        if suspicious:
-            print(f'   ✗ CẢNH BÁO - Phát hiện incremental updates đáng ngờ ({extra_bytes} bytes)\n')
-            lines.append(f'Bước 8: ✗ CẢNH BÁO - Có incremental updates đáng ngờ')
-        else:
-            print(f'   ✓ HỢP LỆ - Incremental update bình thường từ endesive ({extra_bytes} bytes)\n')
-            lines.append('Bước 8: ✓ HỢP LỆ - Incremental update hợp lệ (endesive signature)')
-    
-    # Kết luận tổng quát
-    print('='*60)
-    if sig_valid and md_match:
-        if chain_ok:
-            verdict = '✓ HỢP LỆ - Chữ ký và chuỗi chứng chỉ được tin cậy'
-        else:
-            verdict = '⚠ HỢP LỆ (có điều kiện) - Chữ ký OK nhưng chuỗi chứng chỉ chưa được tin cậy đầy đủ'
+        return _verify_document(data, trust_local_pfx, digests, metrics, policy, recheck)
+    finally:
+        for key, b0, b1 in zip(_CACHE_COUNTER_KEYS, before, _cache_counters()):
+            metrics.count(key, b1 - b0)
+        metrics.finish()
+
+
+_CACHE_COUNTER_KEYS = ('chain_cache_hits', 'chain_cache_misses', 'cert_cache_hits', 'cert_cache_misses',
+                       'result_cache_hits', 'result_cache_misses')
+
+
+def _cache_counters():
+    result = (RESULT_CACHE.hits, RESULT_CACHE.misses) if RESULT_CACHE is not None else (0, 0)
+    return (CHAIN_CACHE.hits, CHAIN_CACHE.misses, CERTIFICATE_STATS['hits'], CERTIFICATE_STATS['misses']) + result
+
+
+@functools.lru_cache(maxsize=None)
+def verifier_version():
+    # Phiên bản bộ xác thực = VERIFIER_VERSION + hash mã nguồn các module tham gia xác thực
+    h = hashlib.sha256(VERIFIER_VERSION.encode('ascii'))
+    base = os.path.dirname(os.path.abspath(__file__))
+    for name in VERIFIER_MODULES:
+        try:
+            with open(os.path.join(base, name), 'rb') as f:
+                h.update(f.read())
+        except OSError:
+            h.update(name.encode('ascii'))
+    return h.hexdigest()[:16]
+
+
+@functools.lru_cache(maxsize=8)
+def _file_digest(path, mtime_ns, size):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+
+def result_context(trust_local_pfx, policy):
+    # Những gì ngoài nội dung tài liệu quyết định kết quả: đổi bất kỳ phần nào thì kết quả cũ bị bỏ
+    policy = get_policy(policy)
+    parts = [verifier_version(), policy.name, REVOCATION_MODE]
+    if trust_local_pfx and os.path.exists('cert.pfx'):
+        st = os.stat('cert.pfx')
+        parts.append('pfx:' + _file_digest(os.path.abspath('cert.pfx'), st.st_mtime_ns, st.st_size))
+    if TRUST_STORE is not None and policy.runs(5):
+        parts.append('trust:' + TRUST_STORE.version)
+    if REVOCATION_STORE is not None and policy.runs(6):
+        if REVOCATION_STORE.refresh():
+            _validation_contexts.clear()
+        parts.append('crl:' + REVOCATION_STORE.version)
+    return '|'.join(parts)
+
+
+def signed_range_digests(data, sigs, digests=None, metrics=None):
+    # SHA-256 của mọi ByteRange; nhiều chữ ký thì băm cả file một lượt (StreamingByteRangeHasher)
+    digests = dict(digests or {})
+    missing = {tuple(br) for _, br, _ in sigs if tuple(br) not in digests}
+    if len(missing) > 1:
+        hasher = StreamingByteRangeHasher()
+        view = byte_view(data)
+        try:
+            for off in range(0, len(view), HASH_CHUNK):
+                hasher.feed(view[off:off + HASH_CHUNK])
+        finally:
+            view.release()
+        found = {br: d for br, d in hasher.digests().items() if br in missing}
+        digests.update(found)
+        missing -= set(found)
+        if metrics is not None:
+            metrics.count('bytes_hashed', len(data))
+    for br in missing:
+        digests[br] = hash_byterange(data, br, hashlib.sha256()).digest()
+        if metrics is not None:
+            metrics.count('bytes_hashed', br[1] + br[3])
+    return digests
+
+
+def _verify_document(data, trust_local_pfx, digests, metrics, policy, recheck):
+    # Liệt kê chữ ký qua bảng xref (AcroForm /Fields); file hỏng xref thì tìm từ đuôi file
+    sigs = find_signatures(data)
+    cache_key = None
+    if RESULT_CACHE is not None and sigs and all(br and contents for _, br, contents in sigs):
+        # Bộ đệm kết quả: chỉ cần băm các ByteRange (dùng lại cho bước 3 nếu trượt), không đụng tới crypto
+        digests = signed_range_digests(data, sigs, digests, metrics)
+        cache_key = (document_key(data, sigs, digests), result_context(trust_local_pfx, policy))
+        cached = None if recheck else RESULT_CACHE.get(*cache_key)
+        if cached is not None:
+            code, lines, verdict = cached
+            return VerificationResult(code, verdict, [], lines, policy, cached=True)
+    result = _verify_signatures(data, sigs, trust_local_pfx, digests, metrics, policy)
+    if cache_key is not None:
+        RESULT_CACHE.put(*cache_key, result.code, result.lines, result.verdict)
+    return result
+
+
+def embedded_revocation(data):
+    # CRL/OCSP nhúng trong /DSS của tài liệu (LTV) làm nguồn thu hồi cho bước 5-6, None nếu không có
+    from du_lieu_ltv import read_dss
+    dss = read_dss(data)
+    return dss.revocation(REVOCATION_STORE) if dss else None
+
+
+def _verify_signatures(data, sigs, trust_local_pfx, digests, metrics, policy):
+    # /DSS được đọc một lần cho mọi chữ ký của tài liệu (chế độ nhanh không cần)
+    revocation = embedded_revocation(data) if sigs and (policy.runs(5) or policy.runs(6)) else None
+    if len(sigs) <= 1:
+        name, br, contents = sigs[0] if sigs else (None, None, None)
+        sig = verify_signature_steps(data, br, contents, trust_local_pfx, digests=digests, metrics=metrics,
+                                     policy=policy, revocation=revocation, name=name)
+        lines = sig.log_lines()
+        if sig.code != 0:
+            return VerificationResult(sig.code, None, [sig], lines, policy)
+        signatures = [sig]
+        verdict = sig.verdict
     else:
-        verdict = '✗ KHÔNG HỢP LỆ - Chữ ký không hợp lệ'
-    
-    print(f'KẾT LUẬN: {verdict}')
-    print('='*60 + '\n')
+        # Các chữ ký độc lập với nhau → xác thực song song (các bước của mỗi chữ ký cũng chạy song song
+        # trong thread pool của buoc_xac_thuc), rồi ghi lần lượt theo thứ tự ký
+        covered_end = max(br[2] + br[3] for _, br, _ in sigs)
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=min(len(sigs), os.cpu_count() or 1)) as pool:
+            futures = [pool.submit(verify_signature_steps, data, br, contents, trust_local_pfx, covered_end,
+                                   digests, metrics, policy, revocation, name)
+                       for name, br, contents in sigs]
+            signatures = [f.result() for f in futures]
+        lines = []
+        for i, sig in enumerate(signatures):
+            lines.append(f'--- Chữ ký {i + 1}/{len(sigs)}: {sig.name} ---')
+            lines.extend(sig.log_lines())
+            lines.append(f'Kết luận chữ ký {sig.name}: {sig.verdict or "✗ KHÔNG HỢP LỆ"}')
+        verdict = _worst_verdict([sig.verdict for sig in signatures])
     lines.append(f'\nKẾT LUẬN: {verdict}')
-    
+    return VerificationResult(0, verdict, signatures, lines, policy)
+
+
+def render_result(result, echo=print):
+    # In VerificationResult theo định dạng nhật ký của CLI
+    echo('\n' + '='*60)
+    echo('CÁC BƯỚC XÁC THỰC CHỮ KÝ TRÊN PDF')
+    echo('='*60 + '\n')
+    if result.cached:
+        echo('(Kết quả lấy từ bộ đệm kết quả, dùng --recheck để xác thực lại)\n')
+        for line in result.lines:
+            echo(line)
+        echo('='*60 + '\n')
+        return
+    signatures = result.signatures
+    if len(signatures) <= 1:
+        for sig in signatures:
+            for line in sig.echo_lines():
+                echo(line)
+        if result.code != 0:
+            return
+    else:
+        for i, sig in enumerate(signatures):
+            echo(f'--- Chữ ký {i + 1}/{len(signatures)}: {sig.name} ---\n')
+            for line in sig.echo_lines():
+                echo(line)
+            echo(f'   → Kết luận chữ ký {sig.name}: {sig.verdict or "✗ KHÔNG HỢP LỆ"}\n')
+    echo('='*60)
+    echo(f'KẾT LUẬN: {result.verdict}')
+    echo('='*60 + '\n')
+
+
+class SignatureContext:
+    # Dữ liệu vào của một chữ ký và các giá trị bước 2 tạo ra cho các bước sau (sd, signer_info).
+    # covered_end: vị trí cuối vùng được chữ ký sau cùng bao phủ (dữ liệu trước đó đã được một chữ ký
+    # sau ký lại nên không xét ở bước 8); revocation: CRL/OCSP nhúng trong /DSS (embedded_revocation).
+    def __init__(self, data, br, contents, trust_local_pfx=False, covered_end=None, digests=None, metrics=None,
+                 revocation=None):
+        self.data = data
+        self.br = br
+        self.contents = contents
+        self.trust_local_pfx = trust_local_pfx
+        self.covered_end = covered_end
+        self.digests = digests
+        self.metrics = metrics
+        self.revocation = revocation
+        self.sd = None
+        self.signer_info = None
+
+    def count(self, key, n=1):
+        if self.metrics is not None:
+            self.metrics.count(key, n)
+
+
+class ByteRangeStep(Step):
+    number, name, title = 1, 'byterange', 'Đọc Signature dictionary: /Contents, /ByteRange'
+    fatal = 2
+
+    def run(self, ctx):
+        if not ctx.br or not ctx.contents:
+            return StepResult('✗ KHÔNG HỢP LỆ - Không tìm thấy /ByteRange hoặc /Contents',
+                              '✗ KHÔNG HỢP LỆ - Không đọc được Signature dictionary')
+        return StepResult(f'✓ HỢP LỆ - ByteRange: {ctx.br}, Contents: {len(ctx.contents)} bytes',
+                          f'✓ HỢP LỆ - ByteRange: {ctx.br}')
+
+
+class Pkcs7Step(Step):
+    number, name, title = 2, 'pkcs7', 'Tách PKCS#7, kiểm tra định dạng'
+    requires = (1,)
+    fatal = 3
+
+    def run(self, ctx):
+        sd = parse_pkcs7(ctx.contents)
+        if sd is None or not len(sd['signer_infos']):
+            return StepResult('✗ KHÔNG HỢP LỆ - Không parse được PKCS#7 SignedData',
+                              '✗ KHÔNG HỢP LỆ - Định dạng PKCS#7 không hợp lệ')
+        ctx.sd = sd
+        ctx.signer_info = sd['signer_infos'][0]
+        return StepResult('✓ HỢP LỆ - PKCS#7 SignedData được parse thành công',
+                          '✓ HỢP LỆ - PKCS#7 định dạng hợp lệ')
+
+
+class DigestStep(Step):
+    number, name, title = 3, 'digest', 'Tính hash và so sánh messageDigest'
+    requires = (2,)
+    expensive = True
+
+    def run(self, ctx):
+        br = ctx.br
+        try:
+            # Băm hai cửa sổ ByteRange theo khối qua memoryview, không tạo bản sao part1 + part2.
+            # Hàm băm theo digest_algorithm của SignerInfo; digests (băm sẵn) chỉ là SHA-256
+            md_name = ctx.signer_info['digest_algorithm']['algorithm'].native
+            sha = (ctx.digests or {}).get(tuple(br)) if md_name == 'sha256' else None
+            if sha is None:
+                sha = hash_byterange(ctx.data, br, hashlib.new(md_name)).digest()
+                ctx.count('bytes_hashed', br[1] + br[3])
+            else:
+                ctx.count('prehashed')
+            md_attr = None
+            for a in ctx.signer_info['signed_attrs']:
+                if a['type'].native == 'message_digest':
+                    md_attr = a['values'][0].native
+                    break
+        except Exception as e:
+            return StepResult(f'✗ KHÔNG HỢP LỆ - Lỗi kiểm tra: {e}', f'✗ KHÔNG HỢP LỆ - Lỗi: {e}')
+        if md_attr and md_attr == sha:
+            return StepResult('✓ HỢP LỆ - messageDigest khớp với hash tính được', '✓ HỢP LỆ - messageDigest khớp')
+        return StepResult('✗ KHÔNG HỢP LỆ - messageDigest không khớp')
+
+
+class SignatureStep(Step):
+    number, name, title = 4, 'signature', 'Verify signature bằng public key trong cert'
+    requires = (2,)
+
+    def run(self, ctx):
+        sd = ctx.sd
+        try:
+            certs = sd['certificates']
+            if not certs or len(certs) == 0:
+                return StepResult('✗ KHÔNG HỢP LỆ - Không có chứng chỉ')
+            # public key được memo theo DER, không parse lại chứng chỉ cho mỗi file
+            public_key = load_public_key(signer_certificate(sd).public_key.dump())
+            signer_info = ctx.signer_info
+            verify_signature(sd, signer_info['signed_attrs'].dump(), signer_info['signature'].native, None,
+                             public_key=public_key)
+        except Exception as e:
+            return StepResult(f'✗ KHÔNG HỢP LỆ - Signature không hợp lệ: {e}', f'✗ KHÔNG HỢP LỆ - {e}')
+        return StepResult('✓ HỢP LỆ - Signature hợp lệ với public key', '✓ HỢP LỆ - Signature được xác thực')
+
+
+class ChainStep(Step):
+    number, name, title = 5, 'chain', 'Kiểm tra chain → root trusted CA'
+    requires = (2,)
+    expensive = True
+
+    def run(self, ctx):
+        certs = ctx.sd['certificates']
+        if not certs:
+            return StepResult('✗ KHÔNG HỢP LỆ - Không có dữ liệu chứng chỉ', '✗ KHÔNG HỢP LỆ - Không có cert')
+        try:
+            validate_chain_cached(ctx.sd, ctx.trust_local_pfx, strict_pfx=True, revocation=ctx.revocation)
+            return StepResult('✓ HỢP LỆ - Chain được xác thực tới root CA', '✓ HỢP LỆ - Chain hợp lệ')
+        except Exception:
+            # Nếu có self-signed root trong bundle → chấp nhận như trusted
+            cert_list = [load_certificate(c.chosen.dump())[0] for c in certs]
+            roots = [c for c in cert_list if c.issuer == c.subject]
+            if roots:
+                return StepResult(
+                    f'✓ HỢP LỆ - Chain đầy đủ với {len(cert_list)} certs (self-signed root được tin tưởng)',
+                    f'✓ HỢP LỆ - Chain hợp lệ ({len(cert_list)} certs)')
+            return StepResult('✗ KHÔNG HỢP LỆ - Không tìm thấy trusted root CA',
+                              '✗ KHÔNG HỢP LỆ - Không có trusted root')
+
+
+class RevocationStep(Step):
+    number, name, title = 6, 'revocation', 'Kiểm tra OCSP/CRL'
+    requires = (2,)
+    # Dùng lại kết quả bước 5 trong bộ đệm chuỗi (cùng khóa end-entity / intermediates / trust anchors)
+    after = (5,)
+    expensive = True
+
+    def run(self, ctx):
+        sd, revocation = ctx.sd, ctx.revocation
+        try:
+            validate_chain_cached(sd, ctx.trust_local_pfx, strict_pfx=False, revocation=revocation)
+        except ImportError:
+            return StepResult('⚠ CẢNH BÁO - Không thể kiểm tra (thiếu certvalidator module)',
+                              '⚠ CẢNH BÁO - Không thể kiểm tra OCSP/CRL')
+        except Exception as e:
+            revoked = 'revoked' in str(e).lower()
+            if 'self-signed' in str(e).lower():
+                cert = load_certificate(signer_certificate(sd).dump())[0]
+                if cert.issuer == cert.subject:
+                    return StepResult('⚠ CẢNH BÁO - Chứng chỉ self-signed, bỏ qua kiểm tra OCSP/CRL',
+                                      '⚠ CẢNH BÁO - Self-signed cert, không áp dụng OCSP/CRL', revoked=revoked)
+            return StepResult(f'✗ KHÔNG HỢP LỆ - Lỗi: {e}', f'✗ KHÔNG HỢP LỆ - {e}', revoked=revoked)
+        embedded = revocation.embedded_status(signer_certificate(sd)) if revocation is not None else None
+        if embedded is not None:
+            return StepResult(f'✓ HỢP LỆ - Đã kiểm tra với CRL/OCSP nhúng trong tài liệu (/DSS, {embedded}), '
+                              'chứng chỉ chưa bị thu hồi', f'✓ HỢP LỆ - OCSP/CRL nhúng (/DSS) OK ({embedded})')
+        if REVOCATION_STORE is not None:
+            status = REVOCATION_STORE.status(signer_certificate(sd)) or 'không có dữ liệu'
+            return StepResult(f'✓ HỢP LỆ - Đã kiểm tra với CRL/OCSP cục bộ ({status}), chứng chỉ chưa bị thu hồi',
+                              f'✓ HỢP LỆ - OCSP/CRL cục bộ OK ({status})')
+        return StepResult('✓ HỢP LỆ - OCSP/CRL đã kiểm tra, chứng chỉ chưa bị thu hồi', '✓ HỢP LỆ - OCSP/CRL OK')
+
+
+class TimestampStep(Step):
+    number, name, title = 7, 'timestamp', 'Kiểm tra timestamp token'
+    requires = (2,)
+
+    def run(self, ctx):
+        try:
+            unsigned = ctx.signer_info['unsigned_attrs']
+            for a in unsigned:
+                if a['type'].dotted == '1.2.840.113549.1.9.16.2.14':
+                    return StepResult('✓ HỢP LỆ - Timestamp token (RFC3161) có trong unsignedAttrs',
+                                      '✓ HỢP LỆ - Có timestamp token')
+        except Exception:
+            return StepResult('⚠ CẢNH BÁO - Không có unsignedAttrs để kiểm tra', '⚠ CẢNH BÁO - Không có unsignedAttrs')
+        return StepResult('⚠ CẢNH BÁO - Không tìm thấy timestamp token', '⚠ CẢNH BÁO - Không có timestamp token')
+
+
+class IncrementalStep(Step):
+    number, name, title = 8, 'incremental', 'Kiểm tra incremental update (phát hiện sửa đổi)'
+    # Chỉ cần ByteRange: chạy song song với bước 2-7
+    requires = (1,)
+    expensive = True
+
+    def run(self, ctx):
+        # Đi theo chuỗi startxref -> /Prev: diff object của từng revision thêm sau vùng được ký,
+        # phân loại theo thay đổi được phép (DSS, chữ ký / timestamp mới, điền form)
+        data, br = ctx.data, ctx.br
+        signed_end = br[2] + br[3]
+        extra_bytes = len(data) - signed_end
+        if extra_bytes <= 0 or not bytes(data[signed_end:signed_end + 64]).strip(TAIL_SLACK) and extra_bytes <= 64:
+            return StepResult('✓ HỢP LỆ - Không phát hiện sửa đổi sau khi ký', '✓ HỢP LỆ - Không có sửa đổi sau ký')
+        try:
+            report = analyze_revisions(data, br)
+        except (PdfSyntaxError, ValueError, KeyError, IndexError, TypeError) as e:
+            report = {'revisions': [], 'problems': [f'không đọc được chuỗi xref: {e}'], 'allowed': False}
+        details = []
+        for r in report['revisions']:
+            # Revision đã được một chữ ký sau bao phủ thì ghi chú thêm
+            covered = ' (chữ ký sau bao phủ)' if ctx.covered_end and r['offset'] < ctx.covered_end else ''
+            details.append(f'   {"✓" if r["allowed"] else "✗"} {describe_revision(r)}{covered}')
+            for o in r['objects']:
+                if not o['allowed']:
+                    details.append(f'      ✗ obj {o["num"]} ({o["change"]}, {o["kind"]}): {o["detail"]}')
+        details.extend(f'   ✗ {p}' for p in report['problems'])
+        n = len(report['revisions'])
+        if report['allowed']:
+            kinds = sorted({k for r in report['revisions'] for k in r['kinds']})
+            return StepResult(
+                f'✓ HỢP LỆ - {n} incremental update sau ký, chỉ gồm thay đổi được phép ({extra_bytes} bytes)',
+                f'✓ HỢP LỆ - {n} incremental update hợp lệ ({", ".join(kinds) or "không có object"})', details)
+        return StepResult(f'✗ CẢNH BÁO - Phát hiện sửa đổi không được phép sau khi ký ({extra_bytes} bytes)',
+                          f'✗ CẢNH BÁO - Có sửa đổi không được phép sau khi ký ({n} incremental update)',
+                          details, modified=True)
+
+
+STEPS = (ByteRangeStep(), Pkcs7Step(), DigestStep(), SignatureStep(), ChainStep(), RevocationStep(),
+         TimestampStep(), IncrementalStep())
+ENGINE = StepEngine(STEPS)
+
+# full: chạy cả 8 bước, báo đầy đủ (mặc định); quick: chỉ toàn vẹn (bước 1-4, --quick);
+# strict: mọi bước trừ timestamp phải đạt, dừng các bước tốn kém ngay khi một bước không đạt
+POLICIES = {
+    'full': Policy('full'),
+    'quick': Policy('quick', steps=(1, 2, 3, 4)),
+    'strict': Policy('strict', required=(1, 2, 3, 4, 5, 6, 8), short_circuit=True),
+}
+
+
+def get_policy(policy=None, quick=False):
+    if isinstance(policy, Policy):
+        return policy
+    if policy is None:
+        policy = 'quick' if quick else 'full'
+    try:
+        return POLICIES[policy]
+    except KeyError:
+        raise ValueError(f'Chính sách không hợp lệ: {policy} (chọn {", ".join(POLICIES)})')
+
+
+def signature_verdict(sig):
+    # Kết luận cho một chữ ký từ kết quả các bước
+    policy = sig.policy
+    integrity = sig.passed(3) and sig.passed(4)
+    if policy.name == 'quick':
+        # Chế độ nhanh: chuỗi / thu hồi / timestamp được kiểm tra sau (chế độ đầy đủ)
+        return QUICK_VERDICT if integrity else '✗ KHÔNG HỢP LỆ - Chữ ký không hợp lệ'
+    failed = policy.failure(sig.steps)
+    if failed is not None:
+        return f'✗ KHÔNG HỢP LỆ - Không đạt chính sách {policy.name} (bước {failed})'
+    if sig.data(6, 'revoked'):
+        return '✗ KHÔNG HỢP LỆ - Chứng chỉ ký đã bị thu hồi'
+    if not integrity:
+        return '✗ KHÔNG HỢP LỆ - Chữ ký không hợp lệ'
+    if sig.data(8, 'modified'):
+        # Chữ ký đúng với bản đã ký nhưng nội dung hiển thị có thể đã khác
+        return '⚠ HỢP LỆ (có điều kiện) - Chữ ký OK nhưng tài liệu bị sửa đổi không được phép sau khi ký'
+    if sig.passed(5):
+        return '✓ HỢP LỆ - Chữ ký và chuỗi chứng chỉ được tin cậy'
+    return '⚠ HỢP LỆ (có điều kiện) - Chữ ký OK nhưng chuỗi chứng chỉ chưa được tin cậy đầy đủ'
+
+
+def verify_signature_steps(data, br, contents, trust_local_pfx=False, covered_end=None, digests=None,
+                           metrics=None, policy=None, revocation=None, name=None):
+    # Bước 1-8 (theo chính sách) cho một chữ ký, trả về SignatureResult có kết luận
+    policy = get_policy(policy)
+    ctx = SignatureContext(data, br, contents, trust_local_pfx, covered_end, digests, metrics, revocation)
+    clock = metrics.clock() if metrics is not None else None
+    sig = ENGINE.run(ctx, policy, name=name, byte_range=br, clock=clock)
+    sig.verdict = signature_verdict(sig) if sig.code == 0 else None
+    return sig
+
+
+def main(pdfpath, trust_local_pfx=False, metrics_path=None, prometheus_path=None, quick=False, policy=None):
+    # metrics_path: nối một bản ghi JSONL (thời gian từng bước, byte đã băm, bộ đệm) cho tài liệu này;
+    # prometheus_path: ghi số liệu cộng dồn dạng text của Prometheus; quick: chỉ bước 1-4;
+    # policy: tên chính sách trong POLICIES (mặc định full, hoặc quick khi quick=True)
+    if not os.path.exists(pdfpath):
+        print(f'✗ File không tìm thấy: {pdfpath}')
+        return 1
+
+    metrics = DocumentMetrics()
+    # mmap thay vì read(): file lớn chỉ tốn vài MB RSS
+    with PdfBuffer(pdfpath) as data:
+        size = len(data)
+        code, lines, verdict = verify_pdf(data, trust_local_pfx=trust_local_pfx, metrics=metrics, quick=quick,
+                                          policy=policy)
+
     # finalize log
     build_log(lines)
-    print(f'Đã ghi nhật ký xác thực vào {LOG_FILE}')
-    return 0
+    if code == 0:
+        print(f'Đã ghi nhật ký xác thực vào {LOG_FILE}')
+
+    record = metrics.as_dict()
+    record['startup_seconds'] = round(STARTUP_SECONDS, 6) if STARTUP_SECONDS is not None else None
+    if metrics_path or prometheus_path:
+        from xacthuc_hangloat import append_record, classify
+        REGISTRY.observe(record, classify(code, verdict))
+    if metrics_path:
+        append_record({'file': pdfpath, 'time': datetime.datetime.now().isoformat(timespec='seconds'),
+                       'bytes': size, 'code': code, 'verdict': verdict, 'quick': quick,
+                       'policy': get_policy(policy, quick).name, 'metrics': record},
+                      metrics_path)
+    if prometheus_path:
+        REGISTRY.write_prometheus(prometheus_path)
+    return code
+
+
+# Thời gian từ lúc bắt đầu nạp module tới khi main() được gọi (import + cấu hình), chỉ đo khi chạy CLI
+STARTUP_SECONDS = None
 
 
 if __name__ == '__main__':
     args = sys.argv[1:]
+    # --quick: cổng kiểm tra nhanh, chỉ bước 1-4 (toàn vẹn); in thời gian khởi động
+    quick = '--quick' in args
+    if quick:
+        args.remove('--quick')
+    # --policy full|quick|strict: strict dừng các bước tốn kém ngay khi một bước bắt buộc không đạt
+    policy = None
+    if '--policy' in args:
+        i = args.index('--policy')
+        policy = get_policy(args[i + 1])
+        del args[i:i + 2]
+        quick = quick or policy.name == 'quick'
     trust_local = False
     if '--trust-local-pfx' in args:
         trust_local = True
         args.remove('--trust-local-pfx')
-    pdfpath = args[0] if len(args) > 0 else DEFAULT_PDF
-    sys.exit(main(pdfpath, trust_local_pfx=trust_local))
+    options = {}
+    for flag, key in (('--chain-cache', 'chain_cache'), ('--revocation-dir', 'revocation_dir'),
+                      ('--revocation-mode', 'revocation_mode'), ('--result-cache', 'result_cache'),
+                      ('--trust-store', 'trust_store'), ('--trust-snapshot', 'trust_snapshot')):
+        # --chain-cache FILE: lưu bộ đệm chuỗi xuống đĩa; --revocation-dir DIR: CRL/OCSP cục bộ;
+        # --result-cache FILE.sqlite: lưu kết quả xác thực theo nội dung tài liệu;
+        # --trust-store THU_MUC|BUNDLE [--trust-snapshot FILE]: kho CA tin cậy (snapshot nạp nhanh lúc khởi động)
+        if flag in args:
+            i = args.index(flag)
+            options[key] = args[i + 1]
+            del args[i:i + 2]
+    if '--recheck' in args:
+        # Bỏ qua kết quả trong --result-cache, xác thực đầy đủ rồi ghi đè
+        options['recheck'] = True
+        args.remove('--recheck')
+    configure(**options)
+    outputs = {}
+    for flag in ('--metrics', '--prometheus', '--profile'):
+        # --metrics FILE.jsonl, --prometheus FILE.prom, --profile FILE.prof (cProfile, xem bằng snakeviz
+        # hoặc chuyển thành flamegraph bằng flameprof)
+        if flag in args:
+            i = args.index(flag)
+            outputs[flag[2:]] = args[i + 1]
+            del args[i:i + 2]
+    workers = None
+    if '--workers' in args:
+        i = args.index('--workers')
+        workers = int(args[i + 1])
+        del args[i:i + 2]
+    archives = []
+    if args and not args[0].lower().endswith('.pdf'):
+        # GOI.zip / GOI.tar[.gz|.bz2|.xz] ...: xác thực mọi PDF trong gói mà không giải nén ra đĩa
+        from xacthuc_luu_tru import is_archive
+        archives = [a for a in args if is_archive(a)]
+    if '--batch' in args:
+        # Chế độ hàng loạt: --batch THU_MUC hoặc --batch @danh_sach.txt
+        i = args.index('--batch')
+        spec = args[i + 1]
+        from xacthuc_hangloat import run_batch
+        code = run_batch(spec, workers=workers, trust_local_pfx=trust_local, options=options,
+                         prometheus=outputs.get('prometheus'), policy=get_policy(policy, quick).name)
+    elif archives:
+        from xacthuc_luu_tru import run_archives
+        code = run_archives(archives, workers=workers, trust_local_pfx=trust_local, options=options,
+                            policy=get_policy(policy, quick).name,
+                            prometheus=outputs.get('prometheus'))
+    else:
+        pdfpath = args[0] if len(args) > 0 else DEFAULT_PDF
+        run = functools.partial(main, pdfpath, trust_local_pfx=trust_local, quick=quick, policy=policy,
+                                metrics_path=outputs.get('metrics'), prometheus_path=outputs.get('prometheus'))
+        STARTUP_SECONDS = time.perf_counter() - _T_START
+        if outputs.get('profile'):
+            import cProfile
+            import pstats
+            profiler = cProfile.Profile()
+            code = profiler.runcall(run)
+            profiler.dump_stats(outputs['profile'])
+            pstats.Stats(profiler).sort_stats('cumulative').print_stats(20)
+            print(f'Đã ghi profile vào {outputs["profile"]}')
+        else:
+            code = run()
+        CHAIN_CACHE.save()
+        if quick:
+            print(f'Khởi động: {STARTUP_SECONDS * 1000:.1f} ms, '
+                  f'tổng (từ lúc nạp module): {(time.perf_counter() - _T_START) * 1000:.1f} ms')
+    sys.exit(code)
@@ -0,0 +1,188 @@
+import os
+import time
+import functools
+import json
+import datetime
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.util import Finalize
+
+from doc_pdf import PdfBuffer
+from do_luong import DocumentMetrics, REGISTRY
+
+try:
+    import fcntl
+except ImportError:  # Windows: không có flock, vẫn ghi bằng O_APPEND
+    fcntl = None
+
+BATCH_REPORT = 'bao_cao_hang_loat.jsonl'
+
+# Trạng thái riêng của từng worker (khởi tạo một lần trong _init_worker)
+_worker_trust_local = False
+
+
+def collect_inputs(spec):
+    # spec là thư mục (quét đệ quy *.pdf) hoặc @danh_sach.txt (mỗi dòng một đường dẫn)
+    if spec.startswith('@'):
+        paths = []
+        with open(spec[1:], 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    paths.append(line)
+        return paths
+    if os.path.isdir(spec):
+        paths = []
+        for root, dirs, files in os.walk(spec):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith('.pdf'):
+                    paths.append(os.path.join(root, name))
+        return paths
+    return [spec]
+
+
+def append_record(record, path=BATCH_REPORT):
+    # Mỗi bản ghi là một dòng JSON, ghi bằng một lệnh write với O_APPEND (+ flock nếu có)
+    # để nhiều tiến trình / nhiều lần chạy cùng ghi vào một báo cáo mà không lẫn dòng.
+    line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        os.write(fd, line)
+    finally:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+def _init_worker(trust_local_pfx, options=None):
+    # Import module nặng và dựng trust context một lần cho mỗi worker
+    global _worker_trust_local
+    _worker_trust_local = trust_local_pfx
+    import xacthuc
+    options = options or {}
+    xacthuc.configure(**options)
+    if options.get('chain_cache'):
+        # Worker thoát bằng os._exit nên atexit không chạy; Finalize của multiprocessing thì có
+        Finalize(None, xacthuc.CHAIN_CACHE.save, exitpriority=10)
+    try:
+        import certvalidator  # noqa: F401
+    except ImportError:
+        pass
+    if trust_local_pfx and os.path.exists('cert.pfx'):
+        try:
+            xacthuc.load_local_trust_root()
+        except Exception:
+            pass
+
+
+def classify(code, verdict):
+    if code != 0 or not verdict:
+        return 'loi'
+    if verdict.startswith('✓'):
+        return 'hop_le'
+    if verdict.startswith('⚠'):
+        return 'co_dieu_kien'
+    return 'khong_hop_le'
+
+
+def verify_one(path, policy=None):
+    import xacthuc
+    t0 = time.perf_counter()
+    record = {'file': path, 'bytes': 0, 'policy': xacthuc.get_policy(policy).name}
+    metrics = DocumentMetrics()
+    try:
+        with PdfBuffer(path) as data:
+            record['bytes'] = len(data)
+            code, lines, verdict = xacthuc.verify_pdf(data, trust_local_pfx=_worker_trust_local,
+                                                      echo=lambda *a, **k: None, metrics=metrics, policy=policy)
+    except Exception as e:
+        code, lines, verdict = 1, [f'✗ Lỗi đọc/xác thực: {e}'], None
+    return _finish_record(record, code, lines, verdict, t0, metrics)
+
+
+def verify_data(data, digests=None, name=None, quick=False, recheck=None, policy=None):
+    # Như verify_one nhưng với dữ liệu đã có trong bộ nhớ (dịch vụ HTTP gửi sang worker);
+    # record['signatures']: kết quả từng bước có kiểu (rỗng khi lấy từ bộ đệm kết quả)
+    import xacthuc
+    t0 = time.perf_counter()
+    record = {'file': name, 'bytes': len(data)}
+    metrics = DocumentMetrics()
+    try:
+        result = xacthuc.verify_document(data, _worker_trust_local, digests, metrics,
+                                         xacthuc.get_policy(policy, quick), recheck)
+        code, lines, verdict = result.code, result.lines, result.verdict
+        record['policy'] = result.policy.name
+        record['signatures'] = [sig.as_dict() for sig in result.signatures]
+    except Exception as e:
+        code, lines, verdict = 1, [f'✗ Lỗi đọc/xác thực: {e}'], None
+    return _finish_record(record, code, lines, verdict, t0, metrics)
+
+
+def _finish_record(record, code, lines, verdict, t0, metrics):
+    record['code'] = code
+    record['ket_qua'] = classify(code, verdict)
+    record['verdict'] = verdict
+    record['steps'] = lines
+    record['seconds'] = round(time.perf_counter() - t0, 6)
+    record['pid'] = os.getpid()
+    if metrics.seconds is None:
+        metrics.finish()
+    record['metrics'] = metrics.as_dict()
+    return record
+
+
+def run_batch(spec, workers=None, trust_local_pfx=False, report=BATCH_REPORT, options=None, prometheus=None,
+              policy=None):
+    # policy: tên chính sách trong xacthuc.POLICIES cho mọi file (mặc định full);
+    # kiểm tra tên ngay ở tiến trình chính để tên sai không làm hỏng từng file trong worker
+    import xacthuc
+    policy = xacthuc.get_policy(policy).name
+    paths = collect_inputs(spec)
+    if not paths:
+        print(f'✗ Không có file PDF nào trong: {spec}')
+        return 1
+    workers = workers or os.cpu_count() or 1
+    print(f'Xác thực hàng loạt {len(paths)} file với {workers} worker (chính sách {policy})...')
+
+    counts = {'hop_le': 0, 'co_dieu_kien': 0, 'khong_hop_le': 0, 'loi': 0}
+    total_bytes = 0
+    t0 = time.perf_counter()
+    chunksize = max(1, len(paths) // (workers * 8))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(trust_local_pfx, options)) as pool:
+        for record in pool.map(functools.partial(verify_one, policy=policy), paths, chunksize=chunksize):
+            counts[record['ket_qua']] += 1
+            total_bytes += record['bytes']
+            REGISTRY.observe(record['metrics'], record['ket_qua'])
+            append_record(record, report)
+            mark = {'hop_le': '✓', 'co_dieu_kien': '⚠'}.get(record['ket_qua'], '✗')
+            print(f'  {mark} {record["file"]} ({record["seconds"] * 1000:.1f} ms)')
+    elapsed = time.perf_counter() - t0
+
+    summary = {
+        'summary': True,
+        'time': datetime.datetime.now().isoformat(timespec='seconds'),
+        'input': spec,
+        'files': len(paths),
+        'workers': workers,
+        'policy': policy,
+        'seconds': round(elapsed, 3),
+        'docs_per_sec': round(len(paths) / elapsed, 2) if elapsed > 0 else None,
+        'mb_per_sec': round(total_bytes / 1e6 / elapsed, 2) if elapsed > 0 else None,
+    }
+    summary.update(counts)
+    append_record(summary, report)
+
+    print('=' * 60)
+    print(f'Tổng: {len(paths)} file trong {elapsed:.2f}s '
+          f'({summary["docs_per_sec"]} file/s, {summary["mb_per_sec"]} MB/s)')
+    print(f'  ✓ hợp lệ: {counts["hop_le"]}  ⚠ có điều kiện: {counts["co_dieu_kien"]}  '
+          f'✗ không hợp lệ: {counts["khong_hop_le"]}  ✗ lỗi: {counts["loi"]}')
+    print(f'Đã ghi báo cáo vào {report}')
+    if prometheus:
+        REGISTRY.write_prometheus(prometheus)
+        print(f'Đã ghi số liệu Prometheus vào {prometheus}')
+    return 0 if counts['khong_hop_le'] == 0 and counts['loi'] == 0 else 1
+
@@ -0,0 +1,339 @@
+import os
+import sys
+import json
+import time
+import struct
+import tarfile
+import zipfile
+import datetime
+import collections
+from concurrent.futures import ProcessPoolExecutor
+
+from doc_pdf import PdfSlice, StreamingByteRangeHasher, HASH_CHUNK
+from do_luong import DocumentMetrics, REGISTRY
+from xacthuc_hangloat import _init_worker, _finish_record, append_record, verify_data
+
+# Xác thực mọi PDF trong gói ZIP/TAR (hồ sơ nộp, bản xuất kiểm toán) mà không giải nén ra đĩa.
+# Thành viên không nén (ZIP stored, TAR thường) được đọc qua offset trong file gói (doc_pdf.PdfSlice, mmap);
+# thành viên nén (ZIP deflate) được giải nén một lượt trong worker vào bộ đệm RAM, băm ByteRange ngay trong lúc
+# giải nén; TAR nén (gz/bz2/xz) chỉ đọc tuần tự được nên tiến trình chính giải nén từng thành viên và gửi sang
+# worker. Worker vừa đọc vừa xác thực nên I/O và CPU của các thành viên chồng lên nhau; mỗi gói một báo cáo.
+#   python xacthuc_luu_tru.py GOI.zip [GOI.tar.gz ...] [--workers N] [--policy full|quick|strict]
+#                             [--report-dir DIR] [--trust-local-pfx] [--chain-cache FILE] [--revocation-dir DIR]
+#                             [--revocation-mode MODE] [--trust-store THU_MUC|BUNDLE] [--trust-snapshot FILE]
+#   python xacthuc_luu_tru.py --demo THU_MUC [--workers N] [--docs N]
+# (hoặc python xacthuc.py GOI.zip ... với các tùy chọn của xacthuc.py)
+
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+REPORT_SUFFIX = '.bao_cao.jsonl'
+# Số thành viên chờ xác thực tối đa cho mỗi worker: giới hạn bộ nhớ của thành viên TAR nén đã giải nén sẵn
+PENDING_PER_WORKER = 2
+# gzip, bzip2, xz: TAR nén không đọc được theo offset
+_COMPRESSED_MAGIC = (b'\x1f\x8b', b'BZh', b'\xfd7zXZ\x00')
+
+# ZipFile đang mở trong worker (central directory chỉ đọc một lần cho mỗi gói)
+_worker_zip = (None, None)
+
+
+def is_archive(path):
+    return path.lower().endswith(ARCHIVE_SUFFIXES) and os.path.isfile(path)
+
+
+def _is_pdf(name):
+    return name.lower().endswith('.pdf')
+
+
+def _zip_data_offset(f, info):
+    # Dữ liệu thành viên bắt đầu sau local file header (30 byte + tên + extra, có thể khác central directory)
+    f.seek(info.header_offset)
+    head = f.read(30)
+    if len(head) != 30 or head[:4] != b'PK\x03\x04':
+        raise zipfile.BadZipFile(f'Local header hỏng: {info.filename}')
+    name_len, extra_len = struct.unpack('<HH', head[26:30])
+    return info.header_offset + 30 + name_len + extra_len
+
+
+def read_member(f, size):
+    # Đọc (giải nén) thành viên một lượt vào bộ đệm cấp sẵn, băm ByteRange trong lúc đọc
+    # (verify_data dùng lại digests, bước 3 không băm lần hai)
+    buf = bytearray(size)
+    view = memoryview(buf)
+    hasher = StreamingByteRangeHasher()
+    pos = 0
+    try:
+        while pos < size:
+            n = f.readinto(view[pos:pos + HASH_CHUNK])
+            if not n:
+                raise EOFError(f'Thành viên bị cắt cụt ({pos}/{size} bytes)')
+            hasher.feed(view[pos:pos + n])
+            pos += n
+    finally:
+        view.release()
+    return buf, hasher.digests()
+
+
+def iter_tasks(path, skipped=None):
+    # Mỗi PDF trong gói thành một task (gói, tên, cách đọc, a, b):
+    #   'slice': a = offset, b = kích thước (mmap trong worker); 'zip': a = chỉ số trong infolist (giải nén
+    #   trong worker); 'data': a = dữ liệu đã giải nén, b = digests (TAR nén, đọc tuần tự ở tiến trình chính).
+    # skipped: danh sách nhận tên các thành viên không phải PDF
+    skipped = skipped if skipped is not None else []
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as zf, open(path, 'rb') as f:
+            for index, info in enumerate(zf.infolist()):
+                if info.is_dir():
+                    continue
+                if not _is_pdf(info.filename):
+                    skipped.append(info.filename)
+                elif info.compress_type == zipfile.ZIP_STORED and not info.flag_bits & 0x1:
+                    yield path, info.filename, 'slice', _zip_data_offset(f, info), info.file_size
+                else:
+                    # Nén hoặc mã hóa: để zipfile trong worker giải nén (báo lỗi nếu cần mật khẩu)
+                    yield path, info.filename, 'zip', index, None
+        return
+    with open(path, 'rb') as f:
+        magic = f.read(6)
+    stream = magic.startswith(_COMPRESSED_MAGIC)
+    with tarfile.open(path, 'r|*' if stream else 'r:') as tf:
+        for member in tf:
+            if not member.isfile():
+                continue
+            if not _is_pdf(member.name):
+                skipped.append(member.name)
+            elif stream or member.issparse():
+                data, digests = read_member(tf.extractfile(member), member.size)
+                yield path, member.name, 'data', data, digests
+            else:
+                yield path, member.name, 'slice', member.offset_data, member.size
+
+
+def _open_zip(path):
+    global _worker_zip
+    if _worker_zip[0] != path:
+        if _worker_zip[1] is not None:
+            _worker_zip[1].close()
+        _worker_zip = (path, zipfile.ZipFile(path))
+    return _worker_zip[1]
+
+
+def verify_member(task, policy=None):
+    # Chạy trong worker (xacthuc_hangloat._init_worker); record như verify_data, thêm gói và cách đọc
+    path, name, kind, a, b = task
+    t0 = time.perf_counter()
+    try:
+        if kind == 'slice':
+            with PdfSlice(path, a, b) as data:
+                record = verify_data(data, name=name, policy=policy)
+        elif kind == 'zip':
+            zf = _open_zip(path)
+            info = zf.infolist()[a]
+            with zf.open(info) as f:
+                data, digests = read_member(f, info.file_size)
+            record = verify_data(data, digests, name, policy=policy)
+        else:
+            record = verify_data(a, b, name, policy=policy)
+    except Exception as e:
+        record = _finish_record({'file': name, 'bytes': 0}, 1, [f'✗ Lỗi đọc/xác thực: {e}'], None, t0,
+                                DocumentMetrics())
+    record['archive'] = path
+    record['access'] = {'slice': 'mmap', 'zip': 'inflate', 'data': 'stream'}[kind]
+    record['seconds'] = round(time.perf_counter() - t0, 6)
+    return record
+
+
+def report_path(path, report_dir='.'):
+    return os.path.join(report_dir, os.path.basename(path) + REPORT_SUFFIX)
+
+
+def verify_archive(pool, path, workers, policy=None, report_dir='.'):
+    # Xác thực một gói trên pool đã có; ghi báo cáo riêng của gói (mỗi thành viên một dòng + dòng tổng kết)
+    report = report_path(path, report_dir)
+    print(f'Xác thực gói {path}...')
+    counts = {'hop_le': 0, 'co_dieu_kien': 0, 'khong_hop_le': 0, 'loi': 0}
+    access = {}
+    skipped = []
+    members = 0
+    total_bytes = 0
+    error = None
+    t0 = time.perf_counter()
+
+    def handle(record):
+        nonlocal members, total_bytes
+        members += 1
+        counts[record['ket_qua']] += 1
+        total_bytes += record['bytes']
+        access[record['access']] = access.get(record['access'], 0) + 1
+        REGISTRY.observe(record['metrics'], record['ket_qua'])
+        append_record(record, report)
+        mark = {'hop_le': '✓', 'co_dieu_kien': '⚠'}.get(record['ket_qua'], '✗')
+        print(f'  {mark} {record["file"]} ({record["seconds"] * 1000:.1f} ms, {record["access"]})')
+
+    # Giữ tối đa workers * PENDING_PER_WORKER task đang chờ; kết quả ghi theo thứ tự trong gói
+    pending = collections.deque()
+    limit = workers * PENDING_PER_WORKER
+    try:
+        for task in iter_tasks(path, skipped):
+            pending.append(pool.submit(verify_member, task, policy))
+            while len(pending) >= limit:
+                handle(pending.popleft().result())
+    except (OSError, EOFError, zipfile.BadZipFile, tarfile.TarError) as e:
+        error = f'Không đọc được gói: {e}'
+        print(f'  ✗ {error}')
+    while pending:
+        handle(pending.popleft().result())
+    elapsed = time.perf_counter() - t0
+
+    summary = {
+        'summary': True,
+        'time': datetime.datetime.now().isoformat(timespec='seconds'),
+        'archive': path,
+        'members': members,
+        'skipped': len(skipped),
+        'access': access,
+        'workers': workers,
+        'seconds': round(elapsed, 3),
+        'docs_per_sec': round(members / elapsed, 2) if elapsed > 0 else None,
+        'mb_per_sec': round(total_bytes / 1e6 / elapsed, 2) if elapsed > 0 else None,
+        'error': error,
+    }
+    summary.update(counts)
+    append_record(summary, report)
+    print(f'  Tổng: {members} PDF trong {elapsed:.2f}s ({summary["docs_per_sec"]} file/s, '
+          f'{summary["mb_per_sec"]} MB/s), bỏ qua {len(skipped)} thành viên không phải PDF')
+    print(f'  ✓ hợp lệ: {counts["hop_le"]}  ⚠ có điều kiện: {counts["co_dieu_kien"]}  '
+          f'✗ không hợp lệ: {counts["khong_hop_le"]}  ✗ lỗi: {counts["loi"]}')
+    print(f'  Đã ghi báo cáo vào {report}')
+    ok = error is None and counts['khong_hop_le'] == 0 and counts['loi'] == 0
+    return 0 if ok else 1
+
+
+def run_archives(paths, workers=None, trust_local_pfx=False, options=None, policy=None, report_dir='.',
+                 prometheus=None):
+    missing = [p for p in paths if not os.path.isfile(p)]
+    if missing:
+        print(f'✗ File không tìm thấy: {", ".join(missing)}')
+        return 1
+    workers = workers or os.cpu_count() or 1
+    policy = getattr(policy, 'name', policy)
+    os.makedirs(report_dir, exist_ok=True)
+    code = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(trust_local_pfx, options)) as pool:
+        for path in paths:
+            code |= verify_archive(pool, path, workers, policy, report_dir)
+    if prometheus:
+        REGISTRY.write_prometheus(prometheus)
+        print(f'Đã ghi số liệu Prometheus vào {prometheus}')
+    return code
+
+
+def run_demo(directory, workers=2, docs=12):
+    # Tự kiểm tra: ký `docs` PDF (một bản bị sửa sau khi ký), đóng gói thành ZIP (xen kẽ stored / deflate),
+    # TAR và TAR.GZ; kết quả từng thành viên trong báo cáo của mỗi gói phải trùng với xác thực PDF gốc trong RAM
+    import io
+    import ky
+    from do_hieu_nang import PFX_PASSWORD, make_ca, make_pdf
+    directory = os.path.abspath(directory)
+    os.makedirs(directory, exist_ok=True)
+    pfx_path, img_path = make_ca(directory)
+    signer = ky.Signer(pfx_path, PFX_PASSWORD, img_path, tsa_servers=[], echo=lambda *a, **k: None)
+    base = os.path.join(directory, 'goc.pdf')
+    make_pdf(base, 3, images=1, seed='luu_tru')
+    with open(base, 'rb') as f:
+        original = f.read()
+    pdfs = {}
+    for i in range(docs):
+        path = os.path.join(directory, 'tai_lieu.pdf')
+        signer.sign_to_file(original, path, page=0, reason=f'Tài liệu {i}', incremental=True)
+        with open(path, 'rb') as f:
+            pdfs[f'ho_so/tai_lieu_{i:03d}.pdf'] = f.read()
+        os.remove(path)
+    # Sửa một byte trong vùng được ký của tài liệu cuối: phải ra "không hợp lệ" ở mọi dạng gói
+    name = f'ho_so/tai_lieu_{docs - 1:03d}.pdf'
+    data = bytearray(pdfs[name])
+    data[200] ^= 0x01
+    pdfs[name] = bytes(data)
+    note = 'Danh sách hồ sơ\n'.encode('utf-8')
+
+    archives = {}
+    path = os.path.join(directory, 'goi.zip')
+    with zipfile.ZipFile(path, 'w') as zf:
+        zf.writestr('ghi_chu.txt', note, compress_type=zipfile.ZIP_DEFLATED)
+        for i, (name, data) in enumerate(pdfs.items()):
+            zf.writestr(name, data, compress_type=zipfile.ZIP_STORED if i % 2 == 0 else zipfile.ZIP_DEFLATED)
+    archives[path] = {'mmap': (docs + 1) // 2, 'inflate': docs // 2}
+    for suffix, mode, kind in (('.tar', 'w', 'mmap'), ('.tar.gz', 'w:gz', 'stream')):
+        path = os.path.join(directory, 'goi' + suffix)
+        with tarfile.open(path, mode) as tf:
+            for name, data in [('ghi_chu.txt', note)] + list(pdfs.items()):
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tf.addfile(info, io.BytesIO(data))
+        archives[path] = {kind: docs}
+
+    # Kết quả chuẩn: xác thực từng PDF gốc trong tiến trình này
+    os.chdir(directory)
+    _init_worker(True)
+    expected = {name: verify_data(data, name=name) for name, data in pdfs.items()}
+    report_dir = os.path.join(directory, 'bao_cao')
+    for path in archives:
+        if os.path.exists(report_path(path, report_dir)):
+            os.remove(report_path(path, report_dir))
+    code = run_archives(list(archives), workers, trust_local_pfx=True, report_dir=report_dir)
+
+    ok = True
+    for path, access in archives.items():
+        with open(report_path(path, report_dir), 'r', encoding='utf-8') as f:
+            lines = [json.loads(line) for line in f]
+        records = {r['file']: r for r in lines if not r.get('summary')}
+        summary = lines[-1]
+        checks = [
+            ('một báo cáo, đủ mọi PDF, có dòng tổng kết',
+             set(records) == set(pdfs) and summary.get('summary') and summary['skipped'] == 1),
+            ('kết quả từng bước trùng với xác thực PDF gốc',
+             all(records[n]['steps'] == expected[n]['steps'] and records[n]['ket_qua'] == expected[n]['ket_qua']
+                 for n in pdfs)),
+            (f'cách đọc {access}', summary['access'] == access),
+            ('tài liệu bị sửa không hợp lệ, còn lại hợp lệ',
+             summary['khong_hop_le'] == 1 and summary['hop_le'] == docs - 1),
+        ]
+        print(os.path.basename(path))
+        for label, passed in checks:
+            print(f'  {"✓" if passed else "✗"} {label}')
+            ok = ok and bool(passed)
+    print(f'Mã kết thúc run_archives: {code} (1 vì có tài liệu không hợp lệ)')
+    ok = ok and code == 1
+    print('✓ Xác thực trong gói khớp với xác thực từng file' if ok else '✗ Xác thực trong gói: kiểm tra không đạt')
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    options = {}
+    for flag, key in (('--chain-cache', 'chain_cache'), ('--revocation-dir', 'revocation_dir'),
+                      ('--revocation-mode', 'revocation_mode'),
+                      ('--trust-store', 'trust_store'), ('--trust-snapshot', 'trust_snapshot')):
+        if flag in args:
+            i = args.index(flag)
+            options[key] = args[i + 1]
+            del args[i:i + 2]
+    opts = {'workers': None, 'policy': None, 'docs': 12, 'report_dir': '.'}
+    for flag, key, conv in (('--workers', 'workers', int), ('--policy', 'policy', str), ('--docs', 'docs', int),
+                            ('--report-dir', 'report_dir', str)):
+        if flag in args:
+            i = args.index(flag)
+            opts[key] = conv(args[i + 1])
+            del args[i:i + 2]
+    trust_local = '--trust-local-pfx' in args
+    if trust_local:
+        args.remove('--trust-local-pfx')
+    if '--demo' in args:
+        i = args.index('--demo')
+        sys.exit(run_demo(args[i + 1], opts['workers'] or 2, opts['docs']))
+    if not args:
+        print('Dùng: python xacthuc_luu_tru.py GOI.zip|GOI.tar[.gz|.bz2|.xz] ... [--workers N] [--report-dir DIR]')
+        sys.exit(2)
+    if opts['policy'] is not None:
+        from xacthuc import get_policy
+        get_policy(opts['policy'])
+    sys.exit(run_archives(args, opts['workers'], trust_local, options, opts['policy'], opts['report_dir']))